@@ -0,0 +1,121 @@
+"""Benchmark the latency of predicting a batch with the different inference engines.
+
+Predicting directly via `model.predict_on_batch` is compared with predicting via an
+`InferenceEngine`, with and without XLA compilation, and, if onnxruntime is installed,
+via an `OnnxInferenceEngine`. Both a full batch and a partial batch, as typically is
+the last batch of a prediction, are timed.
+"""
+
+import argparse
+import importlib.util
+import logging
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+
+import orthoseg.model.model_factory as mf
+from orthoseg.model.inference_engine import (
+    InferenceEngine,
+    OnnxInferenceEngine,
+    export_onnx,
+)
+
+
+def _latency_ms(predict_func, batch_arr: np.ndarray, nb_runs: int) -> float:
+    latencies = []
+    for _ in range(nb_runs):
+        perf_start = perf_counter()
+        np.asarray(predict_func(batch_arr))
+        latencies.append((perf_counter() - perf_start) * 1000)
+    return median(latencies)
+
+
+def benchmark(
+    architecture: str,
+    batch_size: int,
+    image_size: int,
+    nb_runs: int,
+    onnx_threads: int = 0,
+) -> list[dict]:
+    """Time the prediction of a full and a partial batch for the predict variants.
+
+    Args:
+        architecture (str): the model architecture to benchmark.
+        batch_size (int): the batch size.
+        image_size (int): the width and height of the images.
+        nb_runs (int): the number of times each prediction is timed.
+        onnx_threads (int, optional): the number of intra op threads for onnxruntime.
+            If 0, onnxruntime chooses. Defaults to 0.
+
+    Returns:
+        list[dict]: the median latencies in milliseconds per variant.
+    """
+    model, _ = mf.get_model(architecture=architecture, nb_classes=2)
+    rng = np.random.default_rng(0)
+    full_arr = rng.random((batch_size, image_size, image_size, 3), dtype=np.float32)
+    partial_arr = full_arr[: max(batch_size // 2, 1)]
+
+    variants = {
+        "model.predict_on_batch": model.predict_on_batch,
+        "InferenceEngine": InferenceEngine(model, batch_size).predict_on_batch,
+        "InferenceEngine (jit)": InferenceEngine(
+            model, batch_size, jit_compile=True
+        ).predict_on_batch,
+    }
+    tmp_dir = tempfile.TemporaryDirectory()
+    if importlib.util.find_spec("onnxruntime") is not None:
+        onnx_path = export_onnx(model, Path(tmp_dir.name) / "model.onnx")
+        variants["OnnxInferenceEngine"] = OnnxInferenceEngine(
+            onnx_path, batch_size, intra_op_threads=onnx_threads
+        ).predict_on_batch
+    results = []
+    for name, predict_func in variants.items():
+        # The first call of a shape includes tracing, so time it separately
+        first_ms = _latency_ms(predict_func, full_arr, nb_runs=1)
+        first_partial_ms = _latency_ms(predict_func, partial_arr, nb_runs=1)
+        results.append(
+            {
+                "variant": name,
+                "first_batch_ms": first_ms,
+                "full_batch_ms": _latency_ms(predict_func, full_arr, nb_runs),
+                "first_partial_batch_ms": first_partial_ms,
+                "partial_batch_ms": _latency_ms(predict_func, partial_arr, nb_runs),
+            }
+        )
+
+    tmp_dir.cleanup()
+
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--architecture", default="mobilenetv2+unet")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--image_size", type=int, default=512)
+    parser.add_argument("--nb_runs", type=int, default=10)
+    parser.add_argument("--onnx_threads", type=int, default=0)
+    args = parser.parse_args()
+
+    results = benchmark(
+        args.architecture,
+        args.batch_size,
+        args.image_size,
+        args.nb_runs,
+        onnx_threads=args.onnx_threads,
+    )
+    columns = list(results[0])
+    print(" | ".join(f"{column:>24}" for column in columns))
+    for result in results:
+        print(
+            " | ".join(
+                f"{result[column]:>24.1f}"
+                if isinstance(result[column], float)
+                else f"{result[column]:>24}"
+                for column in columns
+            )
+        )
@@ -0,0 +1,129 @@
+"""Benchmark the throughput of caching image tiles from a local file layer.
+
+A tiled GeoTIFF is created as file layer and all tiles of a grid on it are loaded to
+a cache dir with `load_images_to_cache`, for the image formats typically used to save
+the tiles to.
+"""
+
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import rasterio as rio
+
+from orthoseg.util import image_util
+
+
+def _create_file_layer(path: Path, size: int) -> tuple[float, float, float, float]:
+    """Create a tiled 3 band GeoTIFF with 1m pixels and return its bounds."""
+    profile = {
+        "driver": "GTiff",
+        "dtype": "uint8",
+        "count": 3,
+        "width": size,
+        "height": size,
+        "crs": "epsg:31370",
+        "transform": rio.Affine(1.0, 0.0, 150000.0, 0.0, -1.0, 170000.0 + size),
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "deflate",
+    }
+    rng = np.random.default_rng(0)
+    with rio.open(path, "w", **profile) as dst:
+        for _, window in dst.block_windows(1):
+            data = rng.integers(
+                0, 256, (3, window.height, window.width), dtype=np.uint8
+            )
+            dst.write(data, window=window)
+
+        return tuple(dst.bounds)
+
+
+def benchmark(
+    file_size: int, tile_size: int, image_formats: list[str], nb_concurrent_calls: int
+) -> list[dict]:
+    """Time loading all tiles of a file layer to a cache dir, per image format.
+
+    Args:
+        file_size (int): the width and height of the file layer in pixels.
+        tile_size (int): the width and height of the tiles in pixels.
+        image_formats (list[str]): the image formats to save the tiles in.
+        nb_concurrent_calls (int): the number of tiles to load in parallel.
+
+    Returns:
+        list[dict]: the number of tiles per second for each image format.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = Path(tmp_dir) / "file_layer.tif"
+        bounds = _create_file_layer(file_path, file_size)
+        layersource = image_util.FileLayerSource(file_path, layernames=["benchmark"])
+        nb_tiles = (file_size // tile_size) ** 2
+
+        for image_format in image_formats:
+            output_image_dir = Path(tmp_dir) / image_format.replace("/", "_")
+            perf_start = perf_counter()
+            image_util.load_images_to_cache(
+                layersources=[layersource],
+                output_image_dir=output_image_dir,
+                crs="epsg:31370",
+                switch_axes=False,
+                image_gen_bbox=bounds,
+                grid_xmin=bounds[0],
+                grid_ymin=bounds[1],
+                image_crs_pixel_x_size=1.0,
+                image_crs_pixel_y_size=1.0,
+                image_pixel_width=tile_size,
+                image_pixel_height=tile_size,
+                nb_concurrent_calls=nb_concurrent_calls,
+                image_format=image_format,
+                force=True,
+            )
+            elapsed_s = perf_counter() - perf_start
+            results.append(
+                {
+                    "image_format": image_format,
+                    "nb_tiles": nb_tiles,
+                    "elapsed_s": elapsed_s,
+                    "tiles_per_s": nb_tiles / elapsed_s,
+                }
+            )
+
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--file_size", type=int, default=8192)
+    parser.add_argument("--tile_size", type=int, default=512)
+    parser.add_argument(
+        "--image_formats",
+        nargs="+",
+        default=[
+            image_util.FORMAT_JPEG,
+            image_util.FORMAT_PNG,
+            image_util.FORMAT_GEOTIFF,
+        ],
+    )
+    parser.add_argument("--nb_concurrent_calls", type=int, default=1)
+    args = parser.parse_args()
+
+    results = benchmark(
+        args.file_size, args.tile_size, args.image_formats, args.nb_concurrent_calls
+    )
+    columns = list(results[0])
+    print(" | ".join(f"{column:>16}" for column in columns))
+    for result in results:
+        print(
+            " | ".join(
+                f"{result[column]:>16.2f}"
+                if isinstance(result[column], float)
+                else f"{result[column]:>16}"
+                for column in columns
+            )
+        )
@@ -27,8 +27,10 @@ from orthoseg.util.image_util import (
     WMSLayerSource,
     create_roi_for_dir,
     create_vrt_for_dir,
+    get_block_aligned_grid_origin,
     has_switched_axes,
 )
+from orthoseg.util.mosaic_cache import MosaicCache
 
 # Activate gdal to raise exceptions instead of printing/returning errors/errorcodes
 gdal.UseExceptions()
@@ -257,6 +259,21 @@ def read_orthoseg_config(config_path: Path, overrules: list[str] | None = None):
     global image_layers
     image_layers = _read_layer_config(layer_config_filepath=layer_config_filepath)
 
+    # If the images of an image layer are cached in a mosaic, init the mosaic cache
+    for image_layer, image_layer_config in image_layers.items():
+        mosaic_cache = None
+        if image_layer_config["cache_type"] == "mosaic":
+            mosaic_cache = MosaicCache(
+                cache_dir=dirs.getpath("base_image_dir") / image_layer / "mosaic",
+                crs=image_layer_config["projection"],
+                pixel_x_size=image_layer_config["pixel_x_size"],
+                pixel_y_size=image_layer_config["pixel_y_size"],
+                grid_xmin=image_layer_config["grid_xmin"],
+                grid_ymin=image_layer_config["grid_ymin"],
+                block_size=image_layer_config["cache_block_size"],
+            )
+        image_layer_config["mosaic_cache"] = mosaic_cache
+
 
 def _set_tmp_dir(dir_name: str = "orthoseg") -> Path:
     # Check if TMPDIR exists in environment
@@ -467,6 +484,22 @@ def _read_layer_config(layer_config_filepath: Path) -> dict:
                         wms_ignore_capabilities_url=_str2bool(
                             layersource.get("wms_ignore_capabilities_url", "False")
                         ),
+                        max_requests_per_s=float(
+                            layersource.get("wms_max_requests_per_s", 0)
+                        ),
+                        max_bytes_per_s=float(
+                            layersource.get("wms_max_bytes_per_s", 0)
+                        ),
+                        adaptive_concurrency=layer_config[image_layer].getboolean(
+                            "wms_adaptive_concurrency", fallback=True
+                        ),
+                        metatile_factor=_str2intpair(
+                            layersource.get("metatile_factor", 1), "metatile_factor"
+                        ),
+                        max_image_size=_str2intpair(
+                            layersource.get("wms_max_image_size", 4096),
+                            "wms_max_image_size",
+                        ),
                     )
                 elif "wmts_server_url" in layersource:
                     path = _gdal_virtual_file_path(layersource)
@@ -524,6 +557,39 @@ def _read_layer_config(layer_config_filepath: Path) -> dict:
             layersource_objects.append(layersource_object)
         image_layers[image_layer]["layersources"] = layersource_objects
 
+        # If asked, align the grid with the blocks of the file layer source
+        if layer_config[image_layer].getboolean("grid_align_to_blocks", fallback=False):
+            grid_origin = get_block_aligned_grid_origin(
+                layersources=layersource_objects,
+                crs=crs,
+                pixel_x_size=image_layers[image_layer]["pixel_x_size"],
+                pixel_y_size=image_layers[image_layer]["pixel_y_size"],
+            )
+            if grid_origin is None:
+                logger.warning(
+                    f"grid_align_to_blocks ignored for image layer {image_layer}: no "
+                    "file layer source with its pixel size and projection found"
+                )
+            else:
+                grid_xmin, grid_ymin = grid_origin
+                image_layers[image_layer]["grid_xmin"] = grid_xmin
+                image_layers[image_layer]["grid_ymin"] = grid_ymin
+
+        # Read the cache parameters
+        cache_type = layer_config[image_layer].get("cache_type", fallback="tiles")
+        if cache_type not in ("tiles", "mosaic"):
+            raise ValueError(
+                f"Invalid cache_type for image layer {image_layer}: {cache_type}, "
+                "should be 'tiles' or 'mosaic'"
+            )
+        image_layers[image_layer]["cache_type"] = cache_type
+        image_layers[image_layer]["cache_block_size"] = layer_config[
+            image_layer
+        ].getint("cache_block_size", fallback=4096)
+        image_layers[image_layer]["cache_request_size"] = layer_config[
+            image_layer
+        ].getint("cache_request_size", fallback=1024)
+
     return image_layers
 
 
@@ -698,6 +764,29 @@ def _str2intlist(string: str | None):
     return [int(i.strip()) for i in string.split(",")]
 
 
+def _str2intpair(value: str | int | list[int], name: str) -> tuple[int, int]:
+    """Parse one positive int for both the columns and rows or one for each."""
+    if isinstance(value, int):
+        values = [value]
+    elif isinstance(value, list):
+        values = value
+    else:
+        try:
+            values = _str2intlist(value)
+        except ValueError as ex:
+            raise ValueError(
+                f"{name} should be 1 or 2 positive integers, not {value}"
+            ) from ex
+    if (
+        len(values) not in (1, 2)
+        or not all(isinstance(v, int) for v in values)
+        or min(values) < 1
+    ):
+        raise ValueError(f"{name} should be 1 or 2 positive integers, not {value}")
+
+    return (values[0], values[-1])
+
+
 def _str2bool(string: str | None):
     if string is None:
         return None
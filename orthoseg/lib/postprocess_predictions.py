@@ -19,7 +19,7 @@ import skimage.filters.rank
 from skimage.morphology import rectangle
 
 from orthoseg.helpers import vectorfile_helper
-from orthoseg.util import vector_util
+from orthoseg.util import _shared_memory_util, vector_util
 
 # Avoid having many info warnings about self intersections from shapely
 logging.getLogger("shapely.geos").setLevel(logging.WARNING)
@@ -37,6 +37,7 @@ def postprocess_predictions(
     output_path: Path,
     dissolve: bool,
     dissolve_tiles_path: Path | None = None,
+    dissolve_onborder_only: bool = False,
     reclassify_to_neighbour_query: str | None = None,
     simplify_algorithm: str | None = None,
     simplify_tolerance: float = 1,
@@ -58,6 +59,11 @@ def postprocess_predictions(
         dissolve (bool): True if a dissolve needs to be applied
         dissolve_tiles_path (PathLike, optional): Path to a geofile containing
             the tiles to be used for the dissolve. Defaults to None.
+        dissolve_onborder_only (bool, optional): True to only dissolve the features
+            with onborder = 1. The other features can't touch features of other tiles,
+            so they are added to the result as such. Not applicable if
+            `dissolve_tiles_path` is specified or if the input has no onborder column.
+            Defaults to False.
         reclassify_to_neighbour_query (str, optional): Defaults to None.
         simplify_algorithm (str, optional): Algorithm to use for simplification. If
             None, no simplification is applied. Defaults to None.
@@ -101,15 +107,34 @@ def postprocess_predictions(
                 groupby_columns = []
 
             # Now we can dissolve
-            gfo.dissolve(
-                input_path=input_path,
-                tiles_path=dissolve_tiles_path,
-                output_path=curr_output_path,
-                groupby_columns=groupby_columns,
-                explodecollections=True,
-                nb_parallel=nb_parallel,
-                force=force,
-            )
+            if (
+                dissolve_onborder_only
+                and dissolve_tiles_path is None
+                and "onborder" in layerinfo.columns
+            ):
+                _dissolve_onborder(
+                    input_path=input_path,
+                    output_path=curr_output_path,
+                    groupby_columns=groupby_columns,
+                    nb_parallel=nb_parallel,
+                    keep_intermediary_files=keep_intermediary_files,
+                    force=force,
+                )
+            else:
+                if dissolve_onborder_only:
+                    logger.info(
+                        "dissolve_onborder_only is not applicable, so dissolve all "
+                        "features"
+                    )
+                gfo.dissolve(
+                    input_path=input_path,
+                    tiles_path=dissolve_tiles_path,
+                    output_path=curr_output_path,
+                    groupby_columns=groupby_columns,
+                    explodecollections=True,
+                    nb_parallel=nb_parallel,
+                    force=force,
+                )
 
             # Add/recalculate columns with area and nbcoords
             gfo.add_column(
@@ -206,6 +231,54 @@ def postprocess_predictions(
     return output_paths
 
 
+def _dissolve_onborder(
+    input_path: Path,
+    output_path: Path,
+    groupby_columns: list[str],
+    nb_parallel: int,
+    keep_intermediary_files: bool,
+    force: bool,
+):
+    """Dissolve only the features on the border of the tiles they were predicted in.
+
+    The features on the border are written to a separate layer and dissolved. The
+    features that are not on the border can't touch features of other tiles, so they
+    are appended to the result without dissolving them.
+    """
+    # Dissolve the features on the border
+    onborder_path = (
+        output_path.parent / f"{output_path.stem}_onborder{output_path.suffix}"
+    )
+    gfo.copy_layer(
+        src=input_path,
+        dst=onborder_path,
+        columns=groupby_columns,
+        where="onborder = 1",
+        force=True,
+    )
+    gfo.dissolve(
+        input_path=onborder_path,
+        output_path=output_path,
+        groupby_columns=groupby_columns,
+        explodecollections=True,
+        nb_parallel=nb_parallel,
+        force=force,
+    )
+
+    # Append the other features as such
+    gfo.copy_layer(
+        src=input_path,
+        dst=output_path,
+        dst_layer=gfo.get_only_layer(output_path),
+        write_mode="append",
+        columns=groupby_columns,
+        where="onborder = 0",
+    )
+
+    if not keep_intermediary_files:
+        gfo.remove(onborder_path)
+
+
 def _add_output_layer_style(output_path: Path, output_style_path: Path | None) -> None:
     """Add a QML layer style to a GeoPackage output if configured."""
     if output_style_path is None:
@@ -267,11 +340,13 @@ def postprocess_prediction_to_file(
     border_pixels_to_ignore: int = 0,
     postprocess: dict | None = None,
     force: bool = False,
+    return_polygons: bool = False,
 ) -> dict[str, Any]:
     """Postprocess a prediction to file(s).
 
     Args:
-        image_pred_arr (np.ndarray): The prediction as returned by keras.
+        image_pred_arr (np.ndarray): The prediction as returned by keras: float32 or
+            uint8 probabilities per class or a uint8 class map.
         image_crs (str): Crs of the prediction image.
         image_transform (_type_): transform of the prediction image.
         classes (list): _description_
@@ -301,15 +376,31 @@ def postprocess_prediction_to_file(
             Default is None: no postprocessing.
         force (bool, optional): True to force calculation even if output file(s) exist.
             Defaults to False.
+        return_polygons (bool, optional): True to return the polygonized prediction in
+            the result with key "polygons", so it can be written by the caller.
+            Defaults to False.
 
     Raises:
         ValueError: invalid input parameters specified.
 
     Returns:
-        dict[str, Any]: Returns debugging information.
+        dict[str, Any]: Returns debugging information and, if `return_polygons` is
+            True, the polygons.
     """
     result: dict[str, Any] = {}
 
+    # If asked, polygonize the prediction and return the polygons
+    if return_polygons:
+        result["polygons"] = polygonize_pred_multiclass(
+            image_pred_arr=image_pred_arr,
+            image_crs=image_crs,
+            image_transform=image_transform,
+            classes=classes,
+            min_probability=min_probability,
+            postprocess=postprocess,
+            border_pixels_to_ignore=border_pixels_to_ignore,
+        )
+
     # If a vector output path is specified, polygonize the prediction to file
     if output_vector_path is not None:
         result["polygonize_pred_multiclass_to_file"] = (
@@ -351,6 +442,30 @@ def postprocess_prediction_to_file(
     return result
 
 
+def postprocess_shared_prediction_to_file(
+    image_pred_slot: _shared_memory_util.SharedArraySlot, **kwargs
+) -> dict[str, Any]:
+    """Postprocess a prediction that is shared via shared memory to file(s).
+
+    Avoids that the prediction needs to be pickled when it is postprocessed in another
+    process.
+
+    Args:
+        image_pred_slot (SharedArraySlot): handle to the slot in shared memory
+            containing the prediction as returned by keras.
+        kwargs: the other parameters, as documented in
+            :func:`postprocess_prediction_to_file`.
+
+    Returns:
+        dict[str, Any]: Returns debugging information.
+    """
+    with _shared_memory_util.attach(image_pred_slot) as image_pred_arr:
+        result = postprocess_prediction_to_file(image_pred_arr=image_pred_arr, **kwargs)
+        del image_pred_arr
+
+    return result
+
+
 def to_binary_uint8(in_arr: np.ndarray, thresshold_ok: int = 128) -> np.ndarray:
     """Convert input array to binary UINT8.
 
@@ -771,7 +886,8 @@ def polygonize_pred_multiclass_to_file(
     """Polygonize a multiclass prediction to a file.
 
     Args:
-        image_pred_arr (np.ndarray): The prediction as returned by keras.
+        image_pred_arr (np.ndarray): The prediction as returned by keras: float32 or
+            uint8 probabilities per class or a uint8 class map.
         image_crs (str): Crs of the prediction image.
         image_transform (_type_): transform of the prediction image.
         classes (list): _description_
@@ -831,7 +947,9 @@ def polygonize_pred_multiclass(
     """Polygonize a multiclass prediction.
 
     Args:
-        image_pred_arr (np.ndarray): _description_
+        image_pred_arr (np.ndarray): The prediction as returned by keras: float32 or
+            uint8 probabilities per class or a uint8 class map. If it is a class map,
+            `min_probability` should already be applied.
         image_crs (str): _description_
         image_transform (_type_): _description_
         classes (list): _description_
@@ -843,7 +961,9 @@ def polygonize_pred_multiclass(
             should be ignored. Defaults to 0.
 
     Returns:
-        Optional[gpd.GeoDataFrame]: _description_
+        Optional[gpd.GeoDataFrame]: the polygons, with a column "onborder" that is 1
+            for polygons on the border of the image, taking `border_pixels_to_ignore`
+            into account, and 0 for the others.
     """
     # Init
     """
@@ -855,16 +975,7 @@ def polygonize_pred_multiclass(
                 image_pred_arr=image_pred_curr_arr,
                 border_pixels_to_ignore=border_pixels_to_ignore)
     """
-    # Convert prediction to uint8 if needed
-    if image_pred_arr.dtype == np.float32:
-        image_pred_uint8 = np.array((image_pred_arr * 255), dtype=np.uint8)
-    else:
-        image_pred_uint8 = image_pred_arr
-
-    # Reverse the one-hot decoding so each class has it's own number in the array,
-    # but ignore prediction probability < min_probability
-    image_pred_uint8[image_pred_uint8 < math.floor(255 * min_probability)] = 0
-    image_pred_decoded_arr = np.argmax(image_pred_uint8, axis=2).astype(np.uint8)
+    image_pred_decoded_arr = decode_prediction(image_pred_arr, min_probability)
 
     # Make the pixels at the borders of the prediction black so they are ignored
     if border_pixels_to_ignore and border_pixels_to_ignore > 0:
@@ -915,9 +1026,7 @@ def polygonize_pred_multiclass(
         return None
 
     # Calculate the bounds of the image in projected coordinates
-    image_shape = image_pred_decoded_arr.shape
-    image_width = image_shape[0]
-    image_height = image_shape[1]
+    image_height, image_width = image_pred_decoded_arr.shape
     image_bounds = rio_transform.array_bounds(
         image_height, image_width, image_transform
     )
@@ -975,10 +1084,55 @@ def polygonize_pred_multiclass(
                 return None
             result_gdf = result_gdf.explode(ignore_index=True)
 
+    # Add the onborder column, so only features on the border need to be dissolved
+    # afterwards. Use a tolerance of half a pixel to avoid rounding issues.
+    onborder_bounds = (
+        border_bounds[0] + x_pixsize / 2,
+        border_bounds[1] + y_pixsize / 2,
+        border_bounds[2] - x_pixsize / 2,
+        border_bounds[3] - y_pixsize / 2,
+    )
+    result_gdf = vector_util.is_onborder(result_gdf, border_bounds=onborder_bounds)
+
     assert isinstance(result_gdf, gpd.GeoDataFrame)
     return result_gdf
 
 
+def decode_prediction(
+    image_pred_arr: np.ndarray, min_probability: float = 0.5
+) -> np.ndarray:
+    """Decode a prediction to a class map.
+
+    Args:
+        image_pred_arr (np.ndarray): The prediction as returned by keras: float32 or
+            uint8 probabilities per class or a uint8 class map. If it is a class map,
+            it is returned as such.
+        min_probability (float): Minimum probability to consider a pixel being of a
+            certain class. Defaults to 0.5.
+
+    Returns:
+        np.ndarray: the uint8 class map, with for each pixel the index of the class.
+    """
+    if image_pred_arr.ndim == 2:
+        # The prediction is already decoded to a class map by the model
+        return image_pred_arr.astype(np.uint8)
+
+    # Convert prediction to uint8 if needed
+    min_probability_uint8 = math.floor(255 * min_probability)
+    if image_pred_arr.dtype == np.float32:
+        image_pred_uint8 = np.array((image_pred_arr * 255), dtype=np.uint8)
+        image_pred_uint8[image_pred_uint8 < min_probability_uint8] = 0
+    else:
+        # Don't change the input array in place
+        image_pred_uint8 = np.where(
+            image_pred_arr < min_probability_uint8, 0, image_pred_arr
+        )
+
+    # Reverse the one-hot decoding so each class has it's own number in the array,
+    # but ignore prediction probability < min_probability
+    return np.argmax(image_pred_uint8, axis=2).astype(np.uint8)
+
+
 def polygonize_pred(
     image_pred_uint8_bin,
     image_crs: str,
@@ -1060,7 +1214,8 @@ def clean_and_save_prediction(
     """Clean the prediction and save it.
 
     Args:
-        image_pred_arr (np.ndarray): The prediction as returned by keras.
+        image_pred_arr (np.ndarray): The prediction as returned by keras: float32 or
+            uint8 probabilities per class or a uint8 class map.
         image_crs (str): _description_
         image_transform (str): _description_
         classes (list): _description_
@@ -1083,14 +1238,23 @@ def clean_and_save_prediction(
     """
     # If nb. channels in prediction > 1, skip the first as it is the background
     image_pred_shape = image_pred_arr.shape
-    nb_channels = image_pred_shape[2]
+    if len(image_pred_shape) == 2:
+        # The prediction is a class map, so each class will be treated as a channel
+        nb_channels = len(classes)
+    else:
+        nb_channels = image_pred_shape[2]
     if nb_channels > 1:
         channel_start = 1
     else:
         channel_start = 0
 
     for channel_id in range(channel_start, nb_channels):
-        image_pred_curr_arr = image_pred_arr[:, :, channel_id]
+        if len(image_pred_shape) == 2:
+            image_pred_curr_arr = np.where(image_pred_arr == channel_id, 255, 0).astype(
+                np.uint8
+            )
+        else:
+            image_pred_curr_arr = image_pred_arr[:, :, channel_id]
 
         # Clean prediction
         image_pred_uint8_cleaned_curr = clean_prediction(
@@ -0,0 +1,452 @@
+"""Module to calibrate the settings that determine the speed of a prediction."""
+
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+from types import TracebackType
+from typing import Any
+
+import keras
+import numpy as np
+import psutil
+import pyproj
+
+from orthoseg.lib import postprocess_predictions as postp, predicter
+from orthoseg.model import model_factory as mf
+from orthoseg.model.inference_engine import InferenceEngine
+from orthoseg.util import image_util
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# The batch sizes tried while tuning
+BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+
+# A larger batch size or tile size is only retained if it is at least this much faster
+MIN_SPEEDUP = 0.05
+
+
+class _PeakMemory:
+    """Context manager that samples the peak memory used by the current process."""
+
+    def __init__(self, interval_s: float = 0.01):
+        """Initialize the sampler.
+
+        Args:
+            interval_s (float, optional): the interval to sample the memory used.
+                Defaults to 0.01.
+        """
+        self.interval_s = interval_s
+        self.peak_mb = 0.0
+        self._process = psutil.Process(os.getpid())
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "_PeakMemory":
+        """Start sampling."""
+        self._sample_once()
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        """Stop sampling."""
+        self._stop.set()
+        self._thread.join()
+        self._sample_once()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_s):
+            self._sample_once()
+
+    def _sample_once(self):
+        rss_mb = self._process.memory_info().rss / 1024**2
+        self.peak_mb = max(self.peak_mb, rss_mb)
+
+
+def measure_predict(
+    model: keras.models.Model,
+    batch_size: int,
+    width: int,
+    height: int,
+    nb_channels: int = 3,
+    nb_batches: int = 3,
+    jit_compile: bool = False,
+) -> dict[str, float]:
+    """Measure the prediction speed of a model for a batch and image size.
+
+    The speed of a model doesn't depend on the content of the images, so random images
+    are predicted, via an :class:`InferenceEngine` like when predicting. The first batch
+    is predicted before the measurement starts, as it typically is a lot slower.
+
+    Args:
+        model (Model): the model to measure.
+        batch_size (int): the number of images per batch.
+        width (int): the width of the images in pixels, including the overlap.
+        height (int): the height of the images in pixels, including the overlap.
+        nb_channels (int, optional): the number of channels of the images.
+            Defaults to 3.
+        nb_batches (int, optional): the number of batches to measure. Defaults to 3.
+        jit_compile (bool, optional): True to compile the prediction with XLA.
+            Defaults to False.
+
+    Returns:
+        dict[str, float]: "images_per_s" with the number of images predicted per second
+            and "peak_memory_mb" with the peak memory used by the process.
+    """
+    rng = np.random.default_rng(0)
+    batch_arr = rng.random((batch_size, height, width, nb_channels), dtype=np.float32)
+    engine = InferenceEngine(model, batch_size=batch_size, jit_compile=jit_compile)
+    with _PeakMemory() as peak_memory:
+        engine.warm_up(batch_arr.shape[1:])
+        perf_start = perf_counter()
+        for _ in range(nb_batches):
+            engine.predict_on_batch(batch_arr)
+        duration_s = perf_counter() - perf_start
+
+    return {
+        "images_per_s": batch_size * nb_batches / duration_s,
+        "peak_memory_mb": peak_memory.peak_mb,
+    }
+
+
+def tune_batch_size(
+    model: keras.models.Model,
+    width: int,
+    height: int,
+    nb_channels: int = 3,
+    batch_sizes: tuple[int, ...] = BATCH_SIZES,
+    memory_budget_mb: float | None = None,
+    jit_compile: bool = False,
+) -> dict[str, Any]:
+    """Determine the fastest batch size for a model and image size.
+
+    The batch sizes are tried in increasing order till the prediction speed doesn't
+    improve anymore, the memory budget is exceeded or the prediction fails, e.g.
+    because the GPU runs out of memory.
+
+    Args:
+        model (Model): the model to tune the batch size for.
+        width (int): the width of the images in pixels, including the overlap.
+        height (int): the height of the images in pixels, including the overlap.
+        nb_channels (int, optional): the number of channels of the images.
+            Defaults to 3.
+        batch_sizes (tuple[int, ...], optional): the batch sizes to try.
+            Defaults to BATCH_SIZES.
+        memory_budget_mb (float | None, optional): the maximum memory the process can
+            use while predicting. If None, there is no limit. Defaults to None.
+        jit_compile (bool, optional): True to compile the prediction with XLA.
+            Defaults to False.
+
+    Returns:
+        dict[str, Any]: the measurement of the fastest batch size with "batch_size",
+            "images_per_s" and "peak_memory_mb" or an empty dict if no batch size fits
+            in the memory budget.
+    """
+    best: dict[str, Any] = {}
+    for batch_size in sorted(batch_sizes):
+        # Don't try batch sizes if the input alone doesn't fit in the budget
+        input_mb = batch_size * width * height * nb_channels * 4 / 1024**2
+        if memory_budget_mb is not None and input_mb > memory_budget_mb:
+            break
+        try:
+            result = measure_predict(
+                model,
+                batch_size,
+                width,
+                height,
+                nb_channels=nb_channels,
+                jit_compile=jit_compile,
+            )
+        except Exception as ex:
+            logger.info(f"batch_size {batch_size} failed for {width}x{height}: {ex}")
+            break
+
+        logger.info(
+            f"batch_size {batch_size} for {width}x{height}: "
+            f"{result['images_per_s']:.2f} images/s, "
+            f"peak memory {result['peak_memory_mb']:.0f} MB"
+        )
+        if memory_budget_mb is not None and result["peak_memory_mb"] > memory_budget_mb:
+            break
+        if len(best) > 0 and result["images_per_s"] < best["images_per_s"] * (
+            1 + MIN_SPEEDUP
+        ):
+            break
+        best = {"batch_size": batch_size, **result}
+
+    return best
+
+
+def get_parallelism(
+    images_per_s: float,
+    read_s: float,
+    postprocess_s: float,
+    batch_size: int,
+    nb_cpu: int | None = None,
+) -> dict[str, int]:
+    """Determine the number of parallel reads and postprocess workers needed.
+
+    To keep the model busy, the number of images being read or postprocessed at the
+    same time needs to be the time it takes to read or postprocess an image multiplied
+    by the number of images predicted per second. Some margin is added to cope with
+    variations in the read and postprocess times.
+
+    Args:
+        images_per_s (float): the number of images predicted per second.
+        read_s (float): the time to read an image in seconds.
+        postprocess_s (float): the time to postprocess an image in seconds.
+        batch_size (int): the batch size used to predict.
+        nb_cpu (int | None, optional): the number of CPU's available. If None, the
+            number of CPU's of the machine is used. Defaults to None.
+
+    Returns:
+        dict[str, int]: "nb_parallel_read" and "nb_parallel_postprocess".
+    """
+    if nb_cpu is None:
+        nb_cpu = multiprocessing.cpu_count()
+
+    # At least a full batch needs to be read while the previous one is predicted
+    nb_parallel_read = max(batch_size, math.ceil(images_per_s * read_s * 1.5))
+    nb_parallel_postprocess = math.ceil(images_per_s * postprocess_s * 1.2)
+    nb_parallel_postprocess = min(max(nb_parallel_postprocess, 1), nb_cpu)
+
+    return {
+        "nb_parallel_read": nb_parallel_read,
+        "nb_parallel_postprocess": nb_parallel_postprocess,
+    }
+
+
+def tune_predict(
+    model: keras.models.Model,
+    image_layer_config: dict[str, Any],
+    architecture: str,
+    classes: list,
+    image_pixel_x_size: float,
+    image_pixel_y_size: float,
+    tile_sizes: list[tuple[int, int]],
+    image_pixels_overlap: int = 0,
+    min_probability: float = 0.5,
+    postprocess: dict | None = None,
+    memory_budget_mb: float | None = None,
+    nb_sample_tiles: int = 8,
+    jit_compile: bool = False,
+    ssl_verify: bool | str = True,
+) -> dict[str, Any]:
+    """Determine the fastest settings to predict an image layer on this machine.
+
+    First, the tile size and batch size that predict the most pixels per second are
+    determined. Pixels in the overlap are not counted, as they are predicted twice.
+    Then, a sample of the tiles of the image layer is read and postprocessed to
+    determine the parallelism needed for the reads and the postprocessing to keep up
+    with the model.
+
+    Args:
+        model (Model): the model to predict with.
+        image_layer_config (dict[str, Any]): the configuration of the image layer.
+        architecture (str): the architecture of the model, to check the tile sizes.
+        classes (list): the class names.
+        image_pixel_x_size (float): the pixel size in the x direction.
+        image_pixel_y_size (float): the pixel size in the y direction.
+        tile_sizes (list[tuple[int, int]]): the (width, height) of the tiles to try,
+            without overlap.
+        image_pixels_overlap (int, optional): the number of pixels the tiles are
+            enlarged with in all directions. Defaults to 0.
+        min_probability (float, optional): the minimum probability for a pixel to be
+            attributed to a class. Defaults to 0.5.
+        postprocess (dict | None, optional): the postprocessing to apply to the
+            predictions. Defaults to None.
+        memory_budget_mb (float | None, optional): the maximum memory the prediction
+            can use. If None, there is no limit. Defaults to None.
+        nb_sample_tiles (int, optional): the number of tiles of the image layer to read
+            and postprocess. Defaults to 8.
+        jit_compile (bool, optional): True to compile the prediction with XLA.
+            Defaults to False.
+        ssl_verify (bool or str, optional): True to use the default certificate bundle
+            as installed on your system. False disables certificate validation
+            (NOT recommended!). If a path to a certificate bundle file (.pem) is passed,
+            this will be used. Defaults to True.
+
+    Raises:
+        ValueError: if none of the tile sizes can be used.
+
+    Returns:
+        dict[str, Any]: the settings found: "image_pixel_width", "image_pixel_height",
+            "batch_size", "nb_parallel_read" and "nb_parallel_postprocess", together
+            with the measurements they are based on.
+    """
+    # Determine the fastest tile size and batch size
+    best: dict[str, Any] = {}
+    for width, height in tile_sizes:
+        input_width = width + 2 * image_pixels_overlap
+        input_height = height + 2 * image_pixels_overlap
+        try:
+            mf.check_image_size(architecture, input_width, input_height)
+        except ValueError as ex:
+            logger.info(f"tile size {width}x{height} skipped: {ex}")
+            continue
+
+        result = tune_batch_size(
+            model,
+            input_width,
+            input_height,
+            memory_budget_mb=memory_budget_mb,
+            jit_compile=jit_compile,
+        )
+        if len(result) == 0:
+            continue
+        result["pixels_per_s"] = result["images_per_s"] * width * height
+        logger.info(
+            f"tile size {width}x{height}: {result['pixels_per_s']:.0f} pixels/s with "
+            f"batch_size {result['batch_size']}"
+        )
+        if len(best) == 0 or result["pixels_per_s"] > best["pixels_per_s"] * (
+            1 + MIN_SPEEDUP
+        ):
+            best = {"image_pixel_width": width, "image_pixel_height": height, **result}
+
+    if len(best) == 0:
+        raise ValueError(f"none of the tile sizes can be used: {tile_sizes}")
+
+    # Measure the read and postprocess times on a sample of the real tiles
+    sample_times = _measure_sample_tiles(
+        model=model,
+        image_layer_config=image_layer_config,
+        classes=classes,
+        image_pixel_x_size=image_pixel_x_size,
+        image_pixel_y_size=image_pixel_y_size,
+        image_pixel_width=best["image_pixel_width"],
+        image_pixel_height=best["image_pixel_height"],
+        image_pixels_overlap=image_pixels_overlap,
+        min_probability=min_probability,
+        postprocess=postprocess,
+        nb_sample_tiles=nb_sample_tiles,
+        ssl_verify=ssl_verify,
+    )
+    best.update(sample_times)
+    best.update(
+        get_parallelism(
+            images_per_s=best["images_per_s"],
+            read_s=best["read_s"],
+            postprocess_s=best["postprocess_s"],
+            batch_size=best["batch_size"],
+        )
+    )
+
+    # Reduce the parallelism if the images being processed don't fit in the budget
+    if memory_budget_mb is not None:
+        while (
+            _estimate_memory_mb(best) > memory_budget_mb
+            and best["nb_parallel_postprocess"] > 1
+        ):
+            best["nb_parallel_postprocess"] -= 1
+        while (
+            _estimate_memory_mb(best) > memory_budget_mb
+            and best["nb_parallel_read"] > best["batch_size"]
+        ):
+            best["nb_parallel_read"] -= 1
+    best["estimated_memory_mb"] = _estimate_memory_mb(best)
+
+    return best
+
+
+def _measure_sample_tiles(
+    model: keras.models.Model,
+    image_layer_config: dict[str, Any],
+    classes: list,
+    image_pixel_x_size: float,
+    image_pixel_y_size: float,
+    image_pixel_width: int,
+    image_pixel_height: int,
+    image_pixels_overlap: int,
+    min_probability: float,
+    postprocess: dict | None,
+    nb_sample_tiles: int,
+    ssl_verify: bool | str,
+) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tiles_gdf = image_util.get_images_for_grid(
+            output_image_dir=Path(tmp_dir),
+            crs=pyproj.CRS.from_user_input(image_layer_config["projection"]),
+            image_gen_bbox=image_layer_config["bbox"],
+            image_gen_roi_filepath=image_layer_config["roi_filepath"],
+            grid_xmin=image_layer_config["grid_xmin"],
+            grid_ymin=image_layer_config["grid_ymin"],
+            image_crs_pixel_x_size=image_pixel_x_size,
+            image_crs_pixel_y_size=image_pixel_y_size,
+            image_pixel_width=image_pixel_width,
+            image_pixel_height=image_pixel_height,
+            pixels_overlap=image_pixels_overlap,
+        )
+    if len(tiles_gdf) == 0:
+        raise ValueError(f"no tiles for layer {image_layer_config['layername']}")
+
+    # Sample tiles spread over the entire layer
+    sample_idx = np.unique(
+        np.linspace(0, len(tiles_gdf) - 1, nb_sample_tiles).astype(int)
+    )
+    size = (
+        image_pixel_width + 2 * image_pixels_overlap,
+        image_pixel_height + 2 * image_pixels_overlap,
+    )
+    read_s = []
+    postprocess_s = []
+    postprocess_memory_mb = []
+    for bbox in tiles_gdf.geometry.bounds.iloc[sample_idx].itertuples(index=False):
+        image, duration_s = _timed(
+            predicter.load_image,
+            bbox=tuple(bbox),
+            size=size,
+            image_layer=image_layer_config,
+            ssl_verify=ssl_verify,
+        )
+        read_s.append(duration_s)
+        image_pred_arr = np.asarray(model.predict_on_batch(image["image_data"][None]))
+
+        with _PeakMemory() as peak_memory:
+            start_mb = peak_memory.peak_mb
+            _, duration_s = _timed(
+                postp.postprocess_prediction_to_file,
+                image_pred_arr=image_pred_arr[0],
+                image_crs=image["image_crs"],
+                image_transform=image["image_transform"],
+                classes=classes,
+                min_probability=min_probability,
+                border_pixels_to_ignore=image_pixels_overlap,
+                postprocess=postprocess,
+                return_polygons=True,
+            )
+        postprocess_s.append(duration_s)
+        postprocess_memory_mb.append(peak_memory.peak_mb - start_mb)
+
+    image_mb = size[0] * size[1] * image["image_data"].shape[2] * 8 / 1024**2
+    return {
+        "read_s": float(np.median(read_s)),
+        "postprocess_s": float(np.median(postprocess_s)),
+        "image_memory_mb": image_mb,
+        "postprocess_memory_mb": float(max(postprocess_memory_mb)) + image_mb,
+    }
+
+
+def _estimate_memory_mb(settings: dict[str, Any]) -> float:
+    return (
+        settings["peak_memory_mb"]
+        + settings["nb_parallel_read"] * settings["image_memory_mb"]
+        + settings["nb_parallel_postprocess"] * settings["postprocess_memory_mb"]
+    )
+
+
+def _timed(func: Callable, *args, **kwargs) -> tuple[Any, float]:
+    perf_start = perf_counter()
+    result = func(*args, **kwargs)
+    return result, perf_counter() - perf_start
@@ -1,21 +1,24 @@
 """Module with high-level operations to segment images."""
 
 import csv
+import itertools
 import json
 import logging
 import multiprocessing
+import os
 import shutil
-import tempfile
-import time
+import socket
 import traceback
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
 from concurrent import futures
-from datetime import datetime
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from time import perf_counter
+from time import perf_counter, sleep
+from types import TracebackType
 from typing import Any
 
 import geofileops as gfo
+import geopandas as gpd
 import keras.models
 import numpy as np
 import pandas as pd
@@ -24,17 +27,254 @@ import rasterio as rio
 import rasterio.crs as rio_crs
 import rasterio.plot as rio_plot
 import tensorflow as tf
+from rasterio.enums import MaskFlags
 
 import orthoseg.lib.postprocess_predictions as postp
-from orthoseg.util import _processing_util, image_util
+from orthoseg.lib.prediction_journal import PredictionJournal
+from orthoseg.lib.prediction_leases import PredictionLeases
+from orthoseg.lib.prediction_mosaic import (
+    PredictionMosaic,
+    get_block_windows,
+    polygonize_block,
+)
+from orthoseg.lib.prescreen import (
+    SKIP_OUTSIDE_ROI,
+    get_tiles_outside_roi,
+    prescreen_image,
+)
+from orthoseg.lib.shared_tile_reader import SharedTileReader, SharedTileReaderClient
+from orthoseg.model.inference_engine import InferenceEngine, OnnxInferenceEngine
+from orthoseg.util import _processing_util, _shared_memory_util, image_util
 from orthoseg.util.progress_util import ProgressLogger
+from orthoseg.util.tile_manifest import IMAGE_EXTS, TileManifest
 
 # Get a logger...
 logger = logging.getLogger(__name__)
 
 
+class Predictor:
+    """Session to run multiple predictions with the same model.
+
+    The model is wrapped in an :class:`InferenceEngine`, so its prediction function is
+    traced once and reused. The worker pools used to read and postprocess the images
+    are also kept alive between predictions, so the worker processes don't need to be
+    started again for each prediction.
+
+    Use as context manager to make sure the worker pools are shut down.
+    """
+
+    def __init__(
+        self,
+        model: keras.models.Model | InferenceEngine | OnnxInferenceEngine,
+        preprocess_input: Callable | None,
+        classes: list,
+        batch_size: int = 16,
+        nb_parallel_read: int = -1,
+        nb_parallel_postprocess: int = 1,
+        jit_compile: bool = False,
+    ):
+        """Create a predictor session.
+
+        Args:
+            model (Model | InferenceEngine | OnnxInferenceEngine): the model to use for
+                the predictions. A keras model is wrapped in an
+                :class:`InferenceEngine`.
+            preprocess_input (Callable): the preprocessing function to apply to the
+                input images before passing them to the model.
+            classes (list): a list of the different class names.
+            batch_size (int, optional): batch size to use while predicting.
+                Defaults to 16.
+            nb_parallel_read (int, optional): The number of parallel threads to
+                read/load images for prediction. If -1, 3 * `batch_size` is used.
+                Defaults to -1.
+            nb_parallel_postprocess (int, optional): The number of parallel processes
+                used to postprocess the predictions. If -1, all available CPU's are
+                used. Defaults to 1.
+            jit_compile (bool, optional): True to compile the prediction function of a
+                keras model with XLA. Defaults to False.
+        """
+        if isinstance(model, keras.models.Model):
+            model = InferenceEngine(
+                model, batch_size=batch_size, jit_compile=jit_compile
+            )
+        self.model = model
+        self.preprocess_input = preprocess_input
+        self.classes = classes
+        self.batch_size = batch_size
+        self.nb_parallel_read = nb_parallel_read
+        self.nb_parallel_postprocess = nb_parallel_postprocess
+        self._worker_pools = _WorkerPools()
+
+    def __enter__(self) -> "Predictor":
+        """Use the predictor as context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        """Shut down the worker pools when leaving the context."""
+        self.close()
+
+    def warm_up(self, image_shape: tuple[int, ...]):
+        """Prepare the model to predict images of a certain shape.
+
+        Args:
+            image_shape (tuple[int, ...]): the shape of the images to predict, as
+                (height, width, channels).
+        """
+        if isinstance(self.model, InferenceEngine | OnnxInferenceEngine):
+            self.model.warm_up(image_shape)
+
+    def predict_dir(
+        self,
+        input_image_dir: Path,
+        output_image_dir: Path,
+        output_vector_path: Path | None,
+        **kwargs,
+    ):
+        """Create a prediction for all the images in a directory.
+
+        Args:
+            input_image_dir (Path): dir where the input images are located.
+            output_image_dir (Path): dir where the output will be put.
+            output_vector_path (Path, optional): the path to write the vector output
+                to.
+            **kwargs: the other arguments of :func:`predict_dir`.
+        """
+        predict_dir(
+            model=self.model,
+            preprocess_input=self.preprocess_input,
+            input_image_dir=input_image_dir,
+            output_image_dir=output_image_dir,
+            output_vector_path=output_vector_path,
+            classes=self.classes,
+            batch_size=self.batch_size,
+            nb_parallel_read=self.nb_parallel_read,
+            nb_parallel_postprocess=self.nb_parallel_postprocess,
+            predictor=self,
+            **kwargs,
+        )
+
+    def predict_layer(
+        self,
+        image_layer_config: dict[str, Any],
+        output_image_dir: Path,
+        output_vector_path: Path | None,
+        **kwargs,
+    ):
+        """Create a prediction for all the images of a layer.
+
+        Args:
+            image_layer_config (dict[str, Any]): configuration of the image layer to
+                predict on.
+            output_image_dir (Path): dir where the output will be put.
+            output_vector_path (Path, optional): the path to write the vector output
+                to.
+            **kwargs: the other arguments of :func:`predict_layer`.
+        """
+        predict_layer(
+            model=self.model,
+            preprocess_input=self.preprocess_input,
+            image_layer_config=image_layer_config,
+            output_image_dir=output_image_dir,
+            output_vector_path=output_vector_path,
+            classes=self.classes,
+            batch_size=self.batch_size,
+            nb_parallel_read=self.nb_parallel_read,
+            nb_parallel_postprocess=self.nb_parallel_postprocess,
+            predictor=self,
+            **kwargs,
+        )
+
+    def predict_layer_distributed(
+        self,
+        image_layer_config: dict[str, Any],
+        output_image_dir: Path,
+        output_vector_path: Path,
+        **kwargs,
+    ) -> bool:
+        """Predict a layer as one of multiple workers that share the work.
+
+        Args:
+            image_layer_config (dict[str, Any]): configuration of the image layer to
+                predict on.
+            output_image_dir (Path): dir where the work table and the intermediate
+                output of all workers will be put.
+            output_vector_path (Path): the path to write the merged vector output to.
+            **kwargs: the other arguments of :func:`predict_layer_distributed`.
+
+        Returns:
+            bool: True if the prediction is complete and merged by this worker.
+        """
+        return predict_layer_distributed(
+            model=self.model,
+            preprocess_input=self.preprocess_input,
+            image_layer_config=image_layer_config,
+            output_image_dir=output_image_dir,
+            output_vector_path=output_vector_path,
+            classes=self.classes,
+            batch_size=self.batch_size,
+            nb_parallel_read=self.nb_parallel_read,
+            nb_parallel_postprocess=self.nb_parallel_postprocess,
+            predictor=self,
+            **kwargs,
+        )
+
+    def predict_tiles(
+        self,
+        image_paths: list[Path],
+        output_image_dir: Path,
+        output_vector_path: Path | None,
+        **kwargs,
+    ):
+        """Create a prediction for a list of image files.
+
+        The output for the images is put in `output_image_dir` with the same directory
+        structure as the images have relative to their common parent directory.
+
+        Args:
+            image_paths (list[Path]): the image files to predict.
+            output_image_dir (Path): dir where the output will be put.
+            output_vector_path (Path, optional): the path to write the vector output
+                to.
+            **kwargs: the other arguments of :func:`predict_dir`, except
+                `no_images_ok`.
+        """
+        if len(image_paths) == 0:
+            raise ValueError("image_paths is empty")
+        if output_vector_path is not None and output_vector_path.exists():
+            logger.info(f"output file exists already, so return: {output_vector_path}")
+            return
+
+        input_image_dir = Path(
+            os.path.commonpath([path.parent for path in image_paths])
+        )
+        _predict_layer(
+            model=self.model,
+            preprocess_input=self.preprocess_input,
+            input_image_dir=input_image_dir,
+            image_layer=None,
+            output_image_dir=output_image_dir,
+            output_vector_path=output_vector_path,
+            classes=self.classes,
+            image_files=[{"path": path} for path in sorted(image_paths)],
+            batch_size=self.batch_size,
+            nb_parallel_read=self.nb_parallel_read,
+            nb_parallel_postprocess=self.nb_parallel_postprocess,
+            worker_pools=self._worker_pools,
+            **kwargs,
+        )
+
+    def close(self):
+        """Shut down the worker pools."""
+        self._worker_pools.close()
+
+
 def predict_dir(
-    model: keras.models.Model,
+    model: keras.models.Model | InferenceEngine | OnnxInferenceEngine,
     preprocess_input: Callable | None,
     input_image_dir: Path,
     output_image_dir: Path,
@@ -51,8 +291,11 @@ def predict_dir(
     nb_parallel_read: int = -1,
     nb_parallel_postprocess: int = 1,
     max_prediction_errors: int = 100,
+    vector_write_batch_size: int = 50000,
+    prescreen: bool = True,
     force: bool = False,
     no_images_ok: bool = False,
+    predictor: Predictor | None = None,
 ):
     """Create a prediction for all the images in a directory.
 
@@ -76,7 +319,8 @@ def predict_dir(
     available, the prefix is the % white pixels in the prediction.
 
     Args:
-        model (Model): the model to use for the prediction
+        model (Model | InferenceEngine | OnnxInferenceEngine): the model to use for
+            the prediction.
         preprocess_input (Callable): the preprocessing function to apply to the input
             images before passing them to the model
         input_image_dir (Pathlike): dir where the input images are located
@@ -107,11 +351,20 @@ def predict_dir(
             available CPU's are used. Defaults to 1.
         max_prediction_errors (int, optional): the maximum number of errors that is
             tolerated before stopping prediction. If -1, no limit. Defaults to 100.
+        vector_write_batch_size (int, optional): the polygons are buffered and written
+            to `output_vector_path` in batches of at least this number of features.
+            Defaults to 50000.
+        prescreen (bool, optional): True to skip images without running the model if
+            they are entirely nodata or have the same value for all pixels. In
+            evaluate mode, images are never skipped. Defaults to True.
         force: False to skip images that already have a prediction, true to
             ignore existing predictions and overwrite them
         no_images_ok (bool, optional): False to throw `ValueError`
             when no images available in the `input_image_dir`,
             True to return without error. Defaults to False.
+        predictor (Predictor, optional): the predictor session this prediction is
+            part of. Its worker pools are reused. If None, worker pools are started
+            for this prediction only. Defaults to None.
     """
     # Init
     if output_vector_path is not None and output_vector_path.exists():
@@ -126,12 +379,26 @@ def predict_dir(
 
     logger.info("Start predict_dir")
 
-    # Get list of all image files to process
+    # Get list of all image files to process. If the images were cached by
+    # load_images_to_cache, they are listed in its manifest, which is a lot faster than
+    # searching the directory. If the manifest is not complete, e.g. because loading
+    # the images was stopped early, the directory is searched anyway.
     image_filepaths: list[Path] = []
     image_files: list[dict[str, Any]] = []
-    input_ext = [".png", ".tif", ".jpg"]
-    for input_ext_cur in input_ext:
-        image_filepaths.extend(input_image_dir.rglob("*" + input_ext_cur))
+    use_manifest = False
+    if TileManifest.exists(input_image_dir):
+        with TileManifest(input_image_dir) as manifest:
+            use_manifest = manifest.is_complete()
+            if use_manifest:
+                image_filepaths = manifest.get_cached_paths()
+            else:
+                logger.warning(
+                    f"manifest of {input_image_dir} is incomplete, so search the "
+                    "directory for the images"
+                )
+    if not use_manifest:
+        for input_ext_cur in IMAGE_EXTS:
+            image_filepaths.extend(input_image_dir.rglob("*" + input_ext_cur))
 
     # If no images to predict, no use to continue
     nb_images = len(image_filepaths)
@@ -164,12 +431,15 @@ def predict_dir(
         nb_parallel_read=nb_parallel_read,
         nb_parallel_postprocess=nb_parallel_postprocess,
         max_prediction_errors=max_prediction_errors,
+        vector_write_batch_size=vector_write_batch_size,
+        prescreen=prescreen,
         force=force,
+        worker_pools=predictor._worker_pools if predictor is not None else None,
     )
 
 
 def predict_layer(
-    model: keras.models.Model,
+    model: keras.models.Model | InferenceEngine | OnnxInferenceEngine,
     preprocess_input: Callable | None,
     image_layer_config: dict[str, Any],
     image_pixel_x_size: float,
@@ -190,9 +460,14 @@ def predict_layer(
     nb_parallel_read: int = -1,
     nb_parallel_postprocess: int = 1,
     max_prediction_errors: int = 100,
+    vector_write_batch_size: int = 50000,
+    prescreen: bool = True,
+    overlap_mode: str = "ignore_border",
     ssl_verify: bool | str = True,
     force: bool = False,
     no_images_ok: bool = False,
+    predictor: Predictor | None = None,
+    tile_reader: SharedTileReaderClient | None = None,
 ):
     """Create a prediction for all the images of a layer.
 
@@ -216,7 +491,8 @@ def predict_layer(
     available, the prefix is the % white pixels in the prediction.
 
     Args:
-        model (Model): the model to use for the prediction
+        model (Model | InferenceEngine | OnnxInferenceEngine): the model to use for
+            the prediction.
         preprocess_input (Callable): the preprocessing function to apply to the input
             images before passing them to the model.
         image_layer_config: configuration of the image layer to predict on.
@@ -259,6 +535,19 @@ def predict_layer(
             all available CPU's are used. Defaults to 1.
         max_prediction_errors (int, optional): the maximum number of errors that is
             tolerated before stopping prediction. If -1, no limit. Defaults to 100.
+        vector_write_batch_size (int, optional): the polygons are buffered and written
+            to `output_vector_path` in batches of at least this number of features.
+            Defaults to 50000.
+        prescreen (bool, optional): True to skip images without running the model if
+            they are entirely nodata or have the same value for all pixels, or, if the
+            image layer has a roi, if the part of the tile that is predicted is outside
+            the roi. Defaults to True.
+        overlap_mode (str, optional): how to deal with the overlap between the tiles:
+            "ignore_border" to ignore the `image_pixels_overlap` pixels at the borders
+            of each tile, "blend" to blend the predictions of overlapping tiles into
+            one mosaic. The blended classes are written to a tiled GeoTIFF with
+            overviews, next to `output_vector_path` if specified, and polygonized in
+            large blocks. Defaults to "ignore_border".
         ssl_verify (bool or str, optional): True to use the default
             certificate bundle as installed on your system. False disables
             certificate validation (NOT recommended!). If a path to a
@@ -270,6 +559,12 @@ def predict_layer(
         no_images_ok (bool, optional): False to throw `ValueError`
             when no images available in the `input_image_dir`,
             True to return without error. Defaults to False.
+        predictor (Predictor, optional): the predictor session this prediction is
+            part of. Its worker pools are reused. If None, worker pools are started
+            for this prediction only. Defaults to None.
+        tile_reader (SharedTileReaderClient, optional): reader to share the tiles
+            read with other predictions on the same layer, so each tile is only read
+            once. Defaults to None.
     """
     # Init
     if output_vector_path is not None and output_vector_path.exists():
@@ -277,28 +572,20 @@ def predict_layer(
         return
     logger.info("Start predict_layer")
 
-    crs = pyproj.CRS.from_user_input(image_layer_config["projection"])
-    image_format = image_layer_config.get("image_format", image_util.FORMAT_JPEG)
-
     # Determine the tiles to use to divide the prediction
-    output_image_dir.mkdir(parents=True, exist_ok=True)
-    tiles_to_download_gdf = image_util.get_images_for_grid(
-        output_image_dir=output_image_dir,
-        crs=crs,
-        image_gen_bbox=image_layer_config["bbox"],
-        image_gen_roi_filepath=image_layer_config["roi_filepath"],
-        grid_xmin=image_layer_config["grid_xmin"],
-        grid_ymin=image_layer_config["grid_ymin"],
-        image_crs_pixel_x_size=image_pixel_x_size,
-        image_crs_pixel_y_size=image_pixel_y_size,
+    image_files = _get_layer_image_files(
+        image_layer_config=image_layer_config,
+        image_pixel_x_size=image_pixel_x_size,
+        image_pixel_y_size=image_pixel_y_size,
         image_pixel_width=image_pixel_width,
         image_pixel_height=image_pixel_height,
-        image_format=image_format,
-        pixels_overlap=image_pixels_overlap,
+        image_pixels_overlap=image_pixels_overlap,
+        grid_dir=output_image_dir,
+        prescreen=prescreen,
     )
 
     # If no images to predict, no use to continue
-    nb_images = len(tiles_to_download_gdf)
+    nb_images = len(image_files)
     if nb_images == 0:
         if no_images_ok:
             return
@@ -309,26 +596,30 @@ def predict_layer(
 
     logger.info(f"Found {nb_images} images to predict")
 
-    # Determine the size of the tiles used for prediction
-    tile_pixel_width = image_pixel_width
-    tile_pixel_height = image_pixel_height
-    if image_pixels_overlap > 0:
-        tile_pixel_width += 2 * image_pixels_overlap
-        tile_pixel_height += 2 * image_pixels_overlap
-
-    # Convert the dataframe to a list
-    image_files: list[dict[str, Any]] = []
-    for tile in tiles_to_download_gdf.geometry.bounds.itertuples():
-        _, tile_xmin, tile_ymin, tile_xmax, tile_ymax = tile
-
-        output_filepath = tiles_to_download_gdf.loc[tile.Index, "path"]
-        image_files.append(
-            {
-                "path": output_filepath,
-                "bbox": (tile_xmin, tile_ymin, tile_xmax, tile_ymax),
-                "size": (tile_pixel_width, tile_pixel_height),
-            }
+    # If the predictions of overlapping tiles need to be blended, prepare the mosaic
+    mosaic = None
+    if overlap_mode == "blend":
+        if evaluate_mode:
+            raise ValueError("overlap_mode 'blend' is not supported in evaluate_mode")
+        bboxes = np.array([image_file["bbox"] for image_file in image_files])
+        mosaic = PredictionMosaic(
+            path=output_image_dir / "prediction_mosaic_sums.tif",
+            bounds=(
+                bboxes[:, 0].min(),
+                bboxes[:, 1].min(),
+                bboxes[:, 2].max(),
+                bboxes[:, 3].max(),
+            ),
+            pixel_x_size=image_pixel_x_size,
+            pixel_y_size=image_pixel_y_size,
+            crs=pyproj.CRS.from_user_input(image_layer_config["projection"]),
+            nb_classes=len(classes),
+            # Neighbouring tiles overlap twice the number of pixels tiles are enlarged
+            blend_pixels=2 * image_pixels_overlap,
+            force=force,
         )
+    elif overlap_mode != "ignore_border":
+        raise ValueError(f"invalid overlap_mode: {overlap_mode}")
 
     _predict_layer(
         model=model,
@@ -350,13 +641,477 @@ def predict_layer(
         nb_parallel_read=nb_parallel_read,
         nb_parallel_postprocess=nb_parallel_postprocess,
         max_prediction_errors=max_prediction_errors,
+        vector_write_batch_size=vector_write_batch_size,
+        prescreen=prescreen,
+        mosaic=mosaic,
         ssl_verify=ssl_verify,
         force=force,
+        worker_pools=predictor._worker_pools if predictor is not None else None,
+        tile_reader=tile_reader,
+    )
+
+
+def predict_layer_multi(
+    predictions: list[dict[str, Any]],
+    image_layer_config: dict[str, Any],
+    image_pixel_x_size: float,
+    image_pixel_y_size: float,
+    image_pixel_width: int,
+    image_pixel_height: int,
+    image_pixels_overlap: int = 0,
+    prescreen: bool = True,
+    ssl_verify: bool | str = True,
+    max_tiles_ahead: int = 32,
+):
+    """Create the predictions of multiple models for all the images of a layer.
+
+    Each image of the layer is only read once and passed to all models. The
+    predictions run concurrently, each with its own output and postprocessing, and
+    share the images read via a :class:`SharedTileReader`.
+
+    Args:
+        predictions (list[dict[str, Any]]): for each model, the arguments of
+            :func:`predict_layer` that are specific for the model, e.g. "model",
+            "preprocess_input", "output_image_dir", "output_vector_path", "classes",
+            "min_probability" and "postprocess". If a "predictor" is specified, its
+            :meth:`Predictor.predict_layer` is used and the model should not be
+            specified.
+        image_layer_config (dict[str, Any]): configuration of the image layer to
+            predict on.
+        image_pixel_x_size (float): Pixel size of the image tiles.
+        image_pixel_y_size (float): Pixel size of the image tiles.
+        image_pixel_width (int): Width of the tiles in number of pixels.
+        image_pixel_height (int): Height of the tiles in number of pixels.
+        image_pixels_overlap (int, optional): The number of pixels the tiles should be
+            enlarged in all directions to create overlapping tiles. Defaults to 0.
+        prescreen (bool, optional): True to skip images without running the models if
+            they are entirely nodata or have the same value for all pixels, or if they
+            are outside the roi. Defaults to True.
+        ssl_verify (bool or str, optional): True to use the default certificate bundle
+            as installed on your system. False disables certificate validation
+            (NOT recommended!). If a path to a certificate bundle file (.pem) is passed,
+            this will be used. Defaults to True.
+        max_tiles_ahead (int, optional): the maximum number of tiles a prediction can
+            get ahead of the slowest one. Images read are kept in memory till all
+            predictions used them, so this limits the memory used. Defaults to 32.
+
+    Raises:
+        RuntimeError: if one or more predictions failed. The other predictions are
+            completed anyway.
+    """
+    if len(predictions) == 0:
+        raise ValueError("predictions is empty")
+
+    tile_reader = SharedTileReader(len(predictions), max_tiles_ahead=max_tiles_ahead)
+    layer_kwargs = {
+        "image_layer_config": image_layer_config,
+        "image_pixel_x_size": image_pixel_x_size,
+        "image_pixel_y_size": image_pixel_y_size,
+        "image_pixel_width": image_pixel_width,
+        "image_pixel_height": image_pixel_height,
+        "image_pixels_overlap": image_pixels_overlap,
+        "prescreen": prescreen,
+        "ssl_verify": ssl_verify,
+    }
+
+    def predict_one(prediction_id: int, prediction: dict[str, Any]):
+        # Close the client if the prediction stops, so the others don't wait on it
+        with tile_reader.client(prediction_id) as client:
+            kwargs = {**prediction, **layer_kwargs, "tile_reader": client}
+            predictor = kwargs.pop("predictor", None)
+            if predictor is not None:
+                predictor.predict_layer(**kwargs)
+            else:
+                predict_layer(**kwargs)
+
+    logger.info(f"Start predict_layer_multi for {len(predictions)} predictions")
+    errors = []
+    with futures.ThreadPoolExecutor(len(predictions)) as pool:
+        future_to_id = {
+            pool.submit(predict_one, prediction_id, prediction): prediction_id
+            for prediction_id, prediction in enumerate(predictions)
+        }
+        for future in futures.as_completed(future_to_id):
+            prediction_id = future_to_id[future]
+            try:
+                future.result()
+            except Exception as ex:
+                logger.exception(f"Error in prediction {prediction_id}")
+                errors.append(f"prediction {prediction_id}: {ex}")
+
+    logger.info(
+        f"{tile_reader.nb_reads} images read for {len(predictions)} predictions"
+    )
+    if len(errors) > 0:
+        raise RuntimeError("Error(s) occured while predicting:\n" + "\n".join(errors))
+
+
+def predict_layer_distributed(
+    model: keras.models.Model | InferenceEngine | OnnxInferenceEngine,
+    preprocess_input: Callable | None,
+    image_layer_config: dict[str, Any],
+    image_pixel_x_size: float,
+    image_pixel_y_size: float,
+    image_pixel_width: int,
+    image_pixel_height: int,
+    image_pixels_overlap: int,
+    output_image_dir: Path,
+    output_vector_path: Path,
+    classes: list,
+    worker_id: str | None = None,
+    chunk_size: int = 1000,
+    lease_s: float = 900.0,
+    min_probability: float = 0.5,
+    postprocess: dict | None = None,
+    projection_if_missing: str | None = None,
+    input_mask_dir: Path | None = None,
+    batch_size: int = 16,
+    cancel_filepath: Path | None = None,
+    nb_parallel_read: int = -1,
+    nb_parallel_postprocess: int = 1,
+    max_prediction_errors: int = 100,
+    vector_write_batch_size: int = 50000,
+    prescreen: bool = True,
+    ssl_verify: bool | str = True,
+    predictor: Predictor | None = None,
+) -> bool:
+    """Predict a layer as one of multiple workers that share the work.
+
+    The workers can run in multiple processes and on multiple hosts, as long as they
+    all can access `output_image_dir`, e.g. on a shared filesystem. The tiles of the
+    layer are divided in chunks in a work table in `output_image_dir`. Each worker
+    leases a chunk, predicts it to its own partial output and leases the next chunk
+    till all chunks are done. The lease is renewed while the chunk is predicted. If a
+    worker stops, its chunk is leased by another worker once the lease expired.
+
+    The first worker that finds all chunks done merges the partial outputs to
+    `output_vector_path`. This can also be done with
+    :func:`merge_distributed_prediction`.
+
+    The predictions of overlapping tiles are not blended, the borders are ignored as
+    for `overlap_mode` "ignore_border" in :func:`predict_layer`.
+
+    Args:
+        model (Model | InferenceEngine | OnnxInferenceEngine): the model to use for
+            the prediction.
+        preprocess_input (Callable): the preprocessing function to apply to the input
+            images before passing them to the model.
+        image_layer_config (dict[str, Any]): configuration of the image layer to
+            predict on.
+        image_pixel_x_size (float): Pixel size of the image tiles.
+        image_pixel_y_size (float): Pixel size of the image tiles.
+        image_pixel_width (int): Width of the tiles in number of pixels.
+        image_pixel_height (int): Height of the tiles in number of pixels.
+        image_pixels_overlap (int): The number of pixels the tiles should be enlarged
+            in all directions to create overlapping tiles.
+        output_image_dir (Path): dir where the work table and the intermediate output
+            of all workers will be put.
+        output_vector_path (Path): the path to write the merged vector output to.
+        classes (list): a list of the different class names.
+        worker_id (str, optional): unique id of the worker. If a worker is restarted
+            with the same id, it resumes the chunk it was predicting. If None,
+            "<hostname>_<process id>" is used. Defaults to None.
+        chunk_size (int, optional): the number of tiles per chunk. Defaults to 1000.
+        lease_s (float, optional): the time in seconds a lease is valid without being
+            renewed. Defaults to 900.0.
+        min_probability (float): Minimum probability to consider a pixel being of a
+            certain class. Defaults to 0.5.
+        postprocess (dict | None, optional): specifies which postprocessing should be
+            applied to the prediction. Default is None, so no postprocessing.
+        projection_if_missing (str, optional): the projection to use if it is not
+            available in the images. Defaults to None.
+        input_mask_dir (Path, optional): dir where the mask images are located.
+            Defaults to None.
+        batch_size (int, optional): batch size to use while predicting.
+            Defaults to 16.
+        cancel_filepath (Path, optional): If the file in this path exists, processing
+            stops asap. Defaults to None.
+        nb_parallel_read (int, optional): The number of parallel threads to read/load
+            images for prediction. If -1, 3 * `batch_size` is used. Defaults to -1.
+        nb_parallel_postprocess (int, optional): The number of parallel processes used
+            to postprocess the predictions. If -1, all available CPU's are used.
+            Defaults to 1.
+        max_prediction_errors (int, optional): the maximum number of errors that is
+            tolerated before stopping prediction. If -1, no limit. Defaults to 100.
+        vector_write_batch_size (int, optional): the polygons are buffered and written
+            in batches of at least this number of features. Defaults to 50000.
+        prescreen (bool, optional): True to skip images without running the model if
+            they are entirely nodata or have the same value for all pixels, or if they
+            are outside the roi. Defaults to True.
+        ssl_verify (bool or str, optional): True to use the default certificate bundle
+            as installed on your system. False disables certificate validation
+            (NOT recommended!). If a path to a certificate bundle file (.pem) is passed,
+            this will be used. Defaults to True.
+        predictor (Predictor, optional): the predictor session this prediction is
+            part of. Its worker pools are reused. If None, worker pools are started
+            for this prediction only. Defaults to None.
+
+    Returns:
+        bool: True if the prediction is complete and merged by this worker. False if
+            it was cancelled or if another worker merges the output.
+    """
+    if output_vector_path.exists():
+        logger.info(f"output file exists already, so return: {output_vector_path}")
+        return True
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}_{os.getpid()}"
+    logger.info(f"Start predict_layer_distributed as worker {worker_id}")
+
+    # Determine the tiles in a dir per worker, so the workers don't interfere
+    image_files = _get_layer_image_files(
+        image_layer_config=image_layer_config,
+        image_pixel_x_size=image_pixel_x_size,
+        image_pixel_y_size=image_pixel_y_size,
+        image_pixel_width=image_pixel_width,
+        image_pixel_height=image_pixel_height,
+        image_pixels_overlap=image_pixels_overlap,
+        grid_dir=output_image_dir / f"grid_{worker_id}",
+        prescreen=prescreen,
+        grid_cache_dir=output_image_dir,
     )
+    if len(image_files) == 0:
+        raise ValueError(
+            f"No images to predict for layer {image_layer_config['layername']}"
+        )
+
+    def is_cancelled() -> bool:
+        return cancel_filepath is not None and cancel_filepath.exists()
+
+    parts_dir = output_image_dir / "parts"
+    worker_pools = predictor._worker_pools if predictor is not None else None
+    leases_path = output_image_dir / "prediction_leases.sqlite"
+    with PredictionLeases(leases_path) as leases:
+        leases.add_tiles(
+            [image_file["path"].name for image_file in image_files],
+            chunk_size=chunk_size,
+        )
+
+        while not is_cancelled():
+            chunk_id = leases.lease(worker_id, lease_s=lease_s)
+            if chunk_id is None:
+                if leases.is_done():
+                    break
+                # Wait till the other workers are ready or till a lease expires
+                sleep(min(lease_s / 4, 30))
+                continue
+
+            chunk_tile_ids = leases.get_chunk_tile_ids(chunk_id)
+            chunk_image_files = [
+                image_file
+                for image_file in image_files
+                if image_file["path"].name in chunk_tile_ids
+            ]
+            chunk_name = _get_chunk_name(output_vector_path, chunk_id, worker_id)
+            logger.info(
+                f"Start predict of chunk {chunk_id} with {len(chunk_image_files)} "
+                "images"
+            )
+            try:
+                with leases.renewing(chunk_id, worker_id, lease_s=lease_s):
+                    _predict_layer(
+                        model=model,
+                        preprocess_input=preprocess_input,
+                        input_image_dir=None,
+                        image_layer=image_layer_config,
+                        output_image_dir=output_image_dir / chunk_name,
+                        output_vector_path=parts_dir / f"{chunk_name}.gpkg",
+                        classes=classes,
+                        image_files=chunk_image_files,
+                        min_probability=min_probability,
+                        postprocess=postprocess,
+                        border_pixels_to_ignore=image_pixels_overlap,
+                        projection_if_missing=projection_if_missing,
+                        input_mask_dir=input_mask_dir,
+                        batch_size=batch_size,
+                        cancel_filepath=cancel_filepath,
+                        nb_parallel_read=nb_parallel_read,
+                        nb_parallel_postprocess=nb_parallel_postprocess,
+                        max_prediction_errors=max_prediction_errors,
+                        vector_write_batch_size=vector_write_batch_size,
+                        prescreen=prescreen,
+                        ssl_verify=ssl_verify,
+                        worker_pools=worker_pools,
+                    )
+            except Exception:
+                leases.release(chunk_id, worker_id)
+                raise
+
+            if is_cancelled():
+                # The chunk isn't complete, so another worker can continue it
+                leases.release(chunk_id, worker_id)
+            elif not leases.set_done(chunk_id, worker_id):
+                logger.warning(
+                    f"Lease of chunk {chunk_id} was lost, so it is predicted by "
+                    "another worker"
+                )
+
+        if is_cancelled():
+            logger.info(f"Cancel file found, so stop: {cancel_filepath}")
+            return False
+
+        # All chunks are done, so merge the output, unless another worker does
+        if not leases.claim_merge(worker_id):
+            logger.info("All chunks are done, the output is merged by another worker")
+            return False
+
+    merge_distributed_prediction(
+        output_image_dir=output_image_dir, output_vector_path=output_vector_path
+    )
+    return True
+
+
+def merge_distributed_prediction(output_image_dir: Path, output_vector_path: Path):
+    """Merge the partial outputs of a distributed prediction.
+
+    For each chunk, the partial output of the worker that completed it is appended to
+    `output_vector_path`. Afterwards, `output_image_dir` is removed.
+
+    Args:
+        output_image_dir (Path): the output_image_dir the prediction was run with
+            using :func:`predict_layer_distributed`.
+        output_vector_path (Path): the path to write the merged vector output to.
+
+    Raises:
+        ValueError: if not all chunks of the prediction are done.
+    """
+    leases_path = output_image_dir / "prediction_leases.sqlite"
+    if not leases_path.exists():
+        raise ValueError(f"no distributed prediction found in {output_image_dir}")
+    with PredictionLeases(leases_path) as leases:
+        if not leases.is_done():
+            raise ValueError(
+                f"not all chunks are done yet: {leases.get_status_counts()}"
+            )
+        done_chunks = leases.get_done_chunks()
+
+    logger.info(f"Merge the output of {len(done_chunks)} chunks")
+    tmp_output_path = output_image_dir / f"{output_vector_path.stem}_tmp.gpkg"
+    if tmp_output_path.exists():
+        gfo.remove(tmp_output_path)
+    for chunk_id, worker_id in sorted(done_chunks.items()):
+        # If no features were found in a chunk, there is no output for it
+        chunk_name = _get_chunk_name(output_vector_path, chunk_id, worker_id)
+        part_path = output_image_dir / "parts" / f"{chunk_name}.gpkg"
+        if not part_path.exists():
+            continue
+        if not tmp_output_path.exists():
+            gfo.copy_layer(
+                src=part_path, dst=tmp_output_path, dst_layer=output_vector_path.stem
+            )
+        else:
+            gfo.copy_layer(
+                src=part_path,
+                dst=tmp_output_path,
+                dst_layer=output_vector_path.stem,
+                write_mode="append",
+            )
+
+    if tmp_output_path.exists():
+        output_vector_path.parent.mkdir(parents=True, exist_ok=True)
+        gfo.create_spatial_index(tmp_output_path, exist_ok=True)
+        gfo.move(tmp_output_path, output_vector_path)
+    shutil.rmtree(output_image_dir)
+
+
+def _get_chunk_name(output_vector_path: Path, chunk_id: int, worker_id: str) -> str:
+    return f"{output_vector_path.stem}_chunk{chunk_id}_{worker_id}"
+
+
+def _get_layer_image_files(
+    image_layer_config: dict[str, Any],
+    image_pixel_x_size: float,
+    image_pixel_y_size: float,
+    image_pixel_width: int,
+    image_pixel_height: int,
+    image_pixels_overlap: int,
+    grid_dir: Path,
+    prescreen: bool,
+    grid_cache_dir: Path | None = None,
+) -> list[dict[str, Any]]:
+    """Determine the tiles to divide the prediction of an image layer in.
+
+    Args:
+        image_layer_config (dict[str, Any]): configuration of the image layer.
+        image_pixel_x_size (float): Pixel size of the image tiles.
+        image_pixel_y_size (float): Pixel size of the image tiles.
+        image_pixel_width (int): Width of the tiles in number of pixels.
+        image_pixel_height (int): Height of the tiles in number of pixels.
+        image_pixels_overlap (int): The number of pixels the tiles are enlarged in all
+            directions to create overlapping tiles.
+        grid_dir (Path): the directory to write the tiles determined to.
+        prescreen (bool): True to flag the tiles that are outside the roi.
+        grid_cache_dir (Path, optional): the directory to cache the grid in. If None,
+            `grid_dir` is used. Defaults to None.
+
+    Returns:
+        list[dict[str, Any]]: for each tile, its "path", "bbox", "size" and if it can
+            be skipped, the "prescreen" reason.
+    """
+    crs = pyproj.CRS.from_user_input(image_layer_config["projection"])
+    image_format = image_layer_config.get("image_format", image_util.FORMAT_JPEG)
+
+    grid_dir.mkdir(parents=True, exist_ok=True)
+    tiles_to_download_gdf = image_util.get_images_for_grid(
+        output_image_dir=grid_dir,
+        crs=crs,
+        image_gen_bbox=image_layer_config["bbox"],
+        image_gen_roi_filepath=image_layer_config["roi_filepath"],
+        grid_xmin=image_layer_config["grid_xmin"],
+        grid_ymin=image_layer_config["grid_ymin"],
+        image_crs_pixel_x_size=image_pixel_x_size,
+        image_crs_pixel_y_size=image_pixel_y_size,
+        image_pixel_width=image_pixel_width,
+        image_pixel_height=image_pixel_height,
+        image_format=image_format,
+        pixels_overlap=image_pixels_overlap,
+        cache_dir=grid_cache_dir,
+    )
+    nb_images = len(tiles_to_download_gdf)
+    if nb_images == 0:
+        return []
+
+    # Determine the size of the tiles used for prediction
+    tile_pixel_width = image_pixel_width
+    tile_pixel_height = image_pixel_height
+    if image_pixels_overlap > 0:
+        tile_pixel_width += 2 * image_pixels_overlap
+        tile_pixel_height += 2 * image_pixels_overlap
+
+    # Determine the tiles that don't need to be predicted because they are outside the
+    # roi. The tiles returned intersect the roi, but maybe only with their overlap.
+    roi_filepath = image_layer_config.get("roi_filepath")
+    outside_roi = np.zeros(nb_images, dtype=bool)
+    if prescreen and roi_filepath is not None:
+        outside_roi = get_tiles_outside_roi(
+            tiles_to_download_gdf,
+            roi_path=roi_filepath,
+            pixels_overlap=image_pixels_overlap,
+            pixel_x_size=image_pixel_x_size,
+            pixel_y_size=image_pixel_y_size,
+        )
+
+    # Convert the dataframe to a list
+    image_files: list[dict[str, Any]] = []
+    for tile, tile_outside_roi in zip(
+        tiles_to_download_gdf.geometry.bounds.itertuples(), outside_roi, strict=True
+    ):
+        _, tile_xmin, tile_ymin, tile_xmax, tile_ymax = tile
+
+        output_filepath = tiles_to_download_gdf.loc[tile.Index, "path"]
+        image_files.append(
+            {
+                "path": output_filepath,
+                "bbox": (tile_xmin, tile_ymin, tile_xmax, tile_ymax),
+                "size": (tile_pixel_width, tile_pixel_height),
+                "prescreen": SKIP_OUTSIDE_ROI if tile_outside_roi else None,
+            }
+        )
+
+    return image_files
 
 
 def _predict_layer(
-    model: keras.models.Model,
+    model: keras.models.Model | InferenceEngine | OnnxInferenceEngine,
     preprocess_input: Callable | None,
     input_image_dir: Path | None,
     image_layer: dict[str, Any] | None,
@@ -375,24 +1130,30 @@ def _predict_layer(
     nb_parallel_read: int = -1,
     nb_parallel_postprocess: int = 1,
     max_prediction_errors: int = 100,
+    vector_write_batch_size: int = 50000,
+    prescreen: bool = True,
+    mosaic: PredictionMosaic | None = None,
     ssl_verify: bool | str = True,
     force: bool = False,
+    worker_pools: "_WorkerPools | None" = None,
+    tile_reader: SharedTileReaderClient | None = None,
 ):
     # Check inputs
     if input_image_dir is None and image_layer is None:
         raise ValueError("input_image_dir or image_layer should be provided")
     elif input_image_dir is not None and image_layer is not None:
         raise ValueError("input_image_dir and image_layer cannot be provided together")
-
-    # Create tmp dir for this predict run
-    tmp_dir = Path(tempfile.gettempdir())
-    tmp_dir.mkdir(parents=True, exist_ok=True)
-    tmp_dir = Path(tempfile.mkdtemp(prefix=f"{Path(__file__).stem}_", dir=tmp_dir))
+    elif tile_reader is not None and image_layer is None:
+        raise ValueError("tile_reader is only supported to predict an image_layer")
 
     nb_images = len(image_files)
     if nb_images == 0:
         raise ValueError("image_files is empty")
 
+    # All images should be evaluated, so don't skip any
+    if evaluate_mode:
+        prescreen = False
+
     # If we are using evaluate mode, change the output dir...
     if evaluate_mode:
         output_image_dir = Path(str(output_image_dir) + "_eval")
@@ -406,20 +1167,51 @@ def _predict_layer(
         pred_conf["classes"] = classes
         json.dump(pred_conf, pred_conf_file)
 
-    # If force is false, get list of all existing predictions
-    # Getting the list once is way faster than checking file per file later on!
+    # The progress is tracked in a journal, so only the images that aren't processed
+    # yet need to be predicted. If force is True, all images are predicted again.
+    journal_path = output_image_dir / "prediction_journal.sqlite"
     images_done_log_filepath = output_image_dir / "images_done.txt"
-    image_done_filenames = set()
-    if not force:
-        # First read the listing files if they exists
-        if images_done_log_filepath.exists():
-            with images_done_log_filepath.open() as f:
-                for filename in f:
-                    image_done_filenames.add(filename.rstrip())
-        if len(image_done_filenames) > 0:
-            logger.info(
-                f"Skip {len(image_done_filenames)} images that are already processed"
-            )
+    journal_exists = journal_path.exists()
+    journal = PredictionJournal(journal_path)
+    if force:
+        journal.clear()
+    elif not journal_exists and images_done_log_filepath.exists():
+        # Resume a prediction that was started with an older version of orthoseg
+        journal.import_done_log(images_done_log_filepath)
+    all_tile_ids = [image_file["path"].name for image_file in image_files]
+    journal.add_tiles(all_tile_ids)
+    pending_tile_ids = journal.get_pending_tile_ids()
+    image_files = [
+        image_file
+        for image_file in image_files
+        if image_file["path"].name in pending_tile_ids
+    ]
+    if len(image_files) < nb_images:
+        logger.info(
+            f"Skip {nb_images - len(image_files)} images that are already processed"
+        )
+
+    # Images that are already known not to need a prediction are done right away
+    pipeline_stats = _PipelineStats()
+    prescreened_records = [
+        {
+            "tile_id": image_file["path"].name,
+            "nb_features": 0,
+            "prescreen": image_file["prescreen"],
+        }
+        for image_file in image_files
+        if image_file.get("prescreen") is not None
+    ]
+    if len(prescreened_records) > 0:
+        journal.set_done(prescreened_records)
+        journal.flush()
+        for record in prescreened_records:
+            pipeline_stats.add_skipped(record["prescreen"])
+        image_files = [
+            image_file
+            for image_file in image_files
+            if image_file.get("prescreen") is None
+        ]
 
     # Clear error file
     images_error_log_filepath = output_image_dir / "images_error.csv"
@@ -442,55 +1234,63 @@ def _predict_layer(
         nb_parallel_read = batch_size * 3
     if nb_parallel_postprocess == -1:
         nb_parallel_postprocess = multiprocessing.cpu_count()
+
+    # The stages of the pipeline are connected with bounded queues. If a queue is full,
+    # the stage feeding it is paused till the next stage has caught up (backpressure).
+    # Images that are read stay in the read_queue till they are added to a batch, so
+    # the read stage can never get more than nb_parallel_read images ahead.
+    max_postp_queue = nb_parallel_postprocess * 2
+    max_write_queue = 2
+    # The predictions are passed to the postprocess workers via shared memory to avoid
+    # pickling them. Enough slots are foreseen for all predictions being postprocessed.
+    nb_pred_slots = max_postp_queue + batch_size
     predict_queue: list[dict] = []
-    nb_to_predict = nb_images
+    nb_to_predict = len(image_files)
     nb_done = 0
     nb_errors = 0
-    read_sleep_last_logged = None
     progress = None
     read_queue: dict[futures.Future, Path] = {}
-    postp_queue: dict[futures.Future, Path] = {}
-    write_queue: dict[futures.Future, Path] = {}
+    postp_queue: dict[futures.Future, dict[str, Any]] = {}
+    postp_pred_slots: dict[futures.Future, _shared_memory_util.SharedArraySlot] = {}
+    write_queue: dict[futures.Future, list[dict[str, Any]]] = {}
+    vector_buffer = _VectorWriteBuffer()
     image_id = -1
-    last_image_reached = False
+    last_image_reached = nb_to_predict == 0
+    stopped_early = False
 
-    # We don't want the postprocess workers to block the entire system,
-    # so make them a bit nicer
-    def init_postprocess_worker():
-        _processing_util.setprocessnice(15)
+    # If the tiles are shared with other predictions, register the ones to read
+    if tile_reader is not None:
+        tile_reader.register(
+            all_tile_ids, [image_file["path"].name for image_file in image_files]
+        )
 
+    # If no worker pools are passed, start them for this prediction only.
+    # The tile reader is closed first, so other predictions don't wait on this one
+    # while the work still scheduled is finished.
     with (
-        futures.ThreadPoolExecutor(nb_parallel_read) as read_pool,
-        futures.ProcessPoolExecutor(
-            nb_parallel_postprocess, initializer=init_postprocess_worker()
-        ) as postprocess_pool,
-        futures.ProcessPoolExecutor(max_workers=1) as write_pool,
+        journal,
+        _shared_memory_util.SharedArrayRing(nb_pred_slots) as pred_ring,
+        _WorkerPools() if worker_pools is None else nullcontext(worker_pools) as pools,
+        pools.use(nb_parallel_read, nb_parallel_postprocess) as (
+            read_pool,
+            postprocess_pool,
+            write_pool,
+        ),
+        tile_reader if tile_reader is not None else nullcontext(),
     ):
         # Start looping.
         # If ready to stop, the code below will break
-        perf_time_start = datetime.now()
         while True:
-            # If we are ready, stop!
-            if (
-                last_image_reached
-                and len(read_queue) == 0
-                and len(postp_queue) == 0
-                and len(write_queue) == 0
-            ):
-                break
-
             # If the cancel file exists, stop processing...
             if cancel_filepath is not None and cancel_filepath.exists():
                 print()
                 logger.info(f"Cancel file found, so stop: {cancel_filepath}")
+                stopped_early = True
                 break
 
-            # Init for new loop
-            perfinfo: list[str] = []
-
             # Fill the read queue
             # -------------------
-            while not last_image_reached and len(read_queue) <= nb_parallel_read:
+            while not last_image_reached and len(read_queue) < nb_parallel_read:
                 image_id += 1
 
                 # Last image reached
@@ -499,25 +1299,41 @@ def _predict_layer(
 
                 image_file = image_files[image_id]
 
-                # Check if the image has been processed already
-                if not force and image_file["path"].name in image_done_filenames:
-                    nb_to_predict -= 1
-                    continue
-
                 # Schedule file to be read/loaded
                 if image_layer is None:
                     # No layer config specified, so the file should just be read
                     read_future = read_pool.submit(
+                        _timed_call,
+                        _read_and_prescreen,
                         read_image,
+                        prescreen=prescreen,
                         image_path=image_file["path"],
                         projection_if_missing=projection_if_missing,
                         preprocess_input=preprocess_input,
                     )
                     read_queue[read_future] = image_file["path"]
-                else:
+                elif tile_reader is None:
                     # Layer config specified, so load the image realtime
                     read_future = read_pool.submit(
+                        _timed_call,
+                        _read_and_prescreen,
                         load_image,
+                        prescreen=prescreen,
+                        bbox=image_file["bbox"],
+                        size=image_file["size"],
+                        image_layer=image_layer,
+                        ssl_verify=ssl_verify,
+                    )
+                    read_queue[read_future] = image_file["path"]
+                else:
+                    # Load the image realtime, unless another prediction did already
+                    read_future = read_pool.submit(
+                        _timed_call,
+                        tile_reader.read,
+                        image_file["path"].name,
+                        _read_and_prescreen,
+                        load_image,
+                        prescreen=prescreen,
                         bbox=image_file["bbox"],
                         size=image_file["size"],
                         image_layer=image_layer,
@@ -525,107 +1341,177 @@ def _predict_layer(
                     )
                     read_queue[read_future] = image_file["path"]
 
-            # Check read_queue for images read and add them to predict_queue
-            # --------------------------------------------------------------
-            while len(read_queue) > 0 and len(predict_queue) < batch_size:
-                # Prepare the images that have been read for predicting
-                futures_done = [future for future in read_queue if future.done()]
-                for future in futures_done:
-                    # predict_queue should contain maximum batch_size images!
-                    if len(predict_queue) >= batch_size:
-                        break
-
-                    try:
-                        # Get the result from the read
-                        read_result = future.result()
-                        image_filepath_read = read_queue[future]
-
-                        # Prepare the filepath for the output
-                        output_suffix = ".tif"
-                        if evaluate_mode:
-                            # In evaluate mode, put everyting in output base dir for
-                            # easier comparison
-                            output_image_pred_dir = output_image_dir
-
-                            # Prepare complete filepath for image prediction
-                            output_image_pred_path = (
-                                output_image_dir / image_filepath_read.stem
-                            )
-                        else:
-                            # If saving predictions to images for real, keep hierarchic
-                            # structure if present
-                            tmp_output_filepath = Path(
-                                str(image_filepath_read).replace(
-                                    str(input_image_dir), str(output_image_dir)
-                                )
-                            )
-                            output_image_pred_dir = tmp_output_filepath.parent
-                            output_image_pred_path = (
-                                output_image_pred_dir
-                                / f"{image_filepath_read.stem}_pred{output_suffix}"
-                            )
+            # Add the images that have been read to the predict_queue
+            # -------------------------------------------------------
+            for future in [future for future in read_queue if future.done()]:
+                # predict_queue should contain maximum batch_size images!
+                if len(predict_queue) >= batch_size:
+                    break
 
-                        predict_queue.append(
-                            {
-                                "input_image_filepath": image_filepath_read,
-                                "output_pred_filepath": output_image_pred_path,
-                                "output_image_pred_dir": output_image_pred_dir,
-                                "image_crs": read_result["image_crs"],
-                                "image_transform": read_result["image_transform"],
-                                "image_data": read_result["image_data"],
-                            }
+                try:
+                    # Get the result from the read
+                    read_result, read_s = future.result()
+                    image_filepath_read = read_queue[future]
+
+                    # If the image doesn't need a prediction, it is done already
+                    if read_result["prescreen"] is not None:
+                        tile_record = {
+                            "tile_id": image_filepath_read.name,
+                            "read_s": read_s,
+                            "nb_features": 0,
+                            "prescreen": read_result["prescreen"],
+                        }
+                        journal.set_done([tile_record])
+                        pipeline_stats.add_skipped(read_result["prescreen"])
+                        nb_done += 1
+                        continue
+
+                    # Prepare the filepath for the output
+                    output_suffix = ".tif"
+                    if evaluate_mode:
+                        # In evaluate mode, put everyting in output base dir for
+                        # easier comparison
+                        output_image_pred_dir = output_image_dir
+
+                        # Prepare complete filepath for image prediction
+                        output_image_pred_path = (
+                            output_image_dir / image_filepath_read.stem
+                        )
+                    else:
+                        # If saving predictions to images for real, keep hierarchic
+                        # structure if present
+                        tmp_output_filepath = Path(
+                            str(image_filepath_read).replace(
+                                str(input_image_dir), str(output_image_dir)
+                            )
+                        )
+                        output_image_pred_dir = tmp_output_filepath.parent
+                        output_image_pred_path = (
+                            output_image_pred_dir
+                            / f"{image_filepath_read.stem}_pred{output_suffix}"
                         )
 
-                    except Exception as ex:  # pragma: no cover
-                        nb_errors += 1
-                        image_path = read_queue[future]
-                        _handle_error(image_path, ex, images_error_log_filepath)
-
-                    finally:
-                        # Remove from queue...
-                        del read_queue[future]
-
-                # If enough images in predict_queue or if the read queue is not full
-                # stop this loop
-                if (
-                    len(predict_queue) == batch_size
-                    or len(read_queue) < nb_parallel_read
-                ):
-                    break
+                    predict_queue.append(
+                        {
+                            "input_image_filepath": image_filepath_read,
+                            "output_pred_filepath": output_image_pred_path,
+                            "output_image_pred_dir": output_image_pred_dir,
+                            "image_crs": read_result["image_crs"],
+                            "image_transform": read_result["image_transform"],
+                            "image_data": read_result["image_data"],
+                            "tile_record": {
+                                "tile_id": image_filepath_read.name,
+                                "path": image_filepath_read,
+                                "read_s": read_s,
+                            },
+                        }
+                    )
 
-                # Wait a bit for images to be read, then try finding images again
-                cur_counter = perf_counter()
-                if (
-                    not read_sleep_last_logged
-                    or (read_sleep_last_logged - cur_counter) > 5
-                ):
-                    logger.info("Wait for images to be read")
-                    read_sleep_last_logged = cur_counter
-                time.sleep(0.01)
+                except Exception as ex:  # pragma: no cover
+                    nb_errors += 1
+                    image_path = read_queue[future]
+                    _handle_error(image_path, ex, images_error_log_filepath, journal)
+
+                finally:
+                    # Remove from queue...
+                    del read_queue[future]
+
+            # Schedule the write of postprocessings that are completed
+            # --------------------------------------------------------
+            for future in [future for future in postp_queue if future.done()]:
+                # Get the result of the postprocessing
+                tile_record = postp_queue[future]
+                image_path = tile_record["path"]
+                try:
+                    # Get the result (= exception when something went wrong)
+                    result, tile_record["postprocess_s"] = future.result()
+                    polygons_gdf = result.pop("polygons", None)
+                    logger.debug(f"result for {image_path.name}: {result}")
+
+                    if output_vector_path is None:
+                        # No vector output, so we are ready with this image
+                        journal.set_done([tile_record])
+                    else:
+                        # Buffer the polygons till there are enough to be written
+                        vector_buffer.add(tile_record, polygons_gdf)
+                    nb_done += 1
+
+                except ImportError as ex:  # pragma: no cover
+                    raise ex
+                except Exception as ex:  # pragma: no cover
+                    nb_errors += 1
+                    _handle_error(image_path, ex, images_error_log_filepath, journal)
+
+                finally:
+                    # Remove from queue + make the slot of the prediction available
+                    del postp_queue[future]
+                    pred_slot = postp_pred_slots.pop(future, None)
+                    if pred_slot is not None:
+                        pred_ring.release(pred_slot)
+
+            # Schedule the write of the buffered polygons if there are enough or if
+            # no more polygons will be added
+            # ---------------------------------------------------------------------
+            if len(vector_buffer) > 0 and (
+                vector_buffer.nb_features >= vector_write_batch_size
+                or (
+                    last_image_reached
+                    and len(read_queue) == 0
+                    and len(predict_queue) == 0
+                    and len(postp_queue) == 0
+                )
+            ):
+                polygons_gdfs, tile_records = vector_buffer.pop()
+                write_future = write_pool.submit(
+                    _write_vector_batch,
+                    polygons_gdfs=polygons_gdfs,
+                    tile_records=tile_records,
+                    vector_output_path=pred_tmp_output_path,
+                    journal=journal,
+                )
+                write_queue[write_future] = tile_records
 
-            # If sufficient images in predict queue -> predict
+            # Check write_queue for completed write operations
             # ------------------------------------------------
-            if len(predict_queue) == batch_size or (
-                last_image_reached and len(predict_queue) > 0
-            ):
-                perf_time_now = datetime.now()
-                perfinfo += f"waiting for read took {perf_time_now - perf_time_start}"
-                perf_time_start = perf_time_now
+            for future in [future for future in write_queue if future.done()]:
+                try:
+                    # Get the result (= exception when something went wrong)
+                    future.result()
+                    if mosaic is not None:
+                        # The tiles are blended in the mosaic, so they are done
+                        nb_done += len(write_queue[future])
+                except Exception as ex:  # pragma: no cover
+                    for tile_record in write_queue[future]:
+                        nb_errors += 1
+                        _handle_error(
+                            tile_record["path"], ex, images_error_log_filepath, journal
+                        )
+
+                finally:
+                    # Remove from queue...
+                    del write_queue[future]
 
+            # Predict if a batch is ready and the next stages have capacity left
+            # ------------------------------------------------------------------
+            batch_ready = len(predict_queue) >= batch_size or (
+                last_image_reached and len(read_queue) == 0 and len(predict_queue) > 0
+            )
+            if (
+                batch_ready
+                and len(postp_queue) < max_postp_queue
+                and len(write_queue) < max_write_queue
+                and pred_ring.nb_free >= len(predict_queue)
+            ):
                 # Predict!
                 # --------
                 logger.debug(f"Start prediction for {len(predict_queue)} images")
-                perf_time_start = datetime.now()
+                perf_start = perf_counter()
                 curr_batch_image_list = [
                     batch_image_info["image_data"] for batch_image_info in predict_queue
                 ]
                 batch_image_arr = np.stack(curr_batch_image_list)
                 batch_pred_arr = model.predict_on_batch(batch_image_arr)
 
-                perf_time_now = datetime.now()
-                perfinfo += f", predict took {perf_time_now - perf_time_start}"
-                perf_time_start = perf_time_now
-
                 # In tf > 2.1 a tf.tensor object is returned, but we want an ndarray
                 if isinstance(batch_pred_arr, tf.Tensor):
                     arr = batch_pred_arr.numpy()  # pyright: ignore[reportOptionalCall]
@@ -633,166 +1519,144 @@ def _predict_layer(
                 else:
                     batch_pred_arr = np.array(batch_pred_arr)
 
-                # Add predictions to postprocess queue
-                # ------------------------------------
-                logger.debug("Start post-processing")
-                for batch_image_id, image_info in enumerate(predict_queue):
-                    try:
-                        # Schedule postprocessing
-
-                        # Save vector data first to seperate temp file to avoid locking
-                        # issues. Result is copied to the final file via write_queue
-                        # later on.
-                        prd_tmp_partial_output_file = None
-                        if output_vector_path is not None:
-                            name = f"{image_info['input_image_filepath'].stem}.gpkg"
-                            prd_tmp_partial_output_file = tmp_dir / name
-
-                        # Only save the image if no vector output is needed
-                        output_image_result_dir = None
-                        if output_vector_path is None:
-                            output_image_result_dir = image_info[
-                                "output_image_pred_dir"
-                            ]
-
-                        future = postprocess_pool.submit(
-                            postp.postprocess_prediction_to_file,
-                            image_pred_arr=batch_pred_arr[batch_image_id],
-                            image_crs=image_info["image_crs"],
-                            image_transform=image_info["image_transform"],
-                            classes=classes,
-                            output_vector_path=prd_tmp_partial_output_file,
-                            output_image_dir=output_image_result_dir,
-                            input_image_filepath=image_info["input_image_filepath"],
-                            evaluate_mode=evaluate_mode,
-                            input_image_dir=input_image_dir,
-                            input_mask_dir=input_mask_dir,
-                            border_pixels_to_ignore=border_pixels_to_ignore,
-                            min_probability=min_probability,
-                            postprocess=postprocess,
-                            force=force,
-                        )
-                        postp_queue[future] = image_info["input_image_filepath"]
-
-                    except Exception as ex:  # pragma: no cover
-                        nb_errors += 1
-                        image_path = image_info["input_image_filepath"]
-                        _handle_error(image_path, ex, images_error_log_filepath)
+                predict_s = perf_counter() - perf_start
+                pipeline_stats.add_predict(predict_s)
+
+                if mosaic is not None:
+                    # Blend the predictions in the mosaic in the write stage
+                    # ------------------------------------------------------
+                    tile_records = []
+                    for image_info in predict_queue:
+                        tile_record = image_info["tile_record"]
+                        tile_record["predict_s"] = predict_s / len(predict_queue)
+                        tile_records.append(tile_record)
+                    write_future = write_pool.submit(
+                        _add_to_mosaic,
+                        mosaic=mosaic,
+                        image_pred_arrs=list(batch_pred_arr),
+                        image_transforms=[
+                            image_info["image_transform"]
+                            for image_info in predict_queue
+                        ],
+                        tile_records=tile_records,
+                        journal=journal,
+                    )
+                    write_queue[write_future] = tile_records
+                else:
+                    # Add predictions to postprocess queue
+                    # ------------------------------------
+                    logger.debug("Start post-processing")
+                    for batch_image_id, image_info in enumerate(predict_queue):
+                        pred_slot = None
+                        tile_record = image_info["tile_record"]
+                        tile_record["predict_s"] = predict_s / len(predict_queue)
+                        try:
+                            # Schedule postprocessing
+
+                            # The polygons are returned, so they can be written in
+                            # batches to the output file via write_queue later on.
+                            # Only save the image if no vector output is needed
+                            output_image_result_dir = None
+                            if output_vector_path is None:
+                                output_image_result_dir = image_info[
+                                    "output_image_pred_dir"
+                                ]
+
+                            postprocess_kwargs = {
+                                "image_crs": image_info["image_crs"],
+                                "image_transform": image_info["image_transform"],
+                                "classes": classes,
+                                "output_image_dir": output_image_result_dir,
+                                "return_polygons": output_vector_path is not None,
+                                "input_image_filepath": image_info[
+                                    "input_image_filepath"
+                                ],
+                                "evaluate_mode": evaluate_mode,
+                                "input_image_dir": input_image_dir,
+                                "input_mask_dir": input_mask_dir,
+                                "border_pixels_to_ignore": border_pixels_to_ignore,
+                                "min_probability": min_probability,
+                                "postprocess": postprocess,
+                                "force": force,
+                            }
+                            image_pred_arr = batch_pred_arr[batch_image_id]
+                            if pred_ring.fits(image_pred_arr):
+                                pred_slot = pred_ring.put(image_pred_arr)
+                                future = postprocess_pool.submit(
+                                    _timed_call,
+                                    postp.postprocess_shared_prediction_to_file,
+                                    image_pred_slot=pred_slot,
+                                    **postprocess_kwargs,
+                                )
+                                postp_pred_slots[future] = pred_slot
+                            else:
+                                # Prediction is larger than the ones seen before, so it
+                                # doesn't fit in shared memory: pass it directly
+                                future = postprocess_pool.submit(
+                                    _timed_call,
+                                    postp.postprocess_prediction_to_file,
+                                    image_pred_arr=image_pred_arr,
+                                    **postprocess_kwargs,
+                                )
+                            postp_queue[future] = tile_record
+
+                        except Exception as ex:  # pragma: no cover
+                            # If the slot wasn't handed over to a worker, make it
+                            # available again
+                            if (
+                                pred_slot is not None
+                                and pred_slot not in postp_pred_slots.values()
+                            ):
+                                pred_ring.release(pred_slot)
+                            nb_errors += 1
+                            image_path = image_info["input_image_filepath"]
+                            _handle_error(
+                                image_path, ex, images_error_log_filepath, journal
+                            )
 
                 # Reset variable for next batch
                 predict_queue = []
 
-                # Collect performance debugging info
-                time_taken = datetime.now() - perf_time_start
-                perfinfo += f", scheduling postprocessings took {time_taken}"
-                perf_time_start = perf_time_now
-
-            # Check postp_queue for completed postprocessings
-            # -----------------------------------------------
-            postp_sleep_logged = False
-            while len(postp_queue) > 0:
-                # If not at last file, get results from all futures that are
-                # done, if at last file, wait till all are done
-                futures_done = [future for future in postp_queue if future.done()]
-                for future in futures_done:
-                    # Get the result of the postprocessing
-                    image_path = postp_queue[future]
-                    try:
-                        # Get the result (= exception when something went wrong)
-                        result = future.result()
-                        logger.debug(f"result for {image_path.name}: {result}")
-
-                        if output_vector_path is None:
-                            # No vector output, so we are ready with this image
-                            _write_to_done_log(image_path, images_done_log_filepath)
-                            nb_done += 1
-                        else:
-                            # Schedule `_write_vector_result` to move the result of the
-                            # vectorisation to the final output file + to append image
-                            # to the `image_donelog_file`
-                            name = f"{image_path.stem}.gpkg"
-                            partial_vector_path = tmp_dir / name
-                            write_future = write_pool.submit(
-                                _write_vector_result,
-                                image_path=image_path,
-                                partial_vector_path=partial_vector_path,
-                                vector_output_path=pred_tmp_output_path,
-                                images_done_log_filepath=images_done_log_filepath,
-                            )
-                            write_queue[write_future] = image_path
-
-                    except ImportError as ex:  # pragma: no cover
-                        raise ex
-                    except Exception as ex:  # pragma: no cover
-                        nb_errors += 1
-                        _handle_error(image_path, ex, images_error_log_filepath)
-
-                    finally:
-                        # Remove from queue...
-                        del postp_queue[future]
-
-                # Wait till number below thresshold to avoid huge waiting
-                # list (and memory issues)
-                if len(postp_queue) > nb_parallel_postprocess * 2:
-                    if not postp_sleep_logged:
-                        logger.info(
-                            "Postprocessing takes longer than prediction, so wait"
-                        )
-                        postp_sleep_logged = True
-                    time.sleep(0.01)
-                else:
-                    # No need to wait (anymore)...
-                    if postp_sleep_logged:
-                        logger.info("Waited enough for postprocessing to catch up...")
-
-                    perf_time_now = datetime.now()
-                    perfinfo += (
-                        f", after postproces: took {perf_time_now - perf_time_start}"
-                    )
-                    perf_time_start = perf_time_now
-                    break
-
-            # Check write_queue for completed write operations
-            # ------------------------------------------------
-            write_sleep_logged = False
-            while len(write_queue) > 0:
-                # If not at last file, get results from all futures that are
-                # done, if at last file, wait till all are done
-                futures_done = [future for future in write_queue if future.done()]
-                for future in futures_done:
-                    # Get the result from the write
-                    try:
-                        # Get the result (= exception when something went wrong)
-                        result = future.result()
-                    except Exception as ex:  # pragma: no cover
-                        nb_errors += 1
-                        image_path = write_queue[future]
-                        _handle_error(image_path, ex, images_error_log_filepath)
-
-                    finally:
-                        # Remove from queue...
-                        del write_queue[future]
-                        nb_done += 1
+            elif (
+                last_image_reached
+                and len(predict_queue) == 0
+                and len(read_queue) == 0
+                and len(postp_queue) == 0
+                and len(vector_buffer) == 0
+                and len(write_queue) == 0
+            ):
+                # Everything is processed, so stop
+                break
 
-                # Wait till number below thresshold to avoid huge waiting list (and
-                # memory issues)
-                if len(write_queue) > nb_parallel_postprocess * 2:  # pragma: no cover
-                    if write_sleep_logged:
-                        logger.info("Writing takes longer than prediction, so wait")
-                        write_sleep_logged = True
-                    time.sleep(0.01)
+            else:
+                # Nothing to do for the predict stage: wait till one of the other
+                # stages finishes a job. Determine which stage the wait is on.
+                if batch_ready:
+                    # Backpressure: a next stage has too much work queued
+                    if len(write_queue) >= max_write_queue:
+                        stalled_stage = "write"
+                    else:
+                        stalled_stage = "postprocess"
+                    wait_futures = [*postp_queue, *write_queue]
                 else:
-                    # No need to wait (anymore)...
-                    if write_sleep_logged:  # pragma: no cover
-                        logger.info("Waited enough for writing to catch up...")
-
-                    break
+                    if len(read_queue) > 0:
+                        stalled_stage = "read"
+                    elif len(postp_queue) > 0:
+                        stalled_stage = "postprocess"
+                    else:
+                        stalled_stage = "write"
+                    wait_futures = [*read_queue, *postp_queue, *write_queue]
+
+                # Use a timeout so e.g. the cancel file is checked regularly
+                perf_start = perf_counter()
+                futures.wait(
+                    wait_futures, timeout=1, return_when=futures.FIRST_COMPLETED
+                )
+                pipeline_stats.add_stall(stalled_stage, perf_counter() - perf_start)
 
             # Prepare for next loop
             # ---------------------
             # Log the progress and prediction speed
-            if len(perfinfo) > 0:
-                logger.debug(perfinfo)
             if progress is not None:
                 progress.update(nb_steps_done=nb_done, nb_steps_total=nb_to_predict)
             # Init progress only when some imags were already processed, as the
@@ -806,8 +1670,45 @@ def _predict_layer(
 
             # If max number errors reached, stop processings
             if max_prediction_errors >= 0 and nb_errors >= max_prediction_errors:
+                stopped_early = True
                 break
 
+        logger.info(f"Prediction pipeline stats: {pipeline_stats}")
+
+        # If processing stopped early, work can still be in progress. Wait till it is
+        # done, so no writes are done anymore while the buffered polygons are written
+        # and the output is cleaned up. Postprocessing that didn't start yet is skipped:
+        # the tiles aren't marked as done, so they are predicted again next time.
+        for future in postp_queue:
+            future.cancel()
+        futures.wait([*postp_queue, *write_queue])
+        for future in postp_queue:
+            pred_slot = postp_pred_slots.pop(future, None)
+            if pred_slot is not None:
+                pred_ring.release(pred_slot)
+        postp_queue.clear()
+        for future, tile_records in write_queue.items():
+            try:
+                future.result()
+            except Exception as ex:  # pragma: no cover
+                for tile_record in tile_records:
+                    nb_errors += 1
+                    _handle_error(
+                        tile_record["path"], ex, images_error_log_filepath, journal
+                    )
+        write_queue.clear()
+
+        # Write the polygons that are still buffered, e.g. if processing was cancelled
+        if len(vector_buffer) > 0:
+            polygons_gdfs, tile_records = vector_buffer.pop()
+            _write_vector_batch(
+                polygons_gdfs=polygons_gdfs,
+                tile_records=tile_records,
+                vector_output_path=pred_tmp_output_path,
+                journal=journal,
+            )
+        journal.flush()
+
         # If errors occured, raise error
         if images_error_log_filepath.exists():
             errors = pd.read_csv(
@@ -815,9 +1716,26 @@ def _predict_layer(
             ).to_html(justify="left", index=False)
             raise RuntimeError(f"Error(s) occured while predicting:\n{errors}")
 
+        # If all tiles are blended in the mosaic, decode it to classes and polygonize
+        # these in large blocks
+        mosaic_classes_path = output_image_dir / "prediction_mosaic_classes.tif"
+        if mosaic is not None and len(journal.get_pending_tile_ids()) == 0:
+            mosaic.write_classes(mosaic_classes_path, min_probability=min_probability)
+            if pred_tmp_output_path is not None:
+                _polygonize_mosaic(
+                    mosaic_classes_path=mosaic_classes_path,
+                    classes=classes,
+                    postprocess=postprocess,
+                    vector_output_path=pred_tmp_output_path,
+                    vector_write_batch_size=vector_write_batch_size,
+                    postprocess_pool=postprocess_pool,
+                    journal=journal,
+                )
+
         # If all images were processed, rename to real output file + cleanup
         if (
             last_image_reached
+            and not stopped_early
             and output_vector_path is not None
             and pred_tmp_output_path is not None
             and pred_tmp_output_path.exists()
@@ -826,52 +1744,327 @@ def _predict_layer(
             gfo.create_spatial_index(pred_tmp_output_path, exist_ok=True)
             gfo.move(pred_tmp_output_path, output_vector_path)
             gfo.rename_layer(output_vector_path, output_vector_path.stem)
-            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if mosaic_classes_path.exists():
+                shutil.move(
+                    mosaic_classes_path,
+                    output_vector_path.parent / f"{output_vector_path.stem}.tif",
+                )
+            journal.close()
             shutil.rmtree(output_image_dir)
 
 
-def _write_vector_result(
-    image_path: Path,
-    partial_vector_path: Path,
+class _TrackedExecutor(futures.Executor):
+    """Executor that keeps track of the work submitted to another executor.
+
+    This makes it possible to wait till all work submitted via this executor is done,
+    without shutting down the executor it is submitted to.
+    """
+
+    def __init__(self, executor: futures.Executor):
+        self._executor = executor
+        self._futures: set[futures.Future] = set()
+
+    def submit(self, fn, /, *args, **kwargs) -> futures.Future:
+        """Submit work to the executor."""
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def wait(self):
+        """Wait till all work submitted is done."""
+        futures.wait(list(self._futures))
+
+
+class _WorkerPools:
+    """The worker pools of the prediction pipeline, so they can be reused.
+
+    Use as context manager to make sure the worker pools are shut down.
+    """
+
+    def __init__(self):
+        self._read_pool: futures.ThreadPoolExecutor | None = None
+        self._nb_parallel_read = 0
+        self._postprocess_pool: futures.ProcessPoolExecutor | None = None
+        self._nb_parallel_postprocess = 0
+        self._write_pool: futures.ThreadPoolExecutor | None = None
+
+    def __enter__(self) -> "_WorkerPools":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        self.close()
+
+    @contextmanager
+    def use(
+        self, nb_parallel_read: int, nb_parallel_postprocess: int
+    ) -> Iterator[tuple[futures.Executor, futures.Executor, futures.Executor]]:
+        """Get the read, postprocess and write pools for a prediction.
+
+        The pools are started if they aren't yet or if they have another number of
+        workers. When leaving the context, all work submitted is waited for.
+
+        Args:
+            nb_parallel_read (int): the number of threads to read images.
+            nb_parallel_postprocess (int): the number of processes to postprocess the
+                predictions.
+
+        Yields:
+            tuple[Executor, Executor, Executor]: the read, postprocess and write pool.
+        """
+        if self._read_pool is None or self._nb_parallel_read != nb_parallel_read:
+            if self._read_pool is not None:
+                self._read_pool.shutdown()
+            self._read_pool = futures.ThreadPoolExecutor(nb_parallel_read)
+            self._nb_parallel_read = nb_parallel_read
+        if (
+            self._postprocess_pool is None
+            or self._nb_parallel_postprocess != nb_parallel_postprocess
+        ):
+            if self._postprocess_pool is not None:
+                self._postprocess_pool.shutdown()
+            self._postprocess_pool = futures.ProcessPoolExecutor(
+                nb_parallel_postprocess, initializer=_init_postprocess_worker
+            )
+            self._nb_parallel_postprocess = nb_parallel_postprocess
+        if self._write_pool is None:
+            self._write_pool = futures.ThreadPoolExecutor(max_workers=1)
+
+        pools = (
+            _TrackedExecutor(self._read_pool),
+            _TrackedExecutor(self._postprocess_pool),
+            _TrackedExecutor(self._write_pool),
+        )
+        try:
+            yield pools
+        finally:
+            for pool in pools:
+                pool.wait()
+
+    def close(self):
+        """Shut down the worker pools."""
+        for pool in (self._read_pool, self._postprocess_pool, self._write_pool):
+            if pool is not None:
+                pool.shutdown()
+        self._read_pool = None
+        self._postprocess_pool = None
+        self._write_pool = None
+
+
+def _init_postprocess_worker():
+    # We don't want the postprocess workers to block the entire system,
+    # so make them a bit nicer
+    _processing_util.setprocessnice(15)
+
+
+class _PipelineStats:
+    """Keeps track of where the time goes in the prediction pipeline.
+
+    The predict stage runs in the main thread. The time it has to wait is attributed to
+    the stage it waits on: the read stage if not enough images are read yet to fill a
+    batch, the postprocess or write stage if they have too much work queued already or
+    if they are still finishing the last images.
+    """
+
+    stages = ("read", "postprocess", "write")
+
+    def __init__(self):
+        self.nb_batches = 0
+        self.predict_s = 0.0
+        self.stalled_s = dict.fromkeys(self.stages, 0.0)
+        self.nb_skipped: dict[str, int] = {}
+
+    def add_predict(self, duration_s: float):
+        """Add the duration of a batch prediction.
+
+        Args:
+            duration_s (float): the time the prediction took in seconds.
+        """
+        self.nb_batches += 1
+        self.predict_s += duration_s
+
+    def add_stall(self, stage: str, duration_s: float):
+        """Add time the predict stage had to wait on the stage specified.
+
+        Args:
+            stage (str): the stage that was waited on.
+            duration_s (float): the time waited in seconds.
+        """
+        if stage not in self.stalled_s:
+            raise ValueError(f"Invalid stage: {stage}, should be one of {self.stages}")
+        self.stalled_s[stage] += duration_s
+
+    def add_skipped(self, reason: str):
+        """Add an image that was skipped by the prescreen, so wasn't predicted.
+
+        Args:
+            reason (str): the reason the image was skipped.
+        """
+        self.nb_skipped[reason] = self.nb_skipped.get(reason, 0) + 1
+
+    def __str__(self) -> str:
+        stalled = ", ".join(
+            f"{stage}: {duration:.1f}s" for stage, duration in self.stalled_s.items()
+        )
+        result = (
+            f"predicted {self.nb_batches} batches in {self.predict_s:.1f}s, "
+            f"predict stage waited on {stalled}"
+        )
+        if len(self.nb_skipped) > 0:
+            skipped = ", ".join(
+                f"{reason}: {nb}" for reason, nb in sorted(self.nb_skipped.items())
+            )
+            result += (
+                f", prescreen saved {sum(self.nb_skipped.values())} predictions "
+                f"({skipped})"
+            )
+        return result
+
+
+class _VectorWriteBuffer:
+    """Buffers the polygons of predicted images so they can be written in batches."""
+
+    def __init__(self):
+        self.polygons_gdfs: list[gpd.GeoDataFrame] = []
+        self.tile_records: list[dict[str, Any]] = []
+        self.nb_features = 0
+
+    def __len__(self) -> int:
+        """The number of images buffered."""
+        return len(self.tile_records)
+
+    def add(self, tile_record: dict[str, Any], polygons_gdf: gpd.GeoDataFrame | None):
+        """Add the polygons of an image to the buffer.
+
+        Args:
+            tile_record (dict[str, Any]): the journal record of the image the polygons
+                were predicted for. The number of features is added to it.
+            polygons_gdf (gpd.GeoDataFrame | None): the polygons. None or an empty
+                GeoDataFrame if no polygons were found in the image.
+        """
+        nb_features = 0 if polygons_gdf is None else len(polygons_gdf)
+        tile_record["nb_features"] = nb_features
+        self.tile_records.append(tile_record)
+        if polygons_gdf is not None and nb_features > 0:
+            self.polygons_gdfs.append(polygons_gdf)
+            self.nb_features += nb_features
+
+    def pop(self) -> tuple[list[gpd.GeoDataFrame], list[dict[str, Any]]]:
+        """Get all buffered polygons and image records and empty the buffer.
+
+        Returns:
+            tuple[list[gpd.GeoDataFrame], list[dict[str, Any]]]: the polygons and the
+                journal records of the images.
+        """
+        result = (self.polygons_gdfs, self.tile_records)
+        self.polygons_gdfs = []
+        self.tile_records = []
+        self.nb_features = 0
+
+        return result
+
+
+def _write_vector_batch(
+    polygons_gdfs: list[gpd.GeoDataFrame],
+    tile_records: list[dict[str, Any]],
     vector_output_path: Path | None,
-    images_done_log_filepath: Path,
+    journal: PredictionJournal,
 ):
-    # Copy the result to the main vector output file
-    if vector_output_path is not None:
-        if partial_vector_path.exists():
-            gfo.copy_layer(
-                src=partial_vector_path,
-                dst=vector_output_path,
-                dst_layer=vector_output_path.stem,
-                write_mode="append",
-                create_spatial_index=False,
-            )
-            gfo.remove(partial_vector_path)
+    # Append the polygons to the main vector output file in one go
+    if vector_output_path is not None and len(polygons_gdfs) > 0:
+        polygons_gdf = pd.concat(polygons_gdfs, ignore_index=True)
+        gfo.to_file(
+            polygons_gdf,
+            vector_output_path,
+            layer=vector_output_path.stem,
+            append=True,
+            index=False,
+            force_multitype=True,
+            create_spatial_index=False,
+        )
 
-    # Write filepath to file with files that are done
-    _write_to_done_log(image_path, images_done_log_filepath)
+    # The polygons are written, so the images can be marked as done
+    journal.set_done(tile_records)
+    journal.flush()
 
 
-def _write_to_done_log(image_path: Path, images_done_log_filepath: Path):
-    nb_tries = 0
-    while True:
-        try:
-            with images_done_log_filepath.open("a+") as image_donelog_file:
-                image_donelog_file.write(f"{image_path.name}\n")
-            break
+def _add_to_mosaic(
+    mosaic: PredictionMosaic,
+    image_pred_arrs: list[np.ndarray],
+    image_transforms: list,
+    tile_records: list[dict[str, Any]],
+    journal: PredictionJournal,
+):
+    # The predictions are written to the mosaic, so the tiles can be marked as done
+    mosaic.add(image_pred_arrs, image_transforms)
+    journal.set_done(tile_records)
+    journal.flush()
 
-        except Exception as ex:  # pragma: no cover
-            nb_tries += 1
-            time.sleep(0.1)
 
-            if nb_tries >= 5:
-                message = (
-                    f"Write to done log failed {nb_tries} times for {image_path}: {ex}"
-                )
-                raise RuntimeError(message) from ex
+def _polygonize_mosaic(
+    mosaic_classes_path: Path,
+    classes: list,
+    postprocess: dict | None,
+    vector_output_path: Path,
+    vector_write_batch_size: int,
+    postprocess_pool: futures.Executor,
+    journal: PredictionJournal,
+):
+    # Start from scratch, e.g. if polygonizing was interrupted before
+    gfo.remove(vector_output_path, missing_ok=True)
+
+    with rio.open(mosaic_classes_path) as classes_ds:
+        windows = list(get_block_windows(classes_ds.width, classes_ds.height))
+    logger.info(f"Polygonize the blended prediction in {len(windows)} blocks")
+
+    vector_buffer = _VectorWriteBuffer()
+    polygons_gdfs = postprocess_pool.map(
+        polygonize_block,
+        itertools.repeat(mosaic_classes_path),
+        windows,
+        itertools.repeat(classes),
+        itertools.repeat(postprocess),
+    )
+    for window, polygons_gdf in zip(windows, polygons_gdfs, strict=True):
+        vector_buffer.add({"tile_id": str(window)}, polygons_gdf)
+        if vector_buffer.nb_features >= vector_write_batch_size:
+            polygons_gdfs_batch, _ = vector_buffer.pop()
+            _write_vector_batch(polygons_gdfs_batch, [], vector_output_path, journal)
+
+    polygons_gdfs_batch, _ = vector_buffer.pop()
+    _write_vector_batch(polygons_gdfs_batch, [], vector_output_path, journal)
+
+
+def _read_and_prescreen(read_func: Callable, prescreen: bool, **kwargs) -> dict:
+    """Read an image with the function specified and prescreen it if asked."""
+    image = read_func(**kwargs)
+    image["prescreen"] = None
+    if prescreen:
+        image["prescreen"] = prescreen_image(
+            image["image_data"], image_mask=image.get("image_mask")
+        )
+
+    return image
 
 
-def _handle_error(image_path: Path, ex: Exception, log_path: Path):
+def _timed_call(func: Callable, *args, **kwargs) -> tuple[Any, float]:
+    """Call the function and return its result with the time it took in seconds."""
+    perf_start = perf_counter()
+    result = func(*args, **kwargs)
+    return result, perf_counter() - perf_start
+
+
+def _handle_error(
+    image_path: Path,
+    ex: Exception,
+    log_path: Path,
+    journal: PredictionJournal | None = None,
+):
     # Print exception + trace
     exception_trace = traceback.format_exc()
     exception_trace_print = exception_trace.replace("\n", "\n\t")
@@ -889,6 +2082,10 @@ def _handle_error(image_path: Path, ex: Exception, log_path: Path):
         fields = [image_path.name, ex, exception_trace_csv]
         writer.writerow(fields)
 
+    # Mark the image in the journal, so it is retried in a next run
+    if journal is not None:
+        journal.set_error(image_path.name)
+
 
 def read_image(
     image_path: Path,
@@ -920,6 +2117,14 @@ def read_image(
                 # Read pixels
                 image_data = image_ds.read()
 
+                # Read the mask if the image can contain nodata pixels
+                image_mask = None
+                if any(
+                    MaskFlags.all_valid not in flags
+                    for flags in image_ds.mask_flag_enums
+                ):
+                    image_mask = image_ds.dataset_mask()
+
             # change from (channels, width, height) to
             # (width, height, channels) + normalize to between 0 and 1
             image_data = rio_plot.reshape_as_image(image_data)
@@ -953,6 +2158,7 @@ def read_image(
         "image_data": image_data,
         "image_crs": image_crs,
         "image_transform": image_transform,
+        "image_mask": image_mask,
         "image_path": image_path,
     }
 
@@ -981,7 +2187,7 @@ def load_image(
         dict: the image and its properties.
     """
     # Load image
-    crs = pyproj.CRS.from_user_input(image_layer["projection"])
+    crs = image_util.get_crs(image_layer["projection"])
     image_data, profile = image_util.load_image(
         layersources=image_layer["layersources"],
         crs=crs,
@@ -994,6 +2200,11 @@ def load_image(
         switch_axes=image_layer.get("switch_axes"),
     )
 
+    # Determine the nodata pixels if the layer has a nodata value
+    image_mask = None
+    if profile.get("nodata") is not None:
+        image_mask = np.any(image_data != profile["nodata"], axis=0)
+
     # change from (channels, width, height) to
     # (width, height, channels) + normalize to between 0 and 1
     image_data = rio_plot.reshape_as_image(image_data)
@@ -1004,6 +2215,7 @@ def load_image(
         "image_data": image_data,
         "image_crs": crs,
         "image_transform": profile["transform"],
+        "image_mask": image_mask,
     }
 
     return image
@@ -0,0 +1,206 @@
+"""Module to keep track of the progress of a prediction in a journal."""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+# The timings that can be recorded per tile, in seconds
+TIMING_COLUMNS = ("read_s", "predict_s", "postprocess_s")
+
+
+class PredictionJournal:
+    """Journal in a SQLite database with the status of all tiles of a prediction.
+
+    For each tile, the status is kept together with the time it took to process it and
+    the number of features found in it. Hence, the journal can be used to resume a
+    prediction as well as to analyse the performance afterwards.
+
+    Updates are buffered and written in batches. The journal can be used from multiple
+    threads.
+
+    Use as context manager to make sure all updates are written.
+    """
+
+    def __init__(self, path: Path, batch_size: int = 1000):
+        """Open the journal.
+
+        Args:
+            path (Path): the path to the journal file. If it doesn't exist yet, it is
+                created.
+            batch_size (int, optional): the number of updates that is buffered before
+                they are written. Defaults to 1000.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._updates: list[tuple] = []
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        timing_columns_sql = ", ".join(f"{column} REAL" for column in TIMING_COLUMNS)
+        with self._conn:
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS tile (
+                    tile_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    {timing_columns_sql},
+                    nb_features INTEGER,
+                    prescreen TEXT,
+                    updated REAL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tile_status_idx ON tile(status)"
+            )
+            # Journals created by older versions don't have all columns yet
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tile)")}
+            if "prescreen" not in columns:
+                self._conn.execute("ALTER TABLE tile ADD COLUMN prescreen TEXT")
+
+    def __enter__(self) -> "PredictionJournal":
+        """Use the journal as context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        """Close the journal when leaving the context."""
+        self.close()
+
+    def add_tiles(self, tile_ids: Iterable[str]):
+        """Add tiles to the journal with status pending.
+
+        Tiles that are in the journal already are not changed.
+
+        Args:
+            tile_ids (Iterable[str]): the ids of the tiles to add.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tile (tile_id, status) VALUES (?, ?)",
+                ((tile_id, STATUS_PENDING) for tile_id in tile_ids),
+            )
+
+    def get_pending_tile_ids(self) -> set[str]:
+        """Get the ids of the tiles that still need to be processed.
+
+        Tiles that are pending or that had an error are returned.
+
+        Returns:
+            set[str]: the ids of the tiles to process.
+        """
+        self.flush()
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT tile_id FROM tile WHERE status <> ?", (STATUS_DONE,)
+            )
+            return {row[0] for row in cursor}
+
+    def set_done(self, tile_records: Iterable[dict[str, Any]]):
+        """Set tiles as done.
+
+        Args:
+            tile_records (Iterable[dict[str, Any]]): a record for each tile with the
+                "tile_id" and optionally the timings in seconds ("read_s",
+                "predict_s", "postprocess_s"), the "nb_features" found and the reason
+                the tile was skipped by the "prescreen".
+        """
+        now = time.time()
+        updates = [
+            (
+                record["tile_id"],
+                STATUS_DONE,
+                *(record.get(column) for column in TIMING_COLUMNS),
+                record.get("nb_features"),
+                record.get("prescreen"),
+                now,
+            )
+            for record in tile_records
+        ]
+        self._add_updates(updates)
+
+    def set_error(self, tile_id: str):
+        """Set a tile as having an error, so it is retried in a next run.
+
+        Args:
+            tile_id (str): the id of the tile.
+        """
+        update = (tile_id, STATUS_ERROR, *([None] * len(TIMING_COLUMNS)), None, None)
+        self._add_updates([(*update, time.time())])
+
+    def _add_updates(self, updates: list[tuple]):
+        with self._lock:
+            self._updates.extend(updates)
+            nb_updates = len(self._updates)
+        if nb_updates >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered updates to the journal in one transaction."""
+        with self._lock:
+            if len(self._updates) == 0:
+                return
+            columns = [
+                "tile_id",
+                "status",
+                *TIMING_COLUMNS,
+                "nb_features",
+                "prescreen",
+                "updated",
+            ]
+            placeholders = ", ".join("?" for _ in columns)
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO tile ({', '.join(columns)}) "
+                    f"VALUES ({placeholders})",
+                    self._updates,
+                )
+            self._updates = []
+
+    def clear(self):
+        """Remove all tiles from the journal."""
+        with self._lock, self._conn:
+            self._updates = []
+            self._conn.execute("DELETE FROM tile")
+
+    def import_done_log(self, done_log_path: Path):
+        """Set the tiles listed in a text file, one tile id per line, as done.
+
+        This can be used to resume predictions that were started with a version of
+        orthoseg that logged the tiles done in a text file.
+
+        Args:
+            done_log_path (Path): the path to the text file.
+        """
+        with done_log_path.open() as done_log:
+            tile_ids = [line.rstrip() for line in done_log if line.rstrip() != ""]
+        self.set_done({"tile_id": tile_id} for tile_id in tile_ids)
+        self.flush()
+        logger.info(f"Imported {len(tile_ids)} tiles done from {done_log_path}")
+
+    def close(self):
+        """Write the buffered updates and close the journal."""
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None  # type: ignore[assignment]
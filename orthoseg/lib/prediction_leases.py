@@ -0,0 +1,364 @@
+"""Module to distribute the tiles of a prediction over multiple workers."""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from types import TracebackType
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+
+
+class PredictionLeases:
+    """Work table in a SQLite database to distribute a prediction over workers.
+
+    The tiles to predict are divided in chunks. A worker leases a chunk, predicts it and
+    sets it as done. While predicting, the worker needs to renew its lease regularly,
+    e.g. with :meth:`renewing`. If a worker stops without setting its chunk as done,
+    e.g. because it crashed, the lease expires and another worker can lease the chunk.
+
+    The workers can run in multiple processes and on multiple hosts, as long as the
+    database is on a filesystem they all can access. Because the journal mode of the
+    database is kept at "DELETE", this also works on network filesystems that support
+    file locking. The lease expiry times are compared between hosts, so their clocks
+    should be synchronized well compared to the lease time used.
+
+    Use as context manager to make sure the database is closed.
+    """
+
+    def __init__(self, path: Path, timeout: float = 60.0):
+        """Open the work table.
+
+        Args:
+            path (Path): the path to the database file. If it doesn't exist yet, it is
+                created.
+            timeout (float, optional): the time in seconds to wait if the database is
+                locked by another worker. Defaults to 60.0.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk (
+                    chunk_id INTEGER PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    nb_leases INTEGER NOT NULL DEFAULT 0,
+                    updated REAL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_tile (
+                    tile_id TEXT PRIMARY KEY,
+                    chunk_id INTEGER NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS chunk_tile_chunk_idx "
+                "ON chunk_tile(chunk_id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def __enter__(self) -> "PredictionLeases":
+        """Use the work table as context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        """Close the work table when leaving the context."""
+        self.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in a transaction that locks the database for writing."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def add_tiles(self, tile_ids: list[str], chunk_size: int):
+        """Divide the tiles in chunks of consecutive tiles, if not done already.
+
+        The first worker adds the tiles, the other workers check if they would have
+        added the same tiles.
+
+        Args:
+            tile_ids (list[str]): the ids of all tiles to predict.
+            chunk_size (int): the number of tiles per chunk.
+
+        Raises:
+            ValueError: if other tiles were added to the work table already.
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size should be >= 1, not {chunk_size}")
+
+        with self._transaction() as conn:
+            existing_tile_ids = {
+                row[0] for row in conn.execute("SELECT tile_id FROM chunk_tile")
+            }
+            if len(existing_tile_ids) > 0:
+                if existing_tile_ids != set(tile_ids):
+                    raise ValueError(
+                        f"the tiles in {self.path} are different from the tiles to "
+                        "predict: were the predict settings changed?"
+                    )
+                return
+
+            conn.executemany(
+                "INSERT INTO chunk_tile (tile_id, chunk_id) VALUES (?, ?)",
+                (
+                    (tile_id, index // chunk_size)
+                    for index, tile_id in enumerate(tile_ids)
+                ),
+            )
+            nb_chunks = (len(tile_ids) + chunk_size - 1) // chunk_size
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO chunk (chunk_id, status, updated) VALUES (?, ?, ?)",
+                ((chunk_id, STATUS_PENDING, now) for chunk_id in range(nb_chunks)),
+            )
+        logger.info(f"Divided {len(tile_ids)} tiles in {nb_chunks} chunks")
+
+    def get_chunk_tile_ids(self, chunk_id: int) -> set[str]:
+        """Get the ids of the tiles in a chunk.
+
+        Args:
+            chunk_id (int): the id of the chunk.
+
+        Returns:
+            set[str]: the ids of the tiles.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT tile_id FROM chunk_tile WHERE chunk_id = ?", (chunk_id,)
+            )
+            return {row[0] for row in cursor}
+
+    def lease(self, worker_id: str, lease_s: float) -> int | None:
+        """Lease a chunk to predict.
+
+        A chunk that is still leased by the worker, e.g. because it was restarted, is
+        leased first. Otherwise a pending chunk or a chunk with an expired lease is
+        leased.
+
+        Args:
+            worker_id (str): the id of the worker.
+            lease_s (float): the time in seconds till the lease expires.
+
+        Returns:
+            int | None: the id of the chunk leased or None if there are no chunks
+                available at the moment.
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            row = conn.execute(
+                """
+                SELECT chunk_id FROM chunk
+                 WHERE (status = ? AND worker_id = ?)
+                    OR status = ?
+                    OR (status = ? AND lease_expires < ?)
+                 ORDER BY status = ? AND worker_id = ? DESC, chunk_id
+                 LIMIT 1
+                """,
+                (
+                    STATUS_LEASED,
+                    worker_id,
+                    STATUS_PENDING,
+                    STATUS_LEASED,
+                    now,
+                    STATUS_LEASED,
+                    worker_id,
+                ),
+            ).fetchone()
+            if row is None:
+                return None
+
+            chunk_id = row[0]
+            conn.execute(
+                """
+                UPDATE chunk
+                   SET status = ?, worker_id = ?, lease_expires = ?,
+                       nb_leases = nb_leases + 1, updated = ?
+                 WHERE chunk_id = ?
+                """,
+                (STATUS_LEASED, worker_id, now + lease_s, now, chunk_id),
+            )
+            return chunk_id
+
+    def renew(self, chunk_id: int, worker_id: str, lease_s: float) -> bool:
+        """Renew the lease of a chunk.
+
+        Args:
+            chunk_id (int): the id of the chunk.
+            worker_id (str): the id of the worker.
+            lease_s (float): the time in seconds till the lease expires.
+
+        Returns:
+            bool: False if the chunk isn't leased by the worker anymore.
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            cursor = conn.execute(
+                """
+                UPDATE chunk SET lease_expires = ?, updated = ?
+                 WHERE chunk_id = ? AND status = ? AND worker_id = ?
+                """,
+                (now + lease_s, now, chunk_id, STATUS_LEASED, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def renewing(self, chunk_id: int, worker_id: str, lease_s: float) -> Iterator:
+        """Renew the lease of a chunk in a background thread while in the context.
+
+        The lease is renewed every third of `lease_s`.
+
+        Args:
+            chunk_id (int): the id of the chunk.
+            worker_id (str): the id of the worker.
+            lease_s (float): the time in seconds till the lease expires.
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(lease_s / 3):
+                try:
+                    if not self.renew(chunk_id, worker_id, lease_s):
+                        logger.warning(
+                            f"chunk {chunk_id} isn't leased by {worker_id} anymore"
+                        )
+                        return
+                except sqlite3.Error as ex:
+                    # Try again next time, the lease doesn't expire immediately
+                    logger.warning(f"Error renewing lease of chunk {chunk_id}: {ex}")
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, chunk_id: int, worker_id: str):
+        """Release the lease of a chunk, so another worker can lease it.
+
+        Args:
+            chunk_id (int): the id of the chunk.
+            worker_id (str): the id of the worker.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                UPDATE chunk
+                   SET status = ?, worker_id = NULL, lease_expires = NULL, updated = ?
+                 WHERE chunk_id = ? AND status = ? AND worker_id = ?
+                """,
+                (STATUS_PENDING, time.time(), chunk_id, STATUS_LEASED, worker_id),
+            )
+
+    def set_done(self, chunk_id: int, worker_id: str) -> bool:
+        """Set a chunk as done.
+
+        Args:
+            chunk_id (int): the id of the chunk.
+            worker_id (str): the id of the worker.
+
+        Returns:
+            bool: False if the chunk wasn't leased by the worker anymore, so the chunk
+                isn't set as done by the worker.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE chunk SET status = ?, lease_expires = NULL, updated = ?
+                 WHERE chunk_id = ? AND status = ? AND worker_id = ?
+                """,
+                (STATUS_DONE, time.time(), chunk_id, STATUS_LEASED, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def get_done_chunks(self) -> dict[int, str]:
+        """Get the chunks that are done, with the worker that predicted them.
+
+        Returns:
+            dict[int, str]: the worker id for each chunk id that is done.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT chunk_id, worker_id FROM chunk WHERE status = ?",
+                (STATUS_DONE,),
+            )
+            return dict(cursor.fetchall())
+
+    def get_status_counts(self) -> dict[str, int]:
+        """Get the number of chunks per status.
+
+        Returns:
+            dict[str, int]: the number of chunks for each status.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT status, count(*) FROM chunk GROUP BY status"
+            )
+            return dict(cursor.fetchall())
+
+    def is_done(self) -> bool:
+        """Check if all chunks are done.
+
+        Returns:
+            bool: True if all chunks are done.
+        """
+        status_counts = self.get_status_counts()
+        return len(status_counts) > 0 and status_counts.keys() == {STATUS_DONE}
+
+    def claim_merge(self, worker_id: str) -> bool:
+        """Claim merging the outputs of the chunks, so only one worker does it.
+
+        Args:
+            worker_id (str): the id of the worker.
+
+        Returns:
+            bool: True if the worker should do the merge.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('merged_by', ?)",
+                (worker_id,),
+            )
+            return cursor.rowcount == 1
+
+    def close(self):
+        """Close the work table."""
+        if self._conn is None:
+            return
+        self._conn.close()
+        self._conn = None  # type: ignore[assignment]
@@ -0,0 +1,293 @@
+"""Module to blend the overlapping predictions of tiles into one mosaic."""
+
+import logging
+from collections.abc import Iterator
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pyproj
+import rasterio as rio
+import rasterio.transform as rio_transform
+import rasterio.windows as rio_windows
+from rasterio.enums import Resampling
+
+from orthoseg.lib import postprocess_predictions as postp
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# The size of the blocks the mosaic is processed in, in pixels
+BLOCK_SIZE = 4096
+
+
+def cosine_weights(width: int, height: int, blend_pixels: int) -> np.ndarray:
+    """Get the weights to blend a tile prediction with its neighbours.
+
+    The weights are 1 in the center of the tile and decrease with a cosine ramp in the
+    `blend_pixels` pixels at the borders. If tiles overlap `blend_pixels` pixels, the
+    weights of all tiles covering a pixel sum up to 1.
+
+    Args:
+        width (int): the width of the tile in pixels.
+        height (int): the height of the tile in pixels.
+        blend_pixels (int): the number of pixels at the borders to blend.
+
+    Returns:
+        np.ndarray: float32 array with shape (height, width) with the weights.
+    """
+
+    def ramp(size: int) -> np.ndarray:
+        weights = np.ones(size, dtype=np.float32)
+        if blend_pixels <= 0:
+            return weights
+        # Distance of the pixel centers to the border of the tile
+        distance = np.minimum(np.arange(size), np.arange(size)[::-1]) + 0.5
+        on_border = distance < blend_pixels
+        weights[on_border] = np.sin(np.pi / 2 * distance[on_border] / blend_pixels) ** 2
+        return weights
+
+    return np.outer(ramp(height), ramp(width))
+
+
+class PredictionMosaic:
+    """Mosaic where the predictions of overlapping tiles are blended in.
+
+    The probabilities per class, multiplied by the weights determined by
+    :func:`cosine_weights`, are summed in a tiled GeoTIFF on disk, together with the
+    weights. Hence, the predictions of a large area can be blended without having to
+    keep them in memory, and blending can be resumed later on. Afterwards, the blended
+    probabilities can be decoded to a class raster with :meth:`write_classes`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        bounds: tuple[float, float, float, float],
+        pixel_x_size: float,
+        pixel_y_size: float,
+        crs: pyproj.CRS,
+        nb_classes: int,
+        blend_pixels: int,
+        force: bool = False,
+    ):
+        """Create a mosaic, or open it if it exists already.
+
+        Args:
+            path (Path): the path to the GeoTIFF file to sum the predictions in.
+            bounds (tuple[float, float, float, float]): the bounds of the mosaic. All
+                tiles added must be within the bounds.
+            pixel_x_size (float): the size of the pixels in the x direction.
+            pixel_y_size (float): the size of the pixels in the y direction.
+            crs (pyproj.CRS): the crs of the mosaic.
+            nb_classes (int): the number of classes in the predictions.
+            blend_pixels (int): the number of pixels at the borders of the tiles to
+                blend with the neighbouring tiles. Typically twice the number of pixels
+                the tiles overlap.
+            force (bool, optional): True to start from an empty mosaic if it exists
+                already. Defaults to False.
+        """
+        xmin, ymin, xmax, ymax = bounds
+        self.path = path
+        self.nb_classes = nb_classes
+        self.blend_pixels = blend_pixels
+        self.width = round((xmax - xmin) / pixel_x_size)
+        self.height = round((ymax - ymin) / pixel_y_size)
+        self.transform = rio_transform.from_origin(
+            xmin, ymax, pixel_x_size, pixel_y_size
+        )
+        self.crs = crs
+        self._weights: dict[tuple[int, int], np.ndarray] = {}
+
+        if force:
+            path.unlink(missing_ok=True)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Sparse, so blocks that aren't written yet don't take any disk space
+            profile = {
+                "driver": "GTiff",
+                "width": self.width,
+                "height": self.height,
+                "count": nb_classes + 1,
+                "dtype": "float32",
+                "crs": crs,
+                "transform": self.transform,
+                "tiled": True,
+                "blockxsize": 512,
+                "blockysize": 512,
+                "sparse_ok": True,
+                "BIGTIFF": "IF_SAFER",
+            }
+            with rio.open(path, "w", **profile):
+                pass
+
+    def add(self, image_pred_arrs: list[np.ndarray], image_transforms: list):
+        """Blend the predictions of tiles in the mosaic.
+
+        The predictions are written to disk before returning.
+
+        Args:
+            image_pred_arrs (list[np.ndarray]): the predictions as returned by keras:
+                float32 or uint8 probabilities per class.
+            image_transforms (list): the transforms of the predictions.
+
+        Raises:
+            ValueError: if a prediction is a class map or if it is not within the
+                bounds of the mosaic.
+        """
+        with rio.open(self.path, "r+") as mosaic_ds:
+            for image_pred_arr, image_transform in zip(
+                image_pred_arrs, image_transforms, strict=True
+            ):
+                self._add(mosaic_ds, image_pred_arr, image_transform)
+
+    def _add(self, mosaic_ds, image_pred_arr: np.ndarray, image_transform):
+        if image_pred_arr.ndim != 3:
+            raise ValueError(
+                "only predictions with probabilities per class can be blended, not "
+                f"predictions with shape {image_pred_arr.shape}"
+            )
+        height, width, _ = image_pred_arr.shape
+        col_off, row_off = ~self.transform * (image_transform.c, image_transform.f)
+        window = rio_windows.Window(round(col_off), round(row_off), width, height)
+        if (
+            window.col_off < 0
+            or window.row_off < 0
+            or window.col_off + width > self.width
+            or window.row_off + height > self.height
+        ):
+            raise ValueError(f"prediction is not within the mosaic: {window}")
+
+        if image_pred_arr.dtype == np.uint8:
+            probabilities = image_pred_arr.astype(np.float32) / 255
+        else:
+            probabilities = image_pred_arr.astype(np.float32, copy=False)
+        weights = self._weights.get((width, height))
+        if weights is None:
+            weights = cosine_weights(width, height, self.blend_pixels)
+            self._weights[(width, height)] = weights
+
+        sums = mosaic_ds.read(window=window)
+        sums[: self.nb_classes] += np.moveaxis(probabilities, 2, 0) * weights
+        sums[self.nb_classes] += weights
+        mosaic_ds.write(sums, window=window)
+
+    def write_classes(
+        self,
+        output_path: Path,
+        min_probability: float = 0.5,
+        block_size: int = BLOCK_SIZE,
+    ):
+        """Decode the blended probabilities to a tiled class raster with overviews.
+
+        Pixels where no tile was blended in are attributed to the background.
+
+        Args:
+            output_path (Path): the path to write the uint8 class raster to.
+            min_probability (float): Minimum probability to consider a pixel being of a
+                certain class. Defaults to 0.5.
+            block_size (int, optional): the size of the blocks the mosaic is processed
+                in. Defaults to BLOCK_SIZE.
+        """
+        logger.info(f"Write blended prediction classes to {output_path}")
+        profile = {
+            "driver": "GTiff",
+            "width": self.width,
+            "height": self.height,
+            "count": 1,
+            "dtype": "uint8",
+            "crs": self.crs,
+            "transform": self.transform,
+            "tiled": True,
+            "blockxsize": 512,
+            "blockysize": 512,
+            "compress": "deflate",
+            "BIGTIFF": "IF_SAFER",
+        }
+        with (
+            rio.open(self.path) as mosaic_ds,
+            rio.open(output_path, "w", **profile) as output_ds,
+        ):
+            for window in get_block_windows(self.width, self.height, block_size):
+                sums = mosaic_ds.read(window=window)
+                weights = sums[self.nb_classes]
+                probabilities = np.divide(
+                    sums[: self.nb_classes],
+                    weights,
+                    out=np.zeros_like(sums[: self.nb_classes]),
+                    where=weights > 0,
+                )
+                classes_arr = postp.decode_prediction(
+                    np.moveaxis(probabilities, 0, 2), min_probability=min_probability
+                )
+                output_ds.write(classes_arr, 1, window=window)
+
+            # Add overviews till the smallest one fits in one block
+            factors = []
+            factor = 2
+            while max(self.width, self.height) / factor >= 256:
+                factors.append(factor)
+                factor *= 2
+            if len(factors) > 0:
+                output_ds.build_overviews(factors, Resampling.mode)
+                output_ds.update_tags(ns="rio_overview", resampling="mode")
+
+
+def get_block_windows(
+    width: int, height: int, block_size: int = BLOCK_SIZE
+) -> Iterator[rio_windows.Window]:
+    """Get the windows to process a raster in blocks.
+
+    Args:
+        width (int): the width of the raster.
+        height (int): the height of the raster.
+        block_size (int, optional): the size of the blocks. Defaults to BLOCK_SIZE.
+
+    Yields:
+        Window: the windows of the blocks, row by row.
+    """
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield rio_windows.Window(
+                col_off,
+                row_off,
+                min(block_size, width - col_off),
+                min(block_size, height - row_off),
+            )
+
+
+def polygonize_block(
+    classes_path: Path,
+    window: rio_windows.Window,
+    classes: list,
+    postprocess: dict | None = None,
+) -> gpd.GeoDataFrame | None:
+    """Polygonize a block of a class raster.
+
+    Args:
+        classes_path (Path): the path to the class raster.
+        window (Window): the window of the block to polygonize.
+        classes (list): the class names.
+        postprocess (dict | None, optional): specifies which postprocessing should be
+            applied to the polygons. Default is None, so no postprocessing.
+
+    Returns:
+        gpd.GeoDataFrame | None: the polygons or None if no polygons were found.
+    """
+    with rio.open(classes_path) as classes_ds:
+        classes_arr = classes_ds.read(1, window=window)
+        transform = classes_ds.window_transform(window)
+        crs = classes_ds.crs
+
+    if not np.any(classes_arr) and (
+        postprocess is None or postprocess.get("reclassify_to_neighbour_query") is None
+    ):
+        return None
+
+    return postp.polygonize_pred_multiclass(
+        image_pred_arr=classes_arr,
+        image_crs=crs,
+        image_transform=transform,
+        classes=classes,
+        postprocess=postprocess,
+    )
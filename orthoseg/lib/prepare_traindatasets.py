@@ -797,9 +797,19 @@ def _prepare_image_and_mask(
                 dst=output_imagedata_image_dir / pgw_filename,
             )
     else:
-        # Get the image from the WMS service.
+        # Get the image from the mosaic cache if it is cached there, otherwise from the
+        # image layer itself.
+        layersources = image_layers[image_layer]["layersources"]
+        image_pixels_ignore_border = image_layers[image_layer][
+            "image_pixels_ignore_border"
+        ]
+        mosaic_cache = image_layers[image_layer].get("mosaic_cache")
+        if mosaic_cache is not None and mosaic_cache.is_cached(img_bbox.bounds):
+            layersources = [mosaic_cache.get_layersource()]
+            image_pixels_ignore_border = 0
+
         image_filepath = image_util.load_image_to_file(
-            layersources=image_layers[image_layer]["layersources"],
+            layersources=layersources,
             output_dir=output_imagedata_image_dir,
             crs=image_crs,
             bbox=img_bbox.bounds,
@@ -807,9 +817,7 @@ def _prepare_image_and_mask(
             ssl_verify=ssl_verify,
             image_format=image_util.FORMAT_PNG,
             # image_format_save=image_util.FORMAT_TIFF,
-            image_pixels_ignore_border=image_layers[image_layer][
-                "image_pixels_ignore_border"
-            ],
+            image_pixels_ignore_border=image_pixels_ignore_border,
             transparent=False,
             layername_in_filename=True,
             output_filename=output_filename,
@@ -0,0 +1,87 @@
+"""Module to find tiles that don't need to be predicted, without running the model."""
+
+import logging
+from pathlib import Path
+
+import geofileops as gfo
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# The reasons why a tile is skipped
+SKIP_OUTSIDE_ROI = "outside_roi"
+SKIP_NODATA = "nodata"
+SKIP_BLANK = "blank"
+
+
+def get_tiles_outside_roi(
+    tiles_gdf: gpd.GeoDataFrame,
+    roi_path: Path,
+    pixels_overlap: int = 0,
+    pixel_x_size: float = 0.25,
+    pixel_y_size: float = 0.25,
+) -> np.ndarray:
+    """Determine which tiles don't need to be predicted because they are outside a roi.
+
+    Only the part of the tiles that is predicted is taken in account, so without the
+    overlap with the neighbouring tiles. Tiles that only touch the roi are also
+    considered to be outside the roi.
+
+    Args:
+        tiles_gdf (gpd.GeoDataFrame): the tiles, including their overlap.
+        roi_path (Path): the file with the roi polygons.
+        pixels_overlap (int, optional): the number of pixels the tiles are enlarged
+            with in all directions. Defaults to 0.
+        pixel_x_size (float, optional): the pixel size in the x direction.
+            Defaults to 0.25.
+        pixel_y_size (float, optional): the pixel size in the y direction.
+            Defaults to 0.25.
+
+    Returns:
+        np.ndarray: boolean array with True for the tiles that are outside the roi.
+    """
+    roi_gdf = gfo.read_file(roi_path)
+    if tiles_gdf.crs is not None and roi_gdf.crs is not None:
+        roi_gdf = roi_gdf.to_crs(tiles_gdf.crs)
+    roi_geom = roi_gdf.geometry.union_all()
+    shapely.prepare(roi_geom)
+
+    bounds = tiles_gdf.geometry.bounds
+    overlap_x = pixels_overlap * pixel_x_size
+    overlap_y = pixels_overlap * pixel_y_size
+    cores = shapely.box(
+        bounds["minx"].to_numpy() + overlap_x,
+        bounds["miny"].to_numpy() + overlap_y,
+        bounds["maxx"].to_numpy() - overlap_x,
+        bounds["maxy"].to_numpy() - overlap_y,
+    )
+    in_roi = shapely.intersects(roi_geom, cores) & ~shapely.touches(roi_geom, cores)
+
+    return ~in_roi
+
+
+def prescreen_image(
+    image_data: np.ndarray, image_mask: np.ndarray | None = None
+) -> str | None:
+    """Check if an image needs to be predicted based on its mask and pixel values.
+
+    Args:
+        image_data (np.ndarray): the image data, with shape (height, width, bands).
+        image_mask (np.ndarray | None, optional): the mask of the image, with 0 for
+            nodata pixels. If None, all pixels are considered valid. Defaults to None.
+
+    Returns:
+        str | None: the reason to skip the image or None if it needs to be predicted.
+    """
+    # All pixels are nodata
+    if image_mask is not None and not np.any(image_mask):
+        return SKIP_NODATA
+
+    # All pixels have the same value, e.g. entirely white or black
+    if np.all(image_data == image_data[0, 0]):
+        return SKIP_BLANK
+
+    return None
@@ -0,0 +1,227 @@
+"""Module to read the tiles of a layer once for multiple predictions on it."""
+
+import heapq
+import logging
+import threading
+from collections.abc import Callable, Iterable
+from concurrent import futures
+from types import TracebackType
+from typing import Any
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+
+class SharedTileReader:
+    """Reader that reads each tile of a layer only once for multiple predictions.
+
+    The predictions, typically with different models, run concurrently on the same
+    tiles. Each prediction uses its own :class:`SharedTileReaderClient` to read the
+    tiles. A tile is read by the first prediction that needs it and is kept in memory
+    till all predictions that need it took it.
+
+    To limit the memory used, a prediction that is more than `max_tiles_ahead` tiles
+    ahead of the slowest prediction waits till that one has caught up.
+    """
+
+    def __init__(self, nb_clients: int, max_tiles_ahead: int = 32):
+        """Create a shared tile reader.
+
+        Args:
+            nb_clients (int): the number of predictions that will share the reader.
+            max_tiles_ahead (int, optional): the maximum number of tiles a prediction
+                can get ahead of the slowest prediction. Defaults to 32.
+        """
+        if nb_clients < 1:
+            raise ValueError(f"nb_clients should be >= 1, not {nb_clients}")
+        self.nb_clients = nb_clients
+        self.max_tiles_ahead = max_tiles_ahead
+        self.nb_reads = 0
+        self._condition = threading.Condition()
+        self._tile_indexes: dict[str, int] = {}
+        self._nb_clients_per_tile: dict[int, int] = {}
+        self._registered: set[int] = set()
+        self._finished: set[int] = set()
+        self._todo: dict[int, set[int]] = {}
+        self._todo_heaps: dict[int, list[int]] = {}
+        self._tiles: dict[int, futures.Future] = {}
+
+    def client(self, client_id: int) -> "SharedTileReaderClient":
+        """Get the client a prediction should use to read the tiles.
+
+        Args:
+            client_id (int): the id of the prediction, from 0 till `nb_clients`.
+
+        Returns:
+            SharedTileReaderClient: the client to read tiles with.
+        """
+        if client_id < 0 or client_id >= self.nb_clients:
+            raise ValueError(f"invalid client_id: {client_id}")
+        return SharedTileReaderClient(self, client_id)
+
+    @property
+    def nb_tiles_cached(self) -> int:
+        """The number of tiles that are being read or are kept in memory."""
+        with self._condition:
+            return len(self._tiles)
+
+    def _register(self, client_id: int, all_tile_ids: list[str], tile_ids: Iterable):
+        with self._condition:
+            if client_id in self._registered:
+                raise ValueError(f"client {client_id} is registered already")
+            if len(self._tile_indexes) == 0:
+                self._tile_indexes = {
+                    tile_id: index for index, tile_id in enumerate(all_tile_ids)
+                }
+            elif len(all_tile_ids) != len(self._tile_indexes):
+                raise ValueError("all predictions sharing a reader need the same tiles")
+
+            todo = {self._tile_indexes[tile_id] for tile_id in tile_ids}
+            for index in todo:
+                self._nb_clients_per_tile[index] = (
+                    self._nb_clients_per_tile.get(index, 0) + 1
+                )
+            self._todo[client_id] = todo
+            self._todo_heaps[client_id] = sorted(todo)
+            self._registered.add(client_id)
+            self._condition.notify_all()
+
+    def _read(
+        self, client_id: int, tile_id: str, read_func: Callable, *args, **kwargs
+    ) -> dict[str, Any]:
+        with self._condition:
+            # Wait till all predictions know which tiles they need
+            self._condition.wait_for(lambda: len(self._registered) == self.nb_clients)
+            index = self._tile_indexes[tile_id]
+            read_directly = client_id in self._finished
+            if not read_directly and index not in self._todo[client_id]:
+                raise ValueError(f"tile {tile_id} was not registered or read already")
+
+        if read_directly:
+            # The client stopped reading via the reader, e.g. because it is cancelled
+            return read_func(*args, **kwargs)
+
+        with self._condition:
+            # Don't get too far ahead of the slowest prediction
+            self._condition.wait_for(
+                lambda: (
+                    client_id in self._finished
+                    or index
+                    <= self._get_slowest_position(client_id) + self.max_tiles_ahead
+                )
+            )
+
+            tile_future = self._tiles.get(index)
+            read_tile = tile_future is None
+            if tile_future is None:
+                tile_future = futures.Future()
+                self._tiles[index] = tile_future
+                self.nb_reads += 1
+
+        try:
+            if read_tile:
+                try:
+                    tile_future.set_result(read_func(*args, **kwargs))
+                except Exception as ex:
+                    tile_future.set_exception(ex)
+
+            # Every prediction gets its own copy of the dict, not of the data
+            return dict(tile_future.result())
+        finally:
+            with self._condition:
+                self._take(client_id, index)
+                self._condition.notify_all()
+
+    def _finish(self, client_id: int):
+        with self._condition:
+            if client_id in self._finished:
+                return
+            self._finished.add(client_id)
+            self._registered.add(client_id)
+            for index in list(self._todo.get(client_id, [])):
+                self._take(client_id, index)
+            self._condition.notify_all()
+
+    def _take(self, client_id: int, index: int):
+        """Mark the tile as taken by the client, so it can be released if possible."""
+        todo = self._todo[client_id]
+        if index not in todo:
+            return
+        todo.remove(index)
+        self._nb_clients_per_tile[index] -= 1
+        if self._nb_clients_per_tile[index] == 0:
+            del self._nb_clients_per_tile[index]
+            self._tiles.pop(index, None)
+
+    def _get_slowest_position(self, client_id: int) -> float:
+        """Get the first tile still to be taken by the slowest other client."""
+        position = float("inf")
+        for other_id, todo_heap in self._todo_heaps.items():
+            if other_id == client_id or other_id in self._finished:
+                continue
+            # Remove the tiles that are taken already
+            todo = self._todo[other_id]
+            while len(todo_heap) > 0 and todo_heap[0] not in todo:
+                heapq.heappop(todo_heap)
+            if len(todo_heap) > 0:
+                position = min(position, todo_heap[0])
+
+        return position
+
+
+class SharedTileReaderClient:
+    """Client of a :class:`SharedTileReader` for one prediction.
+
+    The client first needs to :meth:`register` the tiles it will read. Use it as
+    context manager to make sure the other predictions don't wait on it anymore when
+    it stops reading.
+    """
+
+    def __init__(self, reader: SharedTileReader, client_id: int):
+        """Create a client. Use :meth:`SharedTileReader.client` for this."""
+        self.reader = reader
+        self.client_id = client_id
+
+    def __enter__(self) -> "SharedTileReaderClient":
+        """Use the client as context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        """Stop reading tiles when leaving the context."""
+        self.close()
+
+    def register(self, all_tile_ids: list[str], tile_ids: Iterable[str]):
+        """Register the tiles the prediction will read.
+
+        No tiles are read before all predictions registered or were closed.
+
+        Args:
+            all_tile_ids (list[str]): the ids of all tiles of the layer, in the order
+                they will be read. This must be the same for all predictions.
+            tile_ids (Iterable[str]): the ids of the tiles the prediction will read.
+        """
+        self.reader._register(self.client_id, all_tile_ids, tile_ids)
+
+    def read(self, tile_id: str, read_func: Callable, *args, **kwargs) -> dict:
+        """Get a tile, reading it if no other prediction did so already.
+
+        Args:
+            tile_id (str): the id of the tile.
+            read_func (Callable): the function to read the tile with. It should return
+                a dict.
+            *args: positional arguments for `read_func`.
+            **kwargs: keyword arguments for `read_func`.
+
+        Returns:
+            dict: a shallow copy of the result of `read_func`.
+        """
+        return self.reader._read(self.client_id, tile_id, read_func, *args, **kwargs)
+
+    def close(self):
+        """Stop reading tiles, so the other predictions don't wait on this one."""
+        self.reader._finish(self.client_id)
@@ -11,6 +11,7 @@ import pyproj
 import orthoseg.model.model_factory as mf
 from orthoseg.helpers import config_helper as conf, email_helper
 from orthoseg.util import image_util, log_util
+from orthoseg.util.tile_manifest import TileManifest
 
 # Get a logger...
 logger = logging.getLogger(__name__)
@@ -36,6 +37,14 @@ def _load_images_args(args) -> argparse.Namespace:
         default=argparse.SUPPRESS,
         help="Show this help message and exit",
     )
+    optional.add_argument(
+        "--rebuild_manifest",
+        action="store_true",
+        help=(
+            "Rebuild the manifest of the image cache from the images in it instead of "
+            "loading images"
+        ),
+    )
     optional.add_argument(
         "config_overrules",
         nargs="*",
@@ -51,6 +60,7 @@ def load_images(
     config_path: Path,
     load_testsample_images: bool = False,
     config_overrules: list[str] | None = None,
+    rebuild_manifest: bool = False,
 ):
     """Load and cache images for a segmentation project.
 
@@ -61,6 +71,10 @@ def load_images(
         config_overrules (list[str], optional): list of config options that will
             overrule other ways to supply configuration. They should be specified in the
             form of "<section>.<key>=<value>". Defaults to None.
+        rebuild_manifest (bool, optional): True to rebuild the manifest of the image
+            cache from the images in it instead of loading images. This is needed if
+            images were added to or removed from the cache directory by other means
+            than load_images. Defaults to False.
     """
     # Init
     # Load the config and save in a bunch of global variables zo it
@@ -111,6 +125,12 @@ def load_images(
             # For the real prediction dataset, no skipping obviously...
             nb_images_to_skip = 0
 
+        if rebuild_manifest:
+            with TileManifest(output_image_dir) as manifest:
+                manifest.rebuild()
+            logger.info(f"Completed rebuild of the manifest for {config_path.stem}")
+            return
+
         # Validate the image size for the model architecture
         input_width_pred = image_pixel_width + 2 * image_pixels_overlap
         input_height_pred = image_pixel_height + 2 * image_pixels_overlap
@@ -146,27 +166,43 @@ def load_images(
         )
 
         # Now we are ready to get the images...
-        image_util.load_images_to_cache(
-            layersources=layersources,
-            output_image_dir=output_image_dir,
-            crs=crs,
-            switch_axes=switch_axes,
-            image_gen_bbox=bbox,
-            image_gen_roi_filepath=roi_filepath,
-            grid_xmin=grid_xmin,
-            grid_ymin=grid_ymin,
-            image_crs_pixel_x_size=image_pixel_x_size,
-            image_crs_pixel_y_size=image_pixel_y_size,
-            image_pixel_width=image_pixel_width,
-            image_pixel_height=image_pixel_height,
-            image_pixels_ignore_border=image_pixels_ignore_border,
-            nb_concurrent_calls=nb_concurrent_calls,
-            cron_schedule=download_cron_schedule,
-            image_format=image_format,
-            pixels_overlap=image_pixels_overlap,
-            nb_images_to_skip=nb_images_to_skip,
-            ssl_verify=ssl_verify,
-        )
+        mosaic_cache = conf.image_layers[predict_layer]["mosaic_cache"]
+        if mosaic_cache is not None and not load_testsample_images:
+            # Load the pixels once: tiles are cut from the mosaic when predicting
+            mosaic_cache.load(
+                layersources=layersources,
+                image_gen_bbox=bbox,
+                image_gen_roi_filepath=roi_filepath,
+                request_size=conf.image_layers[predict_layer]["cache_request_size"],
+                image_format=image_format,
+                image_pixels_ignore_border=image_pixels_ignore_border,
+                switch_axes=switch_axes,
+                nb_concurrent_calls=nb_concurrent_calls,
+                ssl_verify=ssl_verify,
+                cron_schedule=download_cron_schedule,
+            )
+        else:
+            image_util.load_images_to_cache(
+                layersources=layersources,
+                output_image_dir=output_image_dir,
+                crs=crs,
+                switch_axes=switch_axes,
+                image_gen_bbox=bbox,
+                image_gen_roi_filepath=roi_filepath,
+                grid_xmin=grid_xmin,
+                grid_ymin=grid_ymin,
+                image_crs_pixel_x_size=image_pixel_x_size,
+                image_crs_pixel_y_size=image_pixel_y_size,
+                image_pixel_width=image_pixel_width,
+                image_pixel_height=image_pixel_height,
+                image_pixels_ignore_border=image_pixels_ignore_border,
+                nb_concurrent_calls=nb_concurrent_calls,
+                cron_schedule=download_cron_schedule,
+                image_format=image_format,
+                pixels_overlap=image_pixels_overlap,
+                nb_images_to_skip=nb_images_to_skip,
+                ssl_verify=ssl_verify,
+            )
 
         # Log and send mail
         message = f"Completed load_images for {config_path.stem}"
@@ -191,7 +227,9 @@ def main():
 
         # Run!
         load_images(
-            config_path=Path(args.config), config_overrules=args.config_overrules
+            config_path=Path(args.config),
+            config_overrules=args.config_overrules,
+            rebuild_manifest=args.rebuild_manifest,
         )
     except Exception as ex:
         logger.exception(f"Error: {ex}")
@@ -0,0 +1,276 @@
+"""Module with engines to run the inference of a model efficiently."""
+
+import logging
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+
+import keras.models
+import numpy as np
+import tensorflow as tf
+
+from orthoseg._compat import KERAS_GTE_3
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+
+class InferenceEngine:
+    """Wrapper around a model to predict via a compiled function with fixed shapes.
+
+    The model is called in a `tf.function` with a static input signature: the batch
+    size and the image size are fixed. Partial batches, e.g. the last batch of a
+    prediction, are padded to the full batch size, so the function is never retraced.
+    Optionally, the function is compiled with XLA.
+
+    If images with another size are predicted, a function is traced for that size.
+
+    The engine can be used instead of the model for :meth:`predict_on_batch`.
+    """
+
+    def __init__(
+        self, model: keras.models.Model, batch_size: int, jit_compile: bool = False
+    ):
+        """Create an inference engine for a model.
+
+        Args:
+            model (keras.models.Model): the model to predict with.
+            batch_size (int): the fixed number of images per batch.
+            jit_compile (bool, optional): True to compile the prediction with XLA.
+                Defaults to False.
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.jit_compile = jit_compile
+        self._functions: dict[tuple[int, ...], Callable] = {}
+
+    def warm_up(self, image_shape: tuple[int, ...]):
+        """Trace and compile the prediction for images of a certain shape.
+
+        This avoids that the first batch predicted is a lot slower than the next ones.
+
+        Args:
+            image_shape (tuple[int, ...]): the shape of the images to predict, as
+                (height, width, channels).
+        """
+        perf_start = perf_counter()
+        self.predict_on_batch(np.zeros((1, *image_shape), dtype=np.float32))
+        logger.info(
+            f"Inference engine warmed up for {image_shape} with batch_size "
+            f"{self.batch_size}, jit_compile {self.jit_compile} in "
+            f"{perf_counter() - perf_start:.2f}s"
+        )
+
+    def predict_on_batch(self, batch_arr: np.ndarray) -> np.ndarray:
+        """Predict a batch of images.
+
+        Args:
+            batch_arr (np.ndarray): the images to predict, with shape
+                (nb_images, height, width, channels). If there are more than
+                `batch_size` images, they are predicted in multiple batches.
+
+        Returns:
+            np.ndarray: the predictions for the images.
+        """
+        batch_arr = np.asarray(batch_arr, dtype=np.float32)
+        nb_images = len(batch_arr)
+        image_shape = batch_arr.shape[1:]
+        predict_function = self._get_function(image_shape)
+
+        batch_pred_arrs = []
+        for start in range(0, nb_images, self.batch_size):
+            images_arr = batch_arr[start : start + self.batch_size]
+            nb_padding = self.batch_size - len(images_arr)
+            if nb_padding > 0:
+                padding_arr = np.zeros((nb_padding, *image_shape), dtype=np.float32)
+                images_arr = np.concatenate([images_arr, padding_arr])
+            pred_arr = predict_function(images_arr).numpy()
+            batch_pred_arrs.append(pred_arr[: len(pred_arr) - nb_padding])
+
+        if len(batch_pred_arrs) == 1:
+            return batch_pred_arrs[0]
+        return np.concatenate(batch_pred_arrs)
+
+    def _get_function(self, image_shape: tuple[int, ...]) -> Callable:
+        predict_function = self._functions.get(image_shape)
+        if predict_function is None:
+            input_signature = [
+                tf.TensorSpec((self.batch_size, *image_shape), dtype=tf.float32)
+            ]
+            predict_function = tf.function(
+                self._predict,
+                input_signature=input_signature,
+                jit_compile=self.jit_compile,
+            )
+            self._functions[image_shape] = predict_function
+
+        return predict_function
+
+    def _predict(self, batch_tensor: tf.Tensor) -> tf.Tensor:
+        return self.model(batch_tensor, training=False)
+
+
+class OnnxInferenceEngine:
+    """Engine to predict with a model exported to ONNX via onnxruntime.
+
+    On CPU, onnxruntime is often a lot faster than tensorflow. Use
+    :func:`export_onnx` to export the model to ONNX.
+
+    The engine can be used instead of the model for :meth:`predict_on_batch`.
+    """
+
+    def __init__(
+        self,
+        onnx_path: Path,
+        batch_size: int,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+    ):
+        """Create an inference engine for a model exported to ONNX.
+
+        Args:
+            onnx_path (Path): the path to the model in ONNX format.
+            batch_size (int): the maximum number of images per batch.
+            intra_op_threads (int, optional): the number of threads used to parallelize
+                the execution within operations. If 0, onnxruntime chooses.
+                Defaults to 0.
+            inter_op_threads (int, optional): the number of threads used to parallelize
+                the execution of operations. If 0, onnxruntime chooses. Defaults to 0.
+
+        Raises:
+            ImportError: if onnxruntime is not installed.
+        """
+        try:
+            import onnxruntime as ort  # noqa: PLC0415
+        except ImportError as ex:
+            raise ImportError(
+                "onnxruntime needs to be installed to use inference_backend onnxruntime"
+            ) from ex
+
+        self.onnx_path = onnx_path
+        self.batch_size = batch_size
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self._session = ort.InferenceSession(
+            str(onnx_path),
+            sess_options=options,
+            providers=ort.get_available_providers(),
+        )
+        self._input_name = self._session.get_inputs()[0].name
+
+    def warm_up(self, image_shape: tuple[int, ...]):
+        """Run a first prediction for images of a certain shape.
+
+        This avoids that the first batch predicted is a lot slower than the next ones.
+
+        Args:
+            image_shape (tuple[int, ...]): the shape of the images to predict, as
+                (height, width, channels).
+        """
+        perf_start = perf_counter()
+        self.predict_on_batch(np.zeros((self.batch_size, *image_shape), np.float32))
+        logger.info(
+            f"onnxruntime warmed up for {image_shape} with providers "
+            f"{self._session.get_providers()} in {perf_counter() - perf_start:.2f}s"
+        )
+
+    def predict_on_batch(self, batch_arr: np.ndarray) -> np.ndarray:
+        """Predict a batch of images.
+
+        Args:
+            batch_arr (np.ndarray): the images to predict, with shape
+                (nb_images, height, width, channels). If there are more than
+                `batch_size` images, they are predicted in multiple batches.
+
+        Returns:
+            np.ndarray: the predictions for the images.
+        """
+        batch_arr = np.asarray(batch_arr, dtype=np.float32)
+        batch_pred_arrs = [
+            self._session.run(
+                None, {self._input_name: batch_arr[start : start + self.batch_size]}
+            )[0]
+            for start in range(0, len(batch_arr), self.batch_size)
+        ]
+
+        if len(batch_pred_arrs) == 1:
+            return batch_pred_arrs[0]
+        return np.concatenate(batch_pred_arrs)
+
+
+def export_onnx(
+    model: keras.models.Model, onnx_path: Path, model_path: Path | None = None
+) -> Path:
+    """Export a model to ONNX, unless it was exported already.
+
+    Args:
+        model (keras.models.Model): the model to export.
+        onnx_path (Path): the path to export the model to.
+        model_path (Path | None, optional): the file the model was loaded from. If the
+            model file is more recent than `onnx_path`, the model is exported again.
+            Defaults to None.
+
+    Returns:
+        Path: the path to the model in ONNX format.
+    """
+    if onnx_path.exists() and (
+        model_path is None or onnx_path.stat().st_mtime >= model_path.stat().st_mtime
+    ):
+        return onnx_path
+
+    logger.info(f"Export model to {onnx_path}")
+    perf_start = perf_counter()
+
+    # Export to a temporary file first, so no partial export is used if it fails
+    tmp_path = onnx_path.with_name(f"{onnx_path.stem}_tmp{onnx_path.suffix}")
+    if KERAS_GTE_3:
+        input_signature = [tf.TensorSpec(model.input_shape, tf.float32, name="input")]
+        model.export(
+            str(tmp_path),
+            format="onnx",
+            verbose=False,
+            input_signature=input_signature,
+        )
+    else:
+        import tf2onnx  # noqa: PLC0415
+
+        tf2onnx.convert.from_keras(model, output_path=str(tmp_path))
+    tmp_path.replace(onnx_path)
+    logger.info(f"Exported model to ONNX in {perf_counter() - perf_start:.2f}s")
+
+    return onnx_path
+
+
+def get_onnx_path(
+    model_path: Path,
+    decode_head: str = "none",
+    min_probability: float = 0.5,
+    quantized: bool = False,
+) -> Path:
+    """Get the path to cache the ONNX export of a model next to the model file.
+
+    Args:
+        model_path (Path): the file the model was loaded from.
+        decode_head (str, optional): the decode head added to the model.
+            Defaults to "none".
+        min_probability (float, optional): the minimum probability used in the decode
+            head. Only relevant for decode head "classes". Defaults to 0.5.
+        quantized (bool, optional): True to get the path of the model quantized to
+            int8. Defaults to False.
+
+    Returns:
+        Path: the path to the ONNX file.
+    """
+    decode_head = decode_head.lower()
+    suffix = ""
+    if decode_head == "classes":
+        suffix = f"_classes{min_probability}"
+    elif decode_head != "none":
+        suffix = f"_{decode_head}"
+    if quantized:
+        suffix += "_int8"
+
+    return model_path.with_name(f"{model_path.stem}{suffix}.onnx")
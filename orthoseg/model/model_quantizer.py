@@ -0,0 +1,211 @@
+"""Module to quantize models to int8 for a faster inference."""
+
+import logging
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import rasterio as rio
+import rasterio.plot as rio_plot
+
+from orthoseg.lib import postprocess_predictions as postp
+from orthoseg.model.inference_engine import OnnxInferenceEngine
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# The file extensions of the images in the training data
+IMAGE_SUFFIXES = (".png", ".jpg", ".tif")
+
+
+class _TileCalibrationReader:
+    """Reader feeding training tiles to onnxruntime to calibrate the quantization.
+
+    onnxruntime only needs a `get_next` method, returning the inputs for the next run
+    of the model or None if there are no more.
+    """
+
+    def __init__(
+        self,
+        image_paths: list[Path],
+        input_name: str,
+        preprocess_input: Callable | None,
+    ):
+        self._input_name = input_name
+        self._images = (
+            _read_image(image_path, preprocess_input) for image_path in image_paths
+        )
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        image_arr = next(self._images, None)
+        if image_arr is None:
+            return None
+        return {self._input_name: np.expand_dims(image_arr, axis=0)}
+
+
+def quantize_model(
+    onnx_path: Path,
+    output_path: Path,
+    calibration_image_dir: Path,
+    preprocess_input: Callable | None = None,
+    nb_calibration_tiles: int = 100,
+    per_channel: bool = True,
+) -> Path:
+    """Quantize a model in ONNX format to int8.
+
+    The ranges of the activations are calibrated on a random sample of the images in
+    `calibration_image_dir`, typically the training images of the model.
+
+    Args:
+        onnx_path (Path): the path to the model in ONNX format.
+        output_path (Path): the path to write the quantized model to.
+        calibration_image_dir (Path): the directory with the images to calibrate on.
+        preprocess_input (Callable, optional): the preprocessing function to apply to
+            the images. Defaults to None.
+        nb_calibration_tiles (int, optional): the maximum number of images to calibrate
+            on. Defaults to 100.
+        per_channel (bool, optional): True to quantize the weights per channel.
+            Defaults to True.
+
+    Raises:
+        ImportError: if onnxruntime is not installed.
+        ValueError: if there are no images in `calibration_image_dir`.
+
+    Returns:
+        Path: the path to the quantized model.
+    """
+    try:
+        import onnxruntime as ort  # noqa: PLC0415
+        from onnxruntime import quantization  # noqa: PLC0415
+    except ImportError as ex:
+        raise ImportError("onnxruntime needs to be installed to quantize") from ex
+
+    image_paths = _get_image_paths(calibration_image_dir)
+    if len(image_paths) == 0:
+        raise ValueError(f"No images found to calibrate in {calibration_image_dir}")
+    if len(image_paths) > nb_calibration_tiles:
+        rng = np.random.default_rng(0)
+        indexes = rng.choice(len(image_paths), nb_calibration_tiles, replace=False)
+        image_paths = [image_paths[index] for index in sorted(indexes)]
+
+    logger.info(f"Quantize {onnx_path} using {len(image_paths)} calibration images")
+    perf_start = perf_counter()
+    session = ort.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+    reader = _TileCalibrationReader(
+        image_paths, session.get_inputs()[0].name, preprocess_input
+    )
+
+    # Quantize to a temporary file first, so no partial result is used if it fails
+    tmp_path = output_path.with_name(f"{output_path.stem}_tmp{output_path.suffix}")
+    quantization.quantize_static(
+        model_input=str(onnx_path),
+        model_output=str(tmp_path),
+        calibration_data_reader=reader,
+        quant_format=quantization.QuantFormat.QDQ,
+        per_channel=per_channel,
+        activation_type=quantization.QuantType.QUInt8,
+        weight_type=quantization.QuantType.QInt8,
+        calibrate_method=quantization.CalibrationMethod.MinMax,
+    )
+    tmp_path.replace(output_path)
+    logger.info(f"Quantized model in {perf_counter() - perf_start:.2f}s")
+
+    return output_path
+
+
+def compare_iou(
+    onnx_path: Path,
+    quantized_onnx_path: Path,
+    image_dir: Path,
+    mask_dir: Path,
+    classes: list[str],
+    preprocess_input: Callable | None = None,
+    min_probability: float = 0.5,
+    batch_size: int = 4,
+) -> pd.DataFrame:
+    """Compare the IoU per class of a model with the IoU of its quantized version.
+
+    Args:
+        onnx_path (Path): the path to the float model in ONNX format.
+        quantized_onnx_path (Path): the path to the quantized model.
+        image_dir (Path): the directory with the images to evaluate on.
+        mask_dir (Path): the directory with the masks of the images, with for each
+            pixel the index of the class.
+        classes (list[str]): the names of the classes of the model.
+        preprocess_input (Callable, optional): the preprocessing function to apply to
+            the images. Defaults to None.
+        min_probability (float, optional): the minimum probability to consider a pixel
+            being of a certain class. Defaults to 0.5.
+        batch_size (int, optional): the number of images to predict per batch.
+            Defaults to 4.
+
+    Returns:
+        pd.DataFrame: the IoU per class, with columns "class", "iou_float",
+            "iou_quantized" and "iou_delta". The IoU is NaN for classes that are
+            neither in the masks nor in the predictions.
+    """
+    image_paths = [
+        image_path
+        for image_path in _get_image_paths(image_dir)
+        if (mask_dir / f"{image_path.stem}.png").exists()
+    ]
+    logger.info(f"Compare the IoU on {len(image_paths)} images in {image_dir}")
+
+    engines = {
+        "float": OnnxInferenceEngine(onnx_path, batch_size=batch_size),
+        "quantized": OnnxInferenceEngine(quantized_onnx_path, batch_size=batch_size),
+    }
+    nb_classes = len(classes)
+    intersection = {name: np.zeros(nb_classes, dtype=np.int64) for name in engines}
+    union = {name: np.zeros(nb_classes, dtype=np.int64) for name in engines}
+
+    for start in range(0, len(image_paths), batch_size):
+        batch_paths = image_paths[start : start + batch_size]
+        batch_arr = np.stack(
+            [_read_image(image_path, preprocess_input) for image_path in batch_paths]
+        )
+        masks = [
+            _read_image(mask_dir / f"{image_path.stem}.png")[:, :, 0]
+            for image_path in batch_paths
+        ]
+        for name, engine in engines.items():
+            batch_pred_arr = engine.predict_on_batch(batch_arr)
+            for image_pred_arr, mask_arr in zip(batch_pred_arr, masks, strict=True):
+                class_arr = postp.decode_prediction(image_pred_arr, min_probability)
+                for class_id in range(nb_classes):
+                    pred_mask = class_arr == class_id
+                    true_mask = mask_arr == class_id
+                    intersection[name][class_id] += np.sum(pred_mask & true_mask)
+                    union[name][class_id] += np.sum(pred_mask | true_mask)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = {name: intersection[name] / union[name] for name in engines}
+    result_df = pd.DataFrame(
+        {
+            "class": classes,
+            "iou_float": iou["float"],
+            "iou_quantized": iou["quantized"],
+        }
+    )
+    result_df["iou_delta"] = result_df["iou_quantized"] - result_df["iou_float"]
+
+    return result_df
+
+
+def _get_image_paths(image_dir: Path) -> list[Path]:
+    return sorted(
+        path for path in image_dir.glob("*.*") if path.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+def _read_image(
+    image_path: Path, preprocess_input: Callable | None = None
+) -> np.ndarray:
+    with rio.open(image_path) as image_ds:
+        image_arr = rio_plot.reshape_as_image(image_ds.read())
+    if preprocess_input is not None:
+        image_arr = preprocess_input(image_arr)
+
+    return np.asarray(image_arr, dtype=np.float32)
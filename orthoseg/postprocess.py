@@ -121,6 +121,9 @@ def postprocess(config_path: Path, config_overrules: list[str] | None = None) ->
         )
         dissolve = conf.postprocess.getboolean("dissolve", True)
         dissolve_tiles_path = conf.postprocess.getpath("dissolve_tiles_path")
+        dissolve_onborder_only = conf.postprocess.getboolean(
+            "dissolve_onborder_only", False
+        )
         reclassify_query = conf.postprocess.get("reclassify_to_neighbour_query")
         if reclassify_query is not None:
             reclassify_query = reclassify_query.replace("\n", " ")
@@ -140,6 +143,7 @@ def postprocess(config_path: Path, config_overrules: list[str] | None = None) ->
             keep_intermediary_files=keep_intermediary_files,
             dissolve=dissolve,
             dissolve_tiles_path=dissolve_tiles_path,
+            dissolve_onborder_only=dissolve_onborder_only,
             reclassify_to_neighbour_query=reclassify_query,
             simplify_algorithm=simplify_algorithm,
             simplify_tolerance=simplify_tolerance,
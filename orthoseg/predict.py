@@ -5,6 +5,7 @@ import logging
 import pprint
 import sys
 import traceback
+from contextlib import ExitStack
 from pathlib import Path
 from typing import Any
 
@@ -14,6 +15,12 @@ import orthoseg.model.model_factory as mf
 import orthoseg.model.model_helper as mh
 from orthoseg.helpers import config_helper as conf, email_helper
 from orthoseg.lib import cleanup, predicter
+from orthoseg.model.inference_engine import (
+    InferenceEngine,
+    OnnxInferenceEngine,
+    export_onnx,
+    get_onnx_path,
+)
 from orthoseg.util import log_util
 
 # Get a logger...
@@ -27,7 +34,15 @@ def _predict_args(args) -> argparse.Namespace:
     # Required arguments
     required = parser.add_argument_group("Required arguments")
     required.add_argument(
-        "-c", "--config", type=str, required=True, help="The config file to use"
+        "-c",
+        "--config",
+        type=str,
+        required=True,
+        action="append",
+        help=(
+            "The config file to use. Specify multiple times to predict multiple "
+            "configs on the same image layer in one pass"
+        ),
     )
 
     # Optional arguments
@@ -51,6 +66,430 @@ def _predict_args(args) -> argparse.Namespace:
     return parser.parse_args(args)
 
 
+def _get_inline_postprocess() -> dict[str, Any]:
+    """Get the postprocessing to apply to the predictions while predicting.
+
+    Returns:
+        dict[str, Any]: the postprocessing configured in the predict section.
+    """
+    postprocess: dict[str, Any] = {}
+    simplify_algorithm = conf.predict.get("simplify_algorithm")
+    if simplify_algorithm is not None and simplify_algorithm != (""):
+        postprocess["simplify"] = {}
+        simplify = postprocess["simplify"]
+
+        simplify["simplify_algorithm"] = simplify_algorithm
+        simplify["simplify_tolerance"] = conf.predict.geteval("simplify_tolerance")
+        simplify["simplify_lookahead"] = conf.predict.getint("simplify_lookahead")
+        simplify["simplify_topological"] = conf.predict.getboolean_ext(
+            "simplify_topological"
+        )
+    postprocess["filter_background_modal_size"] = conf.predict.getint(
+        "filter_background_modal_size"
+    )
+    query = conf.predict.get("reclassify_to_neighbour_query")
+    if query is not None:
+        query = query.replace("\n", " ")
+    postprocess["reclassify_to_neighbour_query"] = query
+
+    return postprocess
+
+
+def _load_prediction() -> dict[str, Any]:
+    """Load the model and the settings to predict with for the config read.
+
+    Returns:
+        dict[str, Any]: the model to predict with, wrapped in an inference engine, and
+            the prediction settings.
+    """
+    # Read some config, and check if values are ok
+    image_layer = conf.predict["image_layer"]
+    image_layer_config = conf.image_layers.get(image_layer)
+    if image_layer_config is None:
+        raise ValueError(f"{image_layer=} is not configured in image_layers")
+
+    input_image_dir = conf.dirs.getpath("predict_image_input_dir")
+
+    # Create base filename of model to use
+    # TODO: is force data version the most logical, or rather implement
+    #       force weights file or ?
+    traindata_id = None
+    force_model_traindata_id = conf.train.getint("force_model_traindata_id")
+    if force_model_traindata_id is not None and force_model_traindata_id > -1:
+        traindata_id = force_model_traindata_id
+
+    # Get the best model that already exists for this train dataset,...
+    architecture_id = conf.model.getint("architecture_id")
+    trainparams_id = conf.train.getint("trainparams_id")
+    best_model = mh.get_best_model(
+        model_dir=conf.dirs.getpath("model_dir"),
+        segment_subject=conf.general["segment_subject"],
+        traindata_id=traindata_id,
+        architecture_id=architecture_id,
+        trainparams_id=trainparams_id,
+    )
+
+    # Check if a model was found
+    if best_model is None:
+        message = (
+            f"No model found in model_dir: {conf.dirs.getpath('model_dir')} for "
+            f"traindata_id: {traindata_id}, architecture_id: {architecture_id}, "
+            f"trainparams_id: {trainparams_id}"
+        )
+        logger.critical(message)
+        raise RuntimeError(message)
+    else:
+        model_weights_filepath = best_model["filepath"]
+        logger.info(f"Best model found: {model_weights_filepath}")
+
+    model_name = best_model["basefilename"]
+
+    # Load the hyperparams of the model
+    # TODO: move the hyperparams filename formatting to get_models...
+    hyperparams_path = (
+        best_model["filepath"].parent / f"{best_model['basefilename']}_hyperparams.json"
+    )
+    hyperparams = mh.HyperParams(path=hyperparams_path)
+
+    # Validate the image prediction size for the model architecture
+    overlap = conf.predict.getint("image_pixels_overlap", 0)
+    input_width_pred = conf.predict.getint("image_pixel_width") + 2 * overlap
+    input_height_pred = conf.predict.getint("image_pixel_height") + 2 * overlap
+    mf.check_image_size(
+        architecture=hyperparams.architecture.architecture,
+        input_width=input_width_pred,
+        input_height=input_height_pred,
+    )
+
+    # Prepare output subdir to be used for predictions
+    predict_out_subdir = best_model["basefilename"]
+    if trainparams_id > 0:
+        predict_out_subdir += f"_{trainparams_id}"
+    predict_out_subdir += f"_{best_model['epoch']}"
+
+    # Load model to predict with
+    # --------------------------
+    model = None
+    # Try optimizing model with tensorrt. Not supported on Windows
+    # -> disabled for now till I have access again to a linux machine
+    """
+    if os.name != "nt":
+        try:
+            # Try import
+            from tensorflow.python.compiler.tensorrt import trt_convert as trt
+
+            # Import didn't fail, so optimize model
+            logger.info(
+                "Tensorrt is available, so try to create and use optimized model"
+            )
+            savedmodel_optim_dir = (
+                best_model["filepath"].parent
+                / f"{best_model['filepath'].stem}_optim"
+            )
+            if not savedmodel_optim_dir.exists():
+                # If base model not yet in savedmodel format
+                savedmodel_dir = (
+                    best_model["filepath"].parent / best_model["filepath"].stem
+                )
+                if not savedmodel_dir.exists():
+                    logger.info(
+                        f"SavedModel format not yet available, so load "
+                        f"model + weights from {best_model['filepath']}"
+                    )
+                    model = mf.load_model(best_model["filepath"], compile=False)
+                    logger.info(f"Now save again as savedmodel to {savedmodel_dir}")
+                    tf.saved_model.save(model, str(savedmodel_dir))
+                    model = None
+
+                # Now optimize model
+                logger.info(f"Optimize + save model to {savedmodel_optim_dir}")
+                converter = trt.TrtGraphConverterV2(
+                    input_saved_model_dir=str(savedmodel_dir),
+                    is_dynamic_op=True,
+                    precision_mode="FP16",
+                )
+                converter.convert()
+                converter.save(savedmodel_optim_dir)
+
+            logger.info(
+                f"Load optimized model + weights from {savedmodel_optim_dir}"
+            )
+            model = tf.keras.models.load_model(str(savedmodel_optim_dir))
+
+        except ImportError:
+            logger.info("Tensorrt is not available, so load unoptimized model")
+        except Exception as ex:
+            logger.info(
+                "An error occured trying to use tensorrt, "
+                f"so load unoptimized model. Error: {ex}"
+            )
+    """
+
+    # If model isn't loaded yet... load!
+    if model is None:
+        model, preprocess_input = mf.load_model(
+            best_model["filepath"], compile_model=False
+        )
+
+    # Decode the predictions in the model to reduce the output size
+    min_probability = conf.predict.getfloat("min_probability")
+    decode_head = conf.predict.get("decode_head", "none")
+    overlap_mode = conf.predict.get("overlap_mode", "ignore_border")
+    if overlap_mode == "blend" and decode_head == "classes":
+        raise ValueError(
+            "predict.overlap_mode = blend needs probabilities, so it is not "
+            "supported with predict.decode_head = classes"
+        )
+    model = mf.add_decode_head(
+        model, decode_head=decode_head, min_probability=min_probability
+    )
+
+    # Prepare the model for predicting
+    nb_gpu = mh.get_number_gpus()
+    batch_size = conf.predict.getint("batch_size")
+    if nb_gpu <= 1:
+        model_for_predict = model
+        logger.info(f"Predict using single GPU or CPU, with nb_gpu: {nb_gpu}")
+    else:
+        # If multiple GPU's available, create multi_gpu_model
+        try:
+            model_for_predict = model
+            logger.warning("Predict using multiple GPUs NOT IMPLEMENTED AT THE MOMENT")
+
+            # logger.info(
+            #     f"Predict using multiple GPUs: {nb_gpu}, batch size becomes: "
+            #     f"{batch_size*nb_gpu}"
+            # )
+            # batch_size *= nb_gpu
+        except ValueError:
+            logger.info("Predict using single GPU or CPU")
+            model_for_predict = model
+
+    # Prepare the engine to run the inference of the model with
+    inference_backend = conf.predict.get("inference_backend", "keras")
+    engine: InferenceEngine | OnnxInferenceEngine
+    if inference_backend == "keras":
+        # Predict via a compiled function with a fixed batch size and image size
+        engine = InferenceEngine(
+            model_for_predict,
+            batch_size=batch_size,
+            jit_compile=conf.predict.getboolean("jit_compile", False),
+        )
+    elif inference_backend == "onnxruntime":
+        if conf.predict.getboolean("onnx_quantized", False):
+            # The quantized model is created by orthoseg_quantize
+            onnx_path = get_onnx_path(
+                best_model["filepath"], decode_head, min_probability, quantized=True
+            )
+            if not onnx_path.exists():
+                raise ValueError(
+                    f"predict.onnx_quantized is True, but {onnx_path} does not "
+                    "exist: run orthoseg_quantize first"
+                )
+        else:
+            # Export the model to ONNX once, next to the model file
+            onnx_path = export_onnx(
+                model_for_predict,
+                onnx_path=get_onnx_path(
+                    best_model["filepath"], decode_head, min_probability
+                ),
+                model_path=best_model["filepath"],
+            )
+        engine = OnnxInferenceEngine(
+            onnx_path,
+            batch_size=batch_size,
+            intra_op_threads=conf.predict.getint("onnx_intra_op_threads", 0),
+            inter_op_threads=conf.predict.getint("onnx_inter_op_threads", 0),
+        )
+    else:
+        raise ValueError(f"invalid predict.inference_backend: {inference_backend}")
+    engine.warm_up((input_height_pred, input_width_pred, model.input_shape[-1]))
+
+    # Prepare params for the inline postprocessing of the prediction
+    postprocess = _get_inline_postprocess()
+    logger.info(f"Inline postprocessing:\n{pprint.pformat(postprocess)}")
+
+    # Prepare the output dirs/paths
+    predict_output_dir = Path(
+        f"{conf.dirs['predict_image_output_basedir']}_{predict_out_subdir}"
+    )
+    output_vector_dir = conf.dirs.getpath("output_vector_dir")
+    output_vector_name = (
+        f"{best_model['basefilename']}_{best_model['epoch']}_{image_layer}"
+    )
+    output_vector_path = output_vector_dir / f"{output_vector_name}.gpkg"
+
+    # Check if we should use an image cache
+    use_cache = image_layer_config.get("use_cache", "yes")
+    mosaic_cache = image_layer_config.get("mosaic_cache")
+    if mosaic_cache is not None:
+        # Tiles are cut from the mosaic cache as from any other image layer
+        if use_cache == "yes" or (use_cache == "ifavailable" and mosaic_cache.exists):
+            if not mosaic_cache.exists:
+                raise ValueError(
+                    f"mosaic cache {mosaic_cache.cache_dir} not found for "
+                    f"{image_layer=}: run load_images first"
+                )
+            logger.info(f"Predict on the mosaic cache in {mosaic_cache.cache_dir}")
+            image_layer_config = {
+                **image_layer_config,
+                "layersources": [mosaic_cache.get_layersource()],
+                "image_pixels_ignore_border": 0,
+            }
+        use_cache = "no"
+    elif use_cache == "ifavailable":
+        use_cache = (
+            "yes" if input_image_dir is not None and input_image_dir.exists() else "no"
+        )
+
+    # Check if the prediction should be distributed over multiple workers
+    distributed = None
+    if conf.predict.getboolean("distributed", False):
+        worker_id = conf.predict.get("distributed_worker_id")
+        distributed = {
+            "worker_id": worker_id if worker_id not in (None, "") else None,
+            "chunk_size": conf.predict.getint("distributed_chunk_size", 1000),
+            "lease_s": conf.predict.getfloat("distributed_lease_s", 900.0),
+        }
+
+    return {
+        "image_layer": image_layer,
+        "image_layer_config": image_layer_config,
+        "input_image_dir": input_image_dir,
+        "use_cache": use_cache,
+        "model_name": model_name,
+        "engine": engine,
+        "preprocess_input": preprocess_input,
+        "classes": hyperparams.architecture.classes,
+        "batch_size": batch_size,
+        "nb_parallel_read": conf.predict.getint("nb_parallel_read", -1),
+        "nb_parallel_postprocess": conf.general.getint("nb_parallel"),
+        "overlap_mode": overlap_mode,
+        # The settings that determine the tiles of the image layer to predict on
+        "tiling": {
+            "image_pixel_width": conf.predict.getint("image_pixel_width"),
+            "image_pixel_height": conf.predict.getint("image_pixel_height"),
+            "image_pixel_x_size": conf.predict.getfloat("image_pixel_x_size"),
+            "image_pixel_y_size": conf.predict.getfloat("image_pixel_y_size"),
+            "image_pixels_overlap": overlap,
+        },
+        "output_image_dir": predict_output_dir,
+        "output_vector_path": output_vector_path,
+        "distributed": distributed,
+        # The other arguments for the predict_dir/predict_layer functions
+        "predict_kwargs": {
+            "min_probability": min_probability,
+            "postprocess": postprocess,
+            "projection_if_missing": image_layer_config["projection"],
+            "input_mask_dir": None,
+            "cancel_filepath": conf.files.getpath("cancel_filepath"),
+            "max_prediction_errors": conf.predict.getint("max_prediction_errors"),
+            "vector_write_batch_size": conf.predict.getint(
+                "vector_write_batch_size", 50000
+            ),
+            "prescreen": conf.predict.getboolean("prescreen", True),
+        },
+    }
+
+
+def _cleanup():
+    """Cleanup the old models, training data and predictions for the config read."""
+    cleanup.clean_models(
+        model_dir=conf.dirs.getpath("model_dir"),
+        versions_to_retain=conf.cleanup.getint("model_versions_to_retain"),
+        simulate=conf.cleanup.getboolean("simulate"),
+    )
+    cleanup.clean_training_data_directories(
+        training_dir=conf.dirs.getpath("training_dir"),
+        versions_to_retain=conf.cleanup.getint("training_versions_to_retain"),
+        simulate=conf.cleanup.getboolean("simulate"),
+    )
+    cleanup.clean_predictions(
+        output_vector_dir=conf.dirs.getpath("output_vector_dir"),
+        versions_to_retain=conf.cleanup.getint("prediction_versions_to_retain"),
+        simulate=conf.cleanup.getboolean("simulate"),
+    )
+
+
+def _create_predictor(prediction: dict[str, Any]) -> predicter.Predictor:
+    """Create the predictor session for a prediction loaded with _load_prediction.
+
+    Args:
+        prediction (dict[str, Any]): the prediction as loaded by _load_prediction.
+
+    Returns:
+        predicter.Predictor: the predictor session.
+    """
+    return predicter.Predictor(
+        model=prediction["engine"],
+        preprocess_input=prediction["preprocess_input"],
+        classes=prediction["classes"],
+        batch_size=prediction["batch_size"],
+        nb_parallel_read=prediction["nb_parallel_read"],
+        nb_parallel_postprocess=prediction["nb_parallel_postprocess"],
+    )
+
+
+def _run_prediction(
+    predictor: predicter.Predictor, prediction: dict[str, Any], ssl_verify: bool | str
+) -> bool:
+    """Run a prediction loaded with _load_prediction on its own.
+
+    Args:
+        predictor (predicter.Predictor): the predictor session to use.
+        prediction (dict[str, Any]): the prediction as loaded by _load_prediction.
+        ssl_verify (bool or str): the ssl_verify to use to read the image layer.
+
+    Returns:
+        bool: False if the prediction is distributed and it was cancelled or other
+            workers complete it, otherwise True.
+    """
+    overlap_mode = prediction["overlap_mode"]
+    if prediction["distributed"] is not None:
+        if prediction["use_cache"] == "yes" or overlap_mode != "ignore_border":
+            raise ValueError(
+                "predict.distributed is only supported when predicting directly on "
+                "an image layer, without image cache, with overlap_mode ignore_border"
+            )
+        # Predict the chunks of the image layer leased by this worker
+        return predictor.predict_layer_distributed(
+            image_layer_config=prediction["image_layer_config"],
+            output_image_dir=prediction["output_image_dir"],
+            output_vector_path=prediction["output_vector_path"],
+            ssl_verify=ssl_verify,
+            **prediction["distributed"],
+            **prediction["tiling"],
+            **prediction["predict_kwargs"],
+        )
+    elif prediction["use_cache"] == "yes":
+        if overlap_mode != "ignore_border":
+            logger.warning(
+                f"predict.overlap_mode = {overlap_mode} is not supported when "
+                "predicting on cached images, so ignore_border is used"
+            )
+        # Predict from a directory with (cached) images
+        predictor.predict_dir(
+            input_image_dir=prediction["input_image_dir"],
+            output_image_dir=prediction["output_image_dir"],
+            output_vector_path=prediction["output_vector_path"],
+            border_pixels_to_ignore=prediction["tiling"]["image_pixels_overlap"],
+            **prediction["predict_kwargs"],
+        )
+    else:
+        # Predict directly from an image/layer
+        predictor.predict_layer(
+            image_layer_config=prediction["image_layer_config"],
+            output_image_dir=prediction["output_image_dir"],
+            output_vector_path=prediction["output_vector_path"],
+            ssl_verify=ssl_verify,
+            overlap_mode=overlap_mode,
+            **prediction["tiling"],
+            **prediction["predict_kwargs"],
+        )
+
+    return True
+
+
 def predict(config_path: Path, config_overrules: list[str] | None = None):
     """Run a prediction for the config specified.
 
@@ -77,280 +516,161 @@ def predict(config_path: Path, config_overrules: list[str] | None = None):
     model_name = None
 
     try:
-        # Read some config, and check if values are ok
         image_layer = conf.predict["image_layer"]
-        image_layer_config = conf.image_layers.get(image_layer)
-        if image_layer_config is None:
-            raise ValueError(f"{image_layer=} is not configured in image_layers")
-
-        input_image_dir = conf.dirs.getpath("predict_image_input_dir")
-
-        # Create base filename of model to use
-        # TODO: is force data version the most logical, or rather implement
-        #       force weights file or ?
-        traindata_id = None
-        force_model_traindata_id = conf.train.getint("force_model_traindata_id")
-        if force_model_traindata_id is not None and force_model_traindata_id > -1:
-            traindata_id = force_model_traindata_id
-
-        # Get the best model that already exists for this train dataset,...
-        architecture_id = conf.model.getint("architecture_id")
-        trainparams_id = conf.train.getint("trainparams_id")
-        best_model = mh.get_best_model(
-            model_dir=conf.dirs.getpath("model_dir"),
-            segment_subject=conf.general["segment_subject"],
-            traindata_id=traindata_id,
-            architecture_id=architecture_id,
-            trainparams_id=trainparams_id,
-        )
+        prediction = _load_prediction()
+        model_name = prediction["model_name"]
 
-        # Check if a model was found
-        if best_model is None:
-            message = (
-                f"No model found in model_dir: {conf.dirs.getpath('model_dir')} for "
-                f"traindata_id: {traindata_id}, architecture_id: {architecture_id}, "
-                f"trainparams_id: {trainparams_id}"
+        # Start predict for entire dataset
+        # --------------------------------
+        # Send email
+        email_helper.sendmail(f"Start predict for {model_name} on {image_layer}")
+
+        # Predict!
+        with _create_predictor(prediction) as predictor:
+            complete = _run_prediction(
+                predictor, prediction, ssl_verify=conf.general.get("ssl_verify", True)
             )
-            logger.critical(message)
-            raise RuntimeError(message)
-        else:
-            model_weights_filepath = best_model["filepath"]
-            logger.info(f"Best model found: {model_weights_filepath}")
+        if not complete:
+            logger.info(
+                f"Stopped predict for {model_name} on {image_layer}: it was "
+                "cancelled or other workers complete the distributed prediction"
+            )
+            return
 
-        model_name = best_model["basefilename"]
+        # Log and send mail
+        message = f"Completed predict for {model_name} on {image_layer}"
+        logger.info(message)
+        email_helper.sendmail(message)
 
-        # Load the hyperparams of the model
-        # TODO: move the hyperparams filename formatting to get_models...
-        hyperparams_path = (
-            best_model["filepath"].parent
-            / f"{best_model['basefilename']}_hyperparams.json"
-        )
-        hyperparams = mh.HyperParams(path=hyperparams_path)
-
-        # Validate the image prediction size for the model architecture
-        overlap = conf.predict.getint("image_pixels_overlap", 0)
-        input_width_pred = conf.predict.getint("image_pixel_width") + 2 * overlap
-        input_height_pred = conf.predict.getint("image_pixel_height") + 2 * overlap
-        mf.check_image_size(
-            architecture=hyperparams.architecture.architecture,
-            input_width=input_width_pred,
-            input_height=input_height_pred,
+        # Cleanup old data
+        _cleanup()
+    except Exception as ex:
+        if model_name is None:
+            model_name = config_path.name
+        message = f"ERROR in predict for {model_name} on {image_layer}"
+        logger.exception(message)
+        email_helper.sendmail(
+            subject=message, body=f"Exception: {ex}\n\n {traceback.format_exc()}"
         )
+        raise RuntimeError(f"{message}: {ex}") from ex
+    finally:
+        conf.remove_run_tmp_dir()
 
-        # Prepare output subdir to be used for predictions
-        predict_out_subdir = best_model["basefilename"]
-        if trainparams_id > 0:
-            predict_out_subdir += f"_{trainparams_id}"
-        predict_out_subdir += f"_{best_model['epoch']}"
-
-        # Load model to predict with
-        # --------------------------
-        model = None
-        # Try optimizing model with tensorrt. Not supported on Windows
-        # -> disabled for now till I have access again to a linux machine
-        """
-        if os.name != "nt":
-            try:
-                # Try import
-                from tensorflow.python.compiler.tensorrt import trt_convert as trt
-
-                # Import didn't fail, so optimize model
-                logger.info(
-                    "Tensorrt is available, so try to create and use optimized model"
-                )
-                savedmodel_optim_dir = (
-                    best_model["filepath"].parent
-                    / f"{best_model['filepath'].stem}_optim"
-                )
-                if not savedmodel_optim_dir.exists():
-                    # If base model not yet in savedmodel format
-                    savedmodel_dir = (
-                        best_model["filepath"].parent / best_model["filepath"].stem
-                    )
-                    if not savedmodel_dir.exists():
-                        logger.info(
-                            f"SavedModel format not yet available, so load "
-                            f"model + weights from {best_model['filepath']}"
-                        )
-                        model = mf.load_model(best_model["filepath"], compile=False)
-                        logger.info(f"Now save again as savedmodel to {savedmodel_dir}")
-                        tf.saved_model.save(model, str(savedmodel_dir))
-                        model = None
-
-                    # Now optimize model
-                    logger.info(f"Optimize + save model to {savedmodel_optim_dir}")
-                    converter = trt.TrtGraphConverterV2(
-                        input_saved_model_dir=str(savedmodel_dir),
-                        is_dynamic_op=True,
-                        precision_mode="FP16",
-                    )
-                    converter.convert()
-                    converter.save(savedmodel_optim_dir)
 
-                logger.info(
-                    f"Load optimized model + weights from {savedmodel_optim_dir}"
-                )
-                model = tf.keras.models.load_model(str(savedmodel_optim_dir))
-
-            except ImportError:
-                logger.info("Tensorrt is not available, so load unoptimized model")
-            except Exception as ex:
-                logger.info(
-                    "An error occured trying to use tensorrt, "
-                    f"so load unoptimized model. Error: {ex}"
-                )
-        """
+def predict_multi(config_paths: list[Path], config_overrules: list[str] | None = None):
+    """Run the predictions for multiple configs in one pass over the image layer.
 
-        # If model isn't loaded yet... load!
-        if model is None:
-            model, preprocess_input = mf.load_model(
-                best_model["filepath"], compile_model=False
-            )
+    All configs should predict on the same image layer, with the same tile size, pixel
+    size and overlap. Each image is then only read once and passed to the models of all
+    configs. Each prediction is written to its own output, postprocessed as configured
+    in its config.
 
-        # Prepare the model for predicting
-        nb_gpu = mh.get_number_gpus()
-        batch_size = conf.predict.getint("batch_size")
-        if nb_gpu <= 1:
-            model_for_predict = model
-            logger.info(f"Predict using single GPU or CPU, with nb_gpu: {nb_gpu}")
-        else:
-            # If multiple GPU's available, create multi_gpu_model
-            try:
-                model_for_predict = model
-                logger.warning(
-                    "Predict using multiple GPUs NOT IMPLEMENTED AT THE MOMENT"
-                )
+    If the images are read from an image cache, the predictions are run one after the
+    other.
 
-                # logger.info(
-                #     f"Predict using multiple GPUs: {nb_gpu}, batch size becomes: "
-                #     f"{batch_size*nb_gpu}"
-                # )
-                # batch_size *= nb_gpu
-            except ValueError:
-                logger.info("Predict using single GPU or CPU")
-                model_for_predict = model
-
-        # Prepare params for the inline postprocessing of the prediction
-        min_probability = conf.predict.getfloat("min_probability")
-        postprocess: dict[str, Any] = {}
-        simplify_algorithm = conf.predict.get("simplify_algorithm")
-        if simplify_algorithm is not None and simplify_algorithm != (""):
-            postprocess["simplify"] = {}
-            simplify = postprocess["simplify"]
-
-            simplify["simplify_algorithm"] = simplify_algorithm
-            simplify["simplify_tolerance"] = conf.predict.geteval("simplify_tolerance")
-            simplify["simplify_lookahead"] = conf.predict.getint("simplify_lookahead")
-            simplify["simplify_topological"] = conf.predict.getboolean_ext(
-                "simplify_topological"
-            )
-        postprocess["filter_background_modal_size"] = conf.predict.getint(
-            "filter_background_modal_size"
-        )
-        query = conf.predict.get("reclassify_to_neighbour_query")
-        if query is not None:
-            query = query.replace("\n", " ")
-        postprocess["reclassify_to_neighbour_query"] = query
-        logger.info(f"Inline postprocessing:\n{pprint.pformat(postprocess)}")
-
-        # Prepare the output dirs/paths
-        predict_output_dir = Path(
-            f"{conf.dirs['predict_image_output_basedir']}_{predict_out_subdir}"
-        )
-        output_vector_dir = conf.dirs.getpath("output_vector_dir")
-        output_vector_name = (
-            f"{best_model['basefilename']}_{best_model['epoch']}_{image_layer}"
-        )
-        output_vector_path = output_vector_dir / f"{output_vector_name}.gpkg"
+    Args:
+        config_paths (list[Path]): Paths to the config files to use.
+        config_overrules (list[str], optional): list of config options that will
+            overrule other ways to supply configuration for all configs. They should be
+            specified in the form of "<section>.<key>=<value>". Defaults to None.
+    """
+    if len(config_paths) == 0:
+        raise ValueError("config_paths is empty")
 
-        # Start predict for entire dataset
-        # --------------------------------
-        # Send email
-        email_helper.sendmail(f"Start predict for {model_name} on {image_layer}")
+    # Init
+    # The logging is done in the log dir of the first config
+    conf.read_orthoseg_config(config_paths[0], overrules=config_overrules)
 
-        # Check if we should use an image cache
-        use_cache = image_layer_config.get("use_cache", "yes")
-        if use_cache == "ifavailable":
-            use_cache = (
-                "yes"
-                if input_image_dir is not None and input_image_dir.exists()
-                else "no"
-            )
+    # Init logging
+    log_util.clean_log_dir(
+        log_dir=conf.dirs.getpath("log_dir"),
+        nb_logfiles_tokeep=conf.logging_conf.getint("nb_logfiles_tokeep"),
+    )
+    global logger  # noqa: PLW0603
+    logger = log_util.main_log_init(conf.dirs.getpath("log_dir"), __name__)
+    logger.info(f"Start predict for configs {[path.stem for path in config_paths]}")
+    model_names = [path.name for path in config_paths]
+    image_layer = conf.predict["image_layer"]
 
-        # Predict!
-        if use_cache == "yes":
-            # Predict from a directory with (cached) images
-            predicter.predict_dir(
-                model=model_for_predict,
-                preprocess_input=preprocess_input,
-                input_image_dir=input_image_dir,
-                output_image_dir=predict_output_dir,
-                output_vector_path=output_vector_path,
-                classes=hyperparams.architecture.classes,
-                min_probability=min_probability,
-                postprocess=postprocess,
-                border_pixels_to_ignore=conf.predict.getint("image_pixels_overlap"),
-                projection_if_missing=image_layer_config["projection"],
-                input_mask_dir=None,
-                batch_size=batch_size,
-                evaluate_mode=False,
-                cancel_filepath=conf.files.getpath("cancel_filepath"),
-                nb_parallel_read=conf.predict.getint("nb_parallel_read", -1),
-                nb_parallel_postprocess=conf.general.getint("nb_parallel"),
-                max_prediction_errors=conf.predict.getint("max_prediction_errors"),
-            )
-        else:
-            # Predict directly from an image/layer
-            predicter.predict_layer(
-                model=model_for_predict,
-                preprocess_input=preprocess_input,
-                image_layer_config=image_layer_config,
-                image_pixel_width=conf.predict.getint("image_pixel_width"),
-                image_pixel_height=conf.predict.getint("image_pixel_height"),
-                image_pixel_x_size=conf.predict.getfloat("image_pixel_x_size"),
-                image_pixel_y_size=conf.predict.getfloat("image_pixel_y_size"),
-                image_pixels_overlap=conf.predict.getint("image_pixels_overlap", 0),
-                output_image_dir=predict_output_dir,
-                output_vector_path=output_vector_path,
-                classes=hyperparams.architecture.classes,
-                min_probability=min_probability,
-                postprocess=postprocess,
-                projection_if_missing=image_layer_config["projection"],
-                input_mask_dir=None,
-                batch_size=batch_size,
-                evaluate_mode=False,
-                cancel_filepath=conf.files.getpath("cancel_filepath"),
-                ssl_verify=conf.general.get("ssl_verify", True),
-                nb_parallel_read=conf.predict.getint("nb_parallel_read", -1),
-                nb_parallel_postprocess=conf.general.getint("nb_parallel"),
-                max_prediction_errors=conf.predict.getint("max_prediction_errors"),
+    try:
+        with ExitStack() as stack:
+            # Load the models and settings of all configs
+            predictions = []
+            ssl_verify = conf.general.get("ssl_verify", True)
+            for config_path in config_paths:
+                conf.read_orthoseg_config(config_path, overrules=config_overrules)
+                logger.debug(
+                    f"Config used for {config_path.stem}: \n{conf.pformat_config()}"
+                )
+                prediction = _load_prediction()
+                prediction["predictor"] = stack.enter_context(
+                    _create_predictor(prediction)
+                )
+                predictions.append(prediction)
+
+            model_names = [prediction["model_name"] for prediction in predictions]
+            if any(prediction["distributed"] is not None for prediction in predictions):
+                raise ValueError(
+                    "predict.distributed is not supported when predicting multiple "
+                    "configs in one pass"
+                )
+            for config_path, prediction in zip(config_paths, predictions, strict=True):
+                if (
+                    prediction["image_layer"] != image_layer
+                    or prediction["tiling"] != predictions[0]["tiling"]
+                ):
+                    raise ValueError(
+                        "all configs should use the same predict.image_layer, image "
+                        "pixel width, height, size and overlap, but they differ for "
+                        f"{config_path.name}"
+                    )
+
+            # Start predict for entire dataset
+            # --------------------------------
+            # Send email
+            email_helper.sendmail(
+                f"Start predict for {', '.join(model_names)} on {image_layer}"
             )
 
+            if any(prediction["use_cache"] == "yes" for prediction in predictions):
+                # Reading cached images is cheap, so just predict one by one
+                logger.info("Images are read from the image cache: predict one by one")
+                for prediction in predictions:
+                    _run_prediction(
+                        prediction["predictor"], prediction, ssl_verify=ssl_verify
+                    )
+            else:
+                # Predict all models while reading each image only once
+                predict_kwargs = []
+                for prediction in predictions:
+                    kwargs = {
+                        "predictor": prediction["predictor"],
+                        "output_image_dir": prediction["output_image_dir"],
+                        "output_vector_path": prediction["output_vector_path"],
+                        "overlap_mode": prediction["overlap_mode"],
+                        **prediction["predict_kwargs"],
+                    }
+                    del kwargs["prescreen"]
+                    predict_kwargs.append(kwargs)
+                predicter.predict_layer_multi(
+                    predictions=predict_kwargs,
+                    image_layer_config=predictions[0]["image_layer_config"],
+                    prescreen=predictions[0]["predict_kwargs"]["prescreen"],
+                    ssl_verify=ssl_verify,
+                    **predictions[0]["tiling"],
+                )
+
         # Log and send mail
-        message = f"Completed predict for {model_name} on {image_layer}"
+        message = f"Completed predict for {', '.join(model_names)} on {image_layer}"
         logger.info(message)
         email_helper.sendmail(message)
 
         # Cleanup old data
-        cleanup.clean_models(
-            model_dir=conf.dirs.getpath("model_dir"),
-            versions_to_retain=conf.cleanup.getint("model_versions_to_retain"),
-            simulate=conf.cleanup.getboolean("simulate"),
-        )
-        cleanup.clean_training_data_directories(
-            training_dir=conf.dirs.getpath("training_dir"),
-            versions_to_retain=conf.cleanup.getint("training_versions_to_retain"),
-            simulate=conf.cleanup.getboolean("simulate"),
-        )
-        cleanup.clean_predictions(
-            output_vector_dir=conf.dirs.getpath("output_vector_dir"),
-            versions_to_retain=conf.cleanup.getint("prediction_versions_to_retain"),
-            simulate=conf.cleanup.getboolean("simulate"),
-        )
+        for config_path in config_paths:
+            conf.read_orthoseg_config(config_path, overrules=config_overrules)
+            _cleanup()
     except Exception as ex:
-        if model_name is None:
-            model_name = config_path.name
-        message = f"ERROR in predict for {model_name} on {image_layer}"
+        message = f"ERROR in predict for {', '.join(model_names)} on {image_layer}"
         logger.exception(message)
         email_helper.sendmail(
             subject=message, body=f"Exception: {ex}\n\n {traceback.format_exc()}"
@@ -367,7 +687,16 @@ def main():
         args = _predict_args(sys.argv[1:])
 
         # Run!
-        predict(config_path=Path(args.config), config_overrules=args.config_overrules)
+        if len(args.config) == 1:
+            predict(
+                config_path=Path(args.config[0]),
+                config_overrules=args.config_overrules,
+            )
+        else:
+            predict_multi(
+                config_paths=[Path(config) for config in args.config],
+                config_overrules=args.config_overrules,
+            )
     except Exception as ex:
         logger.exception(f"Error: {ex}")
         raise
@@ -0,0 +1,195 @@
+"""High-level API to quantize the model of a project to int8."""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import orthoseg.model.model_factory as mf
+import orthoseg.model.model_helper as mh
+from orthoseg.helpers import config_helper as conf
+from orthoseg.model import model_quantizer
+from orthoseg.model.inference_engine import export_onnx, get_onnx_path
+from orthoseg.util import log_util
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+
+def _quantize_args(args) -> argparse.Namespace:
+    # Interprete arguments
+    parser = argparse.ArgumentParser(add_help=False)
+
+    # Required arguments
+    required = parser.add_argument_group("Required arguments")
+    required.add_argument(
+        "-c", "--config", type=str, required=True, help="The config file to use"
+    )
+
+    # Optional arguments
+    optional = parser.add_argument_group("Optional arguments")
+    # Add back help
+    optional.add_argument(
+        "-h",
+        "--help",
+        action="help",
+        default=argparse.SUPPRESS,
+        help="Show this help message and exit",
+    )
+    optional.add_argument(
+        "-n",
+        "--nb_calibration_tiles",
+        type=int,
+        default=100,
+        help="The maximum number of training tiles to calibrate on. Defaults to 100.",
+    )
+    optional.add_argument(
+        "config_overrules",
+        nargs="*",
+        help=(
+            "Supply any number of config overrules like this: <section>.<key>=<value>"
+        ),
+    )
+
+    return parser.parse_args(args)
+
+
+def quantize(
+    config_path: Path,
+    nb_calibration_tiles: int = 100,
+    config_overrules: list[str] | None = None,
+) -> Path:
+    """Quantize the model that would be used to predict for the config to int8.
+
+    The model is exported to ONNX and quantized with onnxruntime, calibrating the
+    activations on a sample of the training tiles of the model. The IoU per class of
+    the quantized model on the validation tiles is compared with the one of the float
+    model and logged.
+
+    The quantized model is saved next to the model file. Set
+    ``predict.inference_backend = onnxruntime`` and ``predict.onnx_quantized = True``
+    to predict with it.
+
+    Args:
+        config_path (Path): Path to the config file to use.
+        nb_calibration_tiles (int, optional): the maximum number of training tiles to
+            calibrate on. Defaults to 100.
+        config_overrules (list[str], optional): list of config options that will
+            overrule other ways to supply configuration. They should be specified in the
+            form of "<section>.<key>=<value>". Defaults to None.
+
+    Returns:
+        Path: the path to the quantized model.
+    """
+    # Init
+    conf.read_orthoseg_config(config_path, overrules=config_overrules)
+
+    global logger  # noqa: PLW0603
+    logger = log_util.main_log_init(conf.dirs.getpath("log_dir"), __name__)
+    logger.info(f"Start quantize for config {config_path.stem}")
+
+    try:
+        # Get the model that would be used to predict
+        traindata_id = None
+        force_model_traindata_id = conf.train.getint("force_model_traindata_id")
+        if force_model_traindata_id is not None and force_model_traindata_id > -1:
+            traindata_id = force_model_traindata_id
+        best_model = mh.get_best_model(
+            model_dir=conf.dirs.getpath("model_dir"),
+            segment_subject=conf.general["segment_subject"],
+            traindata_id=traindata_id,
+            architecture_id=conf.model.getint("architecture_id"),
+            trainparams_id=conf.train.getint("trainparams_id"),
+        )
+        if best_model is None:
+            raise RuntimeError(
+                f"No model found in model_dir: {conf.dirs.getpath('model_dir')}"
+            )
+        logger.info(f"Best model found: {best_model['filepath']}")
+        hyperparams_path = (
+            best_model["filepath"].parent
+            / f"{best_model['basefilename']}_hyperparams.json"
+        )
+        hyperparams = mh.HyperParams(path=hyperparams_path)
+
+        # Export the model, with the decode head used to predict, to ONNX
+        model, preprocess_input = mf.load_model(
+            best_model["filepath"], compile_model=False
+        )
+        decode_head = conf.predict.get("decode_head", "none")
+        min_probability = conf.predict.getfloat("min_probability")
+        model = mf.add_decode_head(
+            model, decode_head=decode_head, min_probability=min_probability
+        )
+        onnx_path = export_onnx(
+            model,
+            onnx_path=get_onnx_path(
+                best_model["filepath"], decode_head, min_probability
+            ),
+            model_path=best_model["filepath"],
+        )
+
+        # Quantize, calibrating on the training tiles of the model
+        training_dir = (
+            conf.dirs.getpath("training_dir") / f"{best_model['traindata_id']:02d}"
+        )
+        quantized_onnx_path = model_quantizer.quantize_model(
+            onnx_path=onnx_path,
+            output_path=get_onnx_path(
+                best_model["filepath"], decode_head, min_probability, quantized=True
+            ),
+            calibration_image_dir=training_dir / "train" / "image",
+            preprocess_input=preprocess_input,
+            nb_calibration_tiles=nb_calibration_tiles,
+        )
+
+        # Report the impact of the quantization on the validation tiles
+        iou_df = model_quantizer.compare_iou(
+            onnx_path=onnx_path,
+            quantized_onnx_path=quantized_onnx_path,
+            image_dir=training_dir / "validation" / "image",
+            mask_dir=training_dir / "validation" / "mask",
+            classes=list(hyperparams.architecture.classes),
+            preprocess_input=preprocess_input,
+            min_probability=min_probability,
+            batch_size=conf.predict.getint("batch_size"),
+        )
+        logger.info(
+            f"IoU on the validation tiles before and after quantization:\n{iou_df}"
+        )
+        logger.info(
+            f"Quantized model written to {quantized_onnx_path}, set "
+            "predict.inference_backend = onnxruntime and "
+            "predict.onnx_quantized = True to use it"
+        )
+
+        return quantized_onnx_path
+
+    except Exception as ex:
+        message = f"ERROR in quantize for {config_path.name}"
+        logger.exception(message)
+        raise RuntimeError(f"{message}: {ex}") from ex
+    finally:
+        conf.remove_run_tmp_dir()
+
+
+def main():
+    """Run quantize."""
+    try:
+        # Interprete arguments
+        args = _quantize_args(sys.argv[1:])
+
+        # Run!
+        quantize(
+            config_path=Path(args.config),
+            nb_calibration_tiles=args.nb_calibration_tiles,
+            config_overrules=args.config_overrules,
+        )
+    except Exception as ex:
+        logger.exception(f"Error: {ex}")
+        raise
+
+
+# If the script is ran directly...
+if __name__ == "__main__":
+    main()
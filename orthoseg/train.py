@@ -245,45 +245,28 @@ def train(config_path: Path, config_overrules: list[str] | None = None):
                     # Prepare output subdir to be used for predictions
                     predict_out_subdir = best_recent_model["filepath"].stem
 
-                    # Predict training dataset
-                    predicter.predict_dir(
+                    # Predict training and validation dataset
+                    with predicter.Predictor(
                         model=best_model,
                         preprocess_input=preprocess_input,
-                        input_image_dir=traindata_dir / "image",
-                        output_image_dir=traindata_dir / predict_out_subdir,
-                        output_vector_path=None,
-                        projection_if_missing=train_projection,
-                        input_mask_dir=traindata_dir / "mask",
-                        batch_size=conf.train.getint("batch_size_predict"),
-                        evaluate_mode=True,
                         classes=best_hyperparams.architecture.classes,
-                        min_probability=min_probability,
-                        cancel_filepath=conf.files.getpath("cancel_filepath"),
-                        nb_parallel_postprocess=nb_parallel_postprocess,
-                        max_prediction_errors=conf.predict.getint(
-                            "max_prediction_errors"
-                        ),
-                    )
-
-                    # Predict validation dataset
-                    predicter.predict_dir(
-                        model=best_model,
-                        preprocess_input=preprocess_input,
-                        input_image_dir=validationdata_dir / "image",
-                        output_image_dir=validationdata_dir / predict_out_subdir,
-                        output_vector_path=None,
-                        projection_if_missing=train_projection,
-                        input_mask_dir=validationdata_dir / "mask",
                         batch_size=conf.train.getint("batch_size_predict"),
-                        evaluate_mode=True,
-                        classes=best_hyperparams.architecture.classes,
-                        min_probability=min_probability,
-                        cancel_filepath=conf.files.getpath("cancel_filepath"),
                         nb_parallel_postprocess=nb_parallel_postprocess,
-                        max_prediction_errors=conf.predict.getint(
-                            "max_prediction_errors"
-                        ),
-                    )
+                    ) as predictor:
+                        for data_dir in [traindata_dir, validationdata_dir]:
+                            predictor.predict_dir(
+                                input_image_dir=data_dir / "image",
+                                output_image_dir=data_dir / predict_out_subdir,
+                                output_vector_path=None,
+                                projection_if_missing=train_projection,
+                                input_mask_dir=data_dir / "mask",
+                                evaluate_mode=True,
+                                min_probability=min_probability,
+                                cancel_filepath=conf.files.getpath("cancel_filepath"),
+                                max_prediction_errors=conf.predict.getint(
+                                    "max_prediction_errors"
+                                ),
+                            )
                     del best_model
                 except Exception as ex:
                     logger.warning(f"Exception trying to predict with old model: {ex}")
@@ -349,82 +332,61 @@ def train(config_path: Path, config_overrules: list[str] | None = None):
         # Prepare output subdir to be used for predictions
         predict_out_subdir = best_model_curr_train_version["filepath"].stem
 
-        # Predict training dataset
-        predicter.predict_dir(
+        # Predict the train,... datasets with one predictor, so the model and the
+        # worker pools are reused
+        with predicter.Predictor(
             model=model,
             preprocess_input=preprocess_input,
-            input_image_dir=traindata_dir / "image",
-            output_image_dir=traindata_dir / predict_out_subdir,
-            output_vector_path=None,
-            projection_if_missing=train_projection,
-            input_mask_dir=traindata_dir / "mask",
-            batch_size=conf.train.getint("batch_size_predict"),
-            evaluate_mode=True,
             classes=classes,
-            min_probability=min_probability,
-            cancel_filepath=conf.files.getpath("cancel_filepath"),
-            nb_parallel_postprocess=nb_parallel_postprocess,
-            max_prediction_errors=conf.predict.getint("max_prediction_errors"),
-        )
-
-        # Predict validation dataset
-        predicter.predict_dir(
-            model=model,
-            preprocess_input=preprocess_input,
-            input_image_dir=validationdata_dir / "image",
-            output_image_dir=validationdata_dir / predict_out_subdir,
-            output_vector_path=None,
-            projection_if_missing=train_projection,
-            input_mask_dir=validationdata_dir / "mask",
             batch_size=conf.train.getint("batch_size_predict"),
-            evaluate_mode=True,
-            classes=classes,
-            min_probability=min_probability,
-            cancel_filepath=conf.files.getpath("cancel_filepath"),
             nb_parallel_postprocess=nb_parallel_postprocess,
-            max_prediction_errors=conf.predict.getint("max_prediction_errors"),
-        )
+        ) as predictor:
+            # Predict training and validation dataset
+            for data_dir in [traindata_dir, validationdata_dir]:
+                predictor.predict_dir(
+                    input_image_dir=data_dir / "image",
+                    output_image_dir=data_dir / predict_out_subdir,
+                    output_vector_path=None,
+                    projection_if_missing=train_projection,
+                    input_mask_dir=data_dir / "mask",
+                    evaluate_mode=True,
+                    min_probability=min_probability,
+                    cancel_filepath=conf.files.getpath("cancel_filepath"),
+                    max_prediction_errors=conf.predict.getint("max_prediction_errors"),
+                )
 
-        # Predict test dataset, if it exists
-        if testdata_dir is not None and testdata_dir.exists():
-            predicter.predict_dir(
-                model=model,
-                preprocess_input=preprocess_input,
-                input_image_dir=testdata_dir / "image",
-                output_image_dir=testdata_dir / predict_out_subdir,
-                output_vector_path=None,
-                projection_if_missing=train_projection,
-                input_mask_dir=testdata_dir / "mask",
-                batch_size=conf.train.getint("batch_size_predict"),
-                evaluate_mode=True,
-                classes=classes,
-                min_probability=min_probability,
-                cancel_filepath=conf.files.getpath("cancel_filepath"),
-                nb_parallel_postprocess=nb_parallel_postprocess,
-                max_prediction_errors=conf.predict.getint("max_prediction_errors"),
-                no_images_ok=True,
-            )
+            # Predict test dataset, if it exists
+            if testdata_dir is not None and testdata_dir.exists():
+                predictor.predict_dir(
+                    input_image_dir=testdata_dir / "image",
+                    output_image_dir=testdata_dir / predict_out_subdir,
+                    output_vector_path=None,
+                    projection_if_missing=train_projection,
+                    input_mask_dir=testdata_dir / "mask",
+                    evaluate_mode=True,
+                    min_probability=min_probability,
+                    cancel_filepath=conf.files.getpath("cancel_filepath"),
+                    max_prediction_errors=conf.predict.getint("max_prediction_errors"),
+                    no_images_ok=True,
+                )
 
-        # Predict extra test dataset with random images in the roi, to add to
-        # train and/or validation dataset if inaccuracies are found
-        # -> this is very useful to find false positives to improve the datasets
-        if conf.dirs.getpath("predictsample_image_input_dir").exists():
-            predicter.predict_dir(
-                model=model,
-                preprocess_input=preprocess_input,
-                input_image_dir=conf.dirs.getpath("predictsample_image_input_dir"),
-                output_image_dir=conf.dirs.getpath("predictsample_image_output_basedir")
-                / predict_out_subdir,
-                output_vector_path=None,
-                projection_if_missing=train_projection,
-                batch_size=conf.train.getint("batch_size_predict"),
-                evaluate_mode=True,
-                classes=classes,
-                min_probability=min_probability,
-                cancel_filepath=conf.files.getpath("cancel_filepath"),
-                nb_parallel_postprocess=nb_parallel_postprocess,
-                max_prediction_errors=conf.predict.getint("max_prediction_errors"),
-            )
+            # Predict extra test dataset with random images in the roi, to add to
+            # train and/or validation dataset if inaccuracies are found
+            # -> this is very useful to find false positives to improve the datasets
+            if conf.dirs.getpath("predictsample_image_input_dir").exists():
+                predictor.predict_dir(
+                    input_image_dir=conf.dirs.getpath("predictsample_image_input_dir"),
+                    output_image_dir=conf.dirs.getpath(
+                        "predictsample_image_output_basedir"
+                    )
+                    / predict_out_subdir,
+                    output_vector_path=None,
+                    projection_if_missing=train_projection,
+                    evaluate_mode=True,
+                    min_probability=min_probability,
+                    cancel_filepath=conf.files.getpath("cancel_filepath"),
+                    max_prediction_errors=conf.predict.getint("max_prediction_errors"),
+                )
 
         # Free resources...
         logger.debug("Free resources")
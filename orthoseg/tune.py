@@ -0,0 +1,274 @@
+"""High-level API to tune the prediction settings for the current machine."""
+
+import argparse
+import configparser
+import logging
+import platform
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import psutil
+
+import orthoseg.model.model_factory as mf
+import orthoseg.model.model_helper as mh
+from orthoseg.helpers import config_helper as conf
+from orthoseg.lib import predict_tuner
+from orthoseg.predict import _get_inline_postprocess
+from orthoseg.util import log_util
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# The tile sizes, without overlap, that are tried besides the configured one
+TILE_SIZES = (512, 1024, 2048)
+
+
+def _tune_args(args) -> argparse.Namespace:
+    # Interprete arguments
+    parser = argparse.ArgumentParser(add_help=False)
+
+    # Required arguments
+    required = parser.add_argument_group("Required arguments")
+    required.add_argument(
+        "-c", "--config", type=str, required=True, help="The config file to use"
+    )
+
+    # Optional arguments
+    optional = parser.add_argument_group("Optional arguments")
+    # Add back help
+    optional.add_argument(
+        "-h",
+        "--help",
+        action="help",
+        default=argparse.SUPPRESS,
+        help="Show this help message and exit",
+    )
+    optional.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help=(
+            "The config file to write the tuned settings to. Defaults to "
+            "<config>_tuned.ini next to the config file."
+        ),
+    )
+    optional.add_argument(
+        "-m",
+        "--memory_budget",
+        type=float,
+        default=None,
+        help=(
+            "The memory in GB the prediction can use. Defaults to 80%% of the memory "
+            "available."
+        ),
+    )
+    optional.add_argument(
+        "-t",
+        "--tile_sizes",
+        type=str,
+        default=None,
+        help=(
+            "Comma separated tile sizes in pixels, without overlap, to try. Defaults "
+            f"to the configured tile size and {','.join(str(s) for s in TILE_SIZES)}."
+        ),
+    )
+    optional.add_argument(
+        "config_overrules",
+        nargs="*",
+        help=(
+            "Supply any number of config overrules like this: <section>.<key>=<value>"
+        ),
+    )
+
+    return parser.parse_args(args)
+
+
+def tune(
+    config_path: Path,
+    output_path: Path | None = None,
+    memory_budget_gb: float | None = None,
+    tile_sizes: list[int] | None = None,
+    config_overrules: list[str] | None = None,
+) -> Path:
+    """Determine the fastest prediction settings for the config on this machine.
+
+    A short calibration is run on a sample of the tiles of ``predict.image_layer``
+    with the model that would be used by ``orthoseg_predict``. The settings found are
+    written to a config file that can be added to
+    ``general.extra_config_files_to_load`` of the project.
+
+    Args:
+        config_path (Path): Path to the config file to use.
+        output_path (Path, optional): Path to write the tuned settings to. If None, the
+            settings are written to "<config_path.stem>_tuned.ini" next to
+            `config_path`. Defaults to None.
+        memory_budget_gb (float, optional): the memory in GB the prediction can use. If
+            None, 80% of the memory available is used. Defaults to None.
+        tile_sizes (list[int], optional): the tile sizes in pixels, without overlap, to
+            try. If None, the configured tile size and TILE_SIZES are tried.
+            Defaults to None.
+        config_overrules (list[str], optional): list of config options that will
+            overrule other ways to supply configuration. They should be specified in the
+            form of "<section>.<key>=<value>". Defaults to None.
+
+    Returns:
+        Path: the path the tuned settings were written to.
+    """
+    # Init
+    conf.read_orthoseg_config(config_path, overrules=config_overrules)
+
+    global logger  # noqa: PLW0603
+    logger = log_util.main_log_init(conf.dirs.getpath("log_dir"), __name__)
+    logger.info(f"Start tune for config {config_path.stem}")
+
+    try:
+        image_layer = conf.predict["image_layer"]
+        image_layer_config = conf.image_layers.get(image_layer)
+        if image_layer_config is None:
+            raise ValueError(f"{image_layer=} is not configured in image_layers")
+
+        inference_backend = conf.predict.get("inference_backend", "keras")
+        if inference_backend != "keras":
+            logger.warning(
+                f"predict.inference_backend is {inference_backend}, but the prediction "
+                "speed is measured with the keras backend"
+            )
+
+        # Load the model that would be used to predict
+        traindata_id = None
+        force_model_traindata_id = conf.train.getint("force_model_traindata_id")
+        if force_model_traindata_id is not None and force_model_traindata_id > -1:
+            traindata_id = force_model_traindata_id
+        best_model = mh.get_best_model(
+            model_dir=conf.dirs.getpath("model_dir"),
+            segment_subject=conf.general["segment_subject"],
+            traindata_id=traindata_id,
+            architecture_id=conf.model.getint("architecture_id"),
+            trainparams_id=conf.train.getint("trainparams_id"),
+        )
+        if best_model is None:
+            raise RuntimeError(
+                f"No model found in model_dir: {conf.dirs.getpath('model_dir')}"
+            )
+        hyperparams_path = (
+            best_model["filepath"].parent
+            / f"{best_model['basefilename']}_hyperparams.json"
+        )
+        hyperparams = mh.HyperParams(path=hyperparams_path)
+        model, _ = mf.load_model(best_model["filepath"], compile_model=False)
+        min_probability = conf.predict.getfloat("min_probability")
+        model = mf.add_decode_head(
+            model,
+            decode_head=conf.predict.get("decode_head", "none"),
+            min_probability=min_probability,
+        )
+
+        # Determine the tile sizes to try
+        configured_size = (
+            conf.predict.getint("image_pixel_width"),
+            conf.predict.getint("image_pixel_height"),
+        )
+        if tile_sizes is None:
+            sizes = {configured_size, *((size, size) for size in TILE_SIZES)}
+        else:
+            sizes = {(size, size) for size in tile_sizes}
+
+        if memory_budget_gb is None:
+            memory_budget_gb = psutil.virtual_memory().available * 0.8 / 1024**3
+
+        result = predict_tuner.tune_predict(
+            model=model,
+            image_layer_config=image_layer_config,
+            architecture=hyperparams.architecture.architecture,
+            classes=hyperparams.architecture.classes,
+            image_pixel_x_size=conf.predict.getfloat("image_pixel_x_size"),
+            image_pixel_y_size=conf.predict.getfloat("image_pixel_y_size"),
+            tile_sizes=sorted(sizes),
+            image_pixels_overlap=conf.predict.getint("image_pixels_overlap", 0),
+            min_probability=min_probability,
+            postprocess=_get_inline_postprocess(),
+            memory_budget_mb=memory_budget_gb * 1024,
+            jit_compile=conf.predict.getboolean("jit_compile", False),
+            ssl_verify=conf.general.get("ssl_verify", True),
+        )
+
+        # Write the tuned settings
+        if output_path is None:
+            output_path = config_path.parent / f"{config_path.stem}_tuned.ini"
+        write_tuned_config(result, output_path, memory_budget_gb=memory_budget_gb)
+        logger.info(
+            f"Tuned settings written to {output_path}, add it to "
+            "general.extra_config_files_to_load to use them"
+        )
+
+        return output_path
+
+    except Exception as ex:
+        message = f"ERROR in tune for {config_path.name}"
+        logger.exception(message)
+        raise RuntimeError(f"{message}: {ex}") from ex
+    finally:
+        conf.remove_run_tmp_dir()
+
+
+def write_tuned_config(result: dict, output_path: Path, memory_budget_gb: float):
+    """Write the settings found by tuning to a config file.
+
+    Args:
+        result (dict): the result of :func:`predict_tuner.tune_predict`.
+        output_path (Path): the path to write the config file to.
+        memory_budget_gb (float): the memory budget that was used to tune.
+    """
+    tuned = configparser.ConfigParser()
+    tuned["general"] = {"nb_parallel": str(result["nb_parallel_postprocess"])}
+    tuned["predict"] = {
+        key: str(result[key])
+        for key in [
+            "batch_size",
+            "image_pixel_width",
+            "image_pixel_height",
+            "nb_parallel_read",
+        ]
+    }
+
+    with output_path.open("w") as output_file:
+        output_file.write(
+            f"# Tuned by orthoseg_tune on {platform.node()} at "
+            f"{datetime.now():%Y-%m-%d %H:%M}, with a memory budget of "
+            f"{memory_budget_gb:.1f} GB.\n"
+            f"# Measured: {result['images_per_s']:.2f} images/s, "
+            f"read {result['read_s']:.2f} s/image, "
+            f"postprocess {result['postprocess_s']:.2f} s/image, "
+            f"estimated memory {result['estimated_memory_mb']:.0f} MB.\n\n"
+        )
+        tuned.write(output_file)
+
+
+def main():
+    """Run tune."""
+    try:
+        # Interprete arguments
+        args = _tune_args(sys.argv[1:])
+
+        # Run!
+        tune(
+            config_path=Path(args.config),
+            output_path=Path(args.output) if args.output is not None else None,
+            memory_budget_gb=args.memory_budget,
+            tile_sizes=(
+                [int(size) for size in args.tile_sizes.split(",")]
+                if args.tile_sizes is not None
+                else None
+            ),
+            config_overrules=args.config_overrules,
+        )
+    except Exception as ex:
+        logger.exception(f"Error: {ex}")
+        raise
+
+
+# If the script is ran directly...
+if __name__ == "__main__":
+    main()
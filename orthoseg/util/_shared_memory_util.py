@@ -0,0 +1,162 @@
+"""Module containing utilities to share arrays between processes via shared memory."""
+
+import contextlib
+from collections.abc import Iterator
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from types import TracebackType
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class SharedArraySlot:
+    """Handle to an array stored in a slot of a :class:`SharedArrayRing`.
+
+    The handle is small, so it can be passed cheaply to other processes. There the
+    array can be accessed without copying it using :func:`attach`.
+    """
+
+    shm_name: str
+    slot_id: int
+    offset: int
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class SharedArrayRing:
+    """Ring buffer of fixed-size slots in shared memory to pass arrays to processes.
+
+    The shared memory block is only allocated on the first :meth:`put`, with slots big
+    enough to hold the array passed. A slot is reserved by :meth:`put` till it is given
+    back using :meth:`release`, so it can be reused for a next array.
+
+    Use as context manager to make sure the shared memory is cleaned up.
+
+    Args:
+        nb_slots (int): the number of slots in the ring buffer.
+    """
+
+    def __init__(self, nb_slots: int):
+        if nb_slots < 1:
+            raise ValueError(f"nb_slots should be >= 1, not {nb_slots}")
+        self.nb_slots = nb_slots
+        self.slot_nbytes = 0
+        self._shm: shared_memory.SharedMemory | None = None
+        self._free_slot_ids: list[int] = list(range(nb_slots))
+
+    def __enter__(self) -> "SharedArrayRing":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        self.close()
+
+    @property
+    def nb_free(self) -> int:
+        """The number of slots that are available."""
+        return len(self._free_slot_ids)
+
+    def fits(self, arr: np.ndarray) -> bool:
+        """Check if the array can be put in a slot.
+
+        Args:
+            arr (np.ndarray): the array to check.
+
+        Returns:
+            bool: True if the ring buffer isn't allocated yet or if the array fits in a
+                slot.
+        """
+        return self._shm is None or arr.nbytes <= self.slot_nbytes
+
+    def put(self, arr: np.ndarray) -> SharedArraySlot:
+        """Copy the array to a free slot.
+
+        Args:
+            arr (np.ndarray): the array to put in the ring buffer.
+
+        Raises:
+            ValueError: if the array doesn't fit in a slot.
+            RuntimeError: if there are no free slots.
+
+        Returns:
+            SharedArraySlot: handle to the slot the array was put in.
+        """
+        if self._shm is None:
+            self.slot_nbytes = max(arr.nbytes, 1)
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=self.slot_nbytes * self.nb_slots
+            )
+        if arr.nbytes > self.slot_nbytes:
+            raise ValueError(
+                f"array of {arr.nbytes} bytes doesn't fit in slots of "
+                f"{self.slot_nbytes} bytes"
+            )
+        if len(self._free_slot_ids) == 0:
+            raise RuntimeError("no free slots available in the ring buffer")
+
+        slot_id = self._free_slot_ids.pop()
+        slot = SharedArraySlot(
+            shm_name=self._shm.name,
+            slot_id=slot_id,
+            offset=slot_id * self.slot_nbytes,
+            shape=arr.shape,
+            dtype=arr.dtype.str,
+        )
+        slot_arr = np.ndarray(
+            slot.shape, dtype=slot.dtype, buffer=self._shm.buf, offset=slot.offset
+        )
+        np.copyto(slot_arr, arr)
+        del slot_arr
+
+        return slot
+
+    def release(self, slot: SharedArraySlot):
+        """Give the slot back so it can be reused.
+
+        Args:
+            slot (SharedArraySlot): the slot to release.
+        """
+        if slot.slot_id in self._free_slot_ids:
+            raise ValueError(f"slot {slot.slot_id} was already released")
+        self._free_slot_ids.append(slot.slot_id)
+
+    def close(self):
+        """Free the shared memory."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        self._free_slot_ids = list(range(self.nb_slots))
+
+
+@contextlib.contextmanager
+def attach(slot: SharedArraySlot) -> Iterator[np.ndarray]:
+    """Get the array in a slot of a :class:`SharedArrayRing`, without copying it.
+
+    The array returned is only valid within the context. The slot is reserved till it
+    is released by the process that put the array in the ring buffer, so till then the
+    array can be used, and even modified, without copying it first.
+
+    Args:
+        slot (SharedArraySlot): handle to the slot.
+
+    Yields:
+        np.ndarray: the array in the slot.
+    """
+    shm = shared_memory.SharedMemory(name=slot.shm_name)
+    arr = np.ndarray(slot.shape, dtype=slot.dtype, buffer=shm.buf, offset=slot.offset)
+    try:
+        yield arr
+    finally:
+        del arr
+        try:
+            shm.close()
+        except BufferError:
+            # Views on the array are still referenced somewhere, e.g. in the traceback
+            # of an exception. The memory will be unmapped when they are cleaned up.
+            pass
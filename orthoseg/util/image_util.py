@@ -1,12 +1,16 @@
 """Module with generic usable utility functions to load images."""
 
+import hashlib
+import json
 import logging
 import math
 import os
 import random
-import tempfile
+import threading
 import time
 import warnings
+from collections.abc import Callable, Iterable, Iterator
+from concurrent import futures
 from pathlib import Path
 from typing import Any
 
@@ -17,7 +21,6 @@ import owslib
 import owslib.util
 import owslib.wms
 import pycron
-import pygeoops
 import pyproj
 import rasterio as rio
 import rasterio.enums
@@ -31,10 +34,8 @@ from rasterio import (
     warp as rio_warp,
     windows as rio_windows,
 )
-from rasterio._err import CPLE_AppDefinedError
-from shapely.geometry import box
 
-from . import _processing_util, progress_util
+from . import _processing_util, progress_util, tile_manifest, wms_fetcher
 
 FORMAT_GEOTIFF = "image/geotiff"
 FORMAT_GEOTIFF_DRIVER = "Gtiff"
@@ -77,6 +78,11 @@ class WMSLayerSource:
         wms_service: owslib.wms.wms111.WebMapService_1_1_1
         | owslib.wms.wms130.WebMapService_1_3_0
         | None = None,
+        max_requests_per_s: float = 0,
+        max_bytes_per_s: float = 0,
+        adaptive_concurrency: bool = True,
+        metatile_factor: int | tuple[int, int] = 1,
+        max_image_size: int | tuple[int, int] = 4096,
     ):
         """Constructor of WMSLayerSource.
 
@@ -93,6 +99,24 @@ class WMSLayerSource:
                 Defaults to False.
             random_sleep (int, optional): _description_. Defaults to 0.
             wms_service: The WMS service. Defaults to None.
+            max_requests_per_s (float, optional): the maximum number of GetMap
+                requests per second to the WMS server. If 0, the number of requests
+                isn't limited. Defaults to 0.
+            max_bytes_per_s (float, optional): the maximum number of bytes per second
+                fetched from the WMS server. If 0, the number of bytes isn't limited.
+                Defaults to 0.
+            adaptive_concurrency (bool, optional): True to adapt the number of
+                requests in flight to the latency and failures of the WMS server and
+                to pause the requests when it keeps on failing. Defaults to True.
+            metatile_factor (int or tuple[int, int], optional): the number of columns
+                and rows of neighbouring tiles to load in one GetMap request when
+                loading images to a cache. The tiles, overlaps included, are cut from
+                the image locally. If an int is passed, it is used for both.
+                Defaults to 1.
+            max_image_size (int or tuple[int, int], optional): the maximum width and
+                height in pixels of the images the WMS server returns. The
+                `metatile_factor` is reduced if needed to respect it. If an int is
+                passed, it is used for both. Defaults to 4096.
         """
         self.wms_server_url = wms_server_url
         self.wms_version = wms_version
@@ -104,6 +128,19 @@ class WMSLayerSource:
         self.password = password
         self.random_sleep = random_sleep
         self.wms_service = wms_service
+        self.max_requests_per_s = max_requests_per_s
+        self.max_bytes_per_s = max_bytes_per_s
+        self.adaptive_concurrency = adaptive_concurrency
+        if isinstance(metatile_factor, int):
+            metatile_factor = (metatile_factor, metatile_factor)
+        if len(metatile_factor) != 2 or min(metatile_factor) < 1:
+            raise ValueError(f"Invalid metatile_factor: {metatile_factor}")
+        self.metatile_factor = tuple(metatile_factor)
+        if isinstance(max_image_size, int):
+            max_image_size = (max_image_size, max_image_size)
+        if len(max_image_size) != 2 or min(max_image_size) < 1:
+            raise ValueError(f"Invalid max_image_size: {max_image_size}")
+        self.max_image_size = tuple(max_image_size)
 
 
 class FileLayerSource:
@@ -128,6 +165,239 @@ class FileLayerSource:
         self.bands = bands
 
 
+class LayerSourceSession:
+    """Cache of the objects needed to read images from layer sources.
+
+    Opening a dataset, parsing a crs or connecting to a WMS service takes time compared
+    to reading one tile, so these objects are cached and reused for all tiles read.
+
+    The objects cached aren't thread-safe, so they are cached per thread. A process
+    forked from a process that used the session starts with an empty cache.
+    """
+
+    def __init__(self):
+        """Create an empty session."""
+        self._local = threading.local()
+
+    def _get_cache(self) -> dict[str, dict]:
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.cache = {
+                "crs": {},
+                "switched_axes": {},
+                "datasets": {},
+                "same_crs": {},
+                "wms_services": {},
+                "wms_fetchers": {},
+            }
+        return self._local.cache
+
+    def get_crs(self, crs: str | pyproj.CRS) -> pyproj.CRS:
+        """Get the crs, parsing it if it is a string.
+
+        Args:
+            crs (str | pyproj.CRS): the crs.
+
+        Returns:
+            pyproj.CRS: the crs.
+        """
+        if isinstance(crs, pyproj.CRS):
+            return crs
+        crs_cache = self._get_cache()["crs"]
+        if crs not in crs_cache:
+            crs_cache[crs] = pyproj.CRS.from_user_input(crs)
+        return crs_cache[crs]
+
+    def has_switched_axes(self, crs: pyproj.CRS) -> bool:
+        """Determine if the axes of the CRS are switched, see :func:`has_switched_axes`.
+
+        Args:
+            crs (pyproj.CRS): The CRS to check.
+
+        Returns:
+            bool: True if the axes are switched.
+        """
+        switched_axes_cache = self._get_cache()["switched_axes"]
+        if crs.srs not in switched_axes_cache:
+            switched_axes_cache[crs.srs] = has_switched_axes(crs)
+        return switched_axes_cache[crs.srs]
+
+    def open_dataset(
+        self, path: Path, overview_level: int | None = None
+    ) -> rio.DatasetReader:
+        """Get the dataset for a file, opening it if it isn't open yet.
+
+        The dataset should not be closed by the caller.
+
+        Args:
+            path (Path): the path to the file.
+            overview_level (int, optional): the overview level to open the file at.
+                If None, the file is opened at full resolution. Defaults to None.
+
+        Returns:
+            rio.DatasetReader: the opened dataset.
+        """
+        datasets = self._get_cache()["datasets"]
+        dataset = datasets.get((path, overview_level))
+        if dataset is None or dataset.closed:
+            if overview_level is None:
+                dataset = rio.open(str(path))
+            else:
+                dataset = rio.open(str(path), overview_level=overview_level)
+            datasets[(path, overview_level)] = dataset
+        return dataset
+
+    def discard_dataset(self, path: Path):
+        """Close the datasets for a file if they are open, e.g. after a read error.
+
+        Args:
+            path (Path): the path to the file.
+        """
+        datasets = self._get_cache()["datasets"]
+        for key in [key for key in datasets if key[0] == path]:
+            datasets.pop(key).close()
+
+    def is_same_crs(self, dataset: rio.DatasetReader, crs: pyproj.CRS) -> bool:
+        """Check if a dataset is in the crs specified.
+
+        Args:
+            dataset (rio.DatasetReader): the dataset.
+            crs (pyproj.CRS): the crs.
+
+        Returns:
+            bool: True if the dataset is in the crs specified.
+        """
+        same_crs_cache = self._get_cache()["same_crs"]
+        key = (dataset.name, crs.srs)
+        if key not in same_crs_cache:
+            same_crs_cache[key] = crs == dataset.crs
+        return same_crs_cache[key]
+
+    def get_wms_service(
+        self, layersource: "WMSLayerSource", ssl_verify: bool | str = True
+    ) -> Any:
+        """Get the WMS service for a layer source, connecting to it if needed.
+
+        If a `wms_service` is set on the layer source, it is used.
+
+        Args:
+            layersource (WMSLayerSource): the layer source.
+            ssl_verify (bool or str, optional): the ssl_verify to use to connect.
+                Defaults to True.
+
+        Returns:
+            the WMS service.
+        """
+        if layersource.wms_service is not None:
+            return layersource.wms_service
+
+        wms_services = self._get_cache()["wms_services"]
+        key = (
+            layersource.wms_server_url,
+            layersource.wms_version,
+            layersource.username,
+            layersource.password,
+            layersource.wms_ignore_capabilities_url,
+            str(ssl_verify),
+        )
+        if key not in wms_services:
+            auth = _prepare_auth(
+                layersource.username, layersource.password, ssl_verify=ssl_verify
+            )
+            wms_service = owslib.wms.WebMapService(
+                url=layersource.wms_server_url,
+                version=layersource.wms_version,
+                auth=auth,
+            )
+            if layersource.wms_ignore_capabilities_url:
+                # If the wms url in capabilities should be ignored,
+                # overwrite with original url
+                nb = len(wms_service.getOperationByName("GetMap").methods)
+                for method_id in range(nb):
+                    wms_service.getOperationByName("GetMap").methods[method_id][
+                        "url"
+                    ] = layersource.wms_server_url
+            wms_services[key] = wms_service
+
+        return wms_services[key]
+
+    def get_wms_fetcher(
+        self, layersource: "WMSLayerSource", ssl_verify: bool | str = True
+    ) -> wms_fetcher.WMSFetcher:
+        """Get the fetcher to send the GetMap requests for a layer source with.
+
+        The url to send the requests to is determined from the capabilities of the WMS
+        service. The fetcher is shared by all threads of the process, so the
+        connections to the server are reused and the limits on the requests and bytes
+        per second apply to all of them.
+
+        Args:
+            layersource (WMSLayerSource): the layer source.
+            ssl_verify (bool or str, optional): the ssl_verify to use to connect.
+                Defaults to True.
+
+        Returns:
+            WMSFetcher: the fetcher.
+        """
+        wms_fetchers = self._get_cache()["wms_fetchers"]
+        key = (
+            layersource.wms_server_url,
+            layersource.wms_version,
+            layersource.username,
+            layersource.password,
+            layersource.wms_ignore_capabilities_url,
+            str(ssl_verify),
+            layersource.max_requests_per_s,
+            layersource.max_bytes_per_s,
+            layersource.adaptive_concurrency,
+        )
+        if key not in wms_fetchers:
+            wms_service = self.get_wms_service(layersource, ssl_verify)
+            getmap_url = next(
+                (
+                    method["url"]
+                    for method in wms_service.getOperationByName("GetMap").methods
+                    if method.get("type", "Get").lower() == "get"
+                ),
+                wms_service.url,
+            )
+            wms_fetchers[key] = wms_fetcher.get_fetcher(
+                getmap_url=getmap_url,
+                wms_version=layersource.wms_version,
+                username=layersource.username,
+                password=layersource.password,
+                ssl_verify=_parse_ssl_verify(ssl_verify),
+                max_requests_per_s=layersource.max_requests_per_s,
+                max_bytes_per_s=layersource.max_bytes_per_s,
+                adaptive_concurrency=layersource.adaptive_concurrency,
+            )
+
+        return wms_fetchers[key]
+
+    def close(self):
+        """Close the datasets opened by the current thread."""
+        datasets = self._get_cache()["datasets"]
+        for dataset in datasets.values():
+            dataset.close()
+        datasets.clear()
+
+
+# The session used by default, so the cache is shared by all calls in a process
+_default_session = LayerSourceSession()
+
+
+def get_crs(crs: str | pyproj.CRS) -> pyproj.CRS:
+    """Get the crs, parsing it if it is a string, using the default session cache.
+
+    Args:
+        crs (str | pyproj.CRS): the crs.
+
+    Returns:
+        pyproj.CRS: the crs.
+    """
+    return _default_session.get_crs(crs)
+
+
 def get_images_for_grid(
     output_image_dir: Path,
     crs: pyproj.CRS,
@@ -141,9 +411,13 @@ def get_images_for_grid(
     image_pixel_height: int = 1024,
     image_format: str = FORMAT_GEOTIFF,
     pixels_overlap: int = 0,
+    cache_dir: Path | None = None,
 ) -> gpd.GeoDataFrame:
     """Get a list of all images in the grid specified.
 
+    The grid is cached in a grid index file, keyed on the grid parameters and a hash
+    of the roi file, so it can be loaded again fast if the same grid is asked again.
+
     Args:
         output_image_dir (Path): Directory to save the images to.
         crs (Union[str, pyproj.CRS]): The crs of the source and destination images.
@@ -168,6 +442,8 @@ def get_images_for_grid(
         pixels_overlap (int, optional): The number of pixels the tiles should be
             enlarged in all directions to create overlapping tiles.
             Defaults to 0.
+        cache_dir (Path, optional): Directory to cache the grid index in. If None,
+            `output_image_dir` is used. Defaults to None.
     """
     # Tile size in units of crs
     crs_width = math.fabs(image_pixel_width * image_crs_pixel_x_size)
@@ -196,75 +472,109 @@ def get_images_for_grid(
         log_level=logging.WARNING,
     )
 
-    # Create a grid of the images that need to be downloaded
-    tiles_to_download_gdf = gpd.GeoDataFrame(
-        geometry=pygeoops.create_grid3(grid_bbox, width=crs_width, height=crs_height),
+    # If the grid was determined before, load it from the grid index
+    tile_pixel_width = image_pixel_width + 2 * pixels_overlap
+    tile_pixel_height = image_pixel_height + 2 * pixels_overlap
+    grid_key = _get_grid_key(
         crs=crs,
+        grid_bbox=grid_bbox,
+        roi_path=image_gen_roi_filepath,
+        image_crs_pixel_x_size=image_crs_pixel_x_size,
+        image_crs_pixel_y_size=image_crs_pixel_y_size,
+        image_pixel_width=image_pixel_width,
+        image_pixel_height=image_pixel_height,
+        image_format=image_format,
+        pixels_overlap=pixels_overlap,
     )
+    if cache_dir is None:
+        cache_dir = output_image_dir
+    grid_index_path = cache_dir / f"grid_index_{grid_key}.npz"
+    tiles_path = output_image_dir / "tiles_to_download.gpkg"
+    if grid_index_path.exists():
+        with np.load(grid_index_path, allow_pickle=False) as grid_index:
+            bounds = grid_index["bounds"]
+            rel_paths = grid_index["rel_paths"]
+        logger.info(f"Loaded grid of {len(bounds)} tiles from {grid_index_path}")
 
-    # Loop through all tiles to apply pixels_overlap and add the output path
-    for tile in tiles_to_download_gdf.geometry.bounds.itertuples():
-        _, tile_xmin, tile_ymin, tile_xmax, tile_ymax = tile
-        tile_pixel_width = image_pixel_width
-        tile_pixel_height = image_pixel_height
+    else:
+        # Create the grid with array operations, in the same order as
+        # pygeoops.create_grid3: column by column, from bottom to top
+        nb_cols = math.ceil((grid_bbox[2] - grid_bbox[0]) / crs_width)
+        nb_rows = math.ceil((grid_bbox[3] - grid_bbox[1]) / crs_height)
+        xmins = np.repeat(grid_bbox[0] + np.arange(nb_cols) * crs_width, nb_rows)
+        ymins = np.tile(grid_bbox[1] + np.arange(nb_rows) * crs_height, nb_cols)
 
         # If overlapping images are wanted... increase image bbox
-        if pixels_overlap:
-            tile_xmin -= pixels_overlap * image_crs_pixel_x_size
-            tile_xmax += pixels_overlap * image_crs_pixel_x_size
-            tile_ymin -= pixels_overlap * image_crs_pixel_y_size
-            tile_ymax += pixels_overlap * image_crs_pixel_y_size
-            tile_pixel_width += 2 * pixels_overlap
-            tile_pixel_height += 2 * pixels_overlap
-
-        tiles_to_download_gdf.at[tile.Index, "geometry"] = box(
-            tile_xmin, tile_ymin, tile_xmax, tile_ymax
+        overlap_x = pixels_overlap * image_crs_pixel_x_size
+        overlap_y = pixels_overlap * image_crs_pixel_y_size
+        bounds = np.column_stack(
+            [
+                xmins - overlap_x,
+                ymins - overlap_y,
+                xmins + crs_width + overlap_x,
+                ymins + crs_height + overlap_y,
+            ]
         )
 
-        # Create output filepath
+        # If an roi is specified, only keep the tiles that intersect it
+        if image_gen_roi_filepath is not None:
+            roi_gdf = gfo.read_file(image_gen_roi_filepath, columns=[])
+            roi_tree = shapely.STRtree(np.asarray(roi_gdf.geometry.array))
+            tile_idx, _ = roi_tree.query(shapely.box(*bounds.T), predicate="intersects")
+            bounds = bounds[np.unique(tile_idx)]
+
+        # Create output filepath relative to the output_image_dir.
         # Put images in a subdirectory based on the x-coordinate of the tile to avoid
         # one directory with too many files
-        if crs.is_projected:
-            output_dir = output_image_dir / f"{tile_xmin:06.0f}"
-        else:
-            output_dir = output_image_dir / f"{tile_xmin:09.4f}"
-        output_filename = create_filename(
-            crs=crs,
-            bbox=(tile_xmin, tile_ymin, tile_xmax, tile_ymax),
-            size=(tile_pixel_width, tile_pixel_height),
-            image_format=image_format,
-            layername=None,
+        subdir_format = "{:06.0f}" if crs.is_projected else "{:09.4f}"
+        rel_paths = np.array(
+            [
+                f"{subdir_format.format(tile_bounds[0])}/"
+                + create_filename(
+                    crs=crs,
+                    bbox=tuple(tile_bounds),
+                    size=(tile_pixel_width, tile_pixel_height),
+                    image_format=image_format,
+                    layername=None,
+                )
+                for tile_bounds in bounds
+            ],
+            dtype=str,
         )
-        output_filepath = output_dir / output_filename
 
-        # Add the extra info to the gdf
-        tiles_to_download_gdf.at[tile.Index, "path"] = output_filepath
-        tiles_to_download_gdf.at[tile.Index, "pixel_width"] = tile_pixel_width
-        tiles_to_download_gdf.at[tile.Index, "pixel_height"] = tile_pixel_height
+        # Save the grid in the grid index. Write to a temporary file first, so the
+        # grid index is never incomplete, e.g. if it is written by multiple processes.
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        grid_index_tmp_path = cache_dir / f"grid_index_{grid_key}_{os.getpid()}.tmp"
+        with grid_index_tmp_path.open("wb") as grid_index_file:
+            np.savez(grid_index_file, bounds=bounds, rel_paths=rel_paths)
+        grid_index_tmp_path.replace(grid_index_path)
+        tiles_path.unlink(missing_ok=True)
 
-    # Write the tiles to download to file for reference
-    tiles_path = output_image_dir / "tiles_to_download.gpkg"
-    if image_gen_roi_filepath is not None:
-        # If an roi is specified, filter the tiles to download with it
-        tiles_all_tmp_path = output_image_dir / "tiles_all_tmp.gpkg"
-        tiles_to_save_gdf = tiles_to_download_gdf.copy()
-        tiles_to_save_gdf["path"] = tiles_to_save_gdf["path"].apply(Path.as_posix)
-        gfo.to_file(tiles_to_save_gdf, tiles_all_tmp_path)
-        gfo.export_by_location(
-            input_to_select_from_path=tiles_all_tmp_path,
-            input_to_compare_with_path=image_gen_roi_filepath,
-            output_path=tiles_path,
-            spatial_relations_query="intersects is True",
-            force=True,
-        )
-        gfo.remove(tiles_all_tmp_path)
+        # The grid indexes of other grids are outdated now, so remove them
+        for other_grid_index_path in cache_dir.glob("grid_index_*.npz"):
+            if other_grid_index_path != grid_index_path:
+                other_grid_index_path.unlink(missing_ok=True)
 
-        # Read the filtered tiles to download to return them
-        tiles_to_download_gdf = gfo.read_file(tiles_path)
-        tiles_to_download_gdf["path"] = tiles_to_download_gdf["path"].apply(Path)
+    tiles_to_download_gdf = gpd.GeoDataFrame(
+        {
+            "path": [output_image_dir / rel_path for rel_path in rel_paths],
+            "pixel_width": tile_pixel_width,
+            "pixel_height": tile_pixel_height,
+        },
+        geometry=shapely.box(*bounds.T),
+        crs=crs,
+    )
 
-    else:
-        # No roi specified, so just write the tiles to download
+    # Write the tiles to download to file for reference. If the file is older than the
+    # grid index, it was written for another grid, e.g. if the grid index is shared
+    # with other output dirs.
+    if (
+        not tiles_path.exists()
+        or tiles_path.stat().st_mtime < grid_index_path.stat().st_mtime
+    ):
+        tiles_path.unlink(missing_ok=True)
+        output_image_dir.mkdir(parents=True, exist_ok=True)
         tiles_to_save_gdf = tiles_to_download_gdf.copy()
         tiles_to_save_gdf["path"] = tiles_to_save_gdf["path"].apply(Path.as_posix)
         gfo.to_file(tiles_to_save_gdf, tiles_path)
@@ -272,6 +582,29 @@ def get_images_for_grid(
     return tiles_to_download_gdf
 
 
+def _get_grid_key(
+    crs: pyproj.CRS,
+    grid_bbox: tuple[float, float, float, float],
+    roi_path: Path | None,
+    **grid_params,
+) -> str:
+    """Get a key that identifies a grid, including the content of the roi file."""
+    key_params: dict[str, Any] = {
+        "crs": crs.to_wkt(),
+        "grid_bbox": list(grid_bbox),
+        **grid_params,
+    }
+    if roi_path is not None:
+        roi_hash = hashlib.sha256()
+        with roi_path.open("rb") as roi_file:
+            while chunk := roi_file.read(1024 * 1024):
+                roi_hash.update(chunk)
+        key_params["roi_hash"] = roi_hash.hexdigest()
+
+    key_json = json.dumps(key_params, sort_keys=True, default=str)
+    return hashlib.sha256(key_json.encode()).hexdigest()[:16]
+
+
 def load_images_to_cache(
     layersources: list[FileLayerSource | WMSLayerSource],
     output_image_dir: Path,
@@ -387,53 +720,121 @@ def load_images_to_cache(
         # On windows, this pool doesn't exit properly when running in pytest if it is a
         # process pool, so use a thread pool in that case.
         worker_type = "threads"
+    elif all(isinstance(source, WMSLayerSource) for source in layersources):
+        # Threads mainly wait on the WMS server, so they can share the keep-alive
+        # connections and the request rate limits of one process.
+        worker_type = "threads"
+
+    # The manifest of the cache dir is used to determine the images cached already, so
+    # they don't need to be checked one by one.
+    with (
+        tile_manifest.TileManifest(output_image_dir) as manifest,
+        _processing_util.PooledExecutorFactory(
+            worker_type=worker_type, max_workers=nb_concurrent_calls
+        ) as pool,
+    ):
+        # If the manifest is new but the cache dir already contains images, e.g. if
+        # they were loaded by an older version, list them in the manifest first.
+        if manifest.created and not force:
+            has_images = any(
+                next(output_image_dir.rglob(f"*{image_ext}"), None) is not None
+                for image_ext in tile_manifest.IMAGE_EXTS
+            )
+            if has_images:
+                logger.info(f"Add the images in {output_image_dir} to the manifest")
+                manifest.rebuild()
 
-    with _processing_util.PooledExecutorFactory(
-        worker_type=worker_type, max_workers=nb_concurrent_calls
-    ) as pool:
-        # Loop through all columns and get the images...
+        # Till all tiles are processed, images can be missing in the manifest
+        manifest.set_complete(False)
+        statuses = {} if force else manifest.get_statuses()
+
+        # Loop through all tiles and determine the ones that need to be loaded
         nb_total = len(tiles_to_download_gdf)
-        nb_processed = 0
-        nb_downloaded = 0
-        download_queue = {}
         logger.info(f"Start loading {nb_total} images")
-        progress = None
-        for tile in tiles_to_download_gdf.geometry.bounds.itertuples():
-            _, tile_xmin, tile_ymin, tile_xmax, tile_ymax = tile
-            tile_pixel_width = image_pixel_width
-            tile_pixel_height = image_pixel_height
-
-            # Init progress
-            if progress is None:
-                message = (
-                    f"load_images to {output_image_dir.parent.name}/"
-                    f"{output_image_dir.name}"
-                )
-                progress = progress_util.ProgressLogger(
-                    message=message,
-                    nb_steps_total=nb_total,
-                    nb_steps_done=0,
-                )
+        progress = progress_util.ProgressLogger(
+            message=(
+                f"load_images to {output_image_dir.parent.name}/{output_image_dir.name}"
+            ),
+            nb_steps_total=nb_total,
+            nb_steps_done=0,
+        )
 
-            nb_processed += 1
-            output_filepath = tiles_to_download_gdf.at[tile.Index, "path"]
-            output_dir = output_filepath.parent
-            output_filename = output_filepath.name
+        def get_tiles_to_load() -> Iterator[dict[str, Any]]:
+            tiles_bounds = tiles_to_download_gdf.geometry.bounds.itertuples()
+            for nb_processed, tile in enumerate(tiles_bounds, start=1):
+                _, tile_xmin, tile_ymin, tile_xmax, tile_ymax = tile
+                output_filepath = tiles_to_download_gdf.at[tile.Index, "path"]
 
-            # Do some checks to know if the image needs to be downloaded
-            if nb_images_to_skip > 0 and (nb_processed % nb_images_to_skip) != 0:
-                # If we need to skip images, do so...
-                progress.step()
-                continue
-            elif (
-                not force
-                and output_filepath.exists()
-                and output_filepath.stat().st_size > 0
-            ):
-                # Image exists already
-                progress.step()
-                logger.debug("    -> image exists already, so skip")
-                continue
+                # Do some checks to know if the image needs to be downloaded
+                if nb_images_to_skip > 0 and (nb_processed % nb_images_to_skip) != 0:
+                    # If we need to skip images, do so...
+                    progress.step()
+                    continue
+                elif statuses.get(
+                    output_filepath.relative_to(output_image_dir).as_posix()
+                ) in (tile_manifest.STATUS_CACHED, tile_manifest.STATUS_EMPTY):
+                    # Image exists already or the tile is outside the layer bounds
+                    progress.step()
+                    logger.debug("    -> image exists already or is empty, so skip")
+                    continue
+
+                yield {
+                    "path": output_filepath,
+                    "bounds": (tile_xmin, tile_ymin, tile_xmax, tile_ymax),
+                    "pixel_width": image_pixel_width + 2 * pixels_overlap,
+                    "pixel_height": image_pixel_height + 2 * pixels_overlap,
+                }
+
+        # WMS layer sources can load multiple neighbouring tiles in one request
+        metatile_factor = _get_metatile_factor(
+            layersources,
+            image_pixel_width=image_pixel_width,
+            image_pixel_height=image_pixel_height,
+            pixels_overlap=pixels_overlap,
+        )
+        tile_groups: Iterator[list[dict[str, Any]]]
+        if metatile_factor == (1, 1):
+            tile_groups = ([record] for record in get_tiles_to_load())
+        else:
+            logger.info(
+                f"Load meta-tiles of {metatile_factor[0]} x {metatile_factor[1]} tiles"
+            )
+            tile_groups = _iter_metatiles(
+                get_tiles_to_load(),
+                metatile_factor=metatile_factor,
+                grid_xmin=grid_xmin,
+                grid_ymin=grid_ymin,
+                crs_width=math.fabs(image_pixel_width * image_crs_pixel_x_size),
+                crs_height=math.fabs(image_pixel_height * image_crs_pixel_y_size),
+            )
+
+        nb_downloaded = 0
+        download_queue: dict[futures.Future, list[dict[str, Any]]] = {}
+
+        def process_done(futures_done: Iterable[futures.Future]):
+            nonlocal nb_downloaded
+            for future in futures_done:
+                tile_records = download_queue.pop(future)
+
+                # Fetch result: will throw exception if something went wrong
+                results = future.result()
+                for tile_record, result in zip(tile_records, results, strict=True):
+                    if result is None:
+                        manifest.set_empty([tile_record])
+                    else:
+                        _, tile_record["size_bytes"], tile_record["checksum"] = result
+                        manifest.set_cached([tile_record])
+                    nb_downloaded += 1
+
+                    # Log the progress and download speed
+                    progress.step()
+
+        stopped_early = False
+        for tile_records in tile_groups:
+            # Stop if the max number of images to download is reached
+            if max_nb_images > -1 and nb_downloaded >= max_nb_images:
+                stopped_early = True
+                break
 
             # If a cron_schedule is specified, check if we should be running
             if cron_schedule is not None and cron_schedule not in ["", "* * * * *"]:
@@ -446,67 +847,76 @@ def load_images_to_cache(
                         first_cron_check = False
                     time.sleep(60)
 
-            # Submit the image to be downloaded
-            output_dir.mkdir(parents=True, exist_ok=True)
-            if pixels_overlap:
-                tile_pixel_width += 2 * pixels_overlap
-                tile_pixel_height += 2 * pixels_overlap
-
+            # Submit the image(s) to be downloaded
             future = pool.submit(
-                load_image_to_file,  # Function
+                _load_metatile_to_files,  # Function
                 layersources=layersources,
-                output_dir=output_dir,
+                tile_records=tile_records,
                 crs=crs,
-                bbox=(tile_xmin, tile_ymin, tile_xmax, tile_ymax),
-                size=(tile_pixel_width, tile_pixel_height),
                 ssl_verify=ssl_verify,
                 image_format=image_format,
                 image_format_save=image_format_save,
-                output_filename=output_filename,
                 transparent=transparent,
                 tiff_compress=tiff_compress,
                 image_pixels_ignore_border=image_pixels_ignore_border,
                 switch_axes=switch_axes,
                 force=force,
-                on_outside_layer_bounds="return",
             )
-            download_queue[future] = output_filename
-
-            # Process finished downloads till queue is of acceptable size
-            while True:
-                # Process downloads that are ready
-                futures_done = []
-                for future in download_queue:
-                    if not future.done():
-                        continue
-
-                    # Fetch result: will throw exception if something went wrong
-                    _ = future.result()
-                    nb_downloaded += 1
-                    futures_done.append(future)
+            download_queue[future] = tile_records
 
-                    # Log the progress and download speed
-                    progress.step()
+            # Wait till the queue is of acceptable size
+            while len(download_queue) >= nb_concurrent_calls * 2:
+                done, _ = futures.wait(
+                    download_queue, return_when=futures.FIRST_COMPLETED
+                )
+                process_done(done)
 
-                # Remove futures that are done
-                for future in futures_done:
-                    del download_queue[future]
-                futures_done = []
+        # Wait till all downloads are ready
+        process_done(futures.wait(download_queue).done)
+        if not stopped_early and nb_images_to_skip == 0:
+            manifest.set_complete(True)
 
-                # If all image tiles have been processed or if the max number of
-                # images to download is reached...
-                if nb_processed >= nb_total or (
-                    max_nb_images > -1 and nb_downloaded >= max_nb_images
-                ):
-                    if len(download_queue) == 0:
-                        return
-                elif len(download_queue) < nb_concurrent_calls * 2:
-                    # Not all tiles have been processed yet, and the queue isn't too
-                    # full, so process some more
-                    break
 
-                # Sleep a bit before checking again if there are downloads ready
-                time.sleep(0.1)
+def _get_metatile_factor(
+    layersources: list[WMSLayerSource | FileLayerSource],
+    image_pixel_width: int,
+    image_pixel_height: int,
+    pixels_overlap: int = 0,
+) -> tuple[int, int]:
+    """Get the number of tiles to load in one request for the layer sources.
+
+    Only layer sources that consist of WMS layer sources can use meta-tiles. If there
+    are multiple, the smallest factor is used. The factor is reduced if needed so the
+    meta-tiles, overlaps included, are not larger than the max image size of the layer
+    sources.
+    """
+    wms_sources = [
+        source for source in layersources if isinstance(source, WMSLayerSource)
+    ]
+    if len(wms_sources) < len(layersources):
+        return (1, 1)
+    metatile_factor = (
+        min(source.metatile_factor[0] for source in wms_sources),
+        min(source.metatile_factor[1] for source in wms_sources),
+    )
+    max_width = min(source.max_image_size[0] for source in wms_sources)
+    max_height = min(source.max_image_size[1] for source in wms_sources)
+    max_factor = (
+        max((max_width - 2 * pixels_overlap) // image_pixel_width, 1),
+        max((max_height - 2 * pixels_overlap) // image_pixel_height, 1),
+    )
+    if metatile_factor[0] > max_factor[0] or metatile_factor[1] > max_factor[1]:
+        capped_factor = (
+            min(metatile_factor[0], max_factor[0]),
+            min(metatile_factor[1], max_factor[1]),
+        )
+        logger.warning(
+            f"metatile_factor {metatile_factor} reduced to {capped_factor}, as the "
+            f"images requested can be at most {max_width} x {max_height} pixels"
+        )
+        metatile_factor = capped_factor
+
+    return metatile_factor
 
 
 def _align_bbox_to_grid(
@@ -576,23 +986,97 @@ def _prepare_auth(
             this will be used. In corporate networks using a proxy server this is often
             needed to avoid CERTIFICATE_VERIFY_FAILED errors.
     """
-    # Interprete ssl_verify
+    ssl_verify = _parse_ssl_verify(ssl_verify)
+    if not ssl_verify:
+        urllib3.disable_warnings()
+        logger.warning("SSL VERIFICATION IS TURNED OFF!!!")
+
+    return owslib.util.Authentication(
+        username=username, password=password, verify=ssl_verify
+    )
+
+
+def _parse_ssl_verify(ssl_verify: bool | str) -> bool | str:
+    """Interprete ssl_verify: a bool string is cast to bool.
+
+    Args:
+        ssl_verify (bool or str): see :func:`_prepare_auth`.
+
+    Returns:
+        bool | str: the ssl_verify as a bool or as the path to a certificate bundle.
+    """
     if isinstance(ssl_verify, str):
         # If it is actually a bool string, cast it to bool
         if ssl_verify.lower() == "true":
-            ssl_verify = True
+            return True
         elif ssl_verify.lower() == "false":
-            ssl_verify = False
+            return False
     elif not isinstance(ssl_verify, bool):
         raise ValueError(f"Invalid value for ssl_verify: {ssl_verify}")
 
-    if not ssl_verify:
-        urllib3.disable_warnings()
-        logger.warning("SSL VERIFICATION IS TURNED OFF!!!")
+    return ssl_verify
 
-    return owslib.util.Authentication(
-        username=username, password=password, verify=ssl_verify
-    )
+
+def get_block_aligned_grid_origin(
+    layersources: WMSLayerSource | FileLayerSource | list,
+    crs: str | pyproj.CRS,
+    pixel_x_size: float,
+    pixel_y_size: float,
+) -> tuple[float, float] | None:
+    """Get a grid origin so the tiles are aligned with the blocks of a file layer.
+
+    Files are typically stored in compressed blocks. If the tiles of a grid with this
+    origin have a size that is a multiple of the block size, each tile only needs the
+    blocks it covers. In addition, the tiles are on the pixel grid of the file, so they
+    can be read without resampling.
+
+    The first file layer source in the `crs` specified is used. If the pixel size is
+    coarser than the pixel size of the file, the overview with that pixel size is used.
+
+    Args:
+        layersources (WMSLayerSource, FileLayerSource, List): the layer source(s).
+        crs (str | pyproj.CRS): the crs of the grid.
+        pixel_x_size (float): the pixel size in the x direction of the grid.
+        pixel_y_size (float): the pixel size in the y direction of the grid.
+
+    Returns:
+        tuple[float, float] | None: the grid_xmin and grid_ymin to use or None if
+            there is no file layer source the grid can be aligned with.
+    """
+    if not isinstance(layersources, list):
+        layersources = [layersources]
+    session = LayerSourceSession()
+    try:
+        crs = session.get_crs(crs)
+        for layersource in layersources:
+            if not isinstance(layersource, FileLayerSource):
+                continue
+            image_file = session.open_dataset(layersource.path)
+            if not session.is_same_crs(image_file, crs):
+                continue
+
+            # The pixel grid of the file must match the grid in both directions
+            left, top = image_file.bounds.left, image_file.bounds.top
+            image_file, window = _get_aligned_window(
+                session=session,
+                path=layersource.path,
+                image_file=image_file,
+                bbox=(left, top - pixel_y_size, left + pixel_x_size, top),
+                size=(1, 1),
+            )
+            if window is None:
+                continue
+
+            block_height, block_width = image_file.block_shapes[0]
+            logger.info(
+                f"Grid aligned with {layersource.path}, with blocks of {block_width} x "
+                f"{block_height} pixels: use a tile size that is a multiple of it"
+            )
+            return (left, top)
+
+        return None
+    finally:
+        session.close()
 
 
 def load_image_to_file(
@@ -649,6 +1133,54 @@ def load_image_to_file(
         Optional[Path]: The path the file is created at if created succesfully. None if
             the file is not created.
     """
+    result = _load_image_to_file(
+        layersources=layersources,
+        output_dir=output_dir,
+        crs=crs,
+        bbox=bbox,
+        size=size,
+        ssl_verify=ssl_verify,
+        image_format=image_format,
+        image_format_save=image_format_save,
+        output_filename=output_filename,
+        transparent=transparent,
+        tiff_compress=tiff_compress,
+        image_pixels_ignore_border=image_pixels_ignore_border,
+        force=force,
+        layername_in_filename=layername_in_filename,
+        switch_axes=switch_axes,
+        on_outside_layer_bounds=on_outside_layer_bounds,
+    )
+    return None if result is None else result[0]
+
+
+def _load_image_to_file(
+    layersources: WMSLayerSource | FileLayerSource | list,
+    output_dir: Path,
+    crs: str | pyproj.CRS,
+    bbox: tuple[float, float, float, float],
+    size: tuple[int, int],
+    ssl_verify: bool | str = True,
+    image_format: str = FORMAT_GEOTIFF,
+    image_format_save: str | None = None,
+    output_filename: str | None = None,
+    transparent: bool = False,
+    tiff_compress: str = "lzw",
+    image_pixels_ignore_border: int = 0,
+    force: bool = False,
+    layername_in_filename: bool = False,
+    switch_axes: bool | None = None,
+    on_outside_layer_bounds: str | None = "raise",
+) -> tuple[Path, int, str | None] | None:
+    """Loads an image from a layer source and saves it to a file.
+
+    See :func:`load_image_to_file` for the parameters.
+
+    Returns:
+        tuple[Path, int, str | None] | None: The path the file is created at, its size
+            in bytes and its checksum, if it was created succesfully. If the file
+            existed already, the checksum is None. None if the file is not created.
+    """
     # Init
     if on_outside_layer_bounds not in ["raise", "return"]:
         raise ValueError(f"Invalid value for {on_outside_layer_bounds=}")
@@ -686,9 +1218,10 @@ def load_image_to_file(
 
     # If force is false and file exists already, stop...
     if not force and output_filepath.exists():
-        if output_filepath.stat().st_size > 0:
+        size_bytes = output_filepath.stat().st_size
+        if size_bytes > 0:
             logger.debug(f"File already exists, skip: {output_filepath}")
-            return output_filepath
+            return output_filepath, size_bytes, None
         else:
             try:
                 output_filepath.unlink()
@@ -716,174 +1249,295 @@ def load_image_to_file(
                 return None
         raise ex
 
-    # Write (temporary) output file
     image_data_output, image_profile_output = image
+    return _write_image_to_file(
+        image_data=image_data_output,
+        image_profile=image_profile_output,
+        output_filepath=output_filepath,
+        crs=crs,
+        bbox=bbox,
+        size=size,
+        image_format=image_format,
+        image_format_save=image_format_save,
+        tiff_compress=tiff_compress,
+    )
 
-    # Set correct output driver in profile
-    image_profile_output["driver"] = _get_driver_for_image_format(image_format_save)
+
+def _write_image_to_file(
+    image_data: np.ndarray,
+    image_profile: dict[str, Any],
+    output_filepath: Path,
+    crs: pyproj.CRS,
+    bbox: tuple[float, float, float, float],
+    size: tuple[int, int],
+    image_format: str,
+    image_format_save: str,
+    tiff_compress: str,
+) -> tuple[Path, int, str]:
+    """Write an image loaded with :func:`load_image` to a file.
+
+    Returns:
+        tuple[Path, int, str]: The path the file is created at, its size in bytes and
+            its checksum.
+    """
+    # Prepare the profile to write the output file with
+    if image_format_save in (FORMAT_GEOTIFF, image_format):
+        image_profile["driver"] = _get_driver_for_image_format(image_format_save)
+    elif image_format_save == FORMAT_TIFF:
+        image_profile = rio_profiles.Profile(
+            width=image_profile["width"],
+            height=image_profile["height"],
+            nodata=image_profile["nodata"],
+            dtype=image_profile["dtype"],
+            compress=tiff_compress,
+            driver=FORMAT_TIFF_DRIVER,
+        )
+    else:
+        raise Exception(f"Unsupported image_format_save: {image_format_save}")
+
+    if image_format_save == FORMAT_GEOTIFF:
+        # The transform is already in the profile, the crs might not be
+        image_profile["crs"] = crs
+    else:
+        # The file format doesn't support coordinates, so a worldfile is used
+        image_profile.pop("transform", None)
+        image_profile.pop("crs", None)
 
     # Prepare output bands and set them correctly in profile
-    if (
-        image_format_save in [FORMAT_JPEG, FORMAT_PNG]
-        and image_data_output.shape[0] == 2
-    ):
+    if image_format_save in [FORMAT_JPEG, FORMAT_PNG] and image_data.shape[0] == 2:
         zero_band = np.zeros(
-            shape=(1, image_data_output.shape[1], image_data_output.shape[2]),
-            dtype=image_data_output.dtype,
+            shape=(1, image_data.shape[1], image_data.shape[2]),
+            dtype=image_data.dtype,
         )
-        image_data_output = np.append(image_data_output, zero_band, axis=0)
+        image_data = np.append(image_data, zero_band, axis=0)
 
-    assert isinstance(image_data_output, np.ndarray)
-    image_profile_output["count"] = image_data_output.shape[0]
-    image_profile_output = _get_cleaned_write_profile(image_profile_output)
+    assert isinstance(image_data, np.ndarray)
+    image_profile["count"] = image_data.shape[0]
+    image_profile = _get_cleaned_write_profile(image_profile)
 
-    # Because the (temporary) output file doesn't contain coordinates (yet),
-    # suppress NotGeoreferencedWarning while writing
+    # Encode the image in memory, so it is written to disk in one go. If the file
+    # format doesn't support coordinates, suppress NotGeoreferencedWarning.
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=rio_errors.NotGeoreferencedWarning)
+        with rio.MemoryFile() as memfile:
+            with memfile.open(**image_profile) as image_file:
+                image_file.write(image_data)
+            image_bytes = memfile.read()
 
-        try:
-            with rio.open(
-                str(output_filepath), "w", **image_profile_output
-            ) as image_file:
-                image_file.write(image_data_output)
-        except CPLE_AppDefinedError as ex:  # pragma: no cover
-            errmsg = ex.errmsg.strip()
-            if errmsg.startswith("Deleting ") and errmsg.endswith(
-                (" failed: No such file or directory", " failed: Permission denied")
-            ):
-                # Occasionally this error occurs, not sure why: ignore it.
-                logger.debug(f"Ignore error: {ex}")
-            else:
-                raise ex
+    if image_format_save != FORMAT_GEOTIFF:
+        # For file formats that doesn't support coordinates, we add a worldfile
+        crs_pixel_x_size = (bbox[2] - bbox[0]) / size[0]
+        crs_pixel_y_size = (bbox[1] - bbox[3]) / size[1]
 
-    # If an aux.xml file was written, remove it again...
-    output_aux_path = output_filepath.parent / f"{output_filepath.name}.aux.xml"
-    try:
-        output_aux_path.unlink(missing_ok=True)
-    except Exception as ex:  # pragma: no cover
-        # Occasionally the .aux.xml file is locked, not sure why: ignore it.
-        logger.debug(f"Ignore error: {ex}")
+        path_noext = output_filepath.parent / output_filepath.stem
+        ext_world = _get_world_ext_for_image_format(image_format_save)
+        output_worldfile_filepath = Path(str(path_noext) + ext_world)
+        worldfile_lines = [
+            f"{crs_pixel_x_size}",
+            "0.000",
+            "0.000",
+            f"{crs_pixel_y_size}",
+            f"{bbox[0]}",
+            f"{bbox[3]}",
+        ]
+        _write_bytes_atomic(
+            output_worldfile_filepath, "\n".join(worldfile_lines).encode()
+        )
 
-    # Make the output image compliant with image_format_save
+    # Write the image last, as its existence means the tile is cached
+    _write_bytes_atomic(output_filepath, image_bytes)
 
-    # If geotiff is asked, check if the coordinates are embedded...
-    if image_format_save == FORMAT_GEOTIFF:
-        # Read output image to check if coördinates are there
-        with rio.open(str(output_filepath)) as image_file:
-            image_profile_orig = image_file.profile
-            image_transform_affine = image_file.transform
-            image_data_output = image_file.read()
-
-        logger.debug(f"original image_profile: {image_profile_orig}")
-
-        # If coordinates are not embedded add them
-        if image_transform_affine[2] == 0 and image_transform_affine[5] == 0:
-            logger.debug(
-                f"Coordinates not in image, driver: {image_profile_orig['driver']}"
-            )
+    return output_filepath, len(image_bytes), tile_manifest.get_checksum(image_bytes)
 
-            # If profile format is not gtiff, create new profile
-            if image_profile_orig["driver"] != "GTiff":
-                image_profile_gtiff = rio_profiles.DefaultGTiffProfile.defaults
 
-                # Copy appropriate info from source file
-                image_profile_gtiff.update(
-                    count=image_profile_orig["count"],
-                    nodata=image_profile_orig["nodata"],
-                    dtype=image_profile_orig["dtype"],
-                )
-                image_profile = image_profile_gtiff
-            else:
-                image_profile = image_profile_orig
-
-            # Set the asked compression
-            image_profile.update(compress=tiff_compress, width=size[0], height=size[1])
-
-            # For some coordinate systems apparently the axis ordered is wrong in LibOWS
-            crs_pixel_x_size = (bbox[2] - bbox[0]) / size[0]
-            crs_pixel_y_size = (bbox[1] - bbox[3]) / size[1]
-
-            logger.debug(
-                "Coordinates to put in geotiff:\n"
-                f"    - x-part of pixel width, W-E: {crs_pixel_x_size}\n"
-                "    - y-part of pixel width, W-E (0 if image is exactly N up): 0\n"
-                f"    - top-left x: {bbox[0]}\n"
-                "    - x-part of pixel height, N-S (0 if image is exactly N up): \n"
-                f"    - y-part of pixel height, N-S: {crs_pixel_y_size}\n"
-                f"    - top-left y: {bbox[3]}"
-            )
+def _load_metatile_to_files(
+    layersources: list[WMSLayerSource | FileLayerSource],
+    tile_records: list[dict[str, Any]],
+    crs: pyproj.CRS,
+    ssl_verify: bool | str = True,
+    image_format: str = FORMAT_GEOTIFF,
+    image_format_save: str | None = None,
+    transparent: bool = False,
+    tiff_compress: str = "lzw",
+    image_pixels_ignore_border: int = 0,
+    switch_axes: bool | None = None,
+    force: bool = False,
+) -> list[tuple[Path, int, str | None] | None]:
+    """Loads the image of a meta-tile in one go and cuts the tiles in it from it.
 
-            # Add transform and crs to the profile
-            image_profile.update(
-                transform=rio_transform.Affine(
-                    crs_pixel_x_size, 0, bbox[0], 0, crs_pixel_y_size, bbox[3]
-                ),
-                crs=crs,
-            )
+    The tiles should be on the same pixel grid, but they can overlap. If there is only
+    one tile or if the meta-tile is (partly) outside the layer bounds, the tiles are
+    loaded one by one.
 
-            # Delete output file, and write again
-            output_filepath.unlink()
-            with rio.open(str(output_filepath), "w", **image_profile) as image_file:
-                image_file.write(image_data_output)
+    Args:
+        layersources (list): Layer sources to get images from.
+        tile_records (list[dict[str, Any]]): a record for each tile with the "path"
+            to save the image to, the "bounds" of the tile and its "pixel_width" and
+            "pixel_height".
+        crs (pyproj.CRS): The crs of the source and destination images.
+        ssl_verify (bool or str, optional): see :func:`load_image_to_file`.
+            Defaults to True.
+        image_format (str, optional): The image format to get. Defaults to
+            FORMAT_GEOTIFF.
+        image_format_save (str, optional): The image format to save to. If None,
+            `image_format` is used. Defaults to None.
+        transparent (bool, optional): Whether the image should be transparent.
+            Defaults to False.
+        tiff_compress (str, optional): The compression for tiff files.
+            Defaults to "lzw".
+        image_pixels_ignore_border (int, optional): The number of pixels to ignore at
+            the border of the meta-tile. Defaults to 0.
+        switch_axes (bool, optional): see :func:`load_image_to_file`.
+            Defaults to None.
+        force (bool, optional): True to overwrite images that exist already.
+            Defaults to False.
 
-    else:
-        # For file formats that doesn't support coordinates, we add a worldfile
-        crs_pixel_x_size = (bbox[2] - bbox[0]) / size[0]
-        crs_pixel_y_size = (bbox[1] - bbox[3]) / size[1]
+    Returns:
+        list[tuple[Path, int, str | None] | None]: for each tile, the path the file is
+            created at, its size in bytes and its checksum. If the file existed
+            already, the checksum is None. None for tiles that are outside the layer
+            bounds.
+    """
+    if image_format_save is None:
+        image_format_save = image_format
 
-        path_noext = output_filepath.parent / output_filepath.stem
-        ext_world = _get_world_ext_for_image_format(image_format_save)
-        output_worldfile_filepath = Path(str(path_noext) + ext_world)
+    def load_tile(record: dict[str, Any]) -> tuple[Path, int, str | None] | None:
+        return _load_image_to_file(
+            layersources=layersources,
+            output_dir=record["path"].parent,
+            crs=crs,
+            bbox=record["bounds"],
+            size=(record["pixel_width"], record["pixel_height"]),
+            ssl_verify=ssl_verify,
+            image_format=image_format,
+            image_format_save=image_format_save,
+            output_filename=record["path"].name,
+            transparent=transparent,
+            tiff_compress=tiff_compress,
+            image_pixels_ignore_border=image_pixels_ignore_border,
+            switch_axes=switch_axes,
+            force=force,
+            on_outside_layer_bounds="return",
+        )
 
-        with output_worldfile_filepath.open("w") as wld_file:
-            wld_file.write(f"{crs_pixel_x_size}")
-            wld_file.write("\n0.000")
-            wld_file.write("\n0.000")
-            wld_file.write(f"\n{crs_pixel_y_size}")
-            wld_file.write(f"\n{bbox[0]}")
-            wld_file.write(f"\n{bbox[3]}")
-
-        # If the image format to save is different, or if a border needs to be ignored
-        if image_format != image_format_save or image_pixels_ignore_border > 0:
-            # Read image
-            with rio.open(str(output_filepath)) as image_file:
-                image_profile_orig = image_file.profile
-                image_transform_affine = image_file.transform
-                image_data_output = image_file.read()
-
-            # If same save format, reuse profile
-            if image_format == image_format_save:
-                image_profile_curr = image_profile_orig
-                if image_pixels_ignore_border != 0:
-                    image_profile_curr.update(width=size[0], height=size[1])
-            else:
-                if image_format_save == FORMAT_TIFF:
-                    driver = "GTiff"
-                    compress = tiff_compress
-                else:
-                    raise Exception(
-                        f"Unsupported image_format_save: {image_format_save}"
-                    )
-                image_profile_curr = rio_profiles.Profile(
-                    width=size[0],
-                    height=size[1],
-                    count=image_profile_orig["count"],
-                    nodata=image_profile_orig["nodata"],
-                    dtype=image_profile_orig["dtype"],
-                    compress=compress,
-                    driver=driver,
-                )
+    if len(tile_records) == 1:
+        return [load_tile(tile_records[0])]
+
+    # Tiles that exist already don't need to be loaded again
+    results: dict[int, tuple[Path, int, str | None] | None] = {}
+    if not force:
+        for idx, record in enumerate(tile_records):
+            if record["path"].exists() and record["path"].stat().st_size > 0:
+                results[idx] = (record["path"], record["path"].stat().st_size, None)
+        if len(results) == len(tile_records):
+            return list(results.values())
+
+    # The bbox and size of the meta-tile are those of all tiles combined
+    xmin = min(record["bounds"][0] for record in tile_records)
+    ymin = min(record["bounds"][1] for record in tile_records)
+    xmax = max(record["bounds"][2] for record in tile_records)
+    ymax = max(record["bounds"][3] for record in tile_records)
+    first_bounds = tile_records[0]["bounds"]
+    x_pixsize = (first_bounds[2] - first_bounds[0]) / tile_records[0]["pixel_width"]
+    y_pixsize = (first_bounds[3] - first_bounds[1]) / tile_records[0]["pixel_height"]
+    size = (round((xmax - xmin) / x_pixsize), round((ymax - ymin) / y_pixsize))
 
-            # Delete output file, and write again
-            output_filepath.unlink()
-            image_profile_curr = _get_cleaned_write_profile(image_profile_curr)
-            with rio.open(
-                str(output_filepath), "w", **image_profile_curr
-            ) as image_file:
-                image_file.write(image_data_output)
+    try:
+        image_data, image_profile = load_image(
+            layersources=layersources,
+            crs=crs,
+            bbox=(xmin, ymin, xmax, ymax),
+            size=size,
+            ssl_verify=ssl_verify,
+            image_format=image_format,
+            transparent=transparent,
+            image_pixels_ignore_border=image_pixels_ignore_border,
+            switch_axes=switch_axes,
+        )
+    except RuntimeError as ex:  # pragma: no cover
+        if not str(ex).startswith("Bbox outside layer bounds"):
+            raise
+        # Load the tiles one by one, so the ones inside the layer bounds are saved
+        return [
+            results[idx] if idx in results else load_tile(record)
+            for idx, record in enumerate(tile_records)
+        ]
+
+    # Cut the tiles from the meta-tile, overlaps included
+    for idx, record in enumerate(tile_records):
+        if idx in results:
+            continue
+        bounds = record["bounds"]
+        width, height = record["pixel_width"], record["pixel_height"]
+        col_off = round((bounds[0] - xmin) / x_pixsize)
+        row_off = round((ymax - bounds[3]) / y_pixsize)
+        tile_profile = dict(image_profile)
+        tile_profile["width"] = width
+        tile_profile["height"] = height
+        tile_profile["transform"] = rio.Affine(
+            x_pixsize, 0.0, bounds[0], 0.0, -y_pixsize, bounds[3]
+        )
+        record["path"].parent.mkdir(parents=True, exist_ok=True)
+        results[idx] = _write_image_to_file(
+            image_data=image_data[
+                :, row_off : row_off + height, col_off : col_off + width
+            ],
+            image_profile=tile_profile,
+            output_filepath=record["path"],
+            crs=crs,
+            bbox=bounds,
+            size=(width, height),
+            image_format=image_format,
+            image_format_save=image_format_save,
+            tiff_compress=tiff_compress,
+        )
+
+    return [results[idx] for idx in range(len(tile_records))]
 
-    return output_filepath
+
+def _iter_metatiles(
+    tile_records: Iterable[dict[str, Any]],
+    metatile_factor: tuple[int, int],
+    grid_xmin: float,
+    grid_ymin: float,
+    crs_width: float,
+    crs_height: float,
+) -> Iterator[list[dict[str, Any]]]:
+    """Group tiles of a grid in meta-tiles of `metatile_factor` columns x rows.
+
+    The tiles should be ordered column by column, as they are by
+    :func:`get_images_for_grid`, so only the tiles of the current meta-tile columns
+    need to be kept in memory.
+
+    Args:
+        tile_records (Iterable[dict[str, Any]]): a record for each tile with the
+            "bounds" of the tile.
+        metatile_factor (tuple[int, int]): the number of columns and rows of tiles in a
+            meta-tile.
+        grid_xmin (float): xmin of the grid.
+        grid_ymin (float): ymin of the grid.
+        crs_width (float): the width of the tiles, without overlap.
+        crs_height (float): the height of the tiles, without overlap.
+
+    Yields:
+        list[dict[str, Any]]: the records of the tiles in a meta-tile.
+    """
+    nb_cols, nb_rows = metatile_factor
+    metatiles: dict[tuple[int, int], list[dict[str, Any]]] = {}
+    current_metatile_col = None
+    for record in tile_records:
+        bounds = record["bounds"]
+        # Use the center of the tile, so the overlap doesn't matter
+        col = math.floor(((bounds[0] + bounds[2]) / 2 - grid_xmin) / crs_width)
+        row = math.floor(((bounds[1] + bounds[3]) / 2 - grid_ymin) / crs_height)
+        metatile_col = col // nb_cols
+        if metatile_col != current_metatile_col:
+            yield from metatiles.values()
+            metatiles = {}
+            current_metatile_col = metatile_col
+        metatiles.setdefault((metatile_col, row // nb_rows), []).append(record)
+
+    yield from metatiles.values()
 
 
 def load_image(
@@ -896,6 +1550,7 @@ def load_image(
     transparent: bool = False,
     image_pixels_ignore_border: int = 0,
     switch_axes: bool | None = None,
+    session: LayerSourceSession | None = None,
 ) -> tuple[np.ndarray, dict[str, Any]]:
     """Loads an image from a layer source and returns the image data and profile.
 
@@ -922,6 +1577,9 @@ def load_image(
         switch_axes (bool, optional): True if x and y axes should be switched to
             in the WMS GetMap request. If None, an effort is made to determine it
             automatically based on the crs. Defaults to None.
+        session (LayerSourceSession, optional): the session with the cached datasets,
+            crs's and WMS services to use. If None, a default session shared by all
+            calls in the process is used. Defaults to None.
 
     Raises:
         RuntimeError: If the image can't be retrieved.
@@ -932,8 +1590,9 @@ def load_image(
             (transform, width, height,...).
     """
     # Init
-    if isinstance(crs, str):
-        crs = pyproj.CRS.from_user_input(crs)
+    if session is None:
+        session = _default_session
+    crs = session.get_crs(crs)
     if not isinstance(layersources, list):
         layersources = [layersources]
 
@@ -959,7 +1618,7 @@ def load_image(
 
     # For coordinate systems with switched axis (y, x or lon, lat), switch x and y
     if switch_axes is None:
-        switch_axes = has_switched_axes(crs)
+        switch_axes = session.has_switched_axes(crs)
     if switch_axes:
         bbox_with_border = (
             bbox_with_border[1],
@@ -968,7 +1627,8 @@ def load_image(
             bbox_with_border[2],
         )
 
-    image_data_output = None
+    # The data read from each layer source, combined in one array at the end
+    image_datas: list[np.ndarray] = []
     image_profile_output: dict[str, Any] | None = None
     response = None
     nb_retries = 5
@@ -977,49 +1637,27 @@ def load_image(
         memfile = None
         image_file = None
         rio_read_kwargs = {}
-        tmp_reprojected_path = None
+        reproject = False
         try:
             # If it is a WMS layer source
             if isinstance(layersource, WMSLayerSource):
-                # Initialize WMS if this hasn't been done yet
-                if layersource.wms_service is None:
-                    auth = _prepare_auth(
-                        layersource.username,
-                        layersource.password,
-                        ssl_verify=ssl_verify,
-                    )
-                    wms_service = owslib.wms.WebMapService(
-                        url=layersource.wms_server_url,
-                        version=layersource.wms_version,
-                        auth=auth,
-                    )
-                    if layersource.wms_ignore_capabilities_url:
-                        # If the wms url in capabilities should be ignored,
-                        # overwrite with original url
-                        nb = len(wms_service.getOperationByName("GetMap").methods)
-                        for method_id in range(nb):
-                            wms_service.getOperationByName("GetMap").methods[method_id][
-                                "url"
-                            ] = layersource.wms_server_url
-                    layersource.wms_service = wms_service
+                fetcher = session.get_wms_fetcher(layersource, ssl_verify)
 
                 # Get image from server, and retry up to nb_retries times...
                 retry_count = 0
-                time_sleep = 5
                 image_retrieved = False
                 while image_retrieved is False:
                     try:
                         logger.debug(f"Start call GetMap for bbox {bbox}")
-                        response = layersource.wms_service.getmap(
+                        response = fetcher.getmap(
                             layers=layersource.layernames,
                             styles=layersource.layerstyles,
                             srs=f"epsg:{crs.to_epsg()}",
                             bbox=bbox_with_border,
                             size=size_with_border,
-                            format=image_format,
+                            image_format=image_format,
                             transparent=transparent,
                         )
-                        logger.debug(f"Finished doing request {response.geturl()}")
 
                         # If a random sleep was specified... apply it
                         if layersource.random_sleep > 0:
@@ -1028,6 +1666,9 @@ def load_image(
                         # Image was retrieved... so stop loop
                         image_retrieved = True
                     except Exception as ex:  # pragma: no cover
+                        # Back off exponentially, with jitter so the retries of
+                        # concurrent requests are spread out.
+                        time_sleep = wms_fetcher.get_backoff_s(retry_count)
                         if isinstance(ex, owslib.util.ServiceException):
                             if "Error rendering coverage on the fast path" in str(ex):
                                 message = (
@@ -1037,14 +1678,14 @@ def load_image(
                             elif "java.lang.OutOfMemoryError: Java heap" in str(ex):
                                 logger.debug(
                                     f"Request for bbox {bbox_with_border} gave an "
-                                    f"exception, try again in {time_sleep} s: {ex}"
+                                    f"exception, try again in {time_sleep:.1f} s: {ex}"
                                 )
                             elif "ArcGIS Server Error" in str(
                                 ex
                             ) and "http.400:" in str(ex):
                                 logger.debug(
                                     f"Request for bbox {bbox_with_border} gave an "
-                                    f"exception, try again in {time_sleep} s: {ex}"
+                                    f"exception, try again in {time_sleep:.1f} s: {ex}"
                                 )
                             else:
                                 message = f"WMS error for bbox {bbox_with_border}: {ex}"
@@ -1053,10 +1694,6 @@ def load_image(
                         # If the exception isn't handled yet, retry nb_retries times...
                         if retry_count < nb_retries:
                             time.sleep(time_sleep)
-
-                            # Increase sleep time every
-                            # time.
-                            time_sleep += 5
                             retry_count += 1
                             continue
                         else:
@@ -1073,7 +1710,7 @@ def load_image(
                     raise RuntimeError("No valid response retrieved...")
 
                 # Open the response as a file
-                memfile = rio.MemoryFile(response.read())
+                memfile = rio.MemoryFile(response)
                 # Because the image returned by WMS doesn't contain georeferencing
                 # info, suppress NotGeoreferencedWarning
                 with warnings.catch_warnings():
@@ -1089,55 +1726,55 @@ def load_image(
                     # Set the GDAL_HTTP_UNSAFESSL environment variable
                     os.environ["GDAL_HTTP_UNSAFESSL"] = "YES"
 
-                image_file = rio.open(str(layersource.path))
+                # The dataset is pooled in the session, so it isn't closed here
+                image_file = session.open_dataset(layersource.path)
                 if layersource.bands is not None:
                     nb_bands = len(layersource.bands)
                 else:
-                    nb_bands = image_file.profile["count"]
-
-                if crs == image_file.crs:
-                    window = rio_windows.from_bounds(
-                        left=bbox_with_border[0],
-                        bottom=bbox_with_border[1],
-                        right=bbox_with_border[2],
-                        top=bbox_with_border[3],
-                        transform=image_file.transform,
+                    nb_bands = image_file.count
+
+                aligned_window = None
+                if session.is_same_crs(image_file, crs):
+                    # If the tile is on the pixel grid of the file or of one of its
+                    # overviews, it can be read without resampling.
+                    image_file, aligned_window = _get_aligned_window(
+                        session=session,
+                        path=layersource.path,
+                        image_file=image_file,
+                        bbox=bbox_with_border,
+                        size=size_with_border,
                     )
-                    boundless = True
 
+                if aligned_window is not None:
+                    # Read the pixels directly. Only tiles that are partly outside the
+                    # file need a boundless read.
+                    rio_read_kwargs = {
+                        "window": aligned_window,
+                        "boundless": not _is_window_inside(aligned_window, image_file),
+                    }
                 else:
-                    # If the crs of the file is different, we need to reproject.
-                    # Using `image_file = rio_vrt.WarpedVRT(image_file, crs=crs)` would
-                    # be the most elegant solution, but if the input driver is WMS with
-                    # a tiled input layer, this leads to very bad image quality.
-                    tmp_dir = Path(tempfile.gettempdir())
-                    tmp_reprojected_path = (
-                        tmp_dir
-                        / f"{int(bbox_with_border[0])}_{int(bbox_with_border[1])}.tif"
-                    )
-                    options = gdal.WarpOptions(
-                        dstSRS=crs.to_string(),
-                        outputBounds=bbox_with_border,
-                        width=size_with_border[0],
-                        height=size_with_border[1],
-                        resampleAlg="cubic",
-                    )
-                    gdal.Warp(
-                        str(tmp_reprojected_path),
-                        str(layersource.path),
-                        options=options,
-                    )
-                    image_file.close()
-                    image_file = rio.open(str(tmp_reprojected_path))
-                    boundless = True
-
-                # In the output shape, the order is (bands, height, width)
-                rio_read_kwargs = {
-                    "window": window,
-                    "out_shape": (nb_bands, size_with_border[1], size_with_border[0]),
-                    "resampling": rio_warp.Resampling.cubic,
-                    "boundless": boundless,
-                }
+                    if session.is_same_crs(image_file, crs):
+                        window = rio_windows.from_bounds(
+                            left=bbox_with_border[0],
+                            bottom=bbox_with_border[1],
+                            right=bbox_with_border[2],
+                            top=bbox_with_border[3],
+                            transform=image_file.transform,
+                        )
+                        # In the output shape, the order is (bands, height, width)
+                        rio_read_kwargs = {
+                            "window": window,
+                            "out_shape": (
+                                nb_bands,
+                                size_with_border[1],
+                                size_with_border[0],
+                            ),
+                            "resampling": rio_warp.Resampling.cubic,
+                            "boundless": True,
+                        }
+                    else:
+                        # If the crs of the file is different, we need to reproject.
+                        reproject = True
             else:
                 raise ValueError(f"Unsupported layer source: <{layersource}>")
 
@@ -1147,67 +1784,73 @@ def load_image(
             # reading remote files.
             nb_retries_read = nb_retries if image_file.profile["driver"] == "VRT" else 0
 
-            if layersource.bands is None:
-                # If no specific bands specified, read them all...
-                image_data_cur = _rio_read(image_file, rio_read_kwargs, nb_retries_read)
-                if image_data_output is None:
-                    image_data_output = image_data_cur
-                else:
-                    image_data_output = np.append(
-                        image_data_output, image_data_cur, axis=0
-                    )
-            elif len(layersource.bands) == 1 and layersource.bands[0] == -1:
-                # If 1 band, -1 specified: dirty hack to use greyscale
-                # version of rgb image
-                image_data_tmp = _rio_read(image_file, rio_read_kwargs, nb_retries_read)
-                image_data_grey = np.mean(image_data_tmp, axis=0).astype(
-                    image_data_tmp.dtype
+            # If bands specified, only read the bands to keep, all in one read. If
+            # no bands or 1 band -1 is specified, read them all.
+            # Remark: rasterio uses 1-based indexing instead of 0-based
+            indexes = None
+            if layersource.bands is not None and layersource.bands != [-1]:
+                indexes = [band + 1 for band in layersource.bands]
+
+            if reproject:
+                image_data_curr = _rio_read_reprojected(
+                    image_file,
+                    indexes=indexes,
+                    crs=crs,
+                    bbox=bbox_with_border,
+                    size=size_with_border,
+                    nb_retries=nb_retries_read,
                 )
-                new_shape = (1, image_data_grey.shape[0], image_data_grey.shape[1])
-                image_data_grey = np.reshape(image_data_grey, new_shape)
-                if image_data_output is None:
-                    image_data_output = image_data_grey
-                else:
-                    image_data_output = np.append(
-                        image_data_output, image_data_grey, axis=0
-                    )
             else:
-                # If bands specified, only read the bands to keep...
-                for band in layersource.bands:
-                    # Read the band needed + reshape. Remark: rasterio uses
-                    # 1-based indexing instead of 0-based
-                    rio_read_kwargs["indexes"] = band + 1
-                    image_data_curr = _rio_read(
-                        image_file, rio_read_kwargs, nb_retries_read
-                    )
-                    new_shape = (1, image_data_curr.shape[0], image_data_curr.shape[1])
-                    image_data_curr = np.reshape(image_data_curr, new_shape)
+                if indexes is not None:
+                    rio_read_kwargs["indexes"] = indexes
+                image_data_curr = _rio_read(
+                    image_file, rio_read_kwargs, nb_retries_read
+                )
 
-                    # Set or append to image_data_output
-                    if image_data_output is None:
-                        image_data_output = image_data_curr
-                    else:
-                        image_data_output = np.append(
-                            image_data_output, image_data_curr, axis=0
-                        )
+            if layersource.bands == [-1]:
+                # If 1 band, -1 specified: dirty hack to use greyscale
+                # version of rgb image
+                image_data_curr = np.mean(
+                    image_data_curr, axis=0, keepdims=True
+                ).astype(image_data_curr.dtype)
+            image_datas.append(image_data_curr)
 
             # Prepare output profile. Width, height,... will be corrected later.
             if image_profile_output is None:
                 image_profile_output = dict(image_file.profile)
+                if reproject:
+                    image_profile_output["crs"] = rio.crs.CRS.from_wkt(crs.to_wkt())
+
+        except Exception:
+            # The pooled dataset might be in a bad state, so open it again next time
+            if isinstance(layersource, FileLayerSource):
+                session.discard_dataset(layersource.path)
+            raise
 
         finally:
-            if image_file is not None:
-                image_file.close()
-                image_file = None
             if memfile is not None:
+                if image_file is not None:
+                    image_file.close()
                 memfile.close()
                 memfile = None
-            if tmp_reprojected_path is not None:
-                tmp_reprojected_path.unlink(missing_ok=True)
 
-    if image_data_output is None or image_profile_output is None:  # pragma: no cover
+    if len(image_datas) == 0 or image_profile_output is None:  # pragma: no cover
         raise RuntimeError("No image data retrieved...")
 
+    # Combine the data of all layer sources in one preallocated array
+    if len(image_datas) == 1:
+        image_data_output = image_datas[0]
+    else:
+        image_data_output = np.empty(
+            (sum(data.shape[0] for data in image_datas), *image_datas[0].shape[1:]),
+            dtype=np.result_type(*image_datas),
+        )
+        band_start = 0
+        for image_data in image_datas:
+            band_end = band_start + image_data.shape[0]
+            image_data_output[band_start:band_end] = image_data
+            band_start = band_end
+
     # If a border needs to be ignored, remove it from the image data
     if image_pixels_ignore_border > 0:
         assert isinstance(image_data_output, np.ndarray)
@@ -1444,6 +2087,21 @@ def _get_world_ext_for_image_format(image_format: str) -> str:
         )
 
 
+def _write_bytes_atomic(path: Path, data: bytes):
+    """Write data to a file, so it is never incomplete, even if writing fails.
+
+    Args:
+        path (Path): the path to write to.
+        data (bytes): the data to write.
+    """
+    tmp_path = path.parent / f"{path.name}.{os.getpid()}_{threading.get_ident()}.tmp"
+    try:
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
 def _get_cleaned_write_profile(
     profile: dict | rio_profiles.Profile,
 ) -> dict | rio_profiles.Profile:
@@ -1479,14 +2137,133 @@ def _get_cleaned_write_profile(
     return profile_cleaned
 
 
+def _get_aligned_window(
+    session: LayerSourceSession,
+    path: Path,
+    image_file: rio.DatasetReader,
+    bbox: tuple[float, float, float, float],
+    size: tuple[int, int],
+) -> tuple[rio.DatasetReader, rio_windows.Window | None]:
+    """Get the window to read a tile without resampling, if possible.
+
+    This is possible if the tile has the pixel size of the file and its bounds are on
+    the pixel grid of the file. If the pixel size of the tile is coarser, the same
+    applies to the overview with that pixel size, if there is one.
+
+    Args:
+        session (LayerSourceSession): the session to open overviews with.
+        path (Path): the path to the file.
+        image_file (rio.DatasetReader): the file, opened at full resolution.
+        bbox (tuple[float, float, float, float]): the bounds of the tile.
+        size (tuple[int, int]): the width and height of the tile in pixels.
+
+    Returns:
+        tuple[rio.DatasetReader, rio_windows.Window | None]: the file or overview to
+            read and the window to read from it. The window is None if the tile can't
+            be read without resampling.
+    """
+    transform = image_file.transform
+    if not transform.is_rectilinear or transform.a <= 0 or transform.e >= 0:
+        return (image_file, None)
+
+    # Pixel offsets up to 1/1000 of a pixel are considered rounding errors
+    tolerance = 1e-3
+    pixel_size = (bbox[2] - bbox[0]) / size[0]
+    factor = pixel_size / transform.a
+    if factor < 1 - tolerance:
+        return (image_file, None)
+    if factor > 1 + tolerance:
+        # Look for an overview with the pixel size needed
+        decimations = image_file.overviews(1)
+        if len(decimations) == 0:
+            return (image_file, None)
+        level = int(np.argmin([abs(decimation - factor) for decimation in decimations]))
+        if abs(decimations[level] - factor) > factor * tolerance:
+            return (image_file, None)
+        image_file = session.open_dataset(path, overview_level=level)
+
+    window = rio_windows.from_bounds(*bbox, transform=image_file.transform)
+    col_off = round(window.col_off)
+    row_off = round(window.row_off)
+    if (
+        abs(window.col_off - col_off) > tolerance
+        or abs(window.row_off - row_off) > tolerance
+        or abs(window.width - size[0]) > tolerance
+        or abs(window.height - size[1]) > tolerance
+    ):
+        return (image_file, None)
+
+    return (image_file, rio_windows.Window(col_off, row_off, size[0], size[1]))
+
+
+def _is_window_inside(window: rio_windows.Window, image_file: rio.DatasetReader):
+    return (
+        window.col_off >= 0
+        and window.row_off >= 0
+        and window.col_off + window.width <= image_file.width
+        and window.row_off + window.height <= image_file.height
+    )
+
+
+def _rio_read_reprojected(
+    image_file: rio.DatasetReader,
+    indexes: list[int] | None,
+    crs: pyproj.CRS,
+    bbox: tuple[float, float, float, float],
+    size: tuple[int, int],
+    nb_retries: int = 0,
+) -> np.ndarray:
+    """Read the bands of a file reprojected to another crs, in memory.
+
+    The file is warped directly to the pixels requested with cubic resampling, like
+    gdal.Warp does. Reading a `rio_vrt.WarpedVRT(image_file, crs=crs)` with an
+    `out_shape` would be simpler, but first warping the file at its own resolution
+    leads to very bad image quality if the file is a WMS with a tiled input layer.
+
+    Args:
+        image_file (rio.DatasetReader): the file to read.
+        indexes (list[int] | None): the (1-based) bands to read. If None, all bands.
+        crs (pyproj.CRS): the crs to reproject to.
+        bbox (tuple[float, float, float, float]): the bounds to read, in `crs`.
+        size (tuple[int, int]): the width and height to read in pixels.
+        nb_retries (int, optional): the number of times to retry if the read fails.
+            Defaults to 0.
+
+    Returns:
+        np.ndarray: the image data, with shape (bands, height, width).
+    """
+    if indexes is None:
+        indexes = list(range(1, image_file.count + 1))
+    image_data = np.zeros(
+        (len(indexes), size[1], size[0]), dtype=image_file.dtypes[indexes[0] - 1]
+    )
+    dst_transform = rio_transform.from_bounds(*bbox, width=size[0], height=size[1])
+
+    def read():
+        rio_warp.reproject(
+            source=rio.band(image_file, indexes),
+            destination=image_data,
+            dst_transform=dst_transform,
+            dst_crs=crs,
+            resampling=rio_warp.Resampling.cubic,
+        )
+        return image_data
+
+    return _retry_read(read, nb_retries)
+
+
 def _rio_read(
     image_file: rio.DatasetReader, rio_read_kwargs: dict, nb_retries: int = 0
 ):
+    return _retry_read(lambda: image_file.read(**rio_read_kwargs), nb_retries)
+
+
+def _retry_read(read_func: Callable[[], np.ndarray], nb_retries: int = 0):
     retry_count = 0
     time_sleep = 1
     while True:
         try:
-            return image_file.read(**rio_read_kwargs)
+            return read_func()
         except Exception as ex:  # pragma: no cover
             if retry_count < nb_retries:
                 time.sleep(time_sleep)
@@ -0,0 +1,422 @@
+"""Module to cache the images of an image layer in a mosaic of blocks."""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent import futures
+from pathlib import Path
+
+import numpy as np
+import pycron
+import pyproj
+import rasterio as rio
+from osgeo import gdal
+from rasterio.enums import Resampling
+
+from orthoseg.util import _processing_util, image_util, progress_util
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# Activate gdal to raise exceptions instead of printing/returning errors/errorcodes
+gdal.UseExceptions()
+
+
+class MosaicCache:
+    """Image cache that stores the pixels of an image layer once, in a mosaic.
+
+    The pixels are stored at the pixel size of the image layer, in square blocks that
+    are aligned with the grid of the image layer. Each block is a tiled GeoTIFF with
+    overviews. A VRT file combines all blocks into one file, so images with any size and
+    overlap can be read from the cache as from a file layer, e.g. using
+    :meth:`get_layersource`.
+
+    Parts of the mosaic that aren't loaded have value 0.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        crs: str | pyproj.CRS,
+        pixel_x_size: float,
+        pixel_y_size: float,
+        grid_xmin: float = 0.0,
+        grid_ymin: float = 0.0,
+        block_size: int = 4096,
+    ):
+        """Constructor for MosaicCache.
+
+        Args:
+            cache_dir (Path): the directory to store the mosaic in.
+            crs (str | pyproj.CRS): the crs of the mosaic.
+            pixel_x_size (float): the pixel size in the x direction.
+            pixel_y_size (float): the pixel size in the y direction.
+            grid_xmin (float, optional): xmin of the grid to align the blocks with.
+                Defaults to 0.0.
+            grid_ymin (float, optional): ymin of the grid to align the blocks with.
+                Defaults to 0.0.
+            block_size (int, optional): the width and height of the blocks in pixels.
+                Defaults to 4096.
+        """
+        self.cache_dir = cache_dir
+        self.crs = pyproj.CRS(crs)
+        self.pixel_x_size = pixel_x_size
+        self.pixel_y_size = pixel_y_size
+        self.grid_xmin = grid_xmin
+        self.grid_ymin = grid_ymin
+        self.block_size = block_size
+
+        self.blocks_dir = cache_dir / "blocks"
+        self.vrt_path = cache_dir / "mosaic.vrt"
+        self.metadata_path = cache_dir / "mosaic.json"
+
+    @property
+    def exists(self) -> bool:
+        """True if blocks were loaded in the mosaic."""
+        return self.vrt_path.exists()
+
+    def get_layersource(self) -> image_util.FileLayerSource:
+        """Get a layer source to read images from the mosaic.
+
+        Returns:
+            image_util.FileLayerSource: the layer source.
+        """
+        return image_util.FileLayerSource(
+            path=self.vrt_path, layernames=[self.cache_dir.parent.name]
+        )
+
+    def get_block_path(self, block_bounds: tuple[float, float, float, float]) -> Path:
+        """Get the path to the file of a block.
+
+        The blocks are named the same way as the tiles in a tile cache.
+
+        Args:
+            block_bounds (tuple[float, float, float, float]): the bounds of the block.
+
+        Returns:
+            Path: the path to the file.
+        """
+        subdir_format = "{:06.0f}" if self.crs.is_projected else "{:09.4f}"
+        filename = image_util.create_filename(
+            crs=self.crs,
+            bbox=block_bounds,
+            size=(self.block_size, self.block_size),
+            image_format=image_util.FORMAT_GEOTIFF,
+        )
+        return self.blocks_dir / subdir_format.format(block_bounds[0]) / filename
+
+    def get_blocks(
+        self, bbox: tuple[float, float, float, float]
+    ) -> list[tuple[float, float, float, float]]:
+        """Get the bounds of the blocks that intersect with a bbox.
+
+        Args:
+            bbox (tuple[float, float, float, float]): the bbox.
+
+        Returns:
+            list[tuple[float, float, float, float]]: the bounds of the blocks.
+        """
+        block_width = self.block_size * self.pixel_x_size
+        block_height = self.block_size * self.pixel_y_size
+
+        # Ignore rounding errors of less than a pixel
+        cols = range(
+            math.floor((bbox[0] - self.grid_xmin) / block_width + 1 / self.block_size),
+            math.ceil((bbox[2] - self.grid_xmin) / block_width - 1 / self.block_size),
+        )
+        rows = range(
+            math.floor((bbox[1] - self.grid_ymin) / block_height + 1 / self.block_size),
+            math.ceil((bbox[3] - self.grid_ymin) / block_height - 1 / self.block_size),
+        )
+        return [
+            (
+                self.grid_xmin + col * block_width,
+                self.grid_ymin + row * block_height,
+                self.grid_xmin + (col + 1) * block_width,
+                self.grid_ymin + (row + 1) * block_height,
+            )
+            for col in cols
+            for row in rows
+        ]
+
+    def is_cached(self, bbox: tuple[float, float, float, float]) -> bool:
+        """Check if all pixels in a bbox are loaded in the mosaic.
+
+        Args:
+            bbox (tuple[float, float, float, float]): the bbox.
+
+        Returns:
+            bool: True if all blocks that intersect with the bbox are loaded.
+        """
+        return self.exists and all(
+            self.get_block_path(block_bounds).exists()
+            for block_bounds in self.get_blocks(bbox)
+        )
+
+    def load(
+        self,
+        layersources: list,
+        image_gen_bbox: tuple[float, float, float, float] | None = None,
+        image_gen_roi_filepath: Path | None = None,
+        request_size: int = 1024,
+        image_format: str = image_util.FORMAT_GEOTIFF,
+        image_pixels_ignore_border: int = 0,
+        transparent: bool = False,
+        switch_axes: bool | None = None,
+        tiff_compress: str = "jpeg",
+        nb_concurrent_calls: int = 1,
+        ssl_verify: bool | str = True,
+        cron_schedule: str | None = None,
+        force: bool = False,
+    ) -> Path:
+        """Load the blocks of the mosaic that intersect with the roi.
+
+        The pixels of each block are requested from the layer sources in images of at
+        most `request_size` pixels, e.g. because WMS services limit the size of images
+        that can be requested.
+
+        Args:
+            layersources (list): the layer sources to load the images from.
+            image_gen_bbox (tuple[float, float, float, float], optional): bbox of the
+                roi to load. Defaults to None.
+            image_gen_roi_filepath (Path, optional): file with the roi to load.
+                Defaults to None.
+            request_size (int, optional): the maximum width and height in pixels of the
+                images to request from the layer sources. Defaults to 1024.
+            image_format (str, optional): the image format to request images in from a
+                WMS. Defaults to FORMAT_GEOTIFF.
+            image_pixels_ignore_border (int, optional): the number of pixels to ignore
+                at the border of the images requested. Defaults to 0.
+            transparent (bool, optional): whether the images requested should be
+                transparent. Defaults to False.
+            switch_axes (bool, optional): True if the x and y axes should be switched
+                in WMS requests. If None, it is determined based on the crs.
+                Defaults to None.
+            tiff_compress (str, optional): the compression to use for the blocks. If
+                "jpeg" and the images aren't 8 bit, "deflate" is used.
+                Defaults to "jpeg".
+            nb_concurrent_calls (int, optional): the number of blocks to load in
+                parallel. Defaults to 1.
+            ssl_verify (bool or str, optional): True to use the default certificate
+                bundle as installed on your system. False disables certificate
+                validation (NOT recommended!). If a path to a certificate bundle file
+                (.pem) is passed, this will be used. Defaults to True.
+            cron_schedule (str, optional): if specified, blocks are only loaded in the
+                time range of this cron schedule. Defaults to None.
+            force (bool, optional): True to load blocks that are loaded already again.
+                Defaults to False.
+
+        Raises:
+            ValueError: if the mosaic exists already with other settings.
+
+        Returns:
+            Path: the path to the VRT file of the mosaic.
+        """
+        self._write_metadata()
+
+        blocks_gdf = image_util.get_images_for_grid(
+            output_image_dir=self.blocks_dir,
+            crs=self.crs,
+            image_gen_bbox=image_gen_bbox,
+            image_gen_roi_filepath=image_gen_roi_filepath,
+            grid_xmin=self.grid_xmin,
+            grid_ymin=self.grid_ymin,
+            image_crs_pixel_x_size=self.pixel_x_size,
+            image_crs_pixel_y_size=self.pixel_y_size,
+            image_pixel_width=self.block_size,
+            image_pixel_height=self.block_size,
+            image_format=image_util.FORMAT_GEOTIFF,
+            cache_dir=self.cache_dir,
+        )
+        blocks_to_load = [
+            (tuple(bounds), path)
+            for bounds, path in zip(
+                blocks_gdf.geometry.bounds.itertuples(index=False),
+                blocks_gdf["path"],
+                strict=True,
+            )
+            if force or not path.exists()
+        ]
+        logger.info(
+            f"Load {len(blocks_to_load)} of {len(blocks_gdf)} blocks to "
+            f"{self.cache_dir}"
+        )
+
+        worker_type = "processes" if nb_concurrent_calls > 1 else "threads"
+        progress = progress_util.ProgressLogger(
+            message=f"load blocks to {self.cache_dir}",
+            nb_steps_total=len(blocks_to_load),
+        )
+        with _processing_util.PooledExecutorFactory(
+            worker_type=worker_type, max_workers=nb_concurrent_calls
+        ) as pool:
+            running: set[futures.Future] = set()
+            for bounds, path in blocks_to_load:
+                # Don't queue more blocks than can be loaded, so the cron schedule is
+                # checked right before each block is loaded
+                while len(running) >= nb_concurrent_calls:
+                    done, running = futures.wait(
+                        running, return_when=futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        future.result()
+                        progress.step()
+                _wait_for_cron_schedule(cron_schedule)
+
+                future = pool.submit(
+                    self._load_block,
+                    layersources=layersources,
+                    block_bounds=bounds,
+                    path=path,
+                    request_size=request_size,
+                    image_format=image_format,
+                    image_pixels_ignore_border=image_pixels_ignore_border,
+                    transparent=transparent,
+                    switch_axes=switch_axes,
+                    tiff_compress=tiff_compress,
+                    ssl_verify=ssl_verify,
+                )
+                running.add(future)
+
+            for future in futures.as_completed(running):
+                future.result()
+                progress.step()
+
+        if len(blocks_to_load) > 0 or not self.vrt_path.exists():
+            self.build_vrt()
+
+        return self.vrt_path
+
+    def build_vrt(self):
+        """Build the VRT file that combines all blocks loaded."""
+        block_paths = [str(path) for path in sorted(self.blocks_dir.glob("*/*.tif"))]
+        if len(block_paths) == 0:
+            raise ValueError(f"No blocks loaded in {self.blocks_dir}")
+
+        vrt_tmp_path = self.cache_dir / f"mosaic_{os.getpid()}.vrt"
+        gdal.BuildVRT(destName=str(vrt_tmp_path), srcDSOrSrcDSTab=block_paths)
+        vrt_tmp_path.replace(self.vrt_path)
+
+    def _write_metadata(self):
+        """Write the settings of the mosaic, or check them if it exists already."""
+        metadata = {
+            "crs": self.crs.to_wkt(),
+            "pixel_x_size": self.pixel_x_size,
+            "pixel_y_size": self.pixel_y_size,
+            "grid_xmin": self.grid_xmin,
+            "grid_ymin": self.grid_ymin,
+            "block_size": self.block_size,
+        }
+        if self.metadata_path.exists():
+            metadata_existing = json.loads(self.metadata_path.read_text())
+            if metadata_existing != metadata:
+                raise ValueError(
+                    f"mosaic cache {self.cache_dir} was created with other settings: "
+                    f"{metadata_existing}, remove it to create it with {metadata}"
+                )
+            return
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.metadata_path.write_text(json.dumps(metadata, indent=4))
+
+    def _load_block(
+        self,
+        layersources: list,
+        block_bounds: tuple[float, float, float, float],
+        path: Path,
+        request_size: int,
+        tiff_compress: str,
+        **load_image_kwargs,
+    ):
+        """Load the pixels of a block and save them to its file."""
+        xmin, _, _, ymax = block_bounds
+        image_data = None
+        profile = None
+        for row_off in range(0, self.block_size, request_size):
+            for col_off in range(0, self.block_size, request_size):
+                width = min(request_size, self.block_size - col_off)
+                height = min(request_size, self.block_size - row_off)
+                bbox = (
+                    xmin + col_off * self.pixel_x_size,
+                    ymax - (row_off + height) * self.pixel_y_size,
+                    xmin + (col_off + width) * self.pixel_x_size,
+                    ymax - row_off * self.pixel_y_size,
+                )
+                try:
+                    request_data, profile = image_util.load_image(
+                        layersources=layersources,
+                        crs=self.crs,
+                        bbox=bbox,
+                        size=(width, height),
+                        **load_image_kwargs,
+                    )
+                except RuntimeError as ex:  # pragma: no cover
+                    # Leave the part of the block outside the layer bounds empty
+                    if str(ex).startswith("Bbox outside layer bounds"):
+                        continue
+                    raise
+
+                if image_data is None:
+                    image_data = np.zeros(
+                        (request_data.shape[0], self.block_size, self.block_size),
+                        dtype=request_data.dtype,
+                    )
+                image_data[:, row_off : row_off + height, col_off : col_off + width] = (
+                    request_data
+                )
+
+        if image_data is None or profile is None:
+            logger.warning(f"No pixels found for block {block_bounds}")
+            return
+
+        # Write the block to a temporary file first, so it is never incomplete
+        block_profile = {
+            "driver": "GTiff",
+            "dtype": image_data.dtype,
+            "count": image_data.shape[0],
+            "width": self.block_size,
+            "height": self.block_size,
+            "crs": self.crs,
+            "transform": rio.Affine(
+                self.pixel_x_size, 0.0, xmin, 0.0, -self.pixel_y_size, ymax
+            ),
+            "nodata": profile.get("nodata"),
+            "tiled": True,
+            "blockxsize": min(256, self.block_size),
+            "blockysize": min(256, self.block_size),
+            "compress": tiff_compress,
+        }
+        if tiff_compress.lower() == "jpeg":
+            if image_data.dtype != np.uint8:
+                block_profile["compress"] = "deflate"
+            elif image_data.shape[0] == 3:
+                block_profile["photometric"] = "ycbcr"
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = (
+            path.parent / f"{path.name}.{os.getpid()}_{threading.get_ident()}.tmp"
+        )
+        try:
+            with rio.open(tmp_path, "w", **block_profile) as block_file:
+                block_file.write(image_data)
+                block_file.build_overviews([2, 4, 8, 16], Resampling.average)
+            tmp_path.replace(path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+def _wait_for_cron_schedule(cron_schedule: str | None):
+    """Sleep till the cron schedule becomes active, if one is specified."""
+    if cron_schedule is None or cron_schedule in ["", "* * * * *"]:
+        return
+
+    first_cron_check = True
+    while not pycron.is_now(cron_schedule):
+        # The first time, log message that we are going to sleep...
+        if first_cron_check:
+            logger.info(f"Time schedule specified: sleep: {cron_schedule}")
+            first_cron_check = False
+        time.sleep(60)
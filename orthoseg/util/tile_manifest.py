@@ -0,0 +1,320 @@
+"""Module to keep track of the images in an image cache directory in a manifest."""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import warnings
+from collections.abc import Iterable
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+import rasterio as rio
+import rasterio.errors as rio_errors
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "tile_manifest.sqlite"
+
+STATUS_CACHED = "cached"
+STATUS_EMPTY = "empty"
+
+# The file extensions of the images that can be in an image cache
+IMAGE_EXTS = (".png", ".tif", ".jpg")
+
+
+def get_checksum(data: bytes) -> str:
+    """Get the checksum of the data of an image file as stored in the manifest.
+
+    Args:
+        data (bytes): the data of the file.
+
+    Returns:
+        str: the checksum.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class TileManifest:
+    """Manifest in a SQLite database with the images cached in a directory.
+
+    For each tile, the path relative to the cache directory is kept together with its
+    bounds, its size in pixels and bytes, the checksum of the file and its status:
+
+    - "cached": the image is saved in the cache directory.
+    - "empty": the tile is outside the bounds of the layer, so no image was saved.
+
+    Hence, the images in the cache directory can be determined without listing the
+    directory or checking the files one by one, which is slow on network file systems.
+    If the manifest gets out of sync with the directory, use :meth:`rebuild`.
+
+    The manifest is only marked as complete when all images in the directory are
+    listed in it, e.g. after :meth:`rebuild` or after all tiles of the cache were
+    loaded. Otherwise, e.g. if loading images was stopped early, the directory should
+    be searched for the images that are not listed yet.
+
+    Updates are buffered and written in batches. The manifest can be used from multiple
+    threads, but only one process should write to it. As it is typically stored on the
+    same file system as the images, the default SQLite journal mode is used, which,
+    unlike WAL, also works on network file systems.
+
+    Use as context manager to make sure all updates are written.
+    """
+
+    def __init__(self, image_dir: Path, batch_size: int = 1000):
+        """Open the manifest of an image cache directory.
+
+        Args:
+            image_dir (Path): the image cache directory. If it doesn't have a manifest
+                yet, it is created.
+            batch_size (int, optional): the number of updates that is buffered before
+                they are written. Defaults to 1000.
+        """
+        self.image_dir = image_dir
+        self.path = image_dir / MANIFEST_FILENAME
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._updates: list[tuple] = []
+
+        image_dir.mkdir(parents=True, exist_ok=True)
+        self.created = not self.path.exists()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tile (
+                    path TEXT PRIMARY KEY,
+                    xmin REAL,
+                    ymin REAL,
+                    xmax REAL,
+                    ymax REAL,
+                    pixel_width INTEGER,
+                    pixel_height INTEGER,
+                    size_bytes INTEGER,
+                    checksum TEXT,
+                    status TEXT NOT NULL,
+                    updated REAL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tile_status_idx ON tile(status)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    @staticmethod
+    def exists(image_dir: Path) -> bool:
+        """Check if an image cache directory has a manifest.
+
+        Args:
+            image_dir (Path): the image cache directory.
+
+        Returns:
+            bool: True if the directory has a manifest.
+        """
+        return (image_dir / MANIFEST_FILENAME).exists()
+
+    def __enter__(self) -> "TileManifest":
+        """Use the manifest as context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ):
+        """Close the manifest when leaving the context."""
+        self.close()
+
+    def get_statuses(self) -> dict[str, str]:
+        """Get the status of all tiles in the manifest.
+
+        Returns:
+            dict[str, str]: the status of each tile, by the posix path of the tile
+                relative to the image cache directory.
+        """
+        self.flush()
+        with self._lock:
+            cursor = self._conn.execute("SELECT path, status FROM tile")
+            return dict(cursor.fetchall())
+
+    def get_cached_paths(self) -> list[Path]:
+        """Get the paths of the images that are cached, sorted by path.
+
+        Returns:
+            list[Path]: the paths of the images.
+        """
+        self.flush()
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT path FROM tile WHERE status = ? ORDER BY path",
+                (STATUS_CACHED,),
+            )
+            return [self.image_dir / row[0] for row in cursor]
+
+    def is_complete(self) -> bool:
+        """Check if all images in the image cache directory are listed.
+
+        Returns:
+            bool: True if the manifest is marked as complete.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM info WHERE key = 'complete'"
+            ).fetchone()
+        return row is not None and row[0] == "1"
+
+    def set_complete(self, complete: bool):
+        """Mark whether all images in the image cache directory are listed.
+
+        The buffered updates are written first and the mark is written immediately,
+        so it is kept if the process is stopped.
+
+        Args:
+            complete (bool): True if all images are listed in the manifest.
+        """
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO info (key, value) VALUES ('complete', ?)",
+                ("1" if complete else "0",),
+            )
+
+    def set_cached(self, tile_records: Iterable[dict[str, Any]]):
+        """Set tiles as cached.
+
+        Args:
+            tile_records (Iterable[dict[str, Any]]): a record for each tile with the
+                "path" of the image, the "bounds" of the tile, its "pixel_width" and
+                "pixel_height" and optionally the "size_bytes" and "checksum" of the
+                file.
+        """
+        self._add_updates(
+            self._to_update(record, STATUS_CACHED) for record in tile_records
+        )
+
+    def set_empty(self, tile_records: Iterable[dict[str, Any]]):
+        """Set tiles as empty because they are outside the bounds of the layer.
+
+        Args:
+            tile_records (Iterable[dict[str, Any]]): a record for each tile with the
+                "path" the image would have, the "bounds" of the tile and its
+                "pixel_width" and "pixel_height".
+        """
+        self._add_updates(
+            self._to_update(record, STATUS_EMPTY) for record in tile_records
+        )
+
+    def _to_update(self, record: dict[str, Any], status: str) -> tuple:
+        path = Path(record["path"])
+        if path.is_absolute():
+            path = path.relative_to(self.image_dir)
+        return (
+            path.as_posix(),
+            *record["bounds"],
+            record["pixel_width"],
+            record["pixel_height"],
+            record.get("size_bytes"),
+            record.get("checksum"),
+            status,
+            time.time(),
+        )
+
+    def _add_updates(self, updates: Iterable[tuple]):
+        with self._lock:
+            self._updates.extend(updates)
+            nb_updates = len(self._updates)
+        if nb_updates >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered updates to the manifest in one transaction."""
+        with self._lock:
+            if len(self._updates) == 0:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tile (path, xmin, ymin, xmax, ymax, "
+                    "pixel_width, pixel_height, size_bytes, checksum, status, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._updates,
+                )
+            self._updates = []
+
+    def clear(self):
+        """Remove all tiles from the manifest and mark it as incomplete."""
+        with self._lock, self._conn:
+            self._updates = []
+            self._conn.execute("DELETE FROM tile")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO info (key, value) VALUES ('complete', '0')"
+            )
+
+    def rebuild(self) -> int:
+        """Rebuild the manifest from the images in the image cache directory.
+
+        All images in the directory are listed and read to determine their bounds,
+        size and checksum, so this can take a while for a large cache.
+
+        Returns:
+            int: the number of images found.
+        """
+        self.clear()
+        nb_images = 0
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", category=rio_errors.NotGeoreferencedWarning
+            )
+            for image_ext in IMAGE_EXTS:
+                for path in self.image_dir.rglob(f"*{image_ext}"):
+                    data = path.read_bytes()
+                    try:
+                        with rio.open(path) as image_file:
+                            bounds = tuple(image_file.bounds)
+                            pixel_width = image_file.width
+                            pixel_height = image_file.height
+                            if image_file.driver != "GTiff":
+                                # The worldfiles written by orthoseg contain the
+                                # corner of the tile instead of the pixel center
+                                res_x, res_y = image_file.res
+                                bounds = (
+                                    bounds[0] + res_x / 2,
+                                    bounds[1] - res_y / 2,
+                                    bounds[2] + res_x / 2,
+                                    bounds[3] - res_y / 2,
+                                )
+                    except rio_errors.RasterioIOError as ex:
+                        logger.warning(f"Skip image that can't be read {path}: {ex}")
+                        continue
+
+                    self.set_cached(
+                        [
+                            {
+                                "path": path,
+                                "bounds": bounds,
+                                "pixel_width": pixel_width,
+                                "pixel_height": pixel_height,
+                                "size_bytes": len(data),
+                                "checksum": get_checksum(data),
+                            }
+                        ]
+                    )
+                    nb_images += 1
+
+        self.set_complete(True)
+        logger.info(f"Rebuilt manifest of {self.image_dir}: {nb_images} images found")
+        return nb_images
+
+    def close(self):
+        """Write the buffered updates and close the manifest."""
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None  # type: ignore[assignment]
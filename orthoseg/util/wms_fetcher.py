@@ -0,0 +1,640 @@
+"""Module to fetch images from WMS services over pooled keep-alive connections."""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from urllib.parse import urlparse
+from xml.etree import ElementTree
+
+import owslib.util
+import requests
+import requests.adapters
+
+# Get a logger...
+logger = logging.getLogger(__name__)
+
+# The content types WMS services use to return service exceptions
+SERVICE_EXCEPTION_CONTENT_TYPES = (
+    "text/xml",
+    "application/xml",
+    "application/vnd.ogc.se_xml",
+)
+
+# Service exceptions that indicate the server is overloaded
+OVERLOADED_EXCEPTIONS = ("java.lang.OutOfMemoryError",)
+
+
+class TokenBucket:
+    """Token bucket to limit the rate of something, e.g. requests or bytes per second.
+
+    Tokens are added at a fixed rate, up to the capacity of the bucket. Consuming more
+    tokens than available is allowed, but then the caller waits till the bucket isn't
+    in debt anymore. Hence, amounts that are only known afterwards, like the size of a
+    response, can be limited as well.
+
+    The bucket can be used from multiple threads.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Create a full token bucket.
+
+        Args:
+            rate (float): the number of tokens added per second.
+            capacity (float, optional): the maximum number of tokens in the bucket,
+                which is the size of the bursts that are allowed. If None, the rate is
+                used, so a burst of one second is allowed. Defaults to None.
+            clock (Callable, optional): function that returns the time in seconds.
+                Defaults to time.monotonic.
+            sleep (Callable, optional): function to sleep a number of seconds.
+                Defaults to time.sleep.
+        """
+        if rate <= 0:
+            raise ValueError(f"rate should be > 0, not {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: float = 1.0):
+        """Consume tokens, waiting till the bucket isn't in debt anymore.
+
+        Args:
+            amount (float, optional): the number of tokens to consume.
+                Defaults to 1.0.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= amount
+            wait_s = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait_s > 0:
+            self._sleep(wait_s)
+
+
+class AdaptiveLimiter:
+    """Limits the number of requests in flight, adapting it to the server.
+
+    The limit is adjusted with additive increase, multiplicative decrease (AIMD): it
+    increases while the server copes with the requests and is cut when it gets
+    overloaded, i.e. when a request fails or when the average latency of the recent
+    requests gets a lot higher than the average latency of the requests before them.
+    Averages over a window of requests are used, so servers with a mix of fast and slow
+    requests, e.g. cached and rendered images, don't cause needless decreases. At the
+    start, the limit is doubled each time all requests in flight succeeded, till the
+    server gets overloaded the first time.
+
+    Only requests that were started after the last decrease can cause a new decrease,
+    so a burst of slow or failing requests only decreases the limit once.
+
+    Each adjustment is logged with the reason for it.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial_limit: int = 1,
+        latency_tolerance: float = 2.0,
+        backoff_ratio: float = 0.5,
+        *,
+        latency_window: int = 20,
+    ):
+        """Create a limiter.
+
+        Args:
+            max_limit (int): the maximum number of requests in flight.
+            min_limit (int, optional): the minimum number of requests in flight.
+                Defaults to 1.
+            initial_limit (int, optional): the initial number of requests in flight.
+                Defaults to 1.
+            latency_tolerance (float, optional): the server is considered overloaded
+                if the average latency of the last `latency_window` requests gets
+                higher than this factor times the average latency of the requests
+                before them. Defaults to 2.0.
+            backoff_ratio (float, optional): the factor the limit is multiplied with
+                when the server is overloaded. Defaults to 0.5.
+            latency_window (int, optional): the number of recent requests to average
+                the latency over. The baseline latency is averaged over up to 9 times
+                as many requests before them. Defaults to 20.
+        """
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError(
+                f"invalid limits, min_limit: {min_limit}, max_limit: {max_limit}"
+            )
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.latency_window = latency_window
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._slow_start = True
+        self._generation = 0
+        self._latencies: deque[float] = deque(maxlen=10 * latency_window)
+        self._condition = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        """The number of requests in flight."""
+        return self._in_flight
+
+    def acquire(self) -> int:
+        """Wait till a request can be started.
+
+        Returns:
+            int: a ticket that should be passed to :meth:`release`.
+        """
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+            return self._generation
+
+    def release(self, ticket: int, latency_s: float, success: bool = True):
+        """Report that a request finished and adjust the limit based on the result.
+
+        Args:
+            ticket (int): the ticket returned by :meth:`acquire`.
+            latency_s (float): how long the request took, in seconds.
+            success (bool, optional): False if the request failed because the server
+                is overloaded or unavailable. Defaults to True.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if not success:
+                self._decrease(ticket, "a request failed")
+            else:
+                self._latencies.append(latency_s)
+                avg_latency, baseline_latency = self._get_latencies()
+                if (
+                    baseline_latency is not None
+                    and avg_latency > self.latency_tolerance * baseline_latency
+                ):
+                    self._decrease(
+                        ticket,
+                        f"average latency {avg_latency:.2f} s > "
+                        f"{self.latency_tolerance} x baseline latency "
+                        f"{baseline_latency:.2f} s",
+                    )
+                else:
+                    self._increase(avg_latency)
+            self._condition.notify_all()
+
+    def _get_latencies(self) -> tuple[float, float | None]:
+        """Get the average latency of the recent requests and of the ones before.
+
+        The baseline latency is None as long as there are too few requests to
+        determine it.
+        """
+        latencies = list(self._latencies)
+        recent = latencies[-self.latency_window :]
+        avg_latency = sum(recent) / len(recent)
+        before = latencies[: -self.latency_window]
+        if len(before) < self.latency_window:
+            return avg_latency, None
+        return avg_latency, sum(before) / len(before)
+
+    def _increase(self, avg_latency: float):
+        if self.limit >= self.max_limit:
+            return
+        old_limit = int(self.limit)
+        if self._slow_start:
+            # Add one per request, so the limit doubles per round of requests
+            self.limit = min(self.limit + 1, self.max_limit)
+        else:
+            # Add one per round of requests
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+        if int(self.limit) != old_limit:
+            phase = "slow start" if self._slow_start else "additive increase"
+            logger.info(
+                f"Concurrent requests increased to {int(self.limit)} ({phase}): "
+                f"average latency {avg_latency:.2f} s is ok"
+            )
+
+    def _decrease(self, ticket: int, reason: str):
+        if ticket != self._generation:
+            # The request was started before the last decrease, so it doesn't tell if
+            # the decreased limit is still too high.
+            return
+        self._generation += 1
+        self._slow_start = False
+        # The latencies measured at the old limit are no reference anymore
+        self._latencies.clear()
+        old_limit = int(self.limit)
+        self.limit = max(self.limit * self.backoff_ratio, self.min_limit)
+        logger.info(
+            f"Concurrent requests decreased from {old_limit} to {int(self.limit)}: "
+            f"{reason}"
+        )
+
+
+class CircuitBreaker:
+    """Stops sending requests to a server that keeps on failing.
+
+    After a number of consecutive failures the circuit is opened: no requests are sent
+    till a timeout expires. Then, one probe request is let through. If it succeeds,
+    the circuit is closed again, if it fails, the circuit is opened again with a
+    doubled timeout.
+
+    Each change of state is logged with the reason for it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout_s: float = 30,
+        max_reset_timeout_s: float = 600,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Create a closed circuit breaker.
+
+        Args:
+            failure_threshold (int, optional): the number of consecutive failures
+                after which the circuit is opened. Defaults to 5.
+            reset_timeout_s (float, optional): the time in seconds the circuit stays
+                open before a probe request is let through. Defaults to 30.
+            max_reset_timeout_s (float, optional): the maximum time in seconds the
+                circuit stays open when the timeout is doubled. Defaults to 600.
+            clock (Callable, optional): function that returns the time in seconds.
+                Defaults to time.monotonic.
+            sleep (Callable, optional): function to sleep a number of seconds.
+                Defaults to time.sleep.
+        """
+        self.failure_threshold = failure_threshold
+        self.initial_reset_timeout_s = reset_timeout_s
+        self.max_reset_timeout_s = max_reset_timeout_s
+        self.state = self.CLOSED
+        self._reset_timeout_s = reset_timeout_s
+        self._failures = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Wait till a request can be sent."""
+        while True:
+            with self._lock:
+                if self.state == self.CLOSED:
+                    return
+                now = self._clock()
+                if self.state == self.OPEN and now >= self._open_until:
+                    self.state = self.HALF_OPEN
+                    logger.info("Circuit half-open: timeout expired, send a probe")
+                if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return
+                if self.state == self.OPEN:
+                    wait_s = self._open_until - now
+                else:
+                    # Wait for the result of the probe
+                    wait_s = 1.0
+            self._sleep(wait_s)
+
+    def record_success(self):
+        """Report that a request succeeded."""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit closed: the probe request succeeded")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            self._reset_timeout_s = self.initial_reset_timeout_s
+
+    def record_failure(self):
+        """Report that a request failed."""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN:
+                self._reset_timeout_s = min(
+                    self._reset_timeout_s * 2, self.max_reset_timeout_s
+                )
+                self._open("the probe request failed")
+            elif self.state == self.CLOSED and self._failures >= self.failure_threshold:
+                self._open(f"{self._failures} consecutive requests failed")
+
+    def _open(self, reason: str):
+        self.state = self.OPEN
+        self._probe_in_flight = False
+        self._open_until = self._clock() + self._reset_timeout_s
+        logger.warning(f"Circuit opened for {self._reset_timeout_s:.0f} s: {reason}")
+
+
+def get_backoff_s(retry_count: int, base_s: float = 5, max_s: float = 120) -> float:
+    """Get the time to wait before retrying a request, with exponential backoff.
+
+    Half of the time is random, so retries of requests that failed at the same
+    time are spread out.
+
+    Args:
+        retry_count (int): the number of retries done already.
+        base_s (float, optional): the time to wait before the first retry.
+            Defaults to 5.
+        max_s (float, optional): the maximum time to wait. Defaults to 120.
+
+    Returns:
+        float: the time to wait in seconds.
+    """
+    backoff_s = min(base_s * 2**retry_count, max_s)
+    return backoff_s / 2 + random.uniform(0, backoff_s / 2)
+
+
+class WMSFetcher:
+    """Fetches GetMap images from a WMS server over pooled keep-alive connections.
+
+    Unlike owslib, that opens a new connection for each request, the connections are
+    kept open and reused, so many requests can be in flight from multiple threads of
+    one process without the overhead of setting up a connection for each of them.
+
+    The requests and bytes fetched per second from the server can be limited. The
+    number of requests in flight can be adapted to how well the server copes with them
+    and when the server keeps on failing, requests are paused for a while.
+    """
+
+    def __init__(
+        self,
+        getmap_url: str,
+        wms_version: str = "1.3.0",
+        username: str | None = None,
+        password: str | None = None,
+        ssl_verify: bool | str = True,
+        max_requests_per_s: float = 0,
+        max_bytes_per_s: float = 0,
+        max_connections: int = 64,
+        timeout: float = 30,
+        adaptive_concurrency: bool = True,
+    ):
+        """Constructor for WMSFetcher.
+
+        Args:
+            getmap_url (str): the url to send GetMap requests to.
+            wms_version (str, optional): the WMS version. Defaults to "1.3.0".
+            username (str, optional): username to logon with. Defaults to None.
+            password (str, optional): password to logon with. Defaults to None.
+            ssl_verify (bool or str, optional): True to use the default certificate
+                bundle as installed on your system. False disables certificate
+                validation (NOT recommended!). If a path to a certificate bundle file
+                (.pem) is passed, this will be used. Defaults to True.
+            max_requests_per_s (float, optional): the maximum number of requests per
+                second. If 0, the number of requests isn't limited. Defaults to 0.
+            max_bytes_per_s (float, optional): the maximum number of bytes fetched per
+                second. If 0, the number of bytes isn't limited. Defaults to 0.
+            max_connections (int, optional): the maximum number of connections kept
+                open to the server. Defaults to 64.
+            timeout (float, optional): the timeout of the requests in seconds.
+                Defaults to 30.
+            adaptive_concurrency (bool, optional): True to adapt the number of
+                requests in flight to the latency and the failures of the server and
+                to pause requests when it keeps on failing. Defaults to True.
+        """
+        self.getmap_url = getmap_url
+        self.wms_version = wms_version
+        self.timeout = timeout
+        self.requests_bucket = (
+            TokenBucket(max_requests_per_s) if max_requests_per_s > 0 else None
+        )
+        self.bytes_bucket = (
+            TokenBucket(max_bytes_per_s) if max_bytes_per_s > 0 else None
+        )
+        self.limiter = (
+            AdaptiveLimiter(max_limit=max_connections) if adaptive_concurrency else None
+        )
+        self.circuit_breaker = CircuitBreaker() if adaptive_concurrency else None
+
+        self._http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections
+        )
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+        self._http.verify = ssl_verify
+        if username is not None and password is not None:
+            self._http.auth = (username, password)
+
+    def getmap(
+        self,
+        layers: list[str],
+        styles: list[str] | None,
+        srs: str,
+        bbox: tuple[float, float, float, float],
+        size: tuple[int, int],
+        image_format: str,
+        transparent: bool = False,
+    ) -> bytes:
+        """Fetch an image with a GetMap request.
+
+        Args:
+            layers (list[str]): the layers to fetch.
+            styles (list[str], optional): the styles of the layers.
+            srs (str): the crs of the bbox, e.g. "epsg:31370".
+            bbox (tuple[float, float, float, float]): the bbox, in the axis order the
+                server expects.
+            size (tuple[int, int]): the width and height of the image.
+            image_format (str): the image format, e.g. "image/jpeg".
+            transparent (bool, optional): whether the image should be transparent.
+                Defaults to False.
+
+        Raises:
+            owslib.util.ServiceException: if the server returns a service exception.
+            requests.HTTPError: if the server returns another http error.
+            requests.RequestException: if the request fails for another reason.
+
+        Returns:
+            bytes: the image.
+        """
+        params = {
+            "SERVICE": "WMS",
+            "VERSION": self.wms_version,
+            "REQUEST": "GetMap",
+            "LAYERS": ",".join(layers),
+            "STYLES": ",".join(styles) if styles else "",
+            "CRS" if self.wms_version == "1.3.0" else "SRS": srs,
+            "BBOX": ",".join(repr(float(coord)) for coord in bbox),
+            "WIDTH": str(size[0]),
+            "HEIGHT": str(size[1]),
+            "FORMAT": image_format,
+            "TRANSPARENT": "TRUE" if transparent else "FALSE",
+            "EXCEPTIONS": (
+                "XML" if self.wms_version == "1.3.0" else "application/vnd.ogc.se_xml"
+            ),
+        }
+
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.wait()
+        ticket = self.limiter.acquire() if self.limiter is not None else 0
+
+        # Whatever happens, the limiter slot and the circuit breaker probe must be
+        # released again, otherwise later requests could block forever. Unexpected
+        # errors are counted as failures.
+        start = time.perf_counter()
+        success = False
+        try:
+            if self.requests_bucket is not None:
+                self.requests_bucket.consume()
+            start = time.perf_counter()
+            response = self._http.get(
+                self.getmap_url, params=params, timeout=self.timeout
+            )
+            latency_s = time.perf_counter() - start
+            if self.bytes_bucket is not None:
+                self.bytes_bucket.consume(len(response.content))
+            logger.debug(f"Finished doing request {response.url}")
+
+            # Only errors that indicate the server is overloaded or unavailable count
+            # as failures, not e.g. invalid requests.
+            overloaded = response.status_code == 429 or response.status_code >= 500
+            service_exception = None
+            content_type = response.headers.get("Content-Type", "").split(";")[0]
+            if response.status_code in (400, 401, 403):
+                service_exception = response.text
+            elif response.ok and content_type in SERVICE_EXCEPTION_CONTENT_TYPES:
+                service_exception = _get_service_exception(response.content)
+                overloaded = any(
+                    message in service_exception for message in OVERLOADED_EXCEPTIONS
+                )
+            success = not overloaded
+        finally:
+            if not success:
+                latency_s = time.perf_counter() - start
+            self._record_result(ticket, latency_s, success=success)
+
+        # Raise errors like owslib does, so they can be handled the same way
+        if service_exception is not None:
+            raise owslib.util.ServiceException(service_exception)
+        response.raise_for_status()
+
+        return response.content
+
+    def _record_result(self, ticket: int, latency_s: float, success: bool):
+        if self.limiter is not None:
+            self.limiter.release(ticket, latency_s, success=success)
+        if self.circuit_breaker is not None:
+            if success:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+
+    def close(self):
+        """Close the connections to the server."""
+        self._http.close()
+
+
+def _get_service_exception(content: bytes) -> str:
+    """Get the message of a service exception returned by a WMS server."""
+    try:
+        tree = ElementTree.fromstring(content)
+    except ElementTree.ParseError:
+        return content.decode(errors="replace")
+    messages = [
+        element.text.strip()
+        for element in tree.iter()
+        if element.tag.split("}")[-1] in ("ServiceException", "ExceptionText")
+        and element.text is not None
+    ]
+    if len(messages) == 0:
+        return content.decode(errors="replace")
+    return "\n".join(messages)
+
+
+_fetchers: dict[tuple, WMSFetcher] = {}
+_fetchers_pid: int | None = None
+_fetchers_lock = threading.Lock()
+
+
+def get_fetcher(
+    getmap_url: str,
+    wms_version: str = "1.3.0",
+    username: str | None = None,
+    password: str | None = None,
+    ssl_verify: bool | str = True,
+    max_requests_per_s: float = 0,
+    max_bytes_per_s: float = 0,
+    adaptive_concurrency: bool = True,
+) -> WMSFetcher:
+    """Get the fetcher for a WMS server, shared by all threads of the process.
+
+    The fetchers are shared per server, so the limits on the requests and bytes per
+    second and the adaptive concurrency apply to all requests to a server. If they are
+    specified differently for layers of the same server, the ones of the first layer
+    fetched are used.
+
+    Args:
+        getmap_url (str): the url to send GetMap requests to.
+        wms_version (str, optional): the WMS version. Defaults to "1.3.0".
+        username (str, optional): username to logon with. Defaults to None.
+        password (str, optional): password to logon with. Defaults to None.
+        ssl_verify (bool or str, optional): see :class:`WMSFetcher`. Defaults to True.
+        max_requests_per_s (float, optional): the maximum number of requests per
+            second to the server. If 0, the number of requests isn't limited.
+            Defaults to 0.
+        max_bytes_per_s (float, optional): the maximum number of bytes fetched per
+            second from the server. If 0, the number of bytes isn't limited.
+            Defaults to 0.
+        adaptive_concurrency (bool, optional): see :class:`WMSFetcher`.
+            Defaults to True.
+
+    Returns:
+        WMSFetcher: the fetcher.
+    """
+    global _fetchers_pid  # noqa: PLW0603
+
+    key = (
+        urlparse(getmap_url).netloc,
+        getmap_url,
+        wms_version,
+        username,
+        password,
+        str(ssl_verify),
+    )
+    with _fetchers_lock:
+        # Connections can't be shared with a forked process
+        if _fetchers_pid != os.getpid():
+            _fetchers.clear()
+            _fetchers_pid = os.getpid()
+
+        fetcher = _fetchers.get(key)
+        if fetcher is None:
+            fetcher = WMSFetcher(
+                getmap_url=getmap_url,
+                wms_version=wms_version,
+                username=username,
+                password=password,
+                ssl_verify=ssl_verify,
+                max_requests_per_s=max_requests_per_s,
+                max_bytes_per_s=max_bytes_per_s,
+                adaptive_concurrency=adaptive_concurrency,
+            )
+            # Fetchers for other layers of the same server share its limits
+            for other_key, other_fetcher in _fetchers.items():
+                if other_key[0] == key[0]:
+                    fetcher.requests_bucket = other_fetcher.requests_bucket
+                    fetcher.bytes_bucket = other_fetcher.bytes_bucket
+                    fetcher.limiter = other_fetcher.limiter
+                    fetcher.circuit_breaker = other_fetcher.circuit_breaker
+                    break
+            _fetchers[key] = fetcher
+
+        return fetcher
@@ -44,6 +44,8 @@ setuptools.setup(
             orthoseg_validate=orthoseg.validate:main
             orthoseg_train=orthoseg.train:main
             orthoseg_predict=orthoseg.predict:main
+            orthoseg_tune=orthoseg.tune:main
+            orthoseg_quantize=orthoseg.quantize:main
             orthoseg_postprocess=orthoseg.postprocess:main
             osscriptrunner=orthoseg.scriptrunner:main
             orthoseg_load_sampleprojects=orthoseg.load_sampleprojects:main
@@ -43,6 +43,8 @@ def test_read_orthoseg_config_image_layers(image_layer):
     assert layer is not None
     assert layer.get("projection") == pyproj.CRS.from_user_input("epsg:31370")
     assert layer.get("switch_axes") is False
+    assert layer.get("cache_type") == "tiles"
+    assert layer.get("mosaic_cache") is None
 
 
 def test_read_orthoseg_config_extra_config_files_to_load():
@@ -141,6 +143,45 @@ def test_read_orthoseg_config_image_layers_filelayer_dir_no_file_patterns(tmp_pa
         conf._read_layer_config(imagelayers_path)
 
 
+def test_read_orthoseg_config_image_layers_cache_type_invalid(tmp_path):
+    imagelayers_str = f"""
+        [TEST-IMAGE-LAYER]
+        path = {tmp_path.as_posix()}/image.tif
+        layername = TEST-IMAGE-LAYER
+        projection = epsg:31370
+        cache_type = invalid
+    """
+    imagelayers_path = tmp_path / "imagelayers.ini"
+    with imagelayers_path.open("w") as f:
+        for line in imagelayers_str.splitlines():
+            f.write(f"{line.strip()}\n")
+
+    with pytest.raises(ValueError, match="Invalid cache_type for image layer"):
+        conf._read_layer_config(imagelayers_path)
+
+
+@pytest.mark.parametrize("value, expected", [("False", False), (None, True)])
+def test_read_orthoseg_config_image_layers_wms_adaptive_concurrency(
+    tmp_path, value, expected
+):
+    imagelayers_str = """
+        [TEST-IMAGE-LAYER]
+        wms_server_url = https://test/wms?
+        wms_layernames = test
+        projection = epsg:31370
+    """
+    if value is not None:
+        imagelayers_str += f"wms_adaptive_concurrency = {value}\n"
+    imagelayers_path = tmp_path / "imagelayers.ini"
+    with imagelayers_path.open("w") as f:
+        for line in imagelayers_str.splitlines():
+            f.write(f"{line.strip()}\n")
+
+    imagelayers_config = conf._read_layer_config(imagelayers_path)
+    layersource = imagelayers_config["TEST-IMAGE-LAYER"]["layersources"][0]
+    assert layersource.adaptive_concurrency is expected
+
+
 @pytest.mark.parametrize(
     "overrules, expected_image_layer",
     [
@@ -404,6 +445,20 @@ def test_unformat_error():
         )
 
 
+@pytest.mark.parametrize(
+    "value, expected",
+    [("2", (2, 2)), ("4, 2", (4, 2)), (3, (3, 3)), ([1, 2], (1, 2))],
+)
+def test_str2intpair(value, expected):
+    assert conf._str2intpair(value, "metatile_factor") == expected
+
+
+@pytest.mark.parametrize("value", ["0", "1, 2, 3", "-1, 2", "a", ""])
+def test_str2intpair_invalid(value):
+    with pytest.raises(ValueError, match="metatile_factor should be 1 or 2 positive"):
+        conf._str2intpair(value, "metatile_factor")
+
+
 def test_tmpdir():
     tmpdir = conf._set_tmp_dir("orthoseg")
 
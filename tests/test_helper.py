@@ -6,6 +6,10 @@ from pathlib import Path
 from typing import ClassVar
 
 import geopandas as gpd
+import keras
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
 from shapely import geometry as sh_geom
 
 from orthoseg import load_sampleprojects
@@ -89,6 +93,45 @@ class TestData:
     )
 
 
+def create_model() -> keras.Model:
+    """Create a small segmentation model with 2 classes for 3-band images."""
+    inputs = keras.Input((None, None, 3))
+    outputs = keras.layers.Conv2D(2, 3, padding="same", activation="softmax")(inputs)
+    return keras.Model(inputs, outputs)
+
+
+def create_tiled_file(path: Path, overviews: list[int] | None = None) -> np.ndarray:
+    """Create a tiled 3 band file with 1m pixels, with its top-left at (1000, 2000).
+
+    Args:
+        path (Path): the path to create the file at.
+        overviews (list[int], optional): the overview factors to add. Defaults to
+            None.
+
+    Returns:
+        np.ndarray: the data written to the file.
+    """
+    data = (np.arange(3 * 128 * 128).reshape(3, 128, 128) % 251).astype(np.uint8)
+    profile = {
+        "driver": "GTiff",
+        "dtype": "uint8",
+        "count": 3,
+        "width": 128,
+        "height": 128,
+        "crs": "epsg:31370",
+        "transform": rio.Affine(1.0, 0.0, 1000.0, 0.0, -1.0, 2000.0),
+        "tiled": True,
+        "blockxsize": 32,
+        "blockysize": 32,
+    }
+    with rio.open(path, "w", **profile) as dst:
+        dst.write(data)
+        if overviews is not None:
+            dst.build_overviews(overviews, Resampling.average)
+
+    return data
+
+
 def create_tempdir(base_dirname: str, parent_dir: Path | None = None) -> Path:
     # Parent
     if parent_dir is None:
@@ -1,12 +1,18 @@
 """Tests for functionalities in image_util."""
 
+import sqlite3
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import pyproj
 import pytest
 import rasterio as rio
+import rasterio.warp
+import shapely
 
 from orthoseg.util import image_util
+from orthoseg.util.tile_manifest import TileManifest, get_checksum
 from tests import test_helper
 
 
@@ -90,6 +96,94 @@ def test_create_vrt_from_dir_empty_dir(tmp_path):
         image_util.create_vrt_for_dir(tmp_path, "**/*.tif", crs="EPSG:31370")
 
 
+@pytest.mark.parametrize("pixels_overlap", [0, 8])
+def test_get_images_for_grid(tmp_path, pixels_overlap):
+    crs = pyproj.CRS.from_epsg(31370)
+    tiles_gdf = image_util.get_images_for_grid(
+        output_image_dir=tmp_path,
+        crs=crs,
+        image_gen_bbox=(10, 20, 300, 150),
+        image_crs_pixel_x_size=1,
+        image_crs_pixel_y_size=1,
+        image_pixel_width=100,
+        image_pixel_height=100,
+        pixels_overlap=pixels_overlap,
+    )
+
+    # The bbox is aligned to the grid: 3 columns and 2 rows, column by column
+    assert len(tiles_gdf) == 6
+    xmin, ymin, xmax, ymax = tiles_gdf.geometry.iloc[1].bounds
+    assert (xmin, ymin, xmax, ymax) == (
+        -pixels_overlap,
+        100 - pixels_overlap,
+        100 + pixels_overlap,
+        200 + pixels_overlap,
+    )
+    size = 100 + 2 * pixels_overlap
+    assert tiles_gdf["pixel_width"].tolist() == [size] * 6
+    assert tiles_gdf["path"].iloc[1] == tmp_path / f"{xmin:06.0f}" / (
+        image_util.create_filename(
+            crs, (xmin, ymin, xmax, ymax), (size, size), image_util.FORMAT_GEOTIFF
+        )
+    )
+    assert (tmp_path / "tiles_to_download.gpkg").exists()
+
+
+def test_get_images_for_grid_roi_cached(tmp_path):
+    crs = pyproj.CRS.from_epsg(31370)
+    roi_path = tmp_path / "roi.gpkg"
+    roi_gdf = gpd.GeoDataFrame(
+        geometry=[shapely.box(10, 10, 90, 90), shapely.box(210, 110, 290, 190)],
+        crs=crs,
+    )
+    roi_gdf.to_file(roi_path)
+    grid_kwargs = {
+        "output_image_dir": tmp_path / "images",
+        "crs": crs,
+        "image_gen_roi_filepath": roi_path,
+        "image_crs_pixel_x_size": 1,
+        "image_crs_pixel_y_size": 1,
+        "image_pixel_width": 100,
+        "image_pixel_height": 100,
+    }
+    tiles_gdf = image_util.get_images_for_grid(**grid_kwargs)
+
+    # Only the tiles that intersect the roi are retained
+    assert [geom.bounds for geom in tiles_gdf.geometry] == [
+        (0, 0, 100, 100),
+        (200, 100, 300, 200),
+    ]
+    grid_index_paths = list((tmp_path / "images").glob("grid_index_*.npz"))
+    assert len(grid_index_paths) == 1
+
+    # The second time, the grid is loaded from the grid index
+    tiles_cached_gdf = image_util.get_images_for_grid(**grid_kwargs)
+    assert tiles_cached_gdf["path"].tolist() == tiles_gdf["path"].tolist()
+    assert tiles_cached_gdf.geometry.equals(tiles_gdf.geometry)
+
+    # A grid index in another cache dir is also used for other output dirs
+    worker_kwargs = {
+        **grid_kwargs,
+        "output_image_dir": tmp_path / "worker",
+        "cache_dir": tmp_path / "images",
+    }
+    tiles_worker_gdf = image_util.get_images_for_grid(**worker_kwargs)
+    assert tiles_worker_gdf.geometry.equals(tiles_gdf.geometry)
+
+    # If the roi changes, the grid is determined again and the old grid index removed
+    roi_gdf.iloc[[0]].to_file(roi_path)
+    tiles_gdf = image_util.get_images_for_grid(**grid_kwargs)
+    assert len(tiles_gdf) == 1
+    grid_index_paths = list((tmp_path / "images").glob("grid_index_*.npz"))
+    assert len(grid_index_paths) == 1
+    assert len(gpd.read_file(tmp_path / "images" / "tiles_to_download.gpkg")) == 1
+
+    # The tiles to download of the other output dir are rewritten for the new grid
+    tiles_worker_gdf = image_util.get_images_for_grid(**worker_kwargs)
+    assert len(tiles_worker_gdf) == 1
+    assert len(gpd.read_file(tmp_path / "worker" / "tiles_to_download.gpkg")) == 1
+
+
 @pytest.mark.parametrize(
     "crs_epsg, exp_switched_axes",
     [
@@ -113,6 +207,175 @@ def test_load_image_invalid_layersource():
         )
 
 
+def test_get_crs():
+    crs = image_util.get_crs("epsg:31370")
+    assert crs == pyproj.CRS.from_epsg(31370)
+
+    # The crs is cached in the default session
+    assert image_util.get_crs("epsg:31370") is crs
+    assert image_util.get_crs(crs) is crs
+
+
+def test_load_image_filelayer_bands():
+    filelayer_path = (
+        test_helper.sampleprojects_dir
+        / "fields/input_raster"
+        / "BEFL-TEST-s2_2023-05-01_2023-07-01_B08-B04-B03_min_byte.tif"
+    )
+    session = image_util.LayerSourceSession()
+    bbox = (485000.0, 5643000.0, 485640.0, 5643640.0)
+    kwargs = {"crs": "epsg:32631", "bbox": bbox, "size": (128, 128)}
+
+    # Combine bands of multiple layer sources, in the order specified
+    layersources = [
+        image_util.FileLayerSource(path=filelayer_path, layernames=["S1"], bands=[2]),
+        image_util.FileLayerSource(
+            path=filelayer_path, layernames=["S1"], bands=[1, 0]
+        ),
+    ]
+    image_data, profile = image_util.load_image(
+        layersources=layersources, session=session, **kwargs
+    )
+    image_data_all, _ = image_util.load_image(
+        layersources=image_util.FileLayerSource(filelayer_path, layernames=["S1"]),
+        session=session,
+        **kwargs,
+    )
+
+    assert image_data.shape == (3, 128, 128)
+    assert image_data.dtype == image_data_all.dtype
+    assert (image_data == image_data_all[[2, 1, 0]]).all()
+    assert profile["width"] == 128
+    assert profile["height"] == 128
+
+    # The dataset stays open in the session to be reused for the next tiles
+    dataset = session.open_dataset(filelayer_path)
+    assert not dataset.closed
+    session.close()
+    assert dataset.closed
+    assert not session.open_dataset(filelayer_path).closed
+    session.close()
+
+
+def test_load_image_filelayer_aligned(tmp_path):
+    path = tmp_path / "tiled.tif"
+    data = test_helper.create_tiled_file(path, overviews=[2])
+    layersource = image_util.FileLayerSource(path, layernames=["test"], bands=[2, 0])
+    session = image_util.LayerSourceSession()
+
+    # A tile on the pixel grid is read without resampling
+    image_data, profile = image_util.load_image(
+        layersource, "epsg:31370", (1016, 1936, 1048, 1968), (32, 32), session=session
+    )
+    assert (image_data == data[[2, 0], 32:64, 16:48]).all()
+    assert profile["transform"] == rio.Affine(1.0, 0.0, 1016.0, 0.0, -1.0, 1968.0)
+
+    # For a tile with 2m pixels, the overview is read
+    image_data, _ = image_util.load_image(
+        layersource, "epsg:31370", (1000, 1936, 1064, 2000), (32, 32), session=session
+    )
+    with rio.open(path, overview_level=0) as overview:
+        assert (image_data == overview.read([3, 1], window=((0, 32), (0, 32)))).all()
+
+    # The part of a tile outside the file is filled with 0
+    image_data, _ = image_util.load_image(
+        layersource, "epsg:31370", (984, 1984, 1016, 2016), (32, 32), session=session
+    )
+    assert (image_data[:, :16, :] == 0).all()
+    assert (image_data[:, :, :16] == 0).all()
+    assert (image_data[:, 16:, 16:] == data[[2, 0], :16, :16]).all()
+    session.close()
+
+
+def test_load_image_filelayer_reproject(tmp_path):
+    # Create a file with a constant value per band
+    path = tmp_path / "constant.tif"
+    profile = {
+        "driver": "GTiff",
+        "dtype": "uint8",
+        "count": 3,
+        "width": 128,
+        "height": 128,
+        "crs": "epsg:31370",
+        "transform": rio.Affine(1.0, 0.0, 160000.0, 0.0, -1.0, 170128.0),
+    }
+    with rio.open(path, "w", **profile) as dst:
+        for band, value in enumerate([10, 20, 30]):
+            dst.write(np.full((128, 128), value, np.uint8), band + 1)
+    layersource = image_util.FileLayerSource(path, layernames=["test"], bands=[2, 0])
+
+    # Load a tile inside the file in another crs
+    crs = pyproj.CRS("epsg:3857")
+    bbox = rio.warp.transform_bounds("epsg:31370", crs, 160020, 170020, 160080, 170080)
+    image_data, profile = image_util.load_image(layersource, crs, bbox, (32, 32))
+
+    assert image_data.shape == (2, 32, 32)
+    assert image_data.dtype == np.uint8
+    assert (image_data[0] == 30).all()
+    assert (image_data[1] == 10).all()
+    assert pyproj.CRS(profile["crs"]) == crs
+
+
+def test_get_block_aligned_grid_origin(tmp_path):
+    path = tmp_path / "tiled.tif"
+    test_helper.create_tiled_file(path, overviews=[2])
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+
+    for pixel_size in [1.0, 2.0]:
+        origin = image_util.get_block_aligned_grid_origin(
+            layersource, "epsg:31370", pixel_size, pixel_size
+        )
+        assert origin == (1000.0, 2000.0)
+
+    # No overview with 4m pixels and a different crs
+    assert (
+        image_util.get_block_aligned_grid_origin(layersource, "epsg:31370", 4, 4)
+        is None
+    )
+    assert (
+        image_util.get_block_aligned_grid_origin(layersource, "epsg:3857", 1, 1) is None
+    )
+
+
+@pytest.mark.parametrize(
+    "image_format, image_format_save, exp_suffixes",
+    [
+        (image_util.FORMAT_GEOTIFF, image_util.FORMAT_GEOTIFF, [".tif"]),
+        (image_util.FORMAT_JPEG, image_util.FORMAT_JPEG, [".jgw", ".jpg"]),
+        (image_util.FORMAT_PNG, image_util.FORMAT_PNG, [".pgw", ".png"]),
+        (image_util.FORMAT_PNG, image_util.FORMAT_TIFF, [".tfw", ".tif"]),
+    ],
+)
+def test_load_image_to_file_formats(
+    tmp_path, image_format, image_format_save, exp_suffixes
+):
+    path = tmp_path / "tiled.tif"
+    data = test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+    output_dir = tmp_path / "output"
+    bbox = (1016, 1936, 1048, 1968)
+
+    image_path = image_util.load_image_to_file(
+        layersources=layersource,
+        output_dir=output_dir,
+        crs="epsg:31370",
+        bbox=bbox,
+        size=(32, 32),
+        image_format=image_format,
+        image_format_save=image_format_save,
+    )
+
+    # Only the image and its worldfile are written, without temporary files
+    assert image_path is not None
+    assert sorted(path.suffix for path in output_dir.iterdir()) == exp_suffixes
+    with rio.open(image_path) as image_file:
+        assert image_file.count == 3
+        if image_format_save == image_util.FORMAT_GEOTIFF:
+            assert tuple(image_file.bounds) == bbox
+        if image_format_save != image_util.FORMAT_JPEG:
+            assert (image_file.read() == data[:, 32:64, 16:48]).all()
+
+
 @pytest.mark.parametrize("image_format", [image_util.FORMAT_GEOTIFF])
 @pytest.mark.parametrize("width_pix, height_pix", [(128, 64), (64, 128), (128, 128)])
 @pytest.mark.parametrize("image_pixels_ignore_border", [0, 32])
@@ -368,6 +631,257 @@ def test_load_images_to_cache(tmp_path):
     _test_load_images_to_cache(tmp_path)
 
 
+def test_load_images_to_cache_manifest(tmp_path):
+    path = tmp_path / "tiled.tif"
+    test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+    output_image_dir = tmp_path / "cache"
+    kwargs = {
+        "layersources": [layersource],
+        "output_image_dir": output_image_dir,
+        "crs": "epsg:31370",
+        "switch_axes": False,
+        "image_gen_bbox": (1000, 1872, 1128, 2000),
+        "grid_xmin": 1000,
+        "grid_ymin": 1872,
+        "image_crs_pixel_x_size": 1.0,
+        "image_crs_pixel_y_size": 1.0,
+        "image_pixel_width": 64,
+        "image_pixel_height": 64,
+        "image_format": image_util.FORMAT_PNG,
+    }
+    image_util.load_images_to_cache(**kwargs)
+
+    # The images written are listed in the manifest, with their checksum
+    image_paths = sorted(output_image_dir.glob("**/*.png"))
+    assert len(image_paths) == 4
+    with TileManifest(output_image_dir) as manifest:
+        assert manifest.get_cached_paths() == image_paths
+    conn = sqlite3.connect(output_image_dir / "tile_manifest.sqlite")
+    try:
+        row = conn.execute(
+            "SELECT xmin, ymin, xmax, ymax, pixel_width, size_bytes, checksum "
+            "FROM tile WHERE path = ?",
+            (image_paths[0].relative_to(output_image_dir).as_posix(),),
+        ).fetchone()
+    finally:
+        conn.close()
+    image_bytes = image_paths[0].read_bytes()
+    assert row == (
+        1000.0,
+        1872.0,
+        1064.0,
+        1936.0,
+        64,
+        len(image_bytes),
+        get_checksum(image_bytes),
+    )
+
+    # As all tiles were loaded, the manifest is complete
+    with TileManifest(output_image_dir) as manifest:
+        assert manifest.is_complete()
+
+    # Images in the manifest are not checked on disk, so a removed image is only loaded
+    # again after the manifest is rebuilt
+    image_paths[0].unlink()
+    image_util.load_images_to_cache(**kwargs)
+    assert not image_paths[0].exists()
+    with TileManifest(output_image_dir) as manifest:
+        assert manifest.rebuild() == 3
+    image_util.load_images_to_cache(**kwargs)
+    assert image_paths[0].exists()
+
+    # Tiles outside the layer bounds are not requested again either
+    with TileManifest(output_image_dir) as manifest:
+        manifest.set_empty(
+            [
+                {
+                    "path": image_paths[0],
+                    "bounds": (1000, 1872, 1064, 1936),
+                    "pixel_width": 64,
+                    "pixel_height": 64,
+                }
+            ]
+        )
+    image_paths[0].unlink()
+    image_util.load_images_to_cache(**kwargs)
+    assert not image_paths[0].exists()
+
+
+def test_load_images_to_cache_manifest_incomplete(tmp_path):
+    path = tmp_path / "tiled.tif"
+    test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+    output_image_dir = tmp_path / "cache"
+    kwargs = {
+        "layersources": [layersource],
+        "output_image_dir": output_image_dir,
+        "crs": "epsg:31370",
+        "switch_axes": False,
+        "image_gen_bbox": (1000, 1872, 1128, 2000),
+        "grid_xmin": 1000,
+        "grid_ymin": 1872,
+        "image_crs_pixel_x_size": 1.0,
+        "image_crs_pixel_y_size": 1.0,
+        "image_pixel_width": 64,
+        "image_pixel_height": 64,
+        "image_format": image_util.FORMAT_PNG,
+    }
+
+    # If loading is stopped early, the manifest is not complete
+    image_util.load_images_to_cache(**kwargs, nb_concurrent_calls=1, max_nb_images=1)
+    with TileManifest(output_image_dir) as manifest:
+        assert len(manifest.get_cached_paths()) < 4
+        assert not manifest.is_complete()
+
+    # Images cached without manifest, e.g. by an older version, are added to it
+    (output_image_dir / "tile_manifest.sqlite").unlink()
+    image_util.load_images_to_cache(**kwargs)
+    with TileManifest(output_image_dir) as manifest:
+        assert len(manifest.get_cached_paths()) == 4
+        assert manifest.is_complete()
+
+
+def test_iter_metatiles():
+    # A grid of 3 x 3 tiles of 10 x 10 with an overlap of 2, column by column
+    records = [
+        {"bounds": (x - 2, y - 2, x + 12, y + 12)}
+        for x in (100, 110, 120)
+        for y in (200, 210, 220)
+    ]
+    metatiles = image_util._iter_metatiles(
+        records,
+        metatile_factor=(2, 2),
+        grid_xmin=100,
+        grid_ymin=200,
+        crs_width=10,
+        crs_height=10,
+    )
+    assert [
+        [record["bounds"][:2] for record in metatile] for metatile in metatiles
+    ] == [
+        [(98, 198), (98, 208), (108, 198), (108, 208)],
+        [(98, 218), (108, 218)],
+        [(118, 198), (118, 208)],
+        [(118, 218)],
+    ]
+
+
+def test_load_metatile_to_files(tmp_path):
+    path = tmp_path / "tiled.tif"
+    data = test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+
+    # 2 x 2 tiles of 32 x 32 pixels with an overlap of 8 pixels
+    records = [
+        {
+            "path": tmp_path / "cache" / f"tile_{x}_{y}.tif",
+            "bounds": (x - 8, y - 8, x + 40, y + 40),
+            "pixel_width": 48,
+            "pixel_height": 48,
+        }
+        for x in (1016, 1048)
+        for y in (1904, 1936)
+    ]
+    results = image_util._load_metatile_to_files(
+        [layersource], records, crs=pyproj.CRS("epsg:31370")
+    )
+
+    # The tiles cut from the meta-tile contain the pixels of the file, overlaps included
+    for record, result in zip(records, results, strict=True):
+        assert result is not None
+        assert result[0] == record["path"]
+        assert result[2] == get_checksum(record["path"].read_bytes())
+        xmin, ymin, xmax, ymax = record["bounds"]
+        with rio.open(record["path"]) as image_file:
+            assert tuple(image_file.bounds) == record["bounds"]
+            assert (
+                image_file.read()
+                == data[:, 2000 - ymax : 2000 - ymin, xmin - 1000 : xmax - 1000]
+            ).all()
+
+    # Tiles that exist already are skipped
+    results = image_util._load_metatile_to_files(
+        [layersource], records, crs=pyproj.CRS("epsg:31370")
+    )
+    assert all(result is not None and result[2] is None for result in results)
+
+
+def test_load_images_to_cache_metatiles(tmp_path, monkeypatch):
+    path = tmp_path / "tiled.tif"
+    test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+    kwargs = {
+        "layersources": [layersource],
+        "crs": "epsg:31370",
+        "switch_axes": False,
+        "image_gen_bbox": (1000, 1872, 1128, 2000),
+        "grid_xmin": 1000,
+        "grid_ymin": 1872,
+        "image_crs_pixel_x_size": 1.0,
+        "image_crs_pixel_y_size": 1.0,
+        "image_pixel_width": 32,
+        "image_pixel_height": 32,
+        "pixels_overlap": 8,
+    }
+    image_util.load_images_to_cache(output_image_dir=tmp_path / "tiles", **kwargs)
+
+    # Meta-tiles are only used for WMS layer sources, so force them for the test
+    monkeypatch.setattr(image_util, "_get_metatile_factor", lambda *_, **__: (3, 2))
+    image_util.load_images_to_cache(output_image_dir=tmp_path / "metatiles", **kwargs)
+
+    # The same tiles are loaded, with the same pixels
+    tile_paths = sorted((tmp_path / "tiles").glob("**/*.tif"))
+    metatile_paths = sorted((tmp_path / "metatiles").glob("**/*.tif"))
+    assert len(tile_paths) == 16
+    assert [path.relative_to(tmp_path / "tiles") for path in tile_paths] == [
+        path.relative_to(tmp_path / "metatiles") for path in metatile_paths
+    ]
+    for tile_path, metatile_path in zip(tile_paths, metatile_paths, strict=True):
+        with rio.open(tile_path) as tile_file, rio.open(metatile_path) as metatile_file:
+            assert tile_file.bounds == metatile_file.bounds
+            assert (tile_file.read() == metatile_file.read()).all()
+    with TileManifest(tmp_path / "metatiles") as manifest:
+        assert manifest.get_cached_paths() == metatile_paths
+
+
+@pytest.mark.parametrize(
+    "ssl_verify, expected",
+    [(True, True), ("False", False), ("true", True), ("/ca.pem", "/ca.pem")],
+)
+def test_parse_ssl_verify(ssl_verify, expected):
+    assert image_util._parse_ssl_verify(ssl_verify) == expected
+
+
+def test_wmslayersource_metatile_factor():
+    layersource = image_util.WMSLayerSource("https://test", ["test"], metatile_factor=2)
+    assert layersource.metatile_factor == (2, 2)
+    assert image_util._get_metatile_factor(
+        [layersource], image_pixel_width=512, image_pixel_height=512
+    ) == (2, 2)
+    with pytest.raises(ValueError, match="Invalid metatile_factor"):
+        image_util.WMSLayerSource("https://test", ["test"], metatile_factor=(0, 2))
+
+
+def test_get_metatile_factor_max_image_size():
+    layersource = image_util.WMSLayerSource(
+        "https://test", ["test"], metatile_factor=(8, 4), max_image_size=(2048, 4096)
+    )
+
+    # The meta-tiles, overlaps included, can't be larger than the max image size
+    assert image_util._get_metatile_factor(
+        [layersource], image_pixel_width=512, image_pixel_height=512, pixels_overlap=64
+    ) == (3, 4)
+
+    # If one tile is larger than the max image size, meta-tiles aren't used
+    assert image_util._get_metatile_factor(
+        [layersource], image_pixel_width=4096, image_pixel_height=4096
+    ) == (1, 1)
+
+    with pytest.raises(ValueError, match="Invalid max_image_size"):
+        image_util.WMSLayerSource("https://test", ["test"], max_image_size=0)
+
+
 def _test_load_images_to_cache(path):
     # Init some stuff
     tmp_path = path
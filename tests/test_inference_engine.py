@@ -0,0 +1,107 @@
+"""
+Tests for functionalities in orthoseg.model.inference_engine.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from orthoseg.model import model_factory as mf
+from orthoseg.model.inference_engine import (
+    InferenceEngine,
+    OnnxInferenceEngine,
+    export_onnx,
+    get_onnx_path,
+)
+from tests import test_helper
+
+
+@pytest.mark.parametrize("jit_compile", [False, True])
+@pytest.mark.parametrize("decode_head", ["none", "probabilities"])
+def test_inference_engine(jit_compile, decode_head):
+    model = mf.add_decode_head(test_helper.create_model(), decode_head=decode_head)
+    engine = InferenceEngine(model, batch_size=4, jit_compile=jit_compile)
+    engine.warm_up((16, 24, 3))
+    images_arr = np.random.default_rng(0).random((9, 16, 24, 3))
+
+    # More images than the batch size are predicted in multiple batches, the last one
+    # being padded
+    pred_arr = engine.predict_on_batch(images_arr)
+    exp_pred_arr = np.asarray(model.predict_on_batch(images_arr))
+    assert pred_arr.shape == exp_pred_arr.shape
+    assert pred_arr.dtype == exp_pred_arr.dtype
+    assert np.allclose(pred_arr.astype(np.float32), exp_pred_arr, atol=1e-5)
+
+    # Partial batches don't result in retracing
+    assert engine.predict_on_batch(images_arr[:3]).shape == (3, 16, 24, 2)
+    assert engine.predict_on_batch(images_arr[:1]).shape == (1, 16, 24, 2)
+    predict_function = engine._functions[(16, 24, 3)]
+    assert predict_function.experimental_get_tracing_count() == 1
+
+
+def test_inference_engine_image_sizes():
+    # Images with another size get their own function
+    engine = InferenceEngine(test_helper.create_model(), batch_size=2)
+    assert engine.predict_on_batch(np.zeros((2, 16, 16, 3))).shape == (2, 16, 16, 2)
+    assert engine.predict_on_batch(np.zeros((1, 32, 16, 3))).shape == (1, 32, 16, 2)
+    assert set(engine._functions) == {(16, 16, 3), (32, 16, 3)}
+
+
+@pytest.mark.parametrize(
+    "decode_head, min_probability, exp_name",
+    [
+        ("none", 0.5, "model_0.9.onnx"),
+        ("probabilities", 0.5, "model_0.9_probabilities.onnx"),
+        ("classes", 0.3, "model_0.9_classes0.3.onnx"),
+    ],
+)
+def test_get_onnx_path(decode_head, min_probability, exp_name):
+    model_path = Path("models/model_0.9.keras")
+    onnx_path = get_onnx_path(model_path, decode_head, min_probability)
+    assert onnx_path == Path("models") / exp_name
+
+
+@pytest.mark.parametrize("decode_head", ["none", "probabilities", "classes"])
+def test_onnx_inference_engine(tmp_path, decode_head):
+    """The predictions with onnxruntime are the same as with keras."""
+    pytest.importorskip("onnxruntime")
+    model = mf.add_decode_head(test_helper.create_model(), decode_head=decode_head)
+    onnx_path = export_onnx(model, tmp_path / "model.onnx")
+    engine = OnnxInferenceEngine(onnx_path, batch_size=4, intra_op_threads=1)
+    engine.warm_up((16, 24, 3))
+    images_arr = np.random.default_rng(0).random((6, 16, 24, 3))
+
+    pred_arr = engine.predict_on_batch(images_arr)
+
+    exp_pred_arr = np.asarray(model.predict_on_batch(images_arr))
+    assert pred_arr.shape == exp_pred_arr.shape
+    assert pred_arr.dtype == exp_pred_arr.dtype
+    if decode_head == "none":
+        assert np.allclose(pred_arr, exp_pred_arr, atol=1e-5)
+    else:
+        # Rounding differences can give a difference of 1 for a few pixels
+        diff = np.abs(pred_arr.astype(np.int16) - exp_pred_arr)
+        assert diff.max() <= 1
+        assert np.mean(diff > 0) < 0.01
+
+
+def test_export_onnx_cached(tmp_path):
+    pytest.importorskip("onnxruntime")
+    model = test_helper.create_model()
+    model_path = tmp_path / "model.keras"
+    model_path.touch()
+    model_mtime = model_path.stat().st_mtime
+    onnx_path = tmp_path / "model.onnx"
+    export_onnx(model, onnx_path, model_path=model_path)
+
+    # If the export is more recent than the model file, it is reused
+    os.utime(onnx_path, (model_mtime + 100, model_mtime + 100))
+    export_onnx(model, onnx_path, model_path=model_path)
+    assert onnx_path.stat().st_mtime == model_mtime + 100
+
+    # If the model file is more recent, the model is exported again
+    os.utime(onnx_path, (model_mtime - 100, model_mtime - 100))
+    export_onnx(model, onnx_path, model_path=model_path)
+    assert onnx_path.stat().st_mtime >= model_mtime
@@ -1,7 +1,9 @@
 """Tests for functionalities in orthoseg.model.model_factory."""
 
+import math
 import os
 
+import numpy as np
 import pytest
 import segmodels_keras as smk
 
@@ -154,6 +156,41 @@ def test_get_model_weights_type_unknown():
         )
 
 
+@pytest.mark.parametrize("decode_head", ["none", "probabilities", "classes"])
+def test_add_decode_head(decode_head: str):
+    import keras  # noqa: PLC0415
+
+    keras.utils.set_random_seed(0)
+    inputs = keras.Input((32, 32, 3))
+    output = keras.layers.Conv2D(3, 3, padding="same", activation="softmax")(inputs)
+    model = keras.Model(inputs, output)
+    images = np.random.default_rng(0).random((2, 32, 32, 3), dtype=np.float32) * 3
+    min_probability = 0.4
+
+    model_decode = mf.add_decode_head(
+        model, decode_head=decode_head, min_probability=min_probability
+    )
+    result = np.asarray(model_decode.predict_on_batch(images))
+
+    # The result should be the same as decoding the float32 predictions afterwards
+    expected = np.asarray(model.predict_on_batch(images))
+    if decode_head == "none":
+        assert model_decode is model
+    else:
+        expected = np.array(expected * 255, dtype=np.uint8)
+        if decode_head == "classes":
+            expected[expected < math.floor(255 * min_probability)] = 0
+            expected = np.argmax(expected, axis=-1).astype(np.uint8)
+
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_add_decode_head_invalid():
+    with pytest.raises(ValueError, match="Unsupported decode_head: unknown"):
+        _ = mf.add_decode_head(None, decode_head="unknown")  # type: ignore[arg-type]
+
+
 @pytest.mark.parametrize(
     "loss, class_weights",
     [
@@ -0,0 +1,119 @@
+"""
+Tests for functionalities in orthoseg.model.model_quantizer.
+"""
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from orthoseg import quantize
+from orthoseg.model import model_factory as mf, model_quantizer
+from orthoseg.model.inference_engine import (
+    OnnxInferenceEngine,
+    export_onnx,
+    get_onnx_path,
+)
+from tests import test_helper
+
+
+def _write_png(path, image_arr):
+    with rio.open(
+        path,
+        "w",
+        driver="PNG",
+        width=image_arr.shape[1],
+        height=image_arr.shape[0],
+        count=image_arr.shape[2],
+        dtype="uint8",
+    ) as image_ds:
+        image_ds.write(np.moveaxis(image_arr, -1, 0))
+
+
+def _create_tiles(image_dir, mask_dir, nb_tiles):
+    image_dir.mkdir(parents=True)
+    mask_dir.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for index in range(nb_tiles):
+        image_arr = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+        _write_png(image_dir / f"tile_{index}.png", image_arr)
+        mask_arr = (image_arr[:, :, :1] > 127).astype(np.uint8)
+        _write_png(mask_dir / f"tile_{index}.png", mask_arr)
+
+
+def test_quantize_args():
+    valid_args = quantize._quantize_args(
+        args=["--config", "X:/test.ini", "-n", "20", "predict.batch_size=2"]
+    )
+    assert valid_args.config == "X:/test.ini"
+    assert valid_args.nb_calibration_tiles == 20
+    assert valid_args.config_overrules == ["predict.batch_size=2"]
+
+
+def test_get_onnx_path_quantized(tmp_path):
+    onnx_path = get_onnx_path(tmp_path / "model_0.9.keras", "classes", quantized=True)
+    assert onnx_path == tmp_path / "model_0.9_classes0.5_int8.onnx"
+
+
+@pytest.mark.parametrize("decode_head", ["none", "probabilities"])
+def test_quantize_model(tmp_path, decode_head):
+    pytest.importorskip("onnxruntime")
+    image_dir = tmp_path / "image"
+    mask_dir = tmp_path / "mask"
+    _create_tiles(image_dir, mask_dir, nb_tiles=6)
+    model = mf.add_decode_head(test_helper.create_model(), decode_head=decode_head)
+    onnx_path = export_onnx(model, tmp_path / "model.onnx")
+
+    def preprocess_input(image_arr):
+        return image_arr / 255
+
+    quantized_path = model_quantizer.quantize_model(
+        onnx_path,
+        output_path=tmp_path / "model_int8.onnx",
+        calibration_image_dir=image_dir,
+        preprocess_input=preprocess_input,
+        nb_calibration_tiles=4,
+    )
+    assert quantized_path.exists()
+    assert not (tmp_path / "model_int8_tmp.onnx").exists()
+
+    # The quantized model gives predictions with the same shape and type
+    images_arr = np.random.default_rng(1).random((2, 16, 16, 3))
+    engine = OnnxInferenceEngine(onnx_path, batch_size=2)
+    quantized_engine = OnnxInferenceEngine(quantized_path, batch_size=2)
+    pred_arr = engine.predict_on_batch(images_arr)
+    quantized_pred_arr = quantized_engine.predict_on_batch(images_arr)
+    assert quantized_pred_arr.shape == pred_arr.shape
+    assert quantized_pred_arr.dtype == pred_arr.dtype
+
+    result_df = model_quantizer.compare_iou(
+        onnx_path,
+        quantized_path,
+        image_dir=image_dir,
+        mask_dir=mask_dir,
+        classes=["background", "subject"],
+        preprocess_input=preprocess_input,
+        batch_size=4,
+    )
+    assert list(result_df.columns) == [
+        "class",
+        "iou_float",
+        "iou_quantized",
+        "iou_delta",
+    ]
+    assert list(result_df["class"]) == ["background", "subject"]
+    assert np.allclose(
+        result_df["iou_delta"],
+        result_df["iou_quantized"] - result_df["iou_float"],
+        equal_nan=True,
+    )
+
+
+def test_quantize_model_no_images(tmp_path):
+    pytest.importorskip("onnxruntime")
+    onnx_path = export_onnx(test_helper.create_model(), tmp_path / "model.onnx")
+    with pytest.raises(ValueError, match="No images found to calibrate"):
+        model_quantizer.quantize_model(
+            onnx_path,
+            output_path=tmp_path / "model_int8.onnx",
+            calibration_image_dir=tmp_path,
+        )
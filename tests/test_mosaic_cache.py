@@ -0,0 +1,85 @@
+"""Tests for the MosaicCache class."""
+
+import pytest
+
+from orthoseg.util import image_util
+from orthoseg.util.mosaic_cache import MosaicCache
+from tests import test_helper
+
+
+def test_get_blocks(tmp_path):
+    mosaic_cache = MosaicCache(
+        tmp_path, "epsg:31370", 0.5, 0.5, grid_xmin=10, grid_ymin=20, block_size=100
+    )
+
+    # A bbox within one block
+    assert mosaic_cache.get_blocks((20, 30, 40, 50)) == [(10, 20, 60, 70)]
+
+    # A bbox that touches the borders of the block is still within one block
+    assert mosaic_cache.get_blocks((10, 20, 60, 70)) == [(10, 20, 60, 70)]
+
+    # A bbox that overlaps multiple blocks
+    assert mosaic_cache.get_blocks((50, 60, 70, 80)) == [
+        (10, 20, 60, 70),
+        (10, 70, 60, 120),
+        (60, 20, 110, 70),
+        (60, 70, 110, 120),
+    ]
+
+
+def test_load(tmp_path):
+    path = tmp_path / "file_layer.tif"
+    data = test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+    mosaic_cache = MosaicCache(
+        tmp_path / "mosaic",
+        "epsg:31370",
+        1.0,
+        1.0,
+        grid_xmin=1000,
+        grid_ymin=1872,
+        block_size=64,
+    )
+    assert not mosaic_cache.is_cached((1000, 1872, 1128, 2000))
+
+    # Load the file layer in 4 blocks, each requested in 4 images
+    vrt_path = mosaic_cache.load(
+        [layersource],
+        image_gen_bbox=(1000, 1872, 1128, 2000),
+        request_size=32,
+        tiff_compress="deflate",
+    )
+    assert vrt_path.exists()
+    assert len(list(mosaic_cache.blocks_dir.glob("*/*.tif"))) == 4
+    assert mosaic_cache.is_cached((1000, 1872, 1128, 2000))
+    assert not mosaic_cache.is_cached((1000, 1872, 1200, 2000))
+
+    # Tiles with any size and overlap can be read from the mosaic
+    mosaic_layersource = mosaic_cache.get_layersource()
+    for bbox, size in [
+        ((1000, 1872, 1128, 2000), (128, 128)),
+        ((1010, 1900, 1058, 1948), (48, 48)),
+    ]:
+        image_data, _ = image_util.load_image(
+            mosaic_layersource, "epsg:31370", bbox, size
+        )
+        rows = slice(2000 - bbox[3], 2000 - bbox[1])
+        cols = slice(bbox[0] - 1000, bbox[2] - 1000)
+        assert (image_data == data[:, rows, cols]).all()
+
+
+def test_load_other_settings(tmp_path):
+    path = tmp_path / "file_layer.tif"
+    test_helper.create_tiled_file(path)
+    layersource = image_util.FileLayerSource(path, layernames=["test"])
+    mosaic_cache = MosaicCache(
+        tmp_path / "mosaic", "epsg:31370", 1.0, 1.0, block_size=64
+    )
+    mosaic_cache.load([layersource], image_gen_bbox=(1000, 1872, 1128, 2000))
+
+    # The mosaic can't be loaded with another pixel size
+    mosaic_cache = MosaicCache(
+        tmp_path / "mosaic", "epsg:31370", 2.0, 2.0, block_size=64
+    )
+    with pytest.raises(ValueError, match="was created with other settings"):
+        mosaic_cache.load([layersource], image_gen_bbox=(1000, 1872, 1128, 2000))
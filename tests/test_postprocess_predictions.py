@@ -2,6 +2,7 @@
 Tests for functionalities in orthoseg.lib.postprocess_predictions.
 """
 
+import math
 import os
 import shutil
 from pathlib import Path
@@ -231,6 +232,92 @@ def test_postprocess_predictions(
         assert output_reclass_path.exists()
 
 
+@pytest.mark.parametrize("pred_type", ["uint8_probabilities", "uint8_classes"])
+def test_polygonize_pred_multiclass_decoded(pred_type: str):
+    """Predictions decoded in the model should give the same result as float32 ones."""
+    rng = np.random.default_rng(0)
+    pred_arr = rng.dirichlet((1, 1, 1), size=(64, 64)).astype(np.float32)
+    classes = ["background", "class_1", "class_2"]
+    min_probability = 0.5
+    transform = rio_transform.from_origin(0, 64, 1, 1)
+    kwargs = {
+        "image_crs": "EPSG:31370",
+        "image_transform": transform,
+        "classes": classes,
+        "min_probability": min_probability,
+        "border_pixels_to_ignore": 4,
+    }
+
+    # Decode the prediction like a decode head in the model does it
+    pred_decoded_arr = np.array(pred_arr * 255, dtype=np.uint8)
+    if pred_type == "uint8_classes":
+        pred_decoded_arr[pred_decoded_arr < math.floor(255 * min_probability)] = 0
+        pred_decoded_arr = np.argmax(pred_decoded_arr, axis=2).astype(np.uint8)
+    pred_decoded_orig_arr = pred_decoded_arr.copy()
+
+    expected_gdf = postp.polygonize_pred_multiclass(image_pred_arr=pred_arr, **kwargs)
+    result_gdf = postp.polygonize_pred_multiclass(
+        image_pred_arr=pred_decoded_arr, **kwargs
+    )
+
+    assert expected_gdf is not None
+    assert result_gdf is not None
+    assert len(expected_gdf) > 0
+    assert len(result_gdf) == len(expected_gdf)
+    assert result_gdf.geometry.union_all().equals(expected_gdf.geometry.union_all())
+    # The input array should not have been changed
+    assert np.array_equal(pred_decoded_arr, pred_decoded_orig_arr)
+
+
+def test_polygonize_pred_multiclass_onborder():
+    pred_arr = np.zeros((16, 16), dtype=np.uint8)
+    pred_arr[2:5, 2:5] = 1  # On the border, taking the pixels to ignore in account
+    pred_arr[7:10, 7:10] = 1  # Not on the border
+    pred_arr[12:16, 10:14] = 1  # Partly in the pixels to ignore
+    result_gdf = postp.polygonize_pred_multiclass(
+        image_pred_arr=pred_arr,
+        image_crs="EPSG:31370",
+        image_transform=rio_transform.from_origin(0, 16, 1, 1),
+        classes=["background", "class_1"],
+        border_pixels_to_ignore=2,
+    )
+
+    assert result_gdf is not None
+    result_gdf = result_gdf.iloc[result_gdf.geometry.bounds["minx"].argsort()]
+    assert list(result_gdf["onborder"]) == [1, 0, 1]
+
+
+def test_postprocess_predictions_dissolve_onborder_only(tmp_path: Path):
+    # Two tiles of 10x10: polygons on the border of both tiles touch each other
+    predictions_gdf = gpd.GeoDataFrame(
+        {
+            "classname": ["class_1"] * 4,
+            "onborder": [1, 1, 0, 0],
+            "geometry": [
+                shapely.box(5, 2, 10, 4),
+                shapely.box(10, 2, 15, 4),
+                shapely.box(2, 6, 4, 8),
+                shapely.box(12, 6, 14, 8),
+            ],
+        },
+        crs=31370,
+    )
+    input_path = tmp_path / "prediction.gpkg"
+    gfo.to_file(predictions_gdf, input_path)
+
+    output_paths = postp.postprocess_predictions(
+        input_path=input_path,
+        output_path=input_path,
+        dissolve=True,
+        dissolve_onborder_only=True,
+    )
+
+    result_gdf = gfo.read_file(output_paths[0])
+    assert len(result_gdf) == 3
+    assert sorted(result_gdf.geometry.area) == [4, 4, 20]
+    assert result_gdf.geometry.union_all().equals(predictions_gdf.geometry.union_all())
+
+
 def test_postprocess_predictions_output_style_added(tmp_path: Path):
     output_vector_dir = tmp_path / "output_vector"
     subject = "test-subject"
@@ -35,6 +35,14 @@ def test_predict_args(args):
     assert valid_args.config_overrules is not None
 
 
+def test_predict_args_multiple_configs():
+    valid_args = _predict_args(
+        args=["-c", "buildings.ini", "-c", "trees.ini", "predict.image_layer=LT-2023"]
+    )
+    assert valid_args.config == ["buildings.ini", "trees.ini"]
+    assert valid_args.config_overrules == ["predict.image_layer=LT-2023"]
+
+
 @pytest.mark.parametrize("config_path, exp_error", [(Path("INVALID"), True)])
 def test_predict_invalid_config(config_path, exp_error):
     if exp_error:
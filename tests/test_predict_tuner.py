@@ -0,0 +1,57 @@
+"""
+Tests for functionalities in orthoseg.lib.predict_tuner.
+"""
+
+import pytest
+
+from orthoseg.lib import predict_tuner
+from tests import test_helper
+
+
+@pytest.mark.parametrize(
+    "images_per_s, read_s, postprocess_s, exp_read, exp_postprocess",
+    [
+        (10, 0.1, 0.1, 4, 2),
+        (10, 2, 0.5, 30, 6),
+        # The number of postprocess workers is limited to the number of CPU's
+        (100, 0.01, 1, 4, 8),
+    ],
+)
+def test_get_parallelism(
+    images_per_s, read_s, postprocess_s, exp_read, exp_postprocess
+):
+    result = predict_tuner.get_parallelism(
+        images_per_s=images_per_s,
+        read_s=read_s,
+        postprocess_s=postprocess_s,
+        batch_size=4,
+        nb_cpu=8,
+    )
+    assert result == {
+        "nb_parallel_read": exp_read,
+        "nb_parallel_postprocess": exp_postprocess,
+    }
+
+
+def test_measure_predict():
+    result = predict_tuner.measure_predict(
+        test_helper.create_model(), batch_size=2, width=32, height=16, nb_batches=2
+    )
+    assert result["images_per_s"] > 0
+    assert result["peak_memory_mb"] > 0
+
+
+def test_tune_batch_size():
+    result = predict_tuner.tune_batch_size(
+        test_helper.create_model(), width=32, height=32, batch_sizes=(1, 2)
+    )
+    assert result["batch_size"] in (1, 2)
+    assert result["images_per_s"] > 0
+
+
+def test_tune_batch_size_memory_budget():
+    # If the memory budget is too small, no batch size can be used
+    result = predict_tuner.tune_batch_size(
+        test_helper.create_model(), width=32, height=32, memory_budget_mb=1
+    )
+    assert result == {}
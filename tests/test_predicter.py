@@ -1,8 +1,17 @@
 from contextlib import AbstractContextManager, nullcontext
 
+import geofileops as gfo
+import geopandas as gpd
+import numpy as np
 import pytest
+import rasterio as rio
+import shapely
 
 from orthoseg.lib import predicter
+from orthoseg.lib.prediction_journal import PredictionJournal
+from orthoseg.lib.prediction_leases import PredictionLeases
+from orthoseg.model.inference_engine import InferenceEngine
+from tests import test_helper
 
 
 @pytest.mark.parametrize(
@@ -38,3 +47,190 @@ def test_predict_dir_input_image_dir_empty(
             classes=[],
             no_images_ok=no_images_ok,
         )
+
+
+def _write_images(image_dir, nb_images):
+    image_dir.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for index in range(nb_images):
+        image_arr = rng.integers(0, 256, (3, 32, 32), dtype=np.uint8)
+        with rio.open(
+            image_dir / f"image_{index}.tif",
+            "w",
+            driver="GTiff",
+            width=32,
+            height=32,
+            count=3,
+            dtype="uint8",
+            crs="EPSG:31370",
+            transform=rio.transform.from_origin(index * 32, 32, 1, 1),
+        ) as image_ds:
+            image_ds.write(image_arr)
+
+
+def test_predictor(tmp_path):
+    """A predictor reuses the model and the worker pools for multiple predictions."""
+    model = test_helper.create_model()
+    for name in ["train", "validation"]:
+        _write_images(tmp_path / name / "image", nb_images=3)
+
+    with predicter.Predictor(
+        model=model,
+        preprocess_input=lambda image_arr: image_arr / 255,
+        classes=["background", "subject"],
+        batch_size=2,
+        nb_parallel_read=2,
+    ) as predictor:
+        assert isinstance(predictor.model, InferenceEngine)
+        predictor.warm_up((32, 32, 3))
+        postprocess_pools = []
+        for name in ["train", "validation"]:
+            predictor.predict_dir(
+                input_image_dir=tmp_path / name / "image",
+                output_image_dir=tmp_path / name / "pred",
+                output_vector_path=tmp_path / name / "pred.gpkg",
+            )
+            assert (tmp_path / name / "pred.gpkg").exists()
+            postprocess_pools.append(predictor._worker_pools._postprocess_pool)
+
+        predictor.predict_tiles(
+            image_paths=sorted((tmp_path / "train" / "image").glob("*.tif"))[:2],
+            output_image_dir=tmp_path / "tiles" / "pred",
+            output_vector_path=tmp_path / "tiles" / "pred.gpkg",
+        )
+        assert (tmp_path / "tiles" / "pred.gpkg").exists()
+
+        # The worker pools and the traced prediction function are reused
+        assert postprocess_pools[0] is not None
+        assert postprocess_pools[0] is postprocess_pools[1]
+        assert predictor._worker_pools._postprocess_pool is postprocess_pools[0]
+        predict_function = predictor.model._functions[(32, 32, 3)]
+        assert predict_function.experimental_get_tracing_count() == 1
+
+    assert predictor._worker_pools._postprocess_pool is None
+
+
+def test_predict_dir_cancel(tmp_path):
+    """If the prediction is cancelled, the output isn't finalized."""
+    model = test_helper.create_model()
+    _write_images(tmp_path / "image", nb_images=6)
+    cancel_path = tmp_path / "cancel.txt"
+
+    def preprocess_input(image_arr):
+        # Cancel while the first images are still being processed
+        cancel_path.touch()
+        return image_arr / 255
+
+    predicter.predict_dir(
+        model=model,
+        preprocess_input=preprocess_input,
+        input_image_dir=tmp_path / "image",
+        output_image_dir=tmp_path / "pred",
+        output_vector_path=tmp_path / "pred.gpkg",
+        classes=["background", "subject"],
+        batch_size=2,
+        cancel_filepath=cancel_path,
+        vector_write_batch_size=1,
+    )
+
+    assert not (tmp_path / "pred.gpkg").exists()
+    assert (tmp_path / "pred").exists()
+
+
+def test_pipeline_stats():
+    stats = predicter._PipelineStats()
+    stats.add_predict(2.0)
+    stats.add_predict(1.0)
+    stats.add_stall("read", 0.5)
+    stats.add_stall("write", 0.25)
+
+    assert stats.nb_batches == 2
+    assert stats.predict_s == 3.0
+    assert stats.stalled_s == {"read": 0.5, "postprocess": 0.0, "write": 0.25}
+    assert str(stats).startswith("predicted 2 batches in 3.0s")
+    assert "prescreen" not in str(stats)
+
+    stats.add_skipped("blank")
+    stats.add_skipped("outside_roi")
+    stats.add_skipped("blank")
+    assert stats.nb_skipped == {"blank": 2, "outside_roi": 1}
+    assert "prescreen saved 3 predictions (blank: 2, outside_roi: 1)" in str(stats)
+
+    with pytest.raises(ValueError, match="Invalid stage"):
+        stats.add_stall("predict", 1.0)
+
+
+def test_write_vector_batch(tmp_path):
+    buffer = predicter._VectorWriteBuffer()
+    crs = "EPSG:31370"
+    for idx in range(3):
+        polygons_gdf = gpd.GeoDataFrame(
+            {"classname": ["class_1"] * (idx + 1)},
+            geometry=[shapely.box(idx, 0, idx + 1, j + 1) for j in range(idx + 1)],
+            crs=crs,
+        )
+        buffer.add({"tile_id": f"image_{idx}.tif"}, polygons_gdf)
+    buffer.add({"tile_id": "image_empty.tif"}, None)
+    assert len(buffer) == 4
+    assert buffer.nb_features == 6
+
+    polygons_gdfs, tile_records = buffer.pop()
+    assert len(buffer) == 0
+    assert buffer.nb_features == 0
+    assert [record["nb_features"] for record in tile_records] == [1, 2, 3, 0]
+
+    output_path = tmp_path / "output.gpkg"
+    with PredictionJournal(tmp_path / "journal.sqlite") as journal:
+        journal.add_tiles(record["tile_id"] for record in tile_records)
+        predicter._write_vector_batch(
+            polygons_gdfs=polygons_gdfs,
+            tile_records=tile_records,
+            vector_output_path=output_path,
+            journal=journal,
+        )
+        assert journal.get_pending_tile_ids() == set()
+
+    result_gdf = gfo.read_file(output_path)
+    assert len(result_gdf) == 6
+
+
+def test_merge_distributed_prediction(tmp_path):
+    output_image_dir = tmp_path / "output"
+    output_path = tmp_path / "output.gpkg"
+    with PredictionLeases(output_image_dir / "prediction_leases.sqlite") as leases:
+        leases.add_tiles([f"image_{idx}.tif" for idx in range(3)], chunk_size=1)
+        for worker_id in ["worker_1", "worker_2", "worker_1"]:
+            chunk_id = leases.lease(worker_id, lease_s=60)
+            assert leases.set_done(chunk_id, worker_id)
+
+    # Chunk 2 didn't have any features, a part of another worker is ignored
+    parts_dir = output_image_dir / "parts"
+    parts_dir.mkdir()
+    for chunk_id, worker_id in [(0, "worker_1"), (1, "worker_2"), (1, "worker_3")]:
+        polygons_gdf = gpd.GeoDataFrame(
+            {"classname": ["class_1"]},
+            geometry=[shapely.box(chunk_id, 0, chunk_id + 1, 1)],
+            crs="EPSG:31370",
+        )
+        part_path = parts_dir / f"output_chunk{chunk_id}_{worker_id}.gpkg"
+        gfo.to_file(polygons_gdf, part_path)
+
+    predicter.merge_distributed_prediction(
+        output_image_dir=output_image_dir, output_vector_path=output_path
+    )
+
+    result_gdf = gfo.read_file(output_path)
+    assert len(result_gdf) == 2
+    assert not output_image_dir.exists()
+
+
+def test_merge_distributed_prediction_not_done(tmp_path):
+    output_image_dir = tmp_path / "output"
+    with PredictionLeases(output_image_dir / "prediction_leases.sqlite") as leases:
+        leases.add_tiles(["image_0.tif"], chunk_size=1)
+
+    with pytest.raises(ValueError, match="not all chunks are done yet"):
+        predicter.merge_distributed_prediction(
+            output_image_dir=output_image_dir,
+            output_vector_path=tmp_path / "output.gpkg",
+        )
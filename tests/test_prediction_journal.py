@@ -0,0 +1,83 @@
+import sqlite3
+
+from orthoseg.lib.prediction_journal import PredictionJournal
+
+
+def test_prediction_journal(tmp_path):
+    journal_path = tmp_path / "journal.sqlite"
+    with PredictionJournal(journal_path, batch_size=2) as journal:
+        journal.add_tiles(["tile_1", "tile_2", "tile_3"])
+        assert journal.get_pending_tile_ids() == {"tile_1", "tile_2", "tile_3"}
+
+        journal.set_done(
+            [{"tile_id": "tile_1", "read_s": 0.1, "predict_s": 0.2, "nb_features": 5}]
+        )
+        journal.set_error("tile_2")
+        assert journal.get_pending_tile_ids() == {"tile_2", "tile_3"}
+
+        # Adding tiles again doesn't reset their status
+        journal.add_tiles(["tile_1", "tile_4"])
+        assert journal.get_pending_tile_ids() == {"tile_2", "tile_3", "tile_4"}
+
+        # Buffered updates are written when closing the journal
+        journal.set_done([{"tile_id": "tile_3", "prescreen": "blank"}])
+
+    # The status is kept when the journal is reopened
+    with PredictionJournal(journal_path) as journal:
+        assert journal.get_pending_tile_ids() == {"tile_2", "tile_4"}
+
+    conn = sqlite3.connect(journal_path)
+    try:
+        row = conn.execute(
+            "SELECT status, read_s, predict_s, postprocess_s, nb_features FROM tile "
+            "WHERE tile_id = 'tile_1'"
+        ).fetchone()
+        prescreen = conn.execute(
+            "SELECT prescreen FROM tile WHERE tile_id = 'tile_3'"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert row == ("done", 0.1, 0.2, None, 5)
+    assert prescreen == "blank"
+
+
+def test_prediction_journal_clear(tmp_path):
+    with PredictionJournal(tmp_path / "journal.sqlite") as journal:
+        journal.add_tiles(["tile_1", "tile_2"])
+        journal.set_done([{"tile_id": "tile_1"}])
+        journal.clear()
+        assert journal.get_pending_tile_ids() == set()
+
+        journal.add_tiles(["tile_1", "tile_2"])
+        assert journal.get_pending_tile_ids() == {"tile_1", "tile_2"}
+
+
+def test_prediction_journal_import_done_log(tmp_path):
+    done_log_path = tmp_path / "images_done.txt"
+    done_log_path.write_text("tile_1\ntile_3\n\n")
+
+    with PredictionJournal(tmp_path / "journal.sqlite") as journal:
+        journal.import_done_log(done_log_path)
+        journal.add_tiles(["tile_1", "tile_2", "tile_3"])
+        assert journal.get_pending_tile_ids() == {"tile_2"}
+
+
+def test_prediction_journal_add_missing_columns(tmp_path):
+    # Journals without prescreen column are upgraded when opened
+    journal_path = tmp_path / "journal.sqlite"
+    conn = sqlite3.connect(journal_path)
+    try:
+        with conn:
+            conn.execute(
+                "CREATE TABLE tile (tile_id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                "read_s REAL, predict_s REAL, postprocess_s REAL, "
+                "nb_features INTEGER, updated REAL)"
+            )
+            conn.execute("INSERT INTO tile VALUES ('tile_1', 'done', 1, 1, 1, 1, 1)")
+    finally:
+        conn.close()
+
+    with PredictionJournal(journal_path) as journal:
+        journal.add_tiles(["tile_1", "tile_2"])
+        journal.set_done([{"tile_id": "tile_2", "prescreen": "nodata"}])
+        assert journal.get_pending_tile_ids() == set()
@@ -0,0 +1,104 @@
+import time
+from concurrent import futures
+
+import pytest
+
+from orthoseg.lib.prediction_leases import PredictionLeases
+
+
+def test_prediction_leases(tmp_path):
+    leases_path = tmp_path / "leases.sqlite"
+    tile_ids = [f"tile_{index}" for index in range(5)]
+    with PredictionLeases(leases_path) as leases:
+        leases.add_tiles(tile_ids, chunk_size=2)
+        assert leases.get_status_counts() == {"pending": 3}
+
+        chunk_id = leases.lease("worker_1", lease_s=60)
+        assert chunk_id == 0
+        assert leases.get_chunk_tile_ids(chunk_id) == {"tile_0", "tile_1"}
+        assert leases.lease("worker_2", lease_s=60) == 1
+        assert leases.renew(chunk_id, "worker_1", lease_s=60)
+        assert not leases.renew(chunk_id, "worker_2", lease_s=60)
+
+        # A released chunk can be leased again
+        leases.release(1, "worker_2")
+        assert leases.lease("worker_2", lease_s=60) == 1
+
+        assert leases.set_done(0, "worker_1")
+        assert leases.set_done(1, "worker_2")
+        assert not leases.is_done()
+        assert leases.lease("worker_1", lease_s=60) == 2
+        assert leases.lease("worker_2", lease_s=60) is None
+        assert leases.set_done(2, "worker_1")
+        assert leases.is_done()
+        assert leases.get_done_chunks() == {0: "worker_1", 1: "worker_2", 2: "worker_1"}
+
+        # Only one worker merges
+        assert leases.claim_merge("worker_2")
+        assert not leases.claim_merge("worker_1")
+
+    # Adding the same tiles again is fine, other tiles gives an error
+    with PredictionLeases(leases_path) as leases:
+        leases.add_tiles(tile_ids, chunk_size=2)
+        assert leases.is_done()
+        with pytest.raises(ValueError, match="are different from the tiles to predict"):
+            leases.add_tiles(tile_ids[:-1], chunk_size=2)
+
+
+def test_prediction_leases_expired(tmp_path):
+    with PredictionLeases(tmp_path / "leases.sqlite") as leases:
+        leases.add_tiles(["tile_0", "tile_1"], chunk_size=2)
+        assert leases.lease("worker_1", lease_s=0.1) == 0
+        assert leases.lease("worker_2", lease_s=60) is None
+
+        # If the lease expires, another worker can lease the chunk
+        time.sleep(0.2)
+        assert leases.lease("worker_2", lease_s=60) == 0
+        assert not leases.set_done(0, "worker_1")
+        assert leases.set_done(0, "worker_2")
+        assert leases.get_done_chunks() == {0: "worker_2"}
+
+
+def test_prediction_leases_resume(tmp_path):
+    """A restarted worker first resumes the chunk it had leased."""
+    with PredictionLeases(tmp_path / "leases.sqlite") as leases:
+        leases.add_tiles([f"tile_{index}" for index in range(4)], chunk_size=1)
+        assert leases.lease("worker_1", lease_s=60) == 0
+        assert leases.lease("worker_2", lease_s=60) == 1
+        assert leases.lease("worker_2", lease_s=60) == 1
+
+
+def test_prediction_leases_renewing(tmp_path):
+    with PredictionLeases(tmp_path / "leases.sqlite") as leases:
+        leases.add_tiles(["tile_0"], chunk_size=1)
+        assert leases.lease("worker_1", lease_s=0.3) == 0
+        with leases.renewing(0, "worker_1", lease_s=0.3):
+            time.sleep(0.6)
+            assert leases.lease("worker_2", lease_s=60) is None
+        assert leases.set_done(0, "worker_1")
+
+
+def _run_worker(leases_path, worker_id):
+    chunk_ids = []
+    with PredictionLeases(leases_path) as leases:
+        leases.add_tiles([f"tile_{index}" for index in range(50)], chunk_size=3)
+        while (chunk_id := leases.lease(worker_id, lease_s=60)) is not None:
+            time.sleep(0.01)
+            assert leases.set_done(chunk_id, worker_id)
+            chunk_ids.append(chunk_id)
+    return chunk_ids
+
+
+def test_prediction_leases_processes(tmp_path):
+    """Multiple worker processes predict each chunk exactly once."""
+    leases_path = tmp_path / "leases.sqlite"
+    with futures.ProcessPoolExecutor(4) as pool:
+        results = [
+            pool.submit(_run_worker, leases_path, f"worker_{index}")
+            for index in range(4)
+        ]
+        chunk_ids = [chunk_id for result in results for chunk_id in result.result()]
+
+    assert sorted(chunk_ids) == list(range(17))
+    with PredictionLeases(leases_path) as leases:
+        assert leases.is_done()
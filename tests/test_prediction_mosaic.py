@@ -0,0 +1,111 @@
+"""
+Tests for functionalities in orthoseg.lib.prediction_mosaic.
+"""
+
+import numpy as np
+import pyproj
+import pytest
+import rasterio as rio
+import rasterio.transform as rio_transform
+
+from orthoseg.lib import prediction_mosaic
+
+
+@pytest.mark.parametrize("blend_pixels", [0, 4, 8])
+def test_cosine_weights(blend_pixels):
+    weights = prediction_mosaic.cosine_weights(
+        width=32, height=24, blend_pixels=blend_pixels
+    )
+    assert weights.shape == (24, 32)
+    assert weights.dtype == np.float32
+    assert weights.max() == pytest.approx(1)
+    assert weights.min() > 0
+
+    # Tiles that overlap blend_pixels pixels have weights that sum up to 1
+    step = 32 - blend_pixels
+    weights_sum = np.zeros((24, step + 32), dtype=np.float32)
+    weights_sum[:, :32] += weights
+    weights_sum[:, step:] += weights
+    assert np.allclose(weights_sum[12, blend_pixels : step + 32 - blend_pixels], 1)
+
+
+def test_get_block_windows():
+    windows = list(prediction_mosaic.get_block_windows(10, 5, block_size=4))
+    assert len(windows) == 6
+    assert sum(window.width * window.height for window in windows) == 50
+    assert (windows[-1].col_off, windows[-1].row_off) == (8, 4)
+    assert (windows[-1].width, windows[-1].height) == (2, 1)
+
+
+def test_prediction_mosaic(tmp_path):
+    # Two tiles of 16x8 pixels that overlap 8 pixels
+    crs = pyproj.CRS.from_epsg(31370)
+    mosaic = prediction_mosaic.PredictionMosaic(
+        path=tmp_path / "mosaic_sums.tif",
+        bounds=(0, 0, 6, 2),
+        pixel_x_size=0.25,
+        pixel_y_size=0.25,
+        crs=crs,
+        nb_classes=2,
+        blend_pixels=8,
+    )
+    assert (mosaic.width, mosaic.height) == (24, 8)
+
+    # The left tile predicts class 1, the right tile the background
+    pred_left = np.zeros((8, 16, 2), dtype=np.float32)
+    pred_left[:, :, 1] = 1
+    pred_right = np.zeros((8, 16, 2), dtype=np.uint8)
+    pred_right[:, :, 0] = 255
+    mosaic.add(
+        [pred_left, pred_right],
+        [
+            rio_transform.from_origin(0, 2, 0.25, 0.25),
+            rio_transform.from_origin(2, 2, 0.25, 0.25),
+        ],
+    )
+
+    # A tile outside the mosaic gives an error
+    with pytest.raises(ValueError, match="not within the mosaic"):
+        mosaic.add([pred_left], [rio_transform.from_origin(4, 2, 0.25, 0.25)])
+    # Class maps can't be blended
+    with pytest.raises(ValueError, match="only predictions with probabilities"):
+        mosaic.add(
+            [np.zeros((8, 16), dtype=np.uint8)],
+            [rio_transform.from_origin(0, 2, 0.25, 0.25)],
+        )
+
+    classes_path = tmp_path / "classes.tif"
+    mosaic.write_classes(classes_path, min_probability=0.5)
+    with rio.open(classes_path) as classes_ds:
+        assert classes_ds.profile["tiled"]
+        assert classes_ds.crs == crs
+        classes_arr = classes_ds.read(1)
+
+    # Only the left tile covers the first 8 columns, only the right one the last 8.
+    # In the overlap the prediction transitions smoothly from one to the other.
+    assert np.all(classes_arr[:, :8] == 1)
+    assert np.all(classes_arr[:, 16:] == 0)
+    assert np.all(classes_arr[:, 8:12] == 1)
+    assert np.all(classes_arr[:, 12:16] == 0)
+
+    # The blended sums are kept, so blending can be resumed
+    mosaic = prediction_mosaic.PredictionMosaic(
+        path=tmp_path / "mosaic_sums.tif",
+        bounds=(0, 0, 6, 2),
+        pixel_x_size=0.25,
+        pixel_y_size=0.25,
+        crs=crs,
+        nb_classes=2,
+        blend_pixels=8,
+    )
+    mosaic.write_classes(classes_path, min_probability=0.5)
+    with rio.open(classes_path) as classes_ds:
+        assert np.array_equal(classes_ds.read(1), classes_arr)
+
+    # The mosaic can be polygonized in blocks
+    polygons_gdf = prediction_mosaic.polygonize_block(
+        classes_path, next(prediction_mosaic.get_block_windows(24, 8)), ["bg", "fg"]
+    )
+    assert polygons_gdf is not None
+    assert list(polygons_gdf["classname"]) == ["fg"]
+    assert polygons_gdf.geometry.area.sum() == pytest.approx(3 * 2)
@@ -0,0 +1,71 @@
+"""
+Tests for functionalities in orthoseg.lib.prescreen.
+"""
+
+import geofileops as gfo
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from orthoseg.lib import prescreen
+
+
+def test_get_tiles_outside_roi(tmp_path):
+    # Tiles of 10x10 with an overlap of 2 pixels of 0.5 = 1 in all directions
+    tiles_gdf = gpd.GeoDataFrame(
+        geometry=[
+            shapely.box(-1, -1, 11, 11),
+            shapely.box(9, -1, 21, 11),
+            shapely.box(19, -1, 31, 11),
+            shapely.box(29, -1, 41, 11),
+        ],
+        crs=31370,
+    )
+    # The roi covers the first tile partly, only touches the second one, overlaps only
+    # with the overlap of the third one and doesn't intersect the last one.
+    roi_gdf = gpd.GeoDataFrame(
+        geometry=[shapely.box(5, 0, 10, 5), shapely.box(-5, 0, 19.5, -5)], crs=31370
+    )
+    roi_path = tmp_path / "roi.gpkg"
+    gfo.to_file(roi_gdf, roi_path)
+
+    outside_roi = prescreen.get_tiles_outside_roi(
+        tiles_gdf, roi_path, pixels_overlap=2, pixel_x_size=0.5, pixel_y_size=0.5
+    )
+
+    assert outside_roi.tolist() == [False, True, True, True]
+
+
+@pytest.mark.parametrize(
+    "image_values, image_mask_values, exp_reason",
+    [
+        ("random", None, None),
+        ("random", 1, None),
+        ("random", 0, prescreen.SKIP_NODATA),
+        ("white", None, prescreen.SKIP_BLANK),
+        ("black", 1, prescreen.SKIP_BLANK),
+    ],
+)
+def test_prescreen_image(image_values, image_mask_values, exp_reason):
+    if image_values == "random":
+        image_data = np.random.default_rng(0).random((8, 8, 3))
+    elif image_values == "white":
+        image_data = np.ones((8, 8, 3))
+    else:
+        image_data = np.zeros((8, 8, 3))
+    image_mask = None
+    if image_mask_values is not None:
+        image_mask = np.full((8, 8), image_mask_values, dtype=np.uint8)
+
+    assert prescreen.prescreen_image(image_data, image_mask) == exp_reason
+
+
+def test_prescreen_image_partly_nodata():
+    # Images that are only partly nodata or blank need to be predicted
+    image_data = np.zeros((8, 8, 3))
+    image_data[0, 0, 0] = 0.5
+    image_mask = np.zeros((8, 8), dtype=np.uint8)
+    image_mask[4, 4] = 255
+
+    assert prescreen.prescreen_image(image_data, image_mask) is None
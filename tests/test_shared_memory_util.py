@@ -0,0 +1,50 @@
+from concurrent import futures
+
+import numpy as np
+import pytest
+
+from orthoseg.util import _shared_memory_util
+
+
+def _sum_slot(slot: _shared_memory_util.SharedArraySlot) -> float:
+    with _shared_memory_util.attach(slot) as arr:
+        return float(arr.sum())
+
+
+def test_shared_array_ring():
+    arr = np.arange(12, dtype=np.float32).reshape(2, 3, 2)
+    with _shared_memory_util.SharedArrayRing(nb_slots=2) as ring:
+        assert ring.nb_free == 2
+        slot1 = ring.put(arr)
+        slot2 = ring.put(arr * 2)
+        assert ring.nb_free == 0
+        assert slot1.slot_id != slot2.slot_id
+
+        # The arrays can be read back, also in another process
+        with _shared_memory_util.attach(slot1) as arr1:
+            assert np.array_equal(arr1, arr)
+            del arr1
+        with futures.ProcessPoolExecutor(1) as pool:
+            assert pool.submit(_sum_slot, slot2).result() == arr.sum() * 2
+
+        # No slots left
+        with pytest.raises(RuntimeError, match="no free slots"):
+            ring.put(arr)
+
+        # After releasing a slot, it is reused
+        ring.release(slot1)
+        assert ring.nb_free == 1
+        with pytest.raises(ValueError, match="already released"):
+            ring.release(slot1)
+        slot3 = ring.put(arr[0])
+        assert slot3.slot_id == slot1.slot_id
+        with _shared_memory_util.attach(slot3) as arr3:
+            assert np.array_equal(arr3, arr[0])
+            del arr3
+
+        # Arrays larger than the first one don't fit
+        larger_arr = np.zeros((4, 3, 2), dtype=np.float32)
+        assert not ring.fits(larger_arr)
+        ring.release(slot2)
+        with pytest.raises(ValueError, match="doesn't fit"):
+            ring.put(larger_arr)
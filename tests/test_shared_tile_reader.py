@@ -0,0 +1,94 @@
+"""Tests for module shared_tile_reader."""
+
+import threading
+from concurrent import futures
+
+import pytest
+
+from orthoseg.lib.shared_tile_reader import SharedTileReader
+
+
+def _read_tiles(client, tile_ids, reads, lock):
+    def read_func(tile_id):
+        with lock:
+            reads.append(tile_id)
+        return {"tile_id": tile_id}
+
+    with client:
+        client.register(tile_ids, tile_ids)
+        return [
+            client.read(tile_id, read_func, tile_id)["tile_id"] for tile_id in tile_ids
+        ]
+
+
+def test_shared_tile_reader():
+    """Each tile is only read once, even if multiple clients need it."""
+    tile_ids = [f"tile_{index}" for index in range(20)]
+    reader = SharedTileReader(nb_clients=3, max_tiles_ahead=2)
+    reads: list[str] = []
+    lock = threading.Lock()
+
+    with futures.ThreadPoolExecutor(3) as pool:
+        results = [
+            pool.submit(_read_tiles, reader.client(client_id), tile_ids, reads, lock)
+            for client_id in range(3)
+        ]
+        for result in results:
+            assert result.result() == tile_ids
+
+    assert sorted(reads) == sorted(tile_ids)
+    assert reader.nb_reads == len(tile_ids)
+    assert reader.nb_tiles_cached == 0
+
+
+def test_shared_tile_reader_partial():
+    """Clients only need the tiles they registered, e.g. because of resuming."""
+    tile_ids = [f"tile_{index}" for index in range(5)]
+    reader = SharedTileReader(nb_clients=2)
+    reads: list[str] = []
+    lock = threading.Lock()
+
+    # The first client doesn't need any tiles
+    with reader.client(0) as client:
+        client.register(tile_ids, [])
+
+    assert _read_tiles(reader.client(1), tile_ids, reads, lock) == tile_ids
+    assert reader.nb_reads == len(tile_ids)
+    assert reader.nb_tiles_cached == 0
+
+
+def test_shared_tile_reader_closed_client():
+    """A client that stops doesn't block the other clients."""
+    tile_ids = [f"tile_{index}" for index in range(10)]
+    reader = SharedTileReader(nb_clients=2, max_tiles_ahead=1)
+    reads: list[str] = []
+    lock = threading.Lock()
+
+    # The first client registers all tiles, but stops before reading them
+    with reader.client(0) as client:
+        client.register(tile_ids, tile_ids)
+
+    assert _read_tiles(reader.client(1), tile_ids, reads, lock) == tile_ids
+    assert reader.nb_tiles_cached == 0
+
+
+def test_shared_tile_reader_error():
+    """An error reading a tile is raised for all clients that need it."""
+    reader = SharedTileReader(nb_clients=1)
+
+    def read_func():
+        raise RuntimeError("read error")
+
+    with reader.client(0) as client:
+        client.register(["tile_0"], ["tile_0"])
+        with pytest.raises(RuntimeError, match="read error"):
+            client.read("tile_0", read_func)
+
+    assert reader.nb_tiles_cached == 0
+
+
+@pytest.mark.parametrize("client_id", [-1, 2])
+def test_shared_tile_reader_invalid_client(client_id):
+    reader = SharedTileReader(nb_clients=2)
+    with pytest.raises(ValueError, match="invalid client_id"):
+        reader.client(client_id)
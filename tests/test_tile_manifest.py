@@ -0,0 +1,101 @@
+import numpy as np
+import rasterio as rio
+
+from orthoseg.util.tile_manifest import (
+    STATUS_CACHED,
+    STATUS_EMPTY,
+    TileManifest,
+    get_checksum,
+)
+
+
+def _tile_record(path, xmin):
+    return {
+        "path": path,
+        "bounds": (xmin, 0.0, xmin + 10.0, 10.0),
+        "pixel_width": 10,
+        "pixel_height": 10,
+    }
+
+
+def test_tile_manifest(tmp_path):
+    assert not TileManifest.exists(tmp_path)
+    with TileManifest(tmp_path, batch_size=2) as manifest:
+        manifest.set_cached(
+            [
+                _tile_record(tmp_path / "000010/tile_2.png", 10.0),
+                _tile_record("000000/tile_1.png", 0.0),
+            ]
+        )
+        manifest.set_empty([_tile_record("000020/tile_3.png", 20.0)])
+        assert manifest.get_statuses() == {
+            "000000/tile_1.png": STATUS_CACHED,
+            "000010/tile_2.png": STATUS_CACHED,
+            "000020/tile_3.png": STATUS_EMPTY,
+        }
+
+        # Buffered updates are written when closing the manifest
+        manifest.set_cached([_tile_record("000020/tile_3.png", 20.0)])
+
+        # A new manifest is not complete till it is marked so
+        assert manifest.created
+        assert not manifest.is_complete()
+        manifest.set_complete(True)
+
+    # The manifest is kept when it is reopened
+    assert TileManifest.exists(tmp_path)
+    with TileManifest(tmp_path) as manifest:
+        assert not manifest.created
+        assert manifest.is_complete()
+        assert manifest.get_cached_paths() == [
+            tmp_path / "000000/tile_1.png",
+            tmp_path / "000010/tile_2.png",
+            tmp_path / "000020/tile_3.png",
+        ]
+
+
+def test_tile_manifest_rebuild(tmp_path):
+    # Create a GeoTIFF and a png with a worldfile as written by load_images_to_cache
+    data = np.ones((3, 10, 10), dtype=np.uint8)
+    profile = {"dtype": "uint8", "count": 3, "width": 10, "height": 10}
+    tif_path = tmp_path / "000000/tile_1.tif"
+    tif_path.parent.mkdir()
+    transform = rio.Affine(1.0, 0.0, 0.0, 0.0, -1.0, 10.0)
+    with rio.open(tif_path, "w", driver="GTiff", transform=transform, **profile) as f:
+        f.write(data)
+    png_path = tmp_path / "000010/tile_2.png"
+    png_path.parent.mkdir()
+    with rio.open(png_path, "w", driver="PNG", **profile) as f:
+        f.write(data)
+    png_path.with_suffix(".pgw").write_text("1.0\n0.000\n0.000\n-1.0\n10.0\n10.0")
+
+    with TileManifest(tmp_path) as manifest:
+        manifest.set_cached([_tile_record("000020/removed.png", 20.0)])
+        assert manifest.rebuild() == 2
+        assert manifest.get_cached_paths() == [tif_path, png_path]
+        assert manifest.is_complete()
+        rows = manifest._conn.execute(
+            "SELECT path, xmin, ymin, xmax, ymax, size_bytes, checksum FROM tile "
+            "ORDER BY path"
+        ).fetchall()
+
+    assert rows == [
+        (
+            "000000/tile_1.tif",
+            0.0,
+            0.0,
+            10.0,
+            10.0,
+            tif_path.stat().st_size,
+            get_checksum(tif_path.read_bytes()),
+        ),
+        (
+            "000010/tile_2.png",
+            10.0,
+            0.0,
+            20.0,
+            10.0,
+            png_path.stat().st_size,
+            get_checksum(png_path.read_bytes()),
+        ),
+    ]
@@ -0,0 +1,42 @@
+"""Tests for module tune."""
+
+import configparser
+
+from orthoseg import tune
+
+
+def test_tune_args():
+    valid_args = tune._tune_args(
+        args=["--config", "X:/test.ini", "-t", "512,1024", "predict.batch_size=2"]
+    )
+    assert valid_args.config == "X:/test.ini"
+    assert valid_args.tile_sizes == "512,1024"
+    assert valid_args.memory_budget is None
+    assert valid_args.config_overrules == ["predict.batch_size=2"]
+
+
+def test_write_tuned_config(tmp_path):
+    result = {
+        "image_pixel_width": 1024,
+        "image_pixel_height": 1024,
+        "batch_size": 8,
+        "nb_parallel_read": 24,
+        "nb_parallel_postprocess": 6,
+        "images_per_s": 3.5,
+        "read_s": 0.8,
+        "postprocess_s": 1.2,
+        "estimated_memory_mb": 5000,
+    }
+    output_path = tmp_path / "project_tuned.ini"
+
+    tune.write_tuned_config(result, output_path, memory_budget_gb=8)
+
+    tuned = configparser.ConfigParser()
+    tuned.read(output_path)
+    assert tuned["general"]["nb_parallel"] == "6"
+    assert dict(tuned["predict"]) == {
+        "batch_size": "8",
+        "image_pixel_width": "1024",
+        "image_pixel_height": "1024",
+        "nb_parallel_read": "24",
+    }
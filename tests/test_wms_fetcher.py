@@ -0,0 +1,311 @@
+"""Tests for the wms_fetcher module."""
+
+import http.server
+import random
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import owslib.util
+import pytest
+import requests
+
+from orthoseg.util import wms_fetcher
+from orthoseg.util.wms_fetcher import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    TokenBucket,
+    WMSFetcher,
+)
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def wms_server():
+    """Run a local http server that answers GetMap requests."""
+    requests_received = []
+    client_ports = set()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            params = {
+                key: values[0]
+                for key, values in parse_qs(urlparse(self.path).query).items()
+            }
+            requests_received.append(params)
+            client_ports.add(self.client_address[1])
+            if params["LAYERS"] == "unavailable":
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if params["LAYERS"] == "error":
+                content_type = "application/vnd.ogc.se_xml"
+                body = (
+                    b'<?xml version="1.0"?><ServiceExceptionReport>'
+                    b"<ServiceException>Layer not found</ServiceException>"
+                    b"</ServiceExceptionReport>"
+                )
+            else:
+                content_type = params["FORMAT"]
+                body = b"image"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/wms", requests_received, client_ports
+    server.shutdown()
+    server.server_close()
+
+
+def test_token_bucket():
+    clock = _FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+
+    # A burst up to the capacity doesn't wait
+    bucket.consume()
+    bucket.consume()
+    assert clock.sleeps == []
+
+    # Afterwards, the rate is respected
+    bucket.consume()
+    assert clock.sleeps == [0.5]
+
+    # Consuming more than the capacity waits till the debt is paid
+    bucket.consume(3)
+    assert clock.sleeps == [0.5, 1.5]
+
+
+def test_token_bucket_invalid_rate():
+    with pytest.raises(ValueError, match="rate should be > 0"):
+        TokenBucket(rate=0)
+
+
+@pytest.mark.parametrize("wms_version", ["1.3.0", "1.1.1"])
+def test_getmap(wms_server, wms_version):
+    url, requests_received, client_ports = wms_server
+    fetcher = WMSFetcher(url, wms_version=wms_version)
+    for _ in range(3):
+        image = fetcher.getmap(
+            layers=["layer1", "layer2"],
+            styles=None,
+            srs="epsg:31370",
+            bbox=(1.0, 2.0, 3.0, 4.0),
+            size=(256, 512),
+            image_format="image/png",
+        )
+        assert image == b"image"
+    fetcher.close()
+
+    assert len(requests_received) == 3
+    params = requests_received[0]
+    crs_param = "CRS" if wms_version == "1.3.0" else "SRS"
+    assert params[crs_param] == "epsg:31370"
+    assert params["LAYERS"] == "layer1,layer2"
+    assert params["BBOX"] == "1.0,2.0,3.0,4.0"
+    assert params["WIDTH"] == "256"
+    assert params["HEIGHT"] == "512"
+    assert params["VERSION"] == wms_version
+
+    # The connection was kept open and reused
+    assert len(client_ports) == 1
+
+
+def test_getmap_service_exception(wms_server):
+    url, _, _ = wms_server
+    fetcher = WMSFetcher(url)
+    with pytest.raises(owslib.util.ServiceException, match="Layer not found"):
+        fetcher.getmap(
+            layers=["error"],
+            styles=None,
+            srs="epsg:31370",
+            bbox=(1.0, 2.0, 3.0, 4.0),
+            size=(256, 256),
+            image_format="image/png",
+        )
+
+
+def test_getmap_unavailable(wms_server):
+    url, _, _ = wms_server
+    fetcher = WMSFetcher(url)
+    fetcher.limiter.limit = 4.0
+    with pytest.raises(requests.HTTPError, match="503"):
+        fetcher.getmap(
+            layers=["unavailable"],
+            styles=None,
+            srs="epsg:31370",
+            bbox=(1.0, 2.0, 3.0, 4.0),
+            size=(256, 256),
+            image_format="image/png",
+        )
+
+    # The failure is reported to the limiter and the circuit breaker
+    assert fetcher.limiter.limit == 2.0
+    assert fetcher.circuit_breaker._failures == 1
+
+
+def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(max_limit=10)
+    assert limiter.limit == 1
+
+    # Slow start: the limit increases by one per successful request
+    for _ in range(3):
+        ticket = limiter.acquire()
+        limiter.release(ticket, latency_s=1.0)
+    assert limiter.limit == 4
+
+    # A failure halves the limit, but only once for requests started before it
+    tickets = [limiter.acquire() for _ in range(4)]
+    assert limiter.in_flight == 4
+    limiter.release(tickets[0], latency_s=1.0, success=False)
+    assert limiter.limit == 2
+    limiter.release(tickets[1], latency_s=1.0, success=False)
+    assert limiter.limit == 2
+
+    # After the first decrease, the limit increases by about one per round of requests
+    limiter.release(tickets[2], latency_s=1.0)
+    limiter.release(tickets[3], latency_s=1.0)
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+    # If the average latency of the recent requests gets too high compared to the
+    # requests before them, the limit decreases again
+    limiter = AdaptiveLimiter(max_limit=10, latency_window=2)
+    for _ in range(4):
+        limiter.release(limiter.acquire(), latency_s=1.0)
+    assert limiter.limit == 5
+    limiter.release(limiter.acquire(), latency_s=1.5)
+    assert limiter.limit == 6
+    limiter.release(limiter.acquire(), latency_s=5.0)
+    assert limiter.limit == 3
+
+
+def test_adaptive_limiter_bimodal_latency():
+    # Servers can have a mix of fast and slow requests, e.g. cached and rendered images
+    limiter = AdaptiveLimiter(max_limit=10)
+    rng = random.Random(42)
+    for _ in range(1000):
+        ticket = limiter.acquire()
+        limiter.release(ticket, latency_s=rng.choice([0.05, 1.0]))
+
+    # As the latency doesn't increase, the limit doesn't collapse
+    assert limiter.limit == 10
+
+
+def test_adaptive_limiter_invalid_limits():
+    with pytest.raises(ValueError, match="invalid limits"):
+        AdaptiveLimiter(max_limit=1, min_limit=2)
+
+
+def test_circuit_breaker():
+    clock = _FakeClock()
+    breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout_s=10, clock=clock, sleep=clock.sleep
+    )
+
+    # After 2 failures, the circuit opens and requests wait till the timeout expires
+    breaker.record_failure()
+    breaker.wait()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.wait()
+    assert clock.sleeps == [10]
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    # If the probe fails, the circuit opens again with a doubled timeout
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.wait()
+    assert clock.sleeps == [10, 20]
+
+    # If the probe succeeds, the circuit closes
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.wait()
+    assert clock.sleeps == [10, 20]
+
+
+@pytest.mark.parametrize("retry_count, min_s, max_s", [(0, 2.5, 5), (2, 10, 20)])
+def test_get_backoff_s(retry_count, min_s, max_s):
+    for _ in range(10):
+        backoff_s = wms_fetcher.get_backoff_s(retry_count)
+        assert min_s <= backoff_s <= max_s
+
+    # The backoff is capped
+    assert wms_fetcher.get_backoff_s(20) <= 120
+
+
+def test_get_fetcher():
+    fetcher = wms_fetcher.get_fetcher("https://server.test/wms?", max_requests_per_s=10)
+    assert wms_fetcher.get_fetcher("https://server.test/wms?") is fetcher
+
+    # A fetcher for another url of the same server shares the limits
+    other_fetcher = wms_fetcher.get_fetcher("https://server.test/other_wms?")
+    assert other_fetcher is not fetcher
+    assert other_fetcher.requests_bucket is fetcher.requests_bucket
+
+
+def test_getmap_unexpected_error(wms_server):
+    url, _, _ = wms_server
+    fetcher = WMSFetcher(url)
+    fetcher.limiter = AdaptiveLimiter(max_limit=1)
+    http_get = fetcher._http.get
+
+    def get_broken(*_args, **_kwargs):
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    fetcher._http.get = get_broken
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        fetcher.getmap(
+            layers=["layer1"],
+            styles=None,
+            srs="epsg:31370",
+            bbox=(1.0, 2.0, 3.0, 4.0),
+            size=(256, 256),
+            image_format="image/png",
+        )
+
+    # The error is counted as a failure and the slot is released again
+    assert fetcher.limiter.in_flight == 0
+    assert fetcher.circuit_breaker._failures == 1
+
+    # So a next request doesn't block
+    fetcher._http.get = http_get
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(
+            fetcher.getmap(
+                layers=["layer1"],
+                styles=None,
+                srs="epsg:31370",
+                bbox=(1.0, 2.0, 3.0, 4.0),
+                size=(256, 256),
+                image_format="image/png",
+            )
+        ),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout=10)
+    assert result == [b"image"]